@@ -0,0 +1,57 @@
+"""contatore ordine turni su sessioni + unicita' (sessione_id, ordine)
+
+Revision ID: 2c4e8a1f6b93
+Revises: 5f7b3e9d2a48
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c4e8a1f6b93'
+down_revision: Union[str, None] = '5f7b3e9d2a48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('sessioni', sa.Column('ultimo_ordine_turno', sa.Integer(), server_default=sa.text('0'), nullable=False))
+
+    # Ordini duplicati (scritture concorrenti con max(ordine)+1): rinumera solo
+    # le sessioni coinvolte, mantenendo l'ordine di inserimento
+    op.execute("""
+        UPDATE turni_conversazione t SET ordine = r.nuovo_ordine
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY sessione_id ORDER BY ordine, id) AS nuovo_ordine
+            FROM turni_conversazione
+            WHERE sessione_id IN (
+                SELECT sessione_id FROM turni_conversazione
+                GROUP BY sessione_id HAVING count(*) <> count(DISTINCT ordine)
+            )
+        ) r
+        WHERE t.id = r.id AND t.ordine <> r.nuovo_ordine
+    """)
+
+    op.execute("""
+        UPDATE sessioni s SET ultimo_ordine_turno = m.ultimo
+        FROM (
+            SELECT sessione_id, max(ordine) AS ultimo
+            FROM turni_conversazione GROUP BY sessione_id
+        ) m
+        WHERE s.id = m.sessione_id
+    """)
+
+    op.drop_index('ix_turni_conversazione_sessione_ordine', table_name='turni_conversazione')
+    op.create_unique_constraint(
+        'uq_turni_conversazione_sessione_ordine', 'turni_conversazione', ['sessione_id', 'ordine']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_turni_conversazione_sessione_ordine', 'turni_conversazione', type_='unique')
+    op.create_index('ix_turni_conversazione_sessione_ordine', 'turni_conversazione', ['sessione_id', 'ordine'], unique=False)
+    op.drop_column('sessioni', 'ultimo_ordine_turno')
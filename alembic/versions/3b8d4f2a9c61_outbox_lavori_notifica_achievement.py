@@ -0,0 +1,49 @@
+"""outbox lavori post-turno + notifica achievement
+
+Revision ID: 3b8d4f2a9c61
+Revises: 7c1e2f9a4b10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8d4f2a9c61'
+down_revision: Union[str, None] = '7c1e2f9a4b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('outbox_lavori',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('tipo', sa.Text(), nullable=False),
+    sa.Column('utente_id', sa.UUID(), nullable=False),
+    sa.Column('sessione_id', sa.UUID(), nullable=True),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('stato', sa.Text(), server_default='in_attesa', nullable=False),
+    sa.Column('tentativi', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('errore', sa.Text(), nullable=True),
+    sa.Column('disponibile_da', postgresql.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('created_at', postgresql.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('completato_at', postgresql.TIMESTAMP(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['sessione_id'], ['sessioni.id'], ),
+    sa.ForeignKeyConstraint(['utente_id'], ['utenti.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_lavori_stato_disponibile', 'outbox_lavori', ['stato', 'disponibile_da'], unique=False)
+
+    # Gli achievement esistenti sono gia' stati inviati nel turno che li ha sbloccati
+    op.add_column('achievement_utente', sa.Column('notificato', sa.Boolean(), server_default=sa.text('true'), nullable=False))
+    op.alter_column('achievement_utente', 'notificato', server_default=sa.text('false'))
+
+
+def downgrade() -> None:
+    op.drop_column('achievement_utente', 'notificato')
+    op.drop_index('ix_outbox_lavori_stato_disponibile', table_name='outbox_lavori')
+    op.drop_table('outbox_lavori')
@@ -0,0 +1,69 @@
+"""contatori metriche achievement su utenti
+
+Revision ID: 5f7b3e9d2a48
+Revises: 9e2a6c1d7f35
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f7b3e9d2a48'
+down_revision: Union[str, None] = '9e2a6c1d7f35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CONTATORI = (
+    'nodi_completati',
+    'esercizi_risolti',
+    'esercizi_consecutivi_max',
+    'temi_completati',
+    'sessioni_completate',
+)
+
+
+def upgrade() -> None:
+    for colonna in CONTATORI:
+        op.add_column('utenti', sa.Column(colonna, sa.Integer(), server_default=sa.text('0'), nullable=False))
+
+    # Backfill dai dati esistenti (stesse definizioni di ricalcola_contatori_utente)
+    op.execute("""
+        UPDATE utenti u SET
+            nodi_completati = (
+                SELECT count(*) FROM stato_nodi_utente s
+                WHERE s.utente_id = u.id AND s.livello = 'operativo' AND s.presunto = false
+            ),
+            esercizi_risolti = (
+                SELECT count(*) FROM storico_esercizi e
+                WHERE e.utente_id = u.id AND e.esito IN ('primo_tentativo', 'con_aiuto')
+            ),
+            esercizi_consecutivi_max = (
+                SELECT coalesce(max(s.esercizi_consecutivi_ok), 0) FROM stato_nodi_utente s
+                WHERE s.utente_id = u.id
+            ),
+            sessioni_completate = (
+                SELECT count(*) FROM sessioni x
+                WHERE x.utente_id = u.id AND x.stato = 'completata'
+            ),
+            temi_completati = (
+                SELECT count(*) FROM (
+                    SELECT nt.tema_id
+                    FROM nodi_temi nt
+                    JOIN nodi n ON n.id = nt.nodo_id
+                    LEFT JOIN stato_nodi_utente s
+                        ON s.nodo_id = n.id AND s.utente_id = u.id AND s.livello = 'operativo'
+                    WHERE n.tipo_nodo != 'contesto'
+                    GROUP BY nt.tema_id
+                    HAVING count(*) = count(s.nodo_id)
+                ) t
+            )
+    """)
+
+
+def downgrade() -> None:
+    for colonna in reversed(CONTATORI):
+        op.drop_column('utenti', colonna)
@@ -0,0 +1,28 @@
+"""riassunto progressivo conversazione su sessioni
+
+Revision ID: 7c1e2f9a4b10
+Revises: d5767045e1bb
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e2f9a4b10'
+down_revision: Union[str, None] = 'd5767045e1bb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('sessioni', sa.Column('riassunto_conversazione', sa.Text(), nullable=True))
+    op.add_column('sessioni', sa.Column('riassunto_fino_a_ordine', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('sessioni', 'riassunto_fino_a_ordine')
+    op.drop_column('sessioni', 'riassunto_conversazione')
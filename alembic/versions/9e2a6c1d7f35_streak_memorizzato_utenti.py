@@ -0,0 +1,59 @@
+"""streak memorizzato su utenti
+
+Revision ID: 9e2a6c1d7f35
+Revises: 3b8d4f2a9c61
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e2a6c1d7f35'
+down_revision: Union[str, None] = '3b8d4f2a9c61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('utenti', sa.Column('streak_corrente', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('utenti', sa.Column('streak_migliore', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('utenti', sa.Column('streak_ultimo_giorno', sa.Date(), nullable=True))
+
+    # Backfill da statistiche_giornaliere: i giorni con obiettivo raggiunto
+    # consecutivi hanno la stessa data - row_number (una "isola" per serie).
+    # Corrente = la serie piu' recente (streak_attuale la azzera se e'
+    # interrotta), migliore = la serie piu' lunga di tutto lo storico
+    op.execute("""
+        WITH giorni AS (
+            SELECT utente_id, data,
+                   data - (row_number() OVER (PARTITION BY utente_id ORDER BY data))::int AS isola
+            FROM statistiche_giornaliere
+            WHERE obiettivo_raggiunto
+        ), serie AS (
+            SELECT utente_id, count(*) AS lunghezza, max(data) AS fine
+            FROM giorni
+            GROUP BY utente_id, isola
+        ), per_utente AS (
+            SELECT DISTINCT ON (utente_id)
+                   utente_id, lunghezza, fine,
+                   max(lunghezza) OVER (PARTITION BY utente_id) AS migliore
+            FROM serie
+            ORDER BY utente_id, fine DESC
+        )
+        UPDATE utenti u SET
+            streak_corrente = p.lunghezza,
+            streak_migliore = p.migliore,
+            streak_ultimo_giorno = p.fine
+        FROM per_utente p
+        WHERE p.utente_id = u.id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('utenti', 'streak_ultimo_giorno')
+    op.drop_column('utenti', 'streak_migliore')
+    op.drop_column('utenti', 'streak_corrente')
@@ -0,0 +1,32 @@
+"""API admin — operazioni di manutenzione dei worker.
+
+POST /admin/grafo/ricarica → ricarica a caldo di grafo e contenuti (202)
+
+Protette dall'header X-Admin-Token (ADMIN_TOKEN); con ADMIN_TOKEN vuoto gli
+endpoint rispondono 404. Agiscono sul solo worker che riceve la richiesta:
+per ricaricare tutti i worker usare il NOTIFY su GRAFO_RICARICA_CANALE.
+"""
+
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from app.config import settings
+from app.core.ricarica_grafo import ricarica_grafo
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+def verifica_admin(x_admin_token: str = Header("")) -> None:
+    """Raises: HTTPException 404 se disattivati, 403 se il token non corrisponde."""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(x_admin_token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token admin non valido")
+
+
+@router.post("/grafo/ricarica", status_code=202, dependencies=[Depends(verifica_admin)])
+async def api_ricarica_grafo():
+    """Avvia la ricarica in background (accodata se una e' gia' in corso)."""
+    avviata = ricarica_grafo.avvia()
+    return {"avviata": avviata, "stato": ricarica_grafo.stato()}
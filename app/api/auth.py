@@ -3,6 +3,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.esecutori import esecutori
 from app.core.sicurezza import crea_token, verifica_password
 from app.db.crud.utenti import crea_utente, get_utente_by_email
 from app.db.engine import get_db
@@ -32,7 +33,9 @@ async def login(
 ):
     """Login con email e password, ritorna JWT."""
     utente = await get_utente_by_email(db, payload.email)
-    if utente is None or not verifica_password(payload.password, utente.password_hash):
+    if utente is None or not await esecutori.esegui(
+        "hash", verifica_password, payload.password, utente.password_hash
+    ):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
     token = crea_token(str(utente.id))
     return TokenResponse(access_token=token)
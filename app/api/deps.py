@@ -1,14 +1,25 @@
-"""Dipendenze FastAPI — autenticazione JWT."""
+"""Dipendenze FastAPI — autenticazione JWT e versione del grafo.
+
+Token verificati e righe utenti passano dalle cache in memoria (cache_token in
+core.sicurezza, cache_utenti in db.crud.utenti): a cache calda una richiesta
+autenticata non decodifica il JWT e non interroga Postgres.
+
+`fissa_versione_grafo` tiene su una sola versione del grafo gli handler che
+lo leggono piu' volte tra un await e l'altro (ricarica a caldo a meta'
+richiesta).
+"""
 
 import uuid
+from collections.abc import AsyncIterator
 
 from fastapi import Depends, Header, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.sicurezza import verifica_token
-from app.db.crud.utenti import get_utente_by_id
+from app.db.crud.utenti import get_utente_autenticato
 from app.db.engine import get_db
 from app.db.models.utenti import Utente
+from app.grafo.struttura import grafo_knowledge
 
 
 async def get_utente_corrente(
@@ -17,6 +28,8 @@ async def get_utente_corrente(
 ) -> Utente:
     """Estrae e valida JWT dall'header Authorization, ritorna l'utente corrente.
 
+    L'istanza puo' venire dalla cache: staccata dalla sessione, sola lettura.
+
     Raises:
         HTTPException 401: se il token manca, e' invalido, o l'utente non esiste.
     """
@@ -35,8 +48,18 @@ async def get_utente_corrente(
     except ValueError:
         raise HTTPException(status_code=401, detail="Token non valido")
 
-    utente = await get_utente_by_id(db, utente_id)
+    utente = await get_utente_autenticato(db, utente_id)
     if utente is None:
         raise HTTPException(status_code=401, detail="Utente non trovato")
 
     return utente
+
+
+async def fissa_versione_grafo() -> AsyncIterator[None]:
+    """Per tutta la richiesta grafo_knowledge legge la versione attuale.
+
+    Async di proposito: una dipendenza sync con yield gira nel threadpool e il
+    ContextVar di fissa_versione non arriverebbe all'handler.
+    """
+    with grafo_knowledge.fissa_versione():
+        yield
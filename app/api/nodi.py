@@ -0,0 +1,43 @@
+"""API nodi — ricerca per autocompletamento su nodi e temi.
+
+Servita interamente dall'indice lessicale compilato con il grafo in RAM
+(app.grafo.ricerca): nessuna query al database.
+"""
+
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.api.deps import get_utente_corrente
+from app.db.models.utenti import Utente
+from app.grafo.struttura import grafo_knowledge
+
+router = APIRouter(prefix="/nodi", tags=["nodi"])
+
+
+@router.get("/cerca")
+async def cerca_nodi(
+    q: str = Query(..., min_length=1, max_length=100),
+    limite: int = Query(10, ge=1, le=50),
+    tipo: Literal["nodo", "tema"] | None = None,
+    utente: Utente = Depends(get_utente_corrente),
+):
+    """Nodi operativi e temi che corrispondono alla query, per rilevanza.
+
+    Ogni token della query e' cercato come prefisso (senza distinzione di
+    maiuscole e accenti) in nome, parole chiave e temi.
+    """
+    if not grafo_knowledge.caricato:
+        raise HTTPException(status_code=503, detail="Grafo non ancora caricato")
+
+    return [
+        {
+            "tipo": r.tipo,
+            "id": r.id,
+            "nome": r.nome,
+            "tema_id": r.tema_id,
+            "nodo_id": r.nodo_id,
+            "punteggio": r.punteggio,
+        }
+        for r in grafo_knowledge.ricerca.cerca(q, limite=limite, tipo=tipo)
+    ]
@@ -7,7 +7,6 @@ POST /onboarding/completa → finalizza, crea percorso
 
 from __future__ import annotations
 
-import json
 import logging
 import uuid
 from collections.abc import AsyncGenerator
@@ -17,6 +16,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sse_starlette.sse import EventSourceResponse
 
+from app.api.sse import stream_sse
 from app.core.onboarding import (
     aggiorna_fase_onboarding,
     completa_onboarding,
@@ -44,29 +44,21 @@ router = APIRouter(prefix="/onboarding", tags=["onboarding"])
 
 
 async def _genera_stream_onboarding(
-    db: AsyncSession,
     sessione_id: uuid.UUID,
     utente_id: uuid.UUID,
     messaggio_utente: str | None = None,
     evento_iniziale: dict | None = None,
-) -> AsyncGenerator[dict, None]:
-    """Genera eventi SSE per turno onboarding."""
-    if evento_iniziale:
-        yield {
-            "event": evento_iniziale["event"],
-            "data": json.dumps(evento_iniziale["data"]),
-        }
-
-    async for evento in esegui_turno(
-        db=db,
-        sessione_id=sessione_id,
-        utente_id=utente_id,
-        messaggio_utente=messaggio_utente,
+) -> AsyncGenerator[bytes, None]:
+    """Genera i frame SSE per turno onboarding."""
+    async for frame in stream_sse(
+        esegui_turno(
+            sessione_id=sessione_id,
+            utente_id=utente_id,
+            messaggio_utente=messaggio_utente,
+        ),
+        evento_iniziale=evento_iniziale,
     ):
-        yield {
-            "event": evento["event"],
-            "data": json.dumps(evento["data"]),
-        }
+        yield frame
 
 
 # ===================================================================
@@ -101,7 +93,6 @@ async def api_inizia_onboarding(
 
     return EventSourceResponse(
         _genera_stream_onboarding(
-            db=db,
             sessione_id=sessione.id,
             utente_id=utente.id,
             messaggio_utente=None,
@@ -130,9 +121,12 @@ async def api_turno_onboarding(
     # Aggiorna fase automaticamente
     await aggiorna_fase_onboarding(db, sessione)
 
+    # Chiude la transazione della richiesta: il turno usa sessioni proprie e
+    # la connessione torna al pool prima dello stream
+    await db.commit()
+
     return EventSourceResponse(
         _genera_stream_onboarding(
-            db=db,
             sessione_id=sessione.id,
             utente_id=sessione.utente_id,
             messaggio_utente=body.messaggio,
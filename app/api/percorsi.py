@@ -4,11 +4,11 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_utente_corrente
+from app.api.deps import fissa_versione_grafo, get_utente_corrente
 from app.db.engine import get_db
-from app.db.models.grafo import Nodo, NodoTema
 from app.db.models.stato_utente import StatoNodoUtente
 from app.db.models.utenti import PercorsoUtente, Utente
+from app.grafo.struttura import grafo_knowledge
 
 router = APIRouter(prefix="/percorsi", tags=["percorsi"])
 
@@ -37,7 +37,7 @@ async def lista_percorsi(
     ]
 
 
-@router.get("/{percorso_id}/mappa")
+@router.get("/{percorso_id}/mappa", dependencies=[Depends(fissa_versione_grafo)])
 async def mappa_nodi(
     percorso_id: int,
     utente: Utente = Depends(get_utente_corrente),
@@ -61,14 +61,6 @@ async def mappa_nodi(
     if not percorso:
         raise HTTPException(status_code=404, detail="Percorso non trovato")
 
-    # Carica tutti i nodi operativi con il loro tema
-    result_nodi = await db.execute(
-        select(Nodo.id, Nodo.nome, Nodo.tipo, Nodo.tipo_nodo, NodoTema.tema_id)
-        .outerjoin(NodoTema, NodoTema.nodo_id == Nodo.id)
-        .where(Nodo.tipo_nodo != "contesto")
-    )
-    nodi_db = result_nodi.all()
-
     # Carica stati utente
     result_stati = await db.execute(
         select(
@@ -81,19 +73,24 @@ async def mappa_nodi(
     )
     stati = {row.nodo_id: row for row in result_stati.all()}
 
+    # Nodi operativi e temi dal grafo in RAM (una voce per coppia nodo-tema)
+    grafo = grafo_knowledge.grafo
     nodi_mappa = []
-    for nodo_id, nome, tipo, tipo_nodo, tema_id in nodi_db:
+    for nodo_id, attrs in grafo.nodes(data=True):
+        if attrs.get("tipo_nodo") == "contesto":
+            continue
         stato = stati.get(nodo_id)
-        nodi_mappa.append({
-            "id": nodo_id,
-            "nome": nome,
-            "tipo": tipo,
-            "tema_id": tema_id,
-            "livello": stato.livello if stato else "non_iniziato",
-            "presunto": stato.presunto if stato else False,
-            "spiegazione_data": stato.spiegazione_data if stato else False,
-            "esercizi_completati": stato.esercizi_completati if stato else 0,
-        })
+        for tema_id in attrs.get("temi") or (None,):
+            nodi_mappa.append({
+                "id": nodo_id,
+                "nome": grafo_knowledge.nome(nodo_id),
+                "tipo": attrs.get("tipo"),
+                "tema_id": tema_id,
+                "livello": stato.livello if stato else "non_iniziato",
+                "presunto": stato.presunto if stato else False,
+                "spiegazione_data": stato.spiegazione_data if stato else False,
+                "esercizi_completati": stato.esercizi_completati if stato else 0,
+            })
 
     return {
         "percorso_id": percorso.id,
@@ -7,7 +7,6 @@ Nessuna logica di business — tutto delegato a core/.
 
 from __future__ import annotations
 
-import json
 import logging
 import uuid
 from collections.abc import AsyncGenerator
@@ -16,7 +15,8 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sse_starlette.sse import EventSourceResponse
 
-from app.api.deps import get_utente_corrente
+from app.api.deps import fissa_versione_grafo, get_utente_corrente
+from app.api.sse import stream_sse
 from app.core.sessione import (
     SessioneConflitto,
     get_sessione,
@@ -45,29 +45,24 @@ router = APIRouter(prefix="/sessione", tags=["sessione"])
 
 
 async def _genera_stream_sse(
-    db: AsyncSession,
     sessione_id: uuid.UUID,
     utente_id: uuid.UUID,
     messaggio_utente: str | None = None,
     evento_iniziale: dict | None = None,
-) -> AsyncGenerator[dict, None]:
-    """Genera eventi SSE dal turno, con opzionale evento iniziale.
+) -> AsyncGenerator[bytes, None]:
+    """Genera i frame SSE del turno, con opzionale evento iniziale.
 
-    Yield dict con "event" e "data" per EventSourceResponse.
+    I text_delta sono accorpati e i frame gia' serializzati (vedi app.api.sse).
     """
-    if evento_iniziale:
-        yield {"event": evento_iniziale["event"], "data": json.dumps(evento_iniziale["data"])}
-
-    async for evento in esegui_turno(
-        db=db,
-        sessione_id=sessione_id,
-        utente_id=utente_id,
-        messaggio_utente=messaggio_utente,
+    async for frame in stream_sse(
+        esegui_turno(
+            sessione_id=sessione_id,
+            utente_id=utente_id,
+            messaggio_utente=messaggio_utente,
+        ),
+        evento_iniziale=evento_iniziale,
     ):
-        yield {
-            "event": evento["event"],
-            "data": json.dumps(evento["data"]),
-        }
+        yield frame
 
 
 # ===================================================================
@@ -75,7 +70,7 @@ async def _genera_stream_sse(
 # ===================================================================
 
 
-@router.post("/inizia")
+@router.post("/inizia", dependencies=[Depends(fissa_versione_grafo)])
 async def api_inizia_sessione(
     body: IniziaSessioneRequest | None = None,
     utente: Utente = Depends(get_utente_corrente),
@@ -114,8 +109,8 @@ async def api_inizia_sessione(
     nodo_nome = None
     if nodo_id:
         from app.grafo.struttura import grafo_knowledge
-        if grafo_knowledge.caricato and nodo_id in grafo_knowledge.grafo.nodes:
-            nodo_nome = grafo_knowledge.grafo.nodes[nodo_id].get("nome", nodo_id)
+        if grafo_knowledge.caricato:
+            nodo_nome = grafo_knowledge.nome(nodo_id)
 
     evento_iniziale = {
         "event": "sessione_creata",
@@ -128,7 +123,6 @@ async def api_inizia_sessione(
 
     return EventSourceResponse(
         _genera_stream_sse(
-            db=db,
             sessione_id=sessione.id,
             utente_id=utente.id,
             messaggio_utente=None,  # Primo turno senza messaggio utente
@@ -164,11 +158,13 @@ async def api_turno_sessione(
     if stato.get("ripresa"):
         stato["ripresa"] = False
         sessione.stato_orchestratore = stato
-        await db.flush()
+
+    # Chiude la transazione della richiesta: il turno usa sessioni proprie e
+    # la connessione torna al pool prima dello stream
+    await db.commit()
 
     return EventSourceResponse(
         _genera_stream_sse(
-            db=db,
             sessione_id=sessione.id,
             utente_id=utente.id,
             messaggio_utente=body.messaggio,
@@ -257,8 +253,8 @@ def _sessione_to_response(sessione) -> dict:
     nodo_nome = None
     if nodo_id:
         from app.grafo.struttura import grafo_knowledge
-        if grafo_knowledge.caricato and nodo_id in grafo_knowledge.grafo.nodes:
-            nodo_nome = grafo_knowledge.grafo.nodes[nodo_id].get("nome", nodo_id)
+        if grafo_knowledge.caricato:
+            nodo_nome = grafo_knowledge.nome(nodo_id)
 
     return SessioneResponse(
         id=sessione.id,
@@ -0,0 +1,201 @@
+"""Stream SSE del turno — coalescenza dei text_delta e frame precalcolati.
+
+Il tutor emette un text_delta per ogni chunk Anthropic, spesso pochi
+caratteri: inoltrarli uno a uno significa un frame SSE, una send() e un
+repaint del client per chunk. `coalesci_delta` accumula il testo e lo
+rilascia quando supera SSE_COALESCENZA_BYTE o quando il primo delta in
+attesa ha SSE_COALESCENZA_MS; qualunque altro evento (azione, achievement,
+turno_completo, errore) svuota prima il buffer, quindi l'ordine e' preservato.
+
+`frame_sse` produce direttamente i byte del frame (prefisso `event:` per
+nome evento calcolato una volta, JSON compatto): EventSourceResponse li
+inoltra senza ricostruire un ServerSentEvent.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from dataclasses import dataclass
+from functools import lru_cache
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+EVENTO_DELTA = "text_delta"
+
+# Fine dello stream a monte (sentinella nella coda del produttore)
+_FINE = object()
+
+
+@dataclass(slots=True)
+class StatisticheStream:
+    """Contatori per stream: eventi ricevuti dal turno vs frame e byte inviati."""
+
+    eventi: int = 0
+    delta: int = 0
+    frame: int = 0
+    byte: int = 0
+
+    def registra(self, frame: bytes) -> bytes:
+        self.frame += 1
+        self.byte += len(frame)
+        return frame
+
+
+# ---------------------------------------------------------------------------
+# Serializzazione
+# ---------------------------------------------------------------------------
+
+
+@lru_cache(maxsize=64)
+def _prefisso(evento: str) -> bytes:
+    nome = evento.replace("\r", "").replace("\n", "")
+    return f"event: {nome}\r\ndata: ".encode()
+
+
+def frame_sse(evento: str, dati: dict) -> bytes:
+    """Frame SSE completo. Il JSON compatto non contiene a capo: una riga data."""
+    corpo = json.dumps(dati, ensure_ascii=False, separators=(",", ":"))
+    return _prefisso(evento) + corpo.encode() + b"\r\n\r\n"
+
+
+# ---------------------------------------------------------------------------
+# Coalescenza text_delta
+# ---------------------------------------------------------------------------
+
+
+async def coalesci_delta(
+    eventi: AsyncIterator[dict],
+    max_byte: int,
+    max_attesa_ms: float,
+    statistiche: StatisticheStream | None = None,
+) -> AsyncIterator[dict]:
+    """Unisce i text_delta consecutivi; con max_byte <= 0 li inoltra invariati.
+
+    Il generatore a monte gira per intero in un solo task produttore (le
+    sessioni DB del turno non cambiano task tra un passo e l'altro); qui si
+    attende la coda con timeout per rilasciare il testo anche se il modello
+    si ferma (es. mentre genera l'input di un tool).
+    """
+    statistiche = statistiche if statistiche is not None else StatisticheStream()
+
+    if max_byte <= 0:
+        async with aclosing(eventi):
+            async for evento in eventi:
+                statistiche.eventi += 1
+                statistiche.delta += evento["event"] == EVENTO_DELTA
+                yield evento
+        return
+
+    coda: asyncio.Queue = asyncio.Queue(maxsize=64)
+
+    async def produci() -> None:
+        # aclosing: se cancellato, il generatore a monte si chiude qui, nel
+        # task produttore, e non quando viene raccolto
+        try:
+            async with aclosing(eventi):
+                async for evento in eventi:
+                    await coda.put(evento)
+        except Exception as e:  # rilanciata dal consumatore
+            await coda.put(e)
+            return
+        await coda.put(_FINE)
+
+    produttore = asyncio.create_task(produci())
+    parti: list[str] = []
+    byte_in_attesa = 0
+    scadenza: float | None = None
+
+    def svuota() -> dict:
+        nonlocal byte_in_attesa, scadenza
+        evento = {"event": EVENTO_DELTA, "data": {"testo": "".join(parti)}}
+        parti.clear()
+        byte_in_attesa = 0
+        scadenza = None
+        return evento
+
+    try:
+        while True:
+            if scadenza is None:
+                elemento = await coda.get()
+            else:
+                attesa = scadenza - time.monotonic()
+                try:
+                    elemento = await asyncio.wait_for(coda.get(), timeout=max(attesa, 0))
+                except TimeoutError:
+                    yield svuota()
+                    continue
+
+            if elemento is _FINE:
+                break
+            if isinstance(elemento, Exception):
+                if parti:
+                    yield svuota()
+                raise elemento
+
+            statistiche.eventi += 1
+            if elemento["event"] == EVENTO_DELTA:
+                statistiche.delta += 1
+                testo = elemento["data"].get("testo", "")
+                if not testo:
+                    continue
+                parti.append(testo)
+                byte_in_attesa += len(testo.encode())
+                if scadenza is None:
+                    scadenza = time.monotonic() + max_attesa_ms / 1000
+                if byte_in_attesa >= max_byte:
+                    yield svuota()
+                continue
+
+            # Azioni/tool/fine turno: prima il testo in attesa
+            if parti:
+                yield svuota()
+            yield elemento
+
+        if parti:
+            yield svuota()
+    finally:
+        if not produttore.done():
+            produttore.cancel()
+            try:
+                await produttore
+            except asyncio.CancelledError:
+                pass
+
+
+async def stream_sse(
+    eventi: AsyncIterator[dict],
+    evento_iniziale: dict | None = None,
+) -> AsyncIterator[bytes]:
+    """Frame SSE del turno (delta coalescenti) per EventSourceResponse."""
+    statistiche = StatisticheStream()
+    inizio = time.monotonic()
+
+    if evento_iniziale:
+        yield statistiche.registra(
+            frame_sse(evento_iniziale["event"], evento_iniziale["data"])
+        )
+
+    try:
+        async for evento in coalesci_delta(
+            eventi,
+            max_byte=settings.SSE_COALESCENZA_BYTE,
+            max_attesa_ms=settings.SSE_COALESCENZA_MS,
+            statistiche=statistiche,
+        ):
+            yield statistiche.registra(frame_sse(evento["event"], evento["data"]))
+    finally:
+        logger.info(
+            "Stream SSE: %d eventi (%d delta) → %d frame, %d byte in %.0f ms",
+            statistiche.eventi,
+            statistiche.delta,
+            statistiche.frame,
+            statistiche.byte,
+            (time.monotonic() - inizio) * 1000,
+        )
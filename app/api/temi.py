@@ -1,16 +1,44 @@
-"""API temi — dettaglio tema con nodi e progresso."""
+"""API temi — dettaglio tema con nodi e progresso.
+
+Temi e nodi per tema vengono dal grafo in RAM (totali precalcolati al
+caricamento); il progresso utente dalla mappa livelli (cache_livelli): la
+lista temi risponde senza query se la mappa e' in cache, il dettaglio con
+una sola query sugli stati dei nodi del tema. Ogni richiesta legge una sola
+versione del grafo (fissa_versione_grafo), anche a cavallo di una ricarica.
+"""
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func, select
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import get_utente_corrente
+from app.api.deps import fissa_versione_grafo, get_utente_corrente
 from app.db.engine import get_db
-from app.db.models.grafo import Nodo, NodoTema, Tema
 from app.db.models.stato_utente import StatoNodoUtente
 from app.db.models.utenti import Utente
+from app.grafo.stato import get_livelli_utente
+from app.grafo.struttura import InfoTema, grafo_knowledge
 
-router = APIRouter(prefix="/temi", tags=["temi"])
+router = APIRouter(
+    prefix="/temi", tags=["temi"], dependencies=[Depends(fissa_versione_grafo)]
+)
+
+
+def _progresso(tema: InfoTema, completati: int) -> dict:
+    totale = len(tema.nodi_progresso)
+    return {
+        "id": tema.id,
+        "nome": tema.nome,
+        "materia": tema.materia,
+        "descrizione": tema.descrizione,
+        "nodi_totali": totale,
+        "nodi_completati": completati,
+        "completato": completati >= totale if totale > 0 else False,
+    }
+
+
+def _richiedi_grafo() -> None:
+    if not grafo_knowledge.caricato:
+        raise HTTPException(status_code=503, detail="Grafo non ancora caricato")
 
 
 @router.get("/")
@@ -19,47 +47,16 @@ async def lista_temi(
     db: AsyncSession = Depends(get_db),
 ):
     """Lista tutti i temi con progresso sintetico."""
-    result = await db.execute(
-        select(Tema).order_by(Tema.ordine_visualizzazione.asc().nulls_last())
-    )
-    temi = result.scalars().all()
-
-    risposta = []
-    for tema in temi:
-        # Conta nodi totali e completati per questo tema
-        result_totale = await db.execute(
-            select(func.count())
-            .select_from(NodoTema)
-            .join(Nodo, Nodo.id == NodoTema.nodo_id)
-            .where(NodoTema.tema_id == tema.id, Nodo.tipo_nodo != "contesto")
-        )
-        totale = result_totale.scalar_one()
-
-        result_completati = await db.execute(
-            select(func.count())
-            .select_from(NodoTema)
-            .join(Nodo, Nodo.id == NodoTema.nodo_id)
-            .join(
-                StatoNodoUtente,
-                (StatoNodoUtente.nodo_id == Nodo.id)
-                & (StatoNodoUtente.utente_id == utente.id)
-                & (StatoNodoUtente.livello == "operativo"),
-            )
-            .where(NodoTema.tema_id == tema.id, Nodo.tipo_nodo != "contesto")
-        )
-        completati = result_completati.scalar_one()
-
-        risposta.append({
-            "id": tema.id,
-            "nome": tema.nome,
-            "materia": tema.materia,
-            "descrizione": tema.descrizione,
-            "nodi_totali": totale,
-            "nodi_completati": completati,
-            "completato": completati >= totale if totale > 0 else False,
-        })
+    _richiedi_grafo()
+    livelli = await get_livelli_utente(utente.id, db)
 
-    return risposta
+    return [
+        _progresso(
+            tema,
+            sum(1 for n in tema.nodi_progresso if livelli.get(n) == "operativo"),
+        )
+        for tema in grafo_knowledge.temi()
+    ]
 
 
 @router.get("/{tema_id}")
@@ -69,23 +66,14 @@ async def dettaglio_tema(
     db: AsyncSession = Depends(get_db),
 ):
     """Dettaglio tema con nodi e progresso per ciascun nodo."""
-    result = await db.execute(select(Tema).where(Tema.id == tema_id))
-    tema = result.scalar_one_or_none()
+    _richiedi_grafo()
+    tema = grafo_knowledge.tema(tema_id)
     if not tema:
         raise HTTPException(status_code=404, detail="Tema non trovato")
 
-    # Nodi di questo tema con stato utente
-    result_nodi = await db.execute(
-        select(Nodo.id, Nodo.nome, Nodo.tipo, Nodo.tipo_nodo)
-        .join(NodoTema, NodoTema.nodo_id == Nodo.id)
-        .where(NodoTema.tema_id == tema_id, Nodo.tipo_nodo != "contesto")
-    )
-    nodi_db = result_nodi.all()
-
-    # Carica stati utente per i nodi di questo tema
-    nodo_ids = [n.id for n in nodi_db]
+    # Stati utente per i nodi di questo tema
     stati: dict = {}
-    if nodo_ids:
+    if tema.nodi_progresso:
         result_stati = await db.execute(
             select(
                 StatoNodoUtente.nodo_id,
@@ -95,18 +83,19 @@ async def dettaglio_tema(
                 StatoNodoUtente.esercizi_completati,
             ).where(
                 StatoNodoUtente.utente_id == utente.id,
-                StatoNodoUtente.nodo_id.in_(nodo_ids),
+                StatoNodoUtente.nodo_id.in_(tema.nodi_progresso),
             )
         )
         stati = {row.nodo_id: row for row in result_stati.all()}
 
+    attributi = grafo_knowledge.grafo.nodes
     nodi_dettaglio = []
-    for nodo in nodi_db:
-        stato = stati.get(nodo.id)
+    for nodo_id in tema.nodi_progresso:
+        stato = stati.get(nodo_id)
         nodi_dettaglio.append({
-            "id": nodo.id,
-            "nome": nodo.nome,
-            "tipo": nodo.tipo,
+            "id": nodo_id,
+            "nome": attributi[nodo_id]["nome"],
+            "tipo": attributi[nodo_id]["tipo"],
             "livello": stato.livello if stato else "non_iniziato",
             "presunto": stato.presunto if stato else False,
             "spiegazione_data": stato.spiegazione_data if stato else False,
@@ -115,13 +104,4 @@ async def dettaglio_tema(
 
     completati = sum(1 for n in nodi_dettaglio if n["livello"] == "operativo")
 
-    return {
-        "id": tema.id,
-        "nome": tema.nome,
-        "materia": tema.materia,
-        "descrizione": tema.descrizione,
-        "nodi_totali": len(nodi_dettaglio),
-        "nodi_completati": completati,
-        "completato": completati >= len(nodi_dettaglio) if nodi_dettaglio else False,
-        "nodi": nodi_dettaglio,
-    }
+    return {**_progresso(tema, completati), "nodi": nodi_dettaglio}
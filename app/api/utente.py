@@ -7,12 +7,11 @@ from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.deps import get_utente_corrente
-from app.core.gamification import calcola_streak
-from app.db.crud.utenti import aggiorna_profilo
+from app.core.gamification import streak_attuale
+from app.db.crud.utenti import aggiorna_profilo, cache_utenti
 from app.db.engine import get_db
 from app.db.models.gamification import StatisticaGiornaliera
-from app.db.models.stato_utente import StatoNodoUtente
-from app.db.models.utenti import Sessione, Utente
+from app.db.models.utenti import Utente
 from app.schemas.utente import PreferenzeRequest, UtenteResponse
 
 router = APIRouter(prefix="/utente", tags=["utente"])
@@ -30,13 +29,19 @@ async def update_preferenze(
     utente: Utente = Depends(get_utente_corrente),
     db: AsyncSession = Depends(get_db),
 ):
-    """Aggiorna le preferenze del tutor per l'utente autenticato."""
-    preferenze = utente.preferenze_tutor or {}
+    """Aggiorna le preferenze del tutor per l'utente autenticato.
+
+    `utente` puo' essere l'istanza condivisa di cache_utenti: si lavora su una
+    copia delle preferenze e aggiorna_profilo invalida la cache.
+    """
+    preferenze = dict(utente.preferenze_tutor or {})
     aggiornamenti = payload.model_dump(exclude_none=True)
     preferenze.update(aggiornamenti)
     try:
         utente = await aggiorna_profilo(db, utente.id, preferenze_tutor=preferenze)
     except ValueError as e:
+        # Utente non piu' nel DB: la voce in cache non va servita oltre
+        cache_utenti.invalida(utente.id)
         raise HTTPException(status_code=400, detail=str(e))
     return utente
 
@@ -51,27 +56,12 @@ async def get_statistiche(
     inizio_settimana = oggi - timedelta(days=oggi.weekday())  # Lunedì
     inizio_mese = oggi.replace(day=1)
 
-    # Nodi completati (totale)
-    result_nodi = await db.execute(
-        select(func.count()).where(
-            StatoNodoUtente.utente_id == utente.id,
-            StatoNodoUtente.livello == "operativo",
-            StatoNodoUtente.presunto == False,  # noqa: E712
-        )
-    )
-    nodi_completati_totale = result_nodi.scalar_one()
-
-    # Sessioni completate (totale)
-    result_sessioni = await db.execute(
-        select(func.count()).where(
-            Sessione.utente_id == utente.id,
-            Sessione.stato == "completata",
-        )
-    )
-    sessioni_totale = result_sessioni.scalar_one()
+    # Totali dai contatori su utenti (mantenuti dagli eventi, riconciliati)
+    nodi_completati_totale = utente.nodi_completati or 0
+    sessioni_totale = utente.sessioni_completate or 0
 
-    # Streak corrente
-    streak = await calcola_streak(utente.id, db)
+    # Streak corrente (memorizzato su utenti, nessuna query)
+    streak = streak_attuale(utente.streak_corrente, utente.streak_ultimo_giorno)
 
     # Statistiche per periodo (da statistiche_giornaliere)
     stats_settimana = await _stats_periodo(
@@ -84,6 +74,7 @@ async def get_statistiche(
 
     return {
         "streak": streak,
+        "streak_migliore": utente.streak_migliore or 0,
         "nodi_completati": nodi_completati_totale,
         "sessioni_completate": sessioni_totale,
         "settimana": stats_settimana,
@@ -22,9 +22,79 @@ class Settings(BaseSettings):
     JWT_SECRET: str = "change-me-in-production"
     JWT_EXPIRE_HOURS: int = 720
 
+    # Endpoint /admin (header X-Admin-Token; vuoto = disattivati)
+    ADMIN_TOKEN: str = ""
+
     # Timeouts
     TIMEOUT_LLM_SEC: int = 60
 
+    # Client LLM condiviso (pool HTTP + concorrenza per modello)
+    LLM_BASE_URL: str = ""
+    LLM_MAX_CONNESSIONI: int = 50
+    LLM_KEEPALIVE_CONNESSIONI: int = 20
+    LLM_KEEPALIVE_SEC: float = 60.0
+    LLM_HTTP2: bool = False
+    LLM_CONCORRENZA_PER_MODELLO: int = 16
+
+    # Cache livelli utente (in memoria, per processo)
+    CACHE_LIVELLI_MAX_UTENTI: int = 10_000
+    CACHE_LIVELLI_TTL_SEC: int = 300
+
+    # Autenticazione: JWT verificati e righe utenti (in memoria, per processo; 0 = disattivo)
+    CACHE_TOKEN_MAX_VOCI: int = 20_000
+    CACHE_TOKEN_TTL_SEC: int = 300
+    CACHE_UTENTI_MAX_VOCI: int = 10_000
+    CACHE_UTENTI_TTL_SEC: int = 60
+
+    # Esercizi gia' visti per (utente, nodo) (in memoria, per processo)
+    CACHE_TENTATI_MAX_VOCI: int = 50_000
+    CACHE_TENTATI_TTL_SEC: int = 1800
+
+    # Buffer conversazione per sessione (in memoria, per processo; 0 = disattivo)
+    CACHE_CONVERSAZIONI_MAX_SESSIONI: int = 2_000
+    CACHE_CONVERSAZIONI_TTL_SEC: int = 1800
+
+    # Compattazione conversazione (budget token dei messages + riassunto progressivo)
+    CONVERSAZIONE_BUDGET_TOKEN: int = 12_000
+    RIASSUNTO_MIN_TURNI: int = 10
+
+    # Outbox post-processing turno (worker in-process: verifica achievement)
+    OUTBOX_WORKER: int = 2
+    OUTBOX_INTERVALLO_SEC: float = 2.0
+    OUTBOX_LOTTO: int = 20
+    OUTBOX_MAX_TENTATIVI: int = 5
+    # Lavori completati eliminati dopo N ore (0 = conservati)
+    OUTBOX_RETENZIONE_ORE: int = 24
+
+    # Onboarding: scrive solo i nodi presunti (le righe non_iniziato restano implicite)
+    ONBOARDING_STATO_SPARSO: bool = True
+
+    # Riconciliazione statistiche giornaliere/streak (0 = disattiva)
+    STATISTICHE_RICONCILIAZIONE_SEC: int = 3600
+
+    # Grafo: snapshot binario verificato con la firma del contenuto (vuoto = sempre dal DB)
+    GRAFO_SNAPSHOT_PATH: str = ""
+
+    # Ricarica a caldo del grafo su NOTIFY (da scripts/import_extraction.py; vuoto = no LISTEN)
+    GRAFO_RICARICA_CANALE: str = "dydat_grafo"
+
+    # Embedding nodi: snapshot .npy mappato in memoria, verificato con la firma (vuoto = dal DB)
+    EMBEDDING_SNAPSHOT_PATH: str = ""
+
+    # Stream SSE: text_delta accorpati fino a N byte o M ms (0 byte = un frame per delta)
+    SSE_COALESCENZA_BYTE: int = 32
+    SSE_COALESCENZA_MS: float = 30.0
+
+    # Lavoro CPU fuori dall'event loop: thread concorrenti per tipo di lavoro
+    ESECUTORE_HASH_CONCORRENZA: int = 4
+    ESECUTORE_GRAFO_CONCORRENZA: int = 1
+    ESECUTORE_SERIALIZZAZIONE_CONCORRENZA: int = 2
+
+    # Monitor ritardo event loop (0 = disattivo; warning oltre la soglia)
+    LOOP_LAG_INTERVALLO_MS: int = 100
+    LOOP_LAG_CAMPIONI: int = 600
+    LOOP_LAG_SOGLIA_MS: int = 100
+
     model_config = {"env_file": ".env", "env_file_encoding": "utf-8"}
 
 
@@ -0,0 +1,239 @@
+"""Compattazione conversazione a budget di token + riassunto progressivo.
+
+I messages del tutor restano sotto CONVERSAZIONE_BUDGET_TOKEN:
+- i primi TURNI_INIZIALI messaggi sono sempre tenuti (apertura della sessione)
+- dai piu' recenti all'indietro si tengono i messaggi finche' entrano nel budget
+  (almeno TURNI_RECENTI_MIN, anche se li sforano)
+- la parte centrale esclusa e' sostituita dal riassunto salvato su Sessione,
+  o da una nota di raccordo se il riassunto non c'e' ancora
+
+Il riassunto e' prodotto in background con LLM_MODEL_PIPELINE quando i turni
+esclusi e non ancora riassunti superano RIASSUNTO_MIN_TURNI: il turno non lo
+aspetta mai, lo usa dal turno successivo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.core.conversazione import FinestraConversazione
+from app.db.engine import async_session
+from app.db.models.utenti import Sessione, TurnoConversazione
+from app.llm.client import genera_testo
+from app.llm.prompts.riassunto import RIASSUNTO_SYSTEM_PROMPT, messaggio_riassunto
+
+logger = logging.getLogger(__name__)
+
+# Stima token: ~4 caratteri per token + overhead fisso per messaggio (ruolo, separatori)
+CARATTERI_PER_TOKEN = 4
+TOKEN_PER_MESSAGGIO = 4
+
+# Recenti sempre tenuti anche oltre budget (lo scambio in corso non si taglia)
+TURNI_RECENTI_MIN = 4
+
+MAX_TOKEN_RIASSUNTO = 1024
+
+
+def stima_token(testo: str) -> int:
+    """Stima approssimata dei token di un messaggio (nessun tokenizer lato backend)."""
+    return len(testo) // CARATTERI_PER_TOKEN + TOKEN_PER_MESSAGGIO
+
+
+@dataclass(slots=True)
+class Compattazione:
+    """Esito della compattazione: messages pronti + eventuale riassunto da aggiornare."""
+
+    messages: list[dict]
+    token_stimati: int
+    omessi: int = 0
+    # (da_ordine escluso, fino_a_ordine incluso) dei turni da aggiungere al riassunto
+    da_riassumere: tuple[int, int] | None = None
+
+
+def _messaggio_raccordo(
+    omessi: int, riassunto: str | None, riassunto_completo: bool
+) -> dict:
+    if riassunto:
+        contenuto = f"[Riassunto dei turni precedenti: {riassunto}"
+        if not riassunto_completo:
+            contenuto += " — alcuni turni successivi sono stati omessi per brevità."
+        contenuto += "]"
+    else:
+        contenuto = (
+            f"[Nota di sistema: {omessi} turni omessi per brevità. "
+            "La conversazione è continuata normalmente.]"
+        )
+    return {"role": "user", "content": contenuto}
+
+
+def compatta_conversazione(
+    finestra: FinestraConversazione,
+    budget_token: int,
+    riassunto: str | None = None,
+    riassunto_fino_a: int | None = None,
+    min_turni_riassunto: int = 0,
+) -> Compattazione:
+    """Riduce la finestra sotto budget_token sostituendo il centro col riassunto."""
+    iniziali = finestra.iniziali
+    candidati = finestra.successivi_agli_iniziali()
+
+    token_iniziali = sum(stima_token(m["content"]) for _, m in iniziali)
+    token_riassunto = stima_token(riassunto) if riassunto else 0
+    disponibili = budget_token - token_iniziali - token_riassunto
+
+    tenuti: list[tuple[int, dict]] = []
+    usati = 0
+    for ordine, messaggio in reversed(candidati):
+        costo = stima_token(messaggio["content"])
+        if usati + costo > disponibili and len(tenuti) >= TURNI_RECENTI_MIN:
+            break
+        tenuti.append((ordine, messaggio))
+        usati += costo
+    tenuti.reverse()
+
+    omessi = finestra.totale - len(iniziali) - len(tenuti)
+    messages = [m for _, m in iniziali]
+    if omessi <= 0:
+        messages.extend(m for _, m in tenuti)
+        return Compattazione(messages=messages, token_stimati=token_iniziali + usati)
+
+    # Turni esclusi: (ultimo iniziale, primo recente tenuto)
+    ultimo_iniziale = iniziali[-1][0] if iniziali else 0
+    primo_tenuto = tenuti[0][0] if tenuti else finestra.ultimo_ordine + 1
+    coperto_fino_a = max(riassunto_fino_a or 0, ultimo_iniziale)
+    riassunto_completo = coperto_fino_a >= primo_tenuto - 1
+
+    raccordo = _messaggio_raccordo(omessi, riassunto, riassunto_completo)
+    messages.append(raccordo)
+    messages.extend(m for _, m in tenuti)
+
+    da_riassumere = None
+    if not riassunto_completo and (primo_tenuto - 1 - coperto_fino_a) >= min_turni_riassunto:
+        da_riassumere = (coperto_fino_a, primo_tenuto - 1)
+
+    return Compattazione(
+        messages=messages,
+        token_stimati=token_iniziali + usati + stima_token(raccordo["content"]),
+        omessi=omessi,
+        da_riassumere=da_riassumere,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Riassunto progressivo in background
+# ---------------------------------------------------------------------------
+
+_riassunti_in_corso: set[uuid.UUID] = set()
+_task_riassunti: set[asyncio.Task] = set()
+
+
+async def aggiorna_riassunto(
+    session_factory: Callable[[], AsyncSession],
+    sessione_id: uuid.UUID,
+    da_ordine: int,
+    fino_a_ordine: int,
+) -> bool:
+    """Estende il riassunto della sessione con i turni in (da_ordine, fino_a_ordine].
+
+    Lettura dei turni e UPDATE usano ciascuno una sessione breve: durante la
+    chiamata LLM (coda del semaforo per modello compresa) nessuna connessione
+    del pool resta occupata.
+    Ritorna False se nel frattempo un altro job ha gia' coperto fino_a_ordine.
+    """
+    async with session_factory() as db:
+        result = await db.execute(
+            select(Sessione.riassunto_conversazione, Sessione.riassunto_fino_a_ordine).where(
+                Sessione.id == sessione_id
+            )
+        )
+        riga = result.one_or_none()
+        if riga is None:
+            return False
+        precedente, coperto = riga
+        if coperto is not None and coperto >= fino_a_ordine:
+            return False
+        da_ordine = max(da_ordine, coperto or 0)
+
+        result = await db.execute(
+            select(TurnoConversazione.ruolo, TurnoConversazione.contenuto)
+            .where(
+                TurnoConversazione.sessione_id == sessione_id,
+                TurnoConversazione.ordine > da_ordine,
+                TurnoConversazione.ordine <= fino_a_ordine,
+            )
+            .order_by(TurnoConversazione.ordine)
+        )
+        turni = [
+            {"role": "user" if ruolo == "utente" else "assistant", "content": contenuto}
+            for ruolo, contenuto in result.all()
+            if contenuto
+        ]
+    if not turni:
+        return False
+
+    testo = await genera_testo(
+        system=RIASSUNTO_SYSTEM_PROMPT,
+        messages=[{"role": "user", "content": messaggio_riassunto(precedente, turni)}],
+        modello=settings.LLM_MODEL_PIPELINE,
+        max_tokens=MAX_TOKEN_RIASSUNTO,
+    )
+    if not testo:
+        return False
+
+    # Scrive solo se nessun altro job ha coperto di piu' nel frattempo
+    async with session_factory() as db:
+        result = await db.execute(
+            update(Sessione)
+            .where(
+                Sessione.id == sessione_id,
+                func.coalesce(Sessione.riassunto_fino_a_ordine, 0) < fino_a_ordine,
+            )
+            .values(riassunto_conversazione=testo, riassunto_fino_a_ordine=fino_a_ordine)
+        )
+        await db.commit()
+    aggiornato = result.rowcount > 0
+    logger.info(
+        "Riassunto conversazione: sessione=%s, turni (%d, %d], %d chars, aggiornato=%s",
+        sessione_id, da_ordine, fino_a_ordine, len(testo), aggiornato,
+    )
+    return aggiornato
+
+
+async def _esegui_riassunto(
+    session_factory: Callable[[], AsyncSession],
+    sessione_id: uuid.UUID,
+    da_ordine: int,
+    fino_a_ordine: int,
+) -> None:
+    try:
+        await aggiorna_riassunto(session_factory, sessione_id, da_ordine, fino_a_ordine)
+    except Exception:
+        logger.exception("Riassunto conversazione fallito: sessione=%s", sessione_id)
+    finally:
+        _riassunti_in_corso.discard(sessione_id)
+
+
+def pianifica_riassunto(
+    sessione_id: uuid.UUID,
+    da_ordine: int,
+    fino_a_ordine: int,
+    session_factory: Callable[[], AsyncSession] = async_session,
+) -> bool:
+    """Avvia in background l'aggiornamento del riassunto (uno per sessione alla volta)."""
+    if sessione_id in _riassunti_in_corso:
+        return False
+    _riassunti_in_corso.add(sessione_id)
+    task = asyncio.create_task(
+        _esegui_riassunto(session_factory, sessione_id, da_ordine, fino_a_ordine)
+    )
+    _task_riassunti.add(task)
+    task.add_done_callback(_task_riassunti.discard)
+    return True
@@ -7,8 +7,14 @@ Blocco 4: Contesto attivo (nodo focale + nodi supporto)
 Blocco 5: Conversazione nei messages (solo testo)
 Blocco 6: Memoria rilevante (placeholder Loop 3)
 
-Blocchi 1-4 e 6 → system prompt (stringa unica).
-Blocco 5 → messages (lista di dict role/content).
+Blocchi 1-4 e 6 → system prompt, come lista ordinata di blocchi di testo
+dal piu' stabile al piu' volatile (prompt caching Anthropic):
+    system prompt fisso  [cache]  — uguale per tutti (i tool schema lo precedono)
+    nodo focale          [cache]  — contenuto editoriale del nodo
+    profilo utente       [cache]  — cambia raramente
+    contesto attivo + memoria + direttiva — cambiano a ogni turno
+Blocco 5 → messages (lista di dict role/content), compattati a budget di
+token con riassunto progressivo dei turni esclusi (app.core.compattazione).
 """
 
 from __future__ import annotations
@@ -16,14 +22,18 @@ from __future__ import annotations
 import json
 import logging
 import uuid
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models.grafo import Esercizio, Nodo, Relazione
+from app.core.compattazione import compatta_conversazione, pianifica_riassunto
+from app.core.conversazione import carica_finestra_conversazione
 from app.db.models.stato_utente import StatoNodoUtente, StoricoEsercizi
-from app.db.models.utenti import Sessione, TurnoConversazione, Utente
+from app.db.models.utenti import Sessione, Utente
+from app.grafo.contenuti import ContenutoNodo, contenuti
+from app.grafo.struttura import grafo_knowledge
 from app.llm.prompts.direttive import (
     direttiva_esercizio,
     direttiva_feynman,
@@ -36,63 +46,69 @@ from app.llm.prompts.system_prompt import SYSTEM_PROMPT
 
 logger = logging.getLogger(__name__)
 
-# Soglia per troncamento conversazione
-SOGLIA_TURNI = 50
-TURNI_INIZIALI = 2
-TURNI_FINALI = 20
-
 
 # ---------------------------------------------------------------------------
 # Risultato del context builder
 # ---------------------------------------------------------------------------
 
 class ContextPackage:
-    """Risultato assemblato: system prompt + messages per Claude API."""
+    """Risultato assemblato: system prompt + messages per Claude API.
+
+    `system` e' la lista di blocchi {"type": "text", ...} con i breakpoint
+    cache_control sui prefissi stabili (una stringa resta accettata).
+    """
 
     __slots__ = ("system", "messages", "modello")
 
-    def __init__(self, system: str, messages: list[dict], modello: str) -> None:
+    def __init__(self, system: str | list[dict], messages: list[dict], modello: str) -> None:
         self.system = system
         self.messages = messages
         self.modello = modello
 
+    @property
+    def system_testo(self) -> str:
+        """System prompt come stringa unica (log, stime, debug)."""
+        if isinstance(self.system, str):
+            return self.system
+        return "\n\n".join(blocco["text"] for blocco in self.system)
+
 
 # ---------------------------------------------------------------------------
-# Funzioni di supporto per caricare dati dal DB
+# Caricamento dati dal DB
 # ---------------------------------------------------------------------------
 
-async def _carica_utente(db: AsyncSession, utente_id: uuid.UUID) -> Utente | None:
-    result = await db.execute(select(Utente).where(Utente.id == utente_id))
-    return result.scalar_one_or_none()
-
+@dataclass(slots=True)
+class DatiContesto:
+    """Tutto cio' che serve al turno, caricato una volta e condiviso
+    tra direttiva e blocchi del system prompt."""
 
-async def _carica_sessione(db: AsyncSession, sessione_id: uuid.UUID) -> Sessione | None:
-    result = await db.execute(select(Sessione).where(Sessione.id == sessione_id))
-    return result.scalar_one_or_none()
+    utente: Utente
+    sessione: Sessione
+    nodo: ContenutoNodo | None = None
+    storico_errori: list[dict] = field(default_factory=list)
+    nodi_supporto: dict[str, dict] = field(default_factory=dict)
+    messages: list[dict] = field(default_factory=list)
+    # (da_ordine, fino_a_ordine) se il riassunto progressivo va esteso
+    riassunto_da_aggiornare: tuple[int, int] | None = None
 
 
-async def _carica_nodo(db: AsyncSession, nodo_id: str) -> Nodo | None:
-    result = await db.execute(select(Nodo).where(Nodo.id == nodo_id))
-    return result.scalar_one_or_none()
-
-
-async def _carica_esercizi_nodo(db: AsyncSession, nodo_id: str) -> list[Esercizio]:
-    result = await db.execute(
-        select(Esercizio).where(Esercizio.nodo_id == nodo_id).order_by(Esercizio.difficolta)
-    )
-    return list(result.scalars().all())
-
+async def _carica_utente_sessione(
+    db: AsyncSession, utente_id: uuid.UUID, sessione_id: uuid.UUID
+) -> tuple[Utente | None, Sessione | None]:
+    """Utente + sessione in un solo round-trip.
 
-async def _carica_stato_nodo_utente(
-    db: AsyncSession, utente_id: uuid.UUID, nodo_id: str
-) -> StatoNodoUtente | None:
+    Il contenuto del nodo focale (ed esercizi) arriva dallo store in memoria.
+    """
     result = await db.execute(
-        select(StatoNodoUtente).where(
-            StatoNodoUtente.utente_id == utente_id,
-            StatoNodoUtente.nodo_id == nodo_id,
-        )
+        select(Utente, Sessione)
+        .select_from(Utente)
+        .outerjoin(Sessione, Sessione.id == sessione_id)
+        .where(Utente.id == utente_id)
     )
-    return result.scalar_one_or_none()
+    row = result.first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
 
 
 async def _carica_storico_errori_nodo(
@@ -117,85 +133,103 @@ async def _carica_storico_errori_nodo(
     ]
 
 
-async def _carica_prerequisiti_diretti(db: AsyncSession, nodo_id: str) -> list[str]:
-    """Ritorna gli ID dei prerequisiti bloccanti diretti di un nodo."""
-    result = await db.execute(
-        select(Relazione.nodo_da).where(
-            Relazione.nodo_a == nodo_id,
-            Relazione.dipendenza == "bloccante",
-        )
-    )
-    return [row[0] for row in result.all()]
-
-
-async def _carica_stati_nodi_utente(
-    db: AsyncSession, utente_id: uuid.UUID, nodo_ids: list[str]
+async def _carica_stati_prerequisiti(
+    db: AsyncSession, utente_id: uuid.UUID, nodo_id: str
 ) -> dict[str, dict]:
-    """Carica lo stato utente per una lista di nodi."""
-    if not nodo_ids:
+    """Prerequisiti bloccanti diretti del nodo con lo stato utente.
+
+    I prerequisiti arrivano dal grafo in RAM; il DB serve solo per lo stato.
+    Ritorna solo i prerequisiti che hanno una riga in stato_nodi_utente.
+    """
+    prerequisiti = grafo_knowledge.prerequisiti_diretti(nodo_id)
+    if not prerequisiti:
         return {}
+
     result = await db.execute(
-        select(StatoNodoUtente).where(
+        select(
+            StatoNodoUtente.nodo_id,
+            StatoNodoUtente.livello,
+            StatoNodoUtente.spiegazione_data,
+            StatoNodoUtente.esercizi_completati,
+            StatoNodoUtente.errori_in_corso,
+        )
+        .where(
             StatoNodoUtente.utente_id == utente_id,
-            StatoNodoUtente.nodo_id.in_(nodo_ids),
+            StatoNodoUtente.nodo_id.in_(prerequisiti),
         )
     )
-    stati = {}
-    for stato in result.scalars().all():
-        stati[stato.nodo_id] = {
-            "livello": stato.livello,
-            "spiegazione_data": stato.spiegazione_data,
-            "esercizi_completati": stato.esercizi_completati,
-            "errori_in_corso": stato.errori_in_corso,
+    return {
+        prereq_id: {
+            "livello": livello,
+            "spiegazione_data": spiegazione_data,
+            "esercizi_completati": esercizi_completati,
+            "errori_in_corso": errori_in_corso,
         }
-    return stati
+        for prereq_id, livello, spiegazione_data, esercizi_completati, errori_in_corso
+        in result.all()
+    }
 
 
 async def _carica_conversazione(
-    db: AsyncSession, sessione_id: uuid.UUID
-) -> list[dict]:
-    """Carica i turni di conversazione per i messages Claude (SOLO testo)."""
-    result = await db.execute(
-        select(TurnoConversazione.ruolo, TurnoConversazione.contenuto, TurnoConversazione.ordine)
-        .where(TurnoConversazione.sessione_id == sessione_id)
-        .order_by(TurnoConversazione.ordine)
+    db: AsyncSession, sessione: Sessione, messaggio_utente: str | None = None
+) -> tuple[list[dict], tuple[int, int] | None]:
+    """Messages Claude (SOLO testo), compattati a budget di token.
+
+    La finestra arriva dal buffer per sessione o dalla query finestrata:
+    nessuna delle due legge l'intero storico. Il messaggio utente del turno
+    corrente, salvato solo a fine turno, viene accodato a una copia della
+    finestra. Ritorna anche l'intervallo di turni da aggiungere al riassunto
+    progressivo, se serve.
+    """
+    from app.config import settings
+
+    finestra = await carica_finestra_conversazione(db, sessione.id)
+    if messaggio_utente:
+        finestra = finestra.con_turno("utente", messaggio_utente)
+    compattazione = compatta_conversazione(
+        finestra,
+        budget_token=settings.CONVERSAZIONE_BUDGET_TOKEN,
+        riassunto=sessione.riassunto_conversazione,
+        riassunto_fino_a=sessione.riassunto_fino_a_ordine,
+        min_turni_riassunto=settings.RIASSUNTO_MIN_TURNI,
     )
-    turni = []
-    for ruolo, contenuto, _ordine in result.all():
-        if contenuto:
-            turni.append({
-                "role": "user" if ruolo == "utente" else "assistant",
-                "content": contenuto,
-            })
-    return turni
+    return compattazione.messages, compattazione.da_riassumere
 
 
-# ---------------------------------------------------------------------------
-# Troncamento conversazione
-# ---------------------------------------------------------------------------
+async def _carica_dati_contesto(
+    db: AsyncSession,
+    sessione_id: uuid.UUID,
+    utente_id: uuid.UUID,
+    messaggio_utente: str | None = None,
+) -> DatiContesto:
+    """Carica tutti i dati del turno con il minimo di round-trip.
 
-def tronca_conversazione(messages: list[dict]) -> list[dict]:
-    """Tronca la conversazione se supera SOGLIA_TURNI.
+    1. utente + sessione (nodo focale ed esercizi dallo store contenuti)
+    2. storico errori sul nodo focale
+    3. stato utente dei prerequisiti diretti (prerequisiti dal grafo)
+    4. conversazione (finestra compattata; nessuna query se nel buffer)
 
-    Mantiene i primi TURNI_INIZIALI e gli ultimi TURNI_FINALI,
-    inserendo un messaggio sintetico di raccordo.
+    Raises:
+        ValueError: se utente o sessione non esistono.
     """
-    if len(messages) <= SOGLIA_TURNI:
-        return messages
-
-    iniziali = messages[:TURNI_INIZIALI]
-    finali = messages[-TURNI_FINALI:]
-    omessi = len(messages) - TURNI_INIZIALI - TURNI_FINALI
-
-    raccordo = {
-        "role": "user",
-        "content": (
-            f"[Nota di sistema: {omessi} turni omessi per brevità. "
-            "La conversazione è continuata normalmente.]"
-        ),
-    }
+    utente, sessione = await _carica_utente_sessione(db, utente_id, sessione_id)
+    if utente is None:
+        raise ValueError(f"Utente non trovato: {utente_id}")
+    if sessione is None:
+        raise ValueError(f"Sessione non trovata: {sessione_id}")
+
+    nodo_focale_id = (sessione.stato_orchestratore or {}).get("nodo_focale_id")
+    nodo = contenuti.nodo(nodo_focale_id) if nodo_focale_id else None
+    dati = DatiContesto(utente=utente, sessione=sessione, nodo=nodo)
+
+    if nodo is not None:
+        dati.storico_errori = await _carica_storico_errori_nodo(db, utente_id, nodo.id)
+        dati.nodi_supporto = await _carica_stati_prerequisiti(db, utente_id, nodo.id)
 
-    return iniziali + [raccordo] + finali
+    dati.messages, dati.riassunto_da_aggiornare = await _carica_conversazione(
+        db, sessione, messaggio_utente
+    )
+    return dati
 
 
 # ---------------------------------------------------------------------------
@@ -234,41 +268,21 @@ def _blocco_profilo_utente(utente: Utente) -> str:
     return "<profilo_utente>\n" + "\n".join(parti) + "\n</profilo_utente>"
 
 
+def _blocco_nodo_focale(nodo: ContenutoNodo) -> str:
+    """Blocco 4a: contenuto editoriale del nodo focale (stabile, cacheable).
+
+    La parte statica e' gia' serializzata nello store contenuti.
+    """
+    return f"<nodo_focale>\n{nodo.blocco}\n</nodo_focale>"
+
+
 def _blocco_contesto_attivo(
-    nodo: Nodo,
-    esercizi: list[Esercizio],
+    nodo: ContenutoNodo,
     storico_errori: list[dict],
     nodi_supporto: dict[str, dict],
 ) -> str:
-    """Blocco 4: contesto attivo (nodo focale + nodi supporto)."""
-    parti_nodo = [
-        f"ID: {nodo.id}",
-        f"Nome: {nodo.nome}",
-    ]
-
-    if nodo.definizioni_formali:
-        parti_nodo.append(
-            f"Definizioni formali: {json.dumps(nodo.definizioni_formali, ensure_ascii=False)}"
-        )
-    if nodo.formule_proprieta:
-        parti_nodo.append(
-            f"Formule e proprietà: {json.dumps(nodo.formule_proprieta, ensure_ascii=False)}"
-        )
-    if nodo.errori_comuni:
-        parti_nodo.append(
-            f"Errori comuni: {json.dumps(nodo.errori_comuni, ensure_ascii=False)}"
-        )
-    if nodo.esempi_applicazione:
-        parti_nodo.append(
-            f"Esempi: {json.dumps(nodo.esempi_applicazione, ensure_ascii=False)}"
-        )
-
-    # Esercizi disponibili (id + testo + difficoltà)
-    if esercizi:
-        lista_es = []
-        for es in esercizi:
-            lista_es.append(f"  - [{es.id}] (diff={es.difficolta}) {es.testo[:200]}")
-        parti_nodo.append("Esercizi disponibili:\n" + "\n".join(lista_es))
+    """Blocco 4b: stato dell'utente sul nodo focale + nodi supporto (volatile)."""
+    parti_nodo = [f"ID: {nodo.id}"]
 
     # Storico errori
     if storico_errori:
@@ -291,7 +305,7 @@ def _blocco_contesto_attivo(
 
     return (
         "<contesto_attivo>\n"
-        f"  <nodo_focale>\n{nodo_focale_xml}\n  </nodo_focale>\n"
+        f"  <stato_nodo_focale>\n{nodo_focale_xml}\n  </stato_nodo_focale>\n"
         f"  <nodi_supporto>\n{supporto_xml}\n  </nodi_supporto>\n"
         "</contesto_attivo>"
     )
@@ -302,17 +316,25 @@ def _blocco_memoria() -> str:
     return "<memoria_rilevante>\n</memoria_rilevante>"
 
 
+def _blocco_system(testo: str, cache: bool = False) -> dict:
+    """Blocco di testo per il parametro system, con breakpoint di cache opzionale."""
+    blocco: dict = {"type": "text", "text": testo}
+    if cache:
+        blocco["cache_control"] = {"type": "ephemeral"}
+    return blocco
+
+
 # ---------------------------------------------------------------------------
 # Generazione direttiva dalla situazione corrente
 # ---------------------------------------------------------------------------
 
-async def _genera_direttiva(
-    db: AsyncSession,
-    sessione: Sessione,
-    utente: Utente,
-    nodo: Nodo | None,
-) -> str:
-    """Genera la direttiva appropriata in base allo stato_orchestratore della sessione."""
+def _genera_direttiva(dati: DatiContesto) -> str:
+    """Genera la direttiva appropriata in base allo stato_orchestratore della sessione.
+
+    Usa i dati gia' caricati per il contesto (storico errori, prerequisiti):
+    nessuna query aggiuntiva.
+    """
+    sessione, utente, nodo = dati.sessione, dati.utente, dati.nodo
     stato_orch = sessione.stato_orchestratore or {}
     attivita = stato_orch.get("attivita_corrente", "spiegazione")
     fase_onboarding = stato_orch.get("fase_onboarding")
@@ -337,8 +359,9 @@ async def _genera_direttiva(
 
     # Esercizio in corso
     if attivita == "esercizio":
-        storico = await _carica_storico_errori_nodo(db, utente.id, nodo.id)
-        storico_str = [f"{e['esito']} ({e.get('tipo_errore', '?')})" for e in storico]
+        storico_str = [
+            f"{e['esito']} ({e.get('tipo_errore', '?')})" for e in dati.storico_errori
+        ]
 
         return direttiva_esercizio(
             nodo_nome=nodo.nome,
@@ -370,10 +393,8 @@ async def _genera_direttiva(
         )
 
     # Default: spiegazione
-    prerequisiti_ids = await _carica_prerequisiti_diretti(db, nodo.id)
-    stati_prereq = await _carica_stati_nodi_utente(db, utente.id, prerequisiti_ids)
     prerequisiti_completati = [
-        nid for nid, stato in stati_prereq.items()
+        nid for nid, stato in dati.nodi_supporto.items()
         if stato.get("livello") in ("operativo", "comprensivo", "connesso")
     ]
 
@@ -407,62 +428,44 @@ async def assembla_context_package(
     sessione_id: uuid.UUID,
     utente_id: uuid.UUID,
     db: AsyncSession,
+    messaggio_utente: str | None = None,
 ) -> ContextPackage:
     """Assembla il context package completo per una chiamata LLM.
 
+    messaggio_utente: testo del turno corrente non ancora salvato, accodato
+    ai messages.
+
     Returns:
-        ContextPackage con system (blocchi 1-4+6 XML) e messages (blocco 5).
+        ContextPackage con system (blocchi XML ordinati per stabilita') e
+        messages (blocco 5).
     """
     from app.config import settings
 
-    # Carica entità principali
-    utente = await _carica_utente(db, utente_id)
-    if utente is None:
-        raise ValueError(f"Utente non trovato: {utente_id}")
+    dati = await _carica_dati_contesto(db, sessione_id, utente_id, messaggio_utente)
+    nodo = dati.nodo
 
-    sessione = await _carica_sessione(db, sessione_id)
-    if sessione is None:
-        raise ValueError(f"Sessione non trovata: {sessione_id}")
-
-    stato_orch = sessione.stato_orchestratore or {}
-    nodo_focale_id = stato_orch.get("nodo_focale_id")
-
-    # Carica nodo focale (se presente)
-    nodo: Nodo | None = None
-    esercizi: list[Esercizio] = []
-    storico_errori: list[dict] = []
-    nodi_supporto: dict[str, dict] = {}
-
-    if nodo_focale_id:
-        nodo = await _carica_nodo(db, nodo_focale_id)
-        if nodo:
-            esercizi = await _carica_esercizi_nodo(db, nodo_focale_id)
-            storico_errori = await _carica_storico_errori_nodo(db, utente_id, nodo_focale_id)
-
-            # Carica prerequisiti diretti come nodi supporto
-            prereq_ids = await _carica_prerequisiti_diretti(db, nodo_focale_id)
-            nodi_supporto = await _carica_stati_nodi_utente(db, utente_id, prereq_ids)
-
-    # Genera direttiva
-    direttiva = await _genera_direttiva(db, sessione, utente, nodo)
-
-    # Assembla system prompt (blocchi 1-4 + 6)
-    blocchi = [
-        _blocco_system_prompt(),
-        _blocco_direttiva(direttiva),
-        _blocco_profilo_utente(utente),
-    ]
+    # Genera direttiva (riusa storico e prerequisiti gia' caricati)
+    direttiva = _genera_direttiva(dati)
 
+    # Assembla system prompt: prefissi stabili con breakpoint, poi la parte volatile
+    system = [_blocco_system(_blocco_system_prompt(), cache=True)]
     if nodo:
-        blocchi.append(_blocco_contesto_attivo(nodo, esercizi, storico_errori, nodi_supporto))
+        system.append(_blocco_system(_blocco_nodo_focale(nodo), cache=True))
+    system.append(_blocco_system(_blocco_profilo_utente(dati.utente), cache=True))
 
-    blocchi.append(_blocco_memoria())
-
-    system = "\n\n".join(blocchi)
+    volatili = []
+    if nodo:
+        volatili.append(
+            _blocco_contesto_attivo(nodo, dati.storico_errori, dati.nodi_supporto)
+        )
+    volatili.append(_blocco_memoria())
+    volatili.append(_blocco_direttiva(direttiva))
+    system.append(_blocco_system("\n\n".join(volatili)))
 
-    # Carica e tronca conversazione (blocco 5)
-    messages = await _carica_conversazione(db, sessione_id)
-    messages = tronca_conversazione(messages)
+    # Conversazione (blocco 5), gia' compattata a budget di token
+    messages = dati.messages
+    if dati.riassunto_da_aggiornare:
+        pianifica_riassunto(sessione_id, *dati.riassunto_da_aggiornare)
 
     # Anthropic API richiede almeno un messaggio.
     # Al primo turno (onboarding/sessione) il tutor parla per primo senza input utente.
@@ -472,12 +475,16 @@ async def assembla_context_package(
     # Determina modello
     modello = settings.LLM_MODEL_TUTOR
 
+    pkg = ContextPackage(system=system, messages=messages, modello=modello)
+
     logger.info(
-        "Context package assemblato: sessione=%s, nodo=%s, %d messages, system=%d chars",
+        "Context package assemblato: sessione=%s, nodo=%s, %d messages, "
+        "system=%d blocchi/%d chars",
         sessione_id,
-        nodo_focale_id,
+        nodo.id if nodo else None,
         len(messages),
         len(system),
+        len(pkg.system_testo),
     )
 
-    return ContextPackage(system=system, messages=messages, modello=modello)
+    return pkg
@@ -4,20 +4,354 @@ contenuto = SOLO testo visibile
 azioni = JSONB separato (MAI nei messages)
 segnali = JSONB separato (MAI nei messages)
 I messages per Claude contengono SOLO il testo dei turni precedenti.
+
+Finestra conversazione: il context builder riceve i primi TURNI_INIZIALI
+messaggi e al massimo gli ultimi TURNI_RECENTI_MAX; la compattazione a budget
+di token (app.core.compattazione) sceglie poi quanti recenti tenere.
+`carica_finestra_conversazione` legge dal DB solo quelle righe (piu' il
+conteggio); `buffer_conversazioni` le tiene in memoria per sessione, aggiornato
+da salva_turno al commit, cosi' a regime il turno non rilegge lo storico.
+
+Ordine dei turni: `sessioni.ultimo_ordine_turno` e' un contatore incrementato
+con UPDATE ... RETURNING (il lock di riga serializza i turni concorrenti della
+stessa sessione); il vincolo unico (sessione_id, ordine) garantisce che non
+nascano duplicati. salva_turni scrive piu' turni con un solo INSERT.
 """
 
 from __future__ import annotations
 
 import logging
+import time
 import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from functools import partial
 
-from sqlalchemy import func, select
+from sqlalchemy import and_, func, insert, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models.utenti import TurnoConversazione
+from app.config import settings
+from app.db.models.utenti import Sessione, TurnoConversazione
+from app.db.transazioni import dopo_commit
 
 logger = logging.getLogger(__name__)
 
+# Finestra conversazione: primi messaggi sempre tenuti + tetto ai recenti caricati
+TURNI_INIZIALI = 2
+TURNI_RECENTI_MAX = 60
+
+
+def _messaggio(ruolo: str, contenuto: str) -> dict:
+    return {
+        "role": "user" if ruolo == "utente" else "assistant",
+        "content": contenuto,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Finestra conversazione + buffer per sessione
+# ---------------------------------------------------------------------------
+
+@dataclass(slots=True)
+class FinestraConversazione:
+    """Primi e ultimi messaggi (solo testo) di una sessione, come (ordine, messaggio).
+
+    `iniziali` sono i primi TURNI_INIZIALI messaggi; `recenti` gli ultimi
+    TURNI_RECENTI_MAX (i due insiemi si sovrappongono finche' la sessione e'
+    corta). ultimo_ordine e' l'ordine dell'ultimo turno salvato, anche senza testo.
+    """
+
+    iniziali: list[tuple[int, dict]] = field(default_factory=list)
+    recenti: deque[tuple[int, dict]] = field(
+        default_factory=lambda: deque(maxlen=TURNI_RECENTI_MAX)
+    )
+    totale: int = 0
+    ultimo_ordine: int = 0
+
+    def aggiungi(self, ordine: int, messaggio: dict) -> None:
+        if len(self.iniziali) < TURNI_INIZIALI:
+            self.iniziali.append((ordine, messaggio))
+        self.recenti.append((ordine, messaggio))
+        self.totale += 1
+
+    def con_turno(self, ruolo: str, contenuto: str) -> FinestraConversazione:
+        """Copia con un turno non ancora salvato in coda (ordine provvisorio).
+
+        Il turno utente viene scritto a fine turno insieme alla risposta, ma il
+        contesto deve gia' contenerlo; la finestra nel buffer resta intatta.
+        """
+        copia = FinestraConversazione(
+            iniziali=list(self.iniziali),
+            recenti=deque(self.recenti, maxlen=TURNI_RECENTI_MAX),
+            totale=self.totale,
+            ultimo_ordine=self.ultimo_ordine + 1,
+        )
+        copia.aggiungi(copia.ultimo_ordine, _messaggio(ruolo, contenuto))
+        return copia
+
+    def successivi_agli_iniziali(self) -> list[tuple[int, dict]]:
+        """Recenti esclusi quelli gia' presenti negli iniziali."""
+        if not self.iniziali:
+            return list(self.recenti)
+        ultimo_iniziale = self.iniziali[-1][0]
+        return [voce for voce in self.recenti if voce[0] > ultimo_iniziale]
+
+
+class BufferConversazioni:
+    """Finestre conversazione in memoria per sessione (LRU + TTL, per processo).
+
+    Consistenza: salva_turno passa l'ordine del turno appena scritto; se non e'
+    il successivo di quello in buffer (scritture da un altro processo, rollback)
+    la sessione viene invalidata e ricaricata dal DB al turno seguente.
+    """
+
+    def __init__(self, max_sessioni: int, ttl_sec: float) -> None:
+        self._max_sessioni = max_sessioni
+        self._ttl_sec = ttl_sec
+        self._voci: OrderedDict[uuid.UUID, tuple[float, FinestraConversazione]] = (
+            OrderedDict()
+        )
+        self.hit = 0
+        self.miss = 0
+
+    @property
+    def attivo(self) -> bool:
+        return self._max_sessioni > 0
+
+    def leggi(self, sessione_id: uuid.UUID) -> FinestraConversazione | None:
+        voce = self._voci.get(sessione_id)
+        if voce is None or time.monotonic() - voce[0] > self._ttl_sec:
+            if voce is not None:
+                del self._voci[sessione_id]
+            self.miss += 1
+            return None
+        self._voci.move_to_end(sessione_id)
+        self.hit += 1
+        return voce[1]
+
+    def scrivi(self, sessione_id: uuid.UUID, finestra: FinestraConversazione) -> None:
+        if not self.attivo:
+            return
+        self._voci[sessione_id] = (time.monotonic(), finestra)
+        self._voci.move_to_end(sessione_id)
+        while len(self._voci) > self._max_sessioni:
+            self._voci.popitem(last=False)
+
+    def aggiungi_turno(
+        self,
+        sessione_id: uuid.UUID,
+        ordine: int,
+        ruolo: str,
+        contenuto: str | None,
+    ) -> None:
+        """Append del turno appena salvato (no-op se la sessione non e' in buffer)."""
+        voce = self._voci.get(sessione_id)
+        if voce is None:
+            return
+        finestra = voce[1]
+        if ordine != finestra.ultimo_ordine + 1:
+            logger.warning(
+                "Buffer conversazione incoerente: sessione=%s, atteso ordine=%d, "
+                "ricevuto %d — invalidato",
+                sessione_id, finestra.ultimo_ordine + 1, ordine,
+            )
+            del self._voci[sessione_id]
+            return
+        finestra.ultimo_ordine = ordine
+        if contenuto:
+            finestra.aggiungi(ordine, _messaggio(ruolo, contenuto))
+
+    def invalida(self, sessione_id: uuid.UUID) -> None:
+        self._voci.pop(sessione_id, None)
+
+    def svuota(self) -> None:
+        self._voci.clear()
+
+    def statistiche(self) -> dict:
+        totale = self.hit + self.miss
+        return {
+            "sessioni": len(self._voci),
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_ratio": self.hit / totale if totale else 0.0,
+        }
+
+
+buffer_conversazioni = BufferConversazioni(
+    max_sessioni=settings.CACHE_CONVERSAZIONI_MAX_SESSIONI,
+    ttl_sec=settings.CACHE_CONVERSAZIONI_TTL_SEC,
+)
+
+
+async def carica_finestra_conversazione(
+    db: AsyncSession,
+    sessione_id: uuid.UUID,
+) -> FinestraConversazione:
+    """Finestra conversazione dal buffer o, se assente, con una query finestrata.
+
+    La query usa l'indice (sessione_id, ordine) e ritorna solo i primi
+    TURNI_INIZIALI e gli ultimi TURNI_RECENTI_MAX messaggi, con conteggio e
+    ultimo ordine calcolati da window function.
+    """
+    finestra = buffer_conversazioni.leggi(sessione_id)
+    if finestra is not None:
+        return finestra
+
+    ha_testo = and_(
+        TurnoConversazione.contenuto.is_not(None),
+        TurnoConversazione.contenuto != "",
+    )
+    sub = (
+        select(
+            TurnoConversazione.ruolo,
+            TurnoConversazione.contenuto,
+            TurnoConversazione.ordine,
+            ha_testo.label("ha_testo"),
+            func.count()
+            .filter(ha_testo)
+            .over(order_by=TurnoConversazione.ordine)
+            .label("posizione"),
+            func.count().filter(ha_testo).over().label("totale"),
+            func.max(TurnoConversazione.ordine).over().label("ultimo_ordine"),
+        )
+        .where(TurnoConversazione.sessione_id == sessione_id)
+        .subquery()
+    )
+    result = await db.execute(
+        select(
+            sub.c.ruolo,
+            sub.c.contenuto,
+            sub.c.ordine,
+            sub.c.totale,
+            sub.c.ultimo_ordine,
+            sub.c.ha_testo,
+        )
+        .where(
+            or_(
+                # l'ultima riga porta sempre totale/ultimo_ordine, anche senza testo
+                sub.c.ordine == sub.c.ultimo_ordine,
+                and_(
+                    sub.c.ha_testo,
+                    or_(
+                        sub.c.posizione <= TURNI_INIZIALI,
+                        sub.c.posizione > sub.c.totale - TURNI_RECENTI_MAX,
+                    ),
+                ),
+            )
+        )
+        .order_by(sub.c.ordine)
+    )
+    righe = result.all()
+
+    finestra = FinestraConversazione()
+    if righe:
+        totale = righe[-1].totale
+        finestra.ultimo_ordine = righe[-1].ultimo_ordine
+        voci = [(r.ordine, _messaggio(r.ruolo, r.contenuto)) for r in righe if r.ha_testo]
+        if totale <= TURNI_RECENTI_MAX:
+            for ordine, messaggio in voci:
+                finestra.aggiungi(ordine, messaggio)
+        else:
+            finestra.iniziali = voci[:TURNI_INIZIALI]
+            finestra.recenti.extend(voci[TURNI_INIZIALI:])
+            finestra.totale = totale
+
+    buffer_conversazioni.scrivi(sessione_id, finestra)
+    return finestra
+
+
+@dataclass(slots=True)
+class NuovoTurno:
+    """Turno da salvare: contenuto = SOLO testo visibile, azioni/segnali separati."""
+
+    ruolo: str  # "utente" | "assistente"
+    contenuto: str | None
+    azioni: list | None = None
+    segnali: list | None = None
+    nodo_focale_id: str | None = None
+    modello: str | None = None
+    token_input: int | None = None
+    token_output: int | None = None
+    costo_stimato: float | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class TurnoSalvato:
+    id: int
+    ordine: int
+
+
+async def riserva_ordini(db: AsyncSession, sessione_id: uuid.UUID, n: int) -> int:
+    """Riserva n ordini consecutivi per la sessione e ritorna il primo.
+
+    L'UPDATE prende il lock di riga sulla sessione fino al commit: due turni
+    concorrenti ricevono intervalli disgiunti.
+
+    Raises:
+        ValueError: se la sessione non esiste.
+    """
+    result = await db.execute(
+        update(Sessione)
+        .where(Sessione.id == sessione_id)
+        .values(ultimo_ordine_turno=Sessione.ultimo_ordine_turno + n)
+        .returning(Sessione.ultimo_ordine_turno)
+    )
+    ultimo = result.scalar_one_or_none()
+    if ultimo is None:
+        raise ValueError(f"Sessione {sessione_id} non trovata")
+    return ultimo - n + 1
+
+
+async def salva_turni(
+    db: AsyncSession,
+    sessione_id: uuid.UUID,
+    turni: list[NuovoTurno],
+) -> list[TurnoSalvato]:
+    """Salva i turni in ordine con un UPDATE (contatore) e un INSERT multi-riga."""
+    if not turni:
+        return []
+
+    primo = await riserva_ordini(db, sessione_id, len(turni))
+    result = await db.execute(
+        insert(TurnoConversazione)
+        .values([
+            {
+                "sessione_id": sessione_id,
+                "ordine": primo + i,
+                "ruolo": turno.ruolo,
+                "contenuto": turno.contenuto,
+                "azioni": turno.azioni,
+                "segnali": turno.segnali,
+                "nodo_focale_id": turno.nodo_focale_id,
+                "modello": turno.modello,
+                "token_input": turno.token_input,
+                "token_output": turno.token_output,
+                "costo_stimato": turno.costo_stimato,
+            }
+            for i, turno in enumerate(turni)
+        ])
+        .returning(TurnoConversazione.id, TurnoConversazione.ordine)
+    )
+    per_ordine = {ordine: turno_id for turno_id, ordine in result.all()}
+    salvati = [TurnoSalvato(id=per_ordine[primo + i], ordine=primo + i) for i in range(len(turni))]
+
+    for turno, salvato in zip(turni, salvati):
+        # Nel buffer solo a commit avvenuto: dopo un rollback il contatore
+        # riassegna gli stessi ordini
+        dopo_commit(db, partial(
+            buffer_conversazioni.aggiungi_turno,
+            sessione_id, salvato.ordine, turno.ruolo, turno.contenuto,
+        ))
+        logger.debug(
+            "Turno salvato: sessione=%s, ordine=%d, ruolo=%s, %d chars",
+            sessione_id,
+            salvato.ordine,
+            turno.ruolo,
+            len(turno.contenuto) if turno.contenuto else 0,
+        )
+
+    return salvati
+
 
 async def salva_turno(
     db: AsyncSession,
@@ -31,8 +365,8 @@ async def salva_turno(
     token_input: int | None = None,
     token_output: int | None = None,
     costo_stimato: float | None = None,
-) -> TurnoConversazione:
-    """Salva un turno di conversazione separando testo, azioni e segnali.
+) -> TurnoSalvato:
+    """Salva un singolo turno separando testo, azioni e segnali.
 
     Args:
         ruolo: "utente" o "assistente"
@@ -40,17 +374,7 @@ async def salva_turno(
         azioni: lista azioni (JSONB separato, MAI nei messages)
         segnali: lista segnali (JSONB separato, MAI nei messages)
     """
-    # Calcola prossimo ordine
-    result = await db.execute(
-        select(func.coalesce(func.max(TurnoConversazione.ordine), 0)).where(
-            TurnoConversazione.sessione_id == sessione_id
-        )
-    )
-    ordine_corrente = result.scalar_one()
-
-    turno = TurnoConversazione(
-        sessione_id=sessione_id,
-        ordine=ordine_corrente + 1,
+    [salvato] = await salva_turni(db, sessione_id, [NuovoTurno(
         ruolo=ruolo,
         contenuto=contenuto,
         azioni=azioni,
@@ -60,19 +384,8 @@ async def salva_turno(
         token_input=token_input,
         token_output=token_output,
         costo_stimato=costo_stimato,
-    )
-    db.add(turno)
-    await db.flush()
-
-    logger.debug(
-        "Turno salvato: sessione=%s, ordine=%d, ruolo=%s, %d chars",
-        sessione_id,
-        turno.ordine,
-        ruolo,
-        len(contenuto) if contenuto else 0,
-    )
-
-    return turno
+    )])
+    return salvato
 
 
 async def carica_conversazione(
@@ -88,11 +401,8 @@ async def carica_conversazione(
         .where(TurnoConversazione.sessione_id == sessione_id)
         .order_by(TurnoConversazione.ordine)
     )
-    messages = []
-    for ruolo, contenuto in result.all():
-        if contenuto:
-            messages.append({
-                "role": "user" if ruolo == "utente" else "assistant",
-                "content": contenuto,
-            })
-    return messages
+    return [
+        _messaggio(ruolo, contenuto)
+        for ruolo, contenuto in result.all()
+        if contenuto
+    ]
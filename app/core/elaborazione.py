@@ -15,16 +15,33 @@ from __future__ import annotations
 import logging
 import random
 import uuid
+from collections.abc import Iterable
+from dataclasses import dataclass
 from datetime import datetime, timezone
+from functools import partial
 
-from sqlalchemy import func, select
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models.grafo import Esercizio
+from app.core.gamification import (
+    ESITI_CORRETTI,
+    incrementa_contatori_utente,
+    registra_attivita_giornaliera,
+    temi_completati_da,
+)
 from app.db.models.stato_utente import StatoNodoUtente, StoricoEsercizi
 from app.db.models.utenti import Sessione
+from app.db.transazioni import dopo_commit, dopo_rollback
 from app.grafo.algoritmi import nodi_sbloccati_dopo_promozione
-from app.grafo.stato import get_livelli_utente
+from app.grafo.contenuti import EsercizioContenuto, contenuti
+from app.grafo.semantica import embedding_nodi
+from app.grafo.stato import (
+    cache_livelli,
+    cache_tentati,
+    get_esercizi_tentati,
+    get_livelli_utente,
+)
 from app.grafo.struttura import grafo_knowledge
 
 logger = logging.getLogger(__name__)
@@ -38,6 +55,9 @@ DIFFICOLTA_MAPPING: dict[str, tuple[int, int]] = {
 
 ESERCIZI_PER_PROMOZIONE = 3
 
+# Nodi alternativi (per similarita' di embedding) allegati a suggerisci_backtrack
+BACKTRACK_ALTERNATIVE = 3
+
 
 # ===================================================================
 # Action Executor
@@ -59,11 +79,11 @@ async def esegui_azione(
     params = azione.get("input", {})
 
     if nome == "proponi_esercizio":
-        return await _esegui_proponi_esercizio(db, params, sessione_id)
+        return await _esegui_proponi_esercizio(db, params, sessione_id, utente_id)
     elif nome == "mostra_formula":
         return {"tipo": "mostra_formula", "params": params}
     elif nome == "suggerisci_backtrack":
-        return {"tipo": "suggerisci_backtrack", "params": params}
+        return _esegui_suggerisci_backtrack(params)
     elif nome == "chiudi_sessione":
         return await _esegui_chiudi_sessione(db, params, sessione_id)
     else:
@@ -74,43 +94,90 @@ async def esegui_azione(
         return {"tipo": nome, "params": params, "stub": True}
 
 
+def _esegui_suggerisci_backtrack(params: dict) -> dict:
+    """Valida il nodo di backtrack e allega i nodi operativi piu' simili.
+
+    Un nodo_id inesistente (testo libero del tutor) viene risolto con
+    l'indice di ricerca del grafo; le alternative vengono dall'indice
+    embedding, se caricato.
+    """
+    nodo_id = params.get("nodo_id", "")
+    if not grafo_knowledge.caricato:
+        return {"tipo": "suggerisci_backtrack", "params": params}
+
+    if nodo_id not in grafo_knowledge.grafo:
+        risultati = grafo_knowledge.ricerca.cerca(nodo_id, limite=1, tipo="nodo")
+        if risultati:
+            logger.info("Backtrack: nodo %r risolto in %s", nodo_id, risultati[0].id)
+            nodo_id = risultati[0].id
+            params = {**params, "nodo_id": nodo_id}
+
+    evento = {"tipo": "suggerisci_backtrack", "params": params}
+    if embedding_nodi.caricato:
+        simili = embedding_nodi.indice.simili(
+            [nodo_id], k=BACKTRACK_ALTERNATIVE, candidati=grafo_knowledge.nodi_operativi()
+        ).get(nodo_id, [])
+        evento["alternative"] = [
+            {"nodo_id": n, "nome": grafo_knowledge.nome(n), "similarita": round(sim, 3)}
+            for n, sim in simili
+        ]
+    return evento
+
+
+def _scegli_esercizio(
+    nodo_id: str,
+    min_diff: int,
+    max_diff: int,
+    evita_ids: Iterable[str],
+    tentati: frozenset[str],
+) -> EsercizioContenuto | None:
+    """Esercizio casuale dall'indice (nodo, difficoltà) dello store contenuti.
+
+    Ordine di preferenza: range di difficoltà senza ripetizioni, tutto il
+    nodo senza ripetizioni, poi (banco esaurito per l'utente) di nuovo il
+    range e tutto il nodo ammettendo gli esercizi gia' svolti. evita_ids del
+    tutor vale sempre.
+    """
+    evita = set(evita_ids)
+    nel_range = contenuti.esercizi_per_difficolta(nodo_id, min_diff, max_diff, evita)
+    nel_nodo = [es for es in contenuti.esercizi_nodo(nodo_id) if es.id not in evita]
+    for candidati in (
+        [es for es in nel_range if es.id not in tentati],
+        [es for es in nel_nodo if es.id not in tentati],
+        nel_range,
+        nel_nodo,
+    ):
+        if candidati:
+            return random.choice(candidati)
+    return None
+
+
 async def _esegui_proponi_esercizio(
     db: AsyncSession,
     params: dict,
     sessione_id: uuid.UUID,
+    utente_id: uuid.UUID,
 ) -> dict:
-    """Seleziona un esercizio dal banco per nodo e difficoltà."""
+    """Seleziona un esercizio dal banco per nodo e difficoltà.
+
+    Gli esercizi gia' visti dall'utente sul nodo (cache_tentati, una query
+    su storico_esercizi solo al primo accesso) vengono evitati finche' ce ne
+    sono di nuovi.
+    """
     nodo_id = params.get("nodo_id", "")
     difficolta_str = params.get("difficolta", "base")
     evita_ids = params.get("evita_ids", [])
 
     min_diff, max_diff = DIFFICOLTA_MAPPING.get(difficolta_str, (1, 2))
 
-    # Query esercizi disponibili
-    query = (
-        select(Esercizio)
-        .where(
-            Esercizio.nodo_id == nodo_id,
-            Esercizio.difficolta >= min_diff,
-            Esercizio.difficolta <= max_diff,
-        )
+    # Esercizi dallo store contenuti (nessuna query), filtrati sui gia' visti
+    tentati = (
+        await get_esercizi_tentati(utente_id, nodo_id, db)
+        if contenuti.esercizi_nodo(nodo_id) else frozenset()
     )
-    if evita_ids:
-        query = query.where(Esercizio.id.notin_(evita_ids))
-
-    result = await db.execute(query)
-    esercizi = list(result.scalars().all())
-
-    if not esercizi:
-        # Fallback: prova con range più ampio
-        result_fallback = await db.execute(
-            select(Esercizio)
-            .where(Esercizio.nodo_id == nodo_id)
-            .where(Esercizio.id.notin_(evita_ids) if evita_ids else True)
-        )
-        esercizi = list(result_fallback.scalars().all())
+    esercizio = _scegli_esercizio(nodo_id, min_diff, max_diff, evita_ids, tentati)
 
-    if not esercizi:
+    if esercizio is None:
         logger.warning(
             "Nessun esercizio per nodo=%s, difficoltà=%s",
             nodo_id, difficolta_str,
@@ -123,7 +190,7 @@ async def _esegui_proponi_esercizio(
             },
         }
 
-    esercizio = random.choice(esercizi)
+    cache_tentati.aggiungi(utente_id, nodo_id, esercizio.id)
 
     # Aggiorna stato_orchestratore con esercizio corrente
     sessione = await db.execute(
@@ -163,6 +230,8 @@ async def _esegui_chiudi_sessione(
     )
     sess = sessione.scalar_one_or_none()
     if sess:
+        if sess.stato != "completata":
+            await incrementa_contatori_utente(db, sess.utente_id, sessioni_completate=1)
         sess.stato = "completata"
         sess.riepilogo = params.get("riepilogo", "")
         sess.completed_at = datetime.now(timezone.utc)
@@ -176,43 +245,95 @@ async def _esegui_chiudi_sessione(
 # ===================================================================
 
 
+@dataclass(slots=True)
+class _RisposteNodo:
+    """Risposte a esercizi dello stesso nodo in un turno, aggregate per l'UPSERT."""
+
+    completati: int = 0
+    non_risolti: int = 0
+    # primo_tentativo consecutivi in coda al turno (== completati se tutti ok)
+    consecutivi_ok: int = 0
+
+
 async def processa_segnali(
     db: AsyncSession,
     segnali: list[dict],
     sessione_id: uuid.UUID,
     utente_id: uuid.UUID,
+    sessione: Sessione | None = None,
 ) -> list[dict]:
     """Processa i segnali accumulati. Ritorna lista promozioni avvenute.
 
+    I segnali sono raggruppati per tabella e applicati a blocchi, con un
+    numero di statement indipendente da quanti tool ha emesso il tutor:
+    - concetto_spiegato → un UPSERT multi-riga su stato_nodi_utente
+    - risposta_esercizio → un INSERT multi-riga su storico_esercizi + un
+      UPSERT multi-riga dei contatori che ritorna i campi per la promozione
+    - promozioni → un UPDATE ... RETURNING dei nodi promuovibili
+    - statistiche del giorno → un UPSERT incrementale (esercizi, nodi)
+    - contatori achievement su utenti → un UPDATE incrementale
+    - segnali di sessione → mutazione unica di `sessione` (gia' caricata dal
+      turno; letta qui una sola volta se non passata)
+
     Returns:
         Lista di dict con promozioni: [{"nodo_id": ..., "nuovo_livello": ...}]
     """
-    promozioni: list[dict] = []
+    concetti: list[str] = []
+    risposte: list[dict] = []
+    segnali_sessione: list[tuple[str, dict]] = []
 
     for segnale in segnali:
         nome = segnale.get("name", "")
         params = segnale.get("input", {})
 
         if nome == "concetto_spiegato":
-            await _processa_concetto_spiegato(db, params, utente_id)
+            if params.get("nodo_id"):
+                concetti.append(params["nodo_id"])
         elif nome == "risposta_esercizio":
-            promo = await _processa_risposta_esercizio(
-                db, params, utente_id, sessione_id
-            )
-            if promo:
-                promozioni.append(promo)
-        elif nome == "confusione_rilevata":
-            _log_segnale("confusione_rilevata", params)
-        elif nome == "energia_utente":
-            _log_segnale("energia_utente", params)
-        elif nome == "prossimo_passo_raccomandato":
-            await _processa_prossimo_passo(db, params, sessione_id)
-        elif nome == "punto_partenza_suggerito":
-            await _processa_punto_partenza(db, params, sessione_id)
+            if params.get("nodo_focale"):
+                risposte.append(params)
+        elif nome in ("prossimo_passo_raccomandato", "punto_partenza_suggerito"):
+            segnali_sessione.append((nome, params))
         else:
-            # Loop 3 segnali — log senza processare
+            # confusione/energia + Loop 3 segnali — log senza processare
             _log_segnale(nome, params)
 
+    adesso = datetime.now(timezone.utc)
+    promozioni: list[dict] = []
+
+    if concetti:
+        await _processa_concetti_spiegati(db, concetti, utente_id, adesso)
+    if risposte:
+        candidati, consecutivi_max = await _processa_risposte_esercizio(
+            db, risposte, utente_id, sessione_id, adesso
+        )
+        temi_completati = 0
+        if candidati:
+            promozioni = await _promuovi_nodi(db, utente_id, candidati, adesso)
+            if promozioni and grafo_knowledge.caricato:
+                livelli = await get_livelli_utente(utente_id, db)
+                temi_completati = temi_completati_da(
+                    (p["nodo_id"] for p in promozioni), livelli
+                )
+        corretti = sum(1 for r in risposte if r.get("esito") in ESITI_CORRETTI)
+        await registra_attivita_giornaliera(
+            db,
+            utente_id,
+            esercizi_svolti=len(risposte),
+            esercizi_corretti=corretti,
+            nodi_completati=len(promozioni),
+        )
+        await incrementa_contatori_utente(
+            db,
+            utente_id,
+            nodi_completati=len(promozioni),
+            esercizi_risolti=corretti,
+            temi_completati=temi_completati,
+            consecutivi_ok=consecutivi_max,
+        )
+    if segnali_sessione:
+        await _processa_segnali_sessione(db, segnali_sessione, sessione_id, sessione)
+
     return promozioni
 
 
@@ -220,178 +341,214 @@ def _log_segnale(nome: str, params: dict) -> None:
     logger.info("Segnale %s: %s", nome, params)
 
 
-async def _processa_concetto_spiegato(
+async def _processa_concetti_spiegati(
     db: AsyncSession,
-    params: dict,
+    nodi: list[str],
     utente_id: uuid.UUID,
+    adesso: datetime,
 ) -> None:
-    """concetto_spiegato → aggiorna spiegazione_data, livello in_corso."""
-    nodo_id = params.get("nodo_id", "")
-    if not nodo_id:
-        return
-
-    # UPSERT stato nodo utente
-    from sqlalchemy.dialects.postgresql import insert as pg_insert
-
-    stmt = pg_insert(StatoNodoUtente).values(
-        utente_id=utente_id,
-        nodo_id=nodo_id,
-        livello="in_corso",
-        spiegazione_data=True,
-        ultima_interazione=datetime.now(timezone.utc),
-    )
+    """concetto_spiegato → spiegazione_data e livello in_corso (UPSERT multi-riga)."""
+    nodi = list(dict.fromkeys(nodi))
+    stmt = pg_insert(StatoNodoUtente).values([
+        {
+            "utente_id": utente_id,
+            "nodo_id": nodo_id,
+            "livello": "in_corso",
+            "spiegazione_data": True,
+            "ultima_interazione": adesso,
+        }
+        for nodo_id in nodi
+    ])
     stmt = stmt.on_conflict_do_update(
         index_elements=["utente_id", "nodo_id"],
         set_={
             "spiegazione_data": True,
             "livello": "in_corso",
-            "ultima_interazione": datetime.now(timezone.utc),
+            "ultima_interazione": adesso,
         },
     )
     await db.execute(stmt)
-    await db.flush()
+    for nodo_id in nodi:
+        cache_livelli.aggiorna(utente_id, nodo_id, "in_corso")
+    dopo_rollback(db, partial(cache_livelli.invalida, utente_id))
 
     logger.info(
-        "Concetto spiegato: nodo=%s, utente=%s → in_corso",
-        nodo_id, utente_id,
+        "Concetti spiegati: nodi=%s, utente=%s → in_corso", nodi, utente_id,
     )
 
 
-async def _processa_risposta_esercizio(
+def _aggrega_risposte(risposte: list[dict]) -> dict[str, _RisposteNodo]:
+    """Contatori per nodo nell'ordine in cui il tutor ha emesso le risposte."""
+    per_nodo: dict[str, _RisposteNodo] = {}
+    for params in risposte:
+        agg = per_nodo.setdefault(params["nodo_focale"], _RisposteNodo())
+        esito = params.get("esito", "non_risolto")
+        agg.completati += 1
+        if esito == "non_risolto":
+            agg.non_risolti += 1
+        agg.consecutivi_ok = agg.consecutivi_ok + 1 if esito == "primo_tentativo" else 0
+    return per_nodo
+
+
+async def _processa_risposte_esercizio(
     db: AsyncSession,
-    params: dict,
+    risposte: list[dict],
     utente_id: uuid.UUID,
     sessione_id: uuid.UUID,
-) -> dict | None:
-    """risposta_esercizio → storico, contatori, verifica promozione.
+    adesso: datetime,
+) -> tuple[list[str], int]:
+    """risposta_esercizio → storico, contatori, candidati alla promozione.
 
     Returns:
-        Dict con promozione se avvenuta, None altrimenti.
+        (nodi in_corso con spiegazione ed esercizi sufficienti — la condizione
+        sul primo_tentativo e' verificata da _promuovi_nodi —, massimo
+        esercizi_consecutivi_ok dopo il turno sui nodi toccati)
     """
-    esercizio_id = params.get("esercizio_id", "")
-    nodo_focale = params.get("nodo_focale", "")
-    esito = params.get("esito", "non_risolto")
-
-    if not nodo_focale:
-        return None
-
-    # 1. Salva nello storico_esercizi
-    storico = StoricoEsercizi(
-        utente_id=utente_id,
-        nodo_focale_id=nodo_focale,
-        esercizio_id=esercizio_id or None,
-        esito=esito,
-        nodo_causa_id=params.get("nodo_causa"),
-        nodi_coinvolti=params.get("nodi_coinvolti"),
-        tipo_errore=params.get("tipo_errore"),
-        sessione_id=sessione_id,
-    )
-    db.add(storico)
-    await db.flush()
-
-    # 2. Aggiorna contatori su stato_nodi_utente
-    from sqlalchemy.dialects.postgresql import insert as pg_insert
-
-    # Assicura che il record esista
-    stmt = pg_insert(StatoNodoUtente).values(
-        utente_id=utente_id,
-        nodo_id=nodo_focale,
-        livello="in_corso",
-        esercizi_completati=1,
-        esercizi_consecutivi_ok=1 if esito == "primo_tentativo" else 0,
-        ultima_interazione=datetime.now(timezone.utc),
+    # 1. Storico esercizi: un solo INSERT multi-riga
+    await db.execute(
+        insert(StoricoEsercizi).values([
+            {
+                "utente_id": utente_id,
+                "nodo_focale_id": params["nodo_focale"],
+                "esercizio_id": params.get("esercizio_id") or None,
+                "esito": params.get("esito", "non_risolto"),
+                "nodo_causa_id": params.get("nodo_causa"),
+                "nodi_coinvolti": params.get("nodi_coinvolti"),
+                "tipo_errore": params.get("tipo_errore"),
+                "sessione_id": sessione_id,
+            }
+            for params in risposte
+        ])
     )
+    # Nella cache solo a commit avvenuto (lo storico potrebbe andare in rollback)
+    for params in risposte:
+        if params.get("esercizio_id"):
+            dopo_commit(db, partial(
+                cache_tentati.aggiungi, utente_id, params["nodo_focale"], params["esercizio_id"],
+            ))
+
+    # 2. Contatori: UPSERT multi-riga con i delta del turno in excluded.*;
+    #    RETURNING porta i campi per le prime due condizioni di promozione
+    per_nodo = _aggrega_risposte(risposte)
+    stmt = pg_insert(StatoNodoUtente).values([
+        {
+            "utente_id": utente_id,
+            "nodo_id": nodo_id,
+            "livello": "in_corso",
+            "esercizi_completati": agg.completati,
+            "esercizi_consecutivi_ok": agg.consecutivi_ok,
+            "errori_in_corso": agg.non_risolti,
+            "ultima_interazione": adesso,
+        }
+        for nodo_id, agg in per_nodo.items()
+    ])
+    nuovi = stmt.excluded
+    tutti_ok = nuovi.esercizi_consecutivi_ok == nuovi.esercizi_completati
     stmt = stmt.on_conflict_do_update(
         index_elements=["utente_id", "nodo_id"],
         set_={
-            "esercizi_completati": StatoNodoUtente.esercizi_completati + 1,
-            "esercizi_consecutivi_ok": (
-                StatoNodoUtente.esercizi_consecutivi_ok + 1
-                if esito == "primo_tentativo"
-                else 0
+            "esercizi_completati": (
+                StatoNodoUtente.esercizi_completati + nuovi.esercizi_completati
             ),
-            "errori_in_corso": (
-                StatoNodoUtente.errori_in_corso + (
-                    1 if esito == "non_risolto" else 0
-                )
+            "esercizi_consecutivi_ok": case(
+                (
+                    tutti_ok,
+                    func.coalesce(StatoNodoUtente.esercizi_consecutivi_ok, 0)
+                    + nuovi.esercizi_consecutivi_ok,
+                ),
+                else_=nuovi.esercizi_consecutivi_ok,
             ),
-            "ultima_interazione": datetime.now(timezone.utc),
+            "errori_in_corso": StatoNodoUtente.errori_in_corso + nuovi.errori_in_corso,
+            "ultima_interazione": adesso,
         },
+    ).returning(
+        StatoNodoUtente.nodo_id,
+        StatoNodoUtente.livello,
+        StatoNodoUtente.spiegazione_data,
+        StatoNodoUtente.esercizi_completati,
+        StatoNodoUtente.esercizi_consecutivi_ok,
     )
-    await db.execute(stmt)
-    await db.flush()
+    result = await db.execute(stmt)
+    righe = result.all()
+
+    for nodo_id in per_nodo:
+        cache_livelli.aggiorna(utente_id, nodo_id, "in_corso", solo_se_assente=True)
+    dopo_rollback(db, partial(cache_livelli.invalida, utente_id))
 
     logger.info(
-        "Risposta esercizio: nodo=%s, esito=%s, utente=%s",
-        nodo_focale, esito, utente_id,
+        "Risposte esercizio: %d su nodi=%s, utente=%s",
+        len(risposte), list(per_nodo), utente_id,
     )
 
-    # 3. Verifica promozione
-    promozione = await _verifica_promozione(db, utente_id, nodo_focale)
-    return promozione
+    candidati = [riga.nodo_id for riga in righe if _promuovibile(riga)]
+    consecutivi_max = max((riga.esercizi_consecutivi_ok or 0 for riga in righe), default=0)
+    return candidati, consecutivi_max
 
 
-async def _verifica_promozione(
-    db: AsyncSession,
-    utente_id: uuid.UUID,
-    nodo_id: str,
-) -> dict | None:
-    """Verifica se il nodo può essere promosso da in_corso a operativo.
+def _promuovibile(stato) -> bool:
+    """Condizioni di promozione verificabili sulla riga di stato_nodi_utente.
 
-    Condizioni (tutte devono essere vere):
     1. spiegazione_data = true
     2. esercizi_completati >= 3
-    3. almeno 1 esercizio con esito = 'primo_tentativo' nello storico
+    (la 3. — almeno 1 primo_tentativo nello storico — e' nell'UPDATE di promozione)
     """
-    # Carica stato corrente
-    result = await db.execute(
-        select(StatoNodoUtente).where(
-            StatoNodoUtente.utente_id == utente_id,
-            StatoNodoUtente.nodo_id == nodo_id,
-        )
+    return (
+        stato.livello == "in_corso"
+        and bool(stato.spiegazione_data)
+        and stato.esercizi_completati >= ESERCIZI_PER_PROMOZIONE
     )
-    stato = result.scalar_one_or_none()
 
-    if stato is None:
-        return None
-    if stato.livello != "in_corso":
-        return None
-    if not stato.spiegazione_data:
-        return None
-    if stato.esercizi_completati < ESERCIZI_PER_PROMOZIONE:
-        return None
 
-    # Controlla almeno 1 primo_tentativo
-    result_pt = await db.execute(
-        select(func.count()).where(
-            StoricoEsercizi.utente_id == utente_id,
-            StoricoEsercizi.nodo_focale_id == nodo_id,
+async def _promuovi_nodi(
+    db: AsyncSession,
+    utente_id: uuid.UUID,
+    nodi: list[str],
+    adesso: datetime,
+) -> list[dict]:
+    """Promuove a operativo i nodi candidati + cascata sblocco.
+
+    Un solo UPDATE ... RETURNING: filtra i nodi con almeno un esercizio
+    risolto al primo tentativo nello storico (condizione 3 di promozione).
+    """
+    ha_primo_tentativo = (
+        select(StoricoEsercizi.id)
+        .where(
+            StoricoEsercizi.utente_id == StatoNodoUtente.utente_id,
+            StoricoEsercizi.nodo_focale_id == StatoNodoUtente.nodo_id,
             StoricoEsercizi.esito == "primo_tentativo",
         )
+        .exists()
     )
-    primo_tentativo_count = result_pt.scalar_one()
-
-    if primo_tentativo_count < 1:
-        return None
-
-    # Promozione!
-    stato.livello = "operativo"
-    stato.ultima_interazione = datetime.now(timezone.utc)
-    await db.flush()
-
-    logger.info(
-        "PROMOZIONE: nodo=%s → operativo, utente=%s",
-        nodo_id, utente_id,
+    result = await db.execute(
+        update(StatoNodoUtente)
+        .where(
+            StatoNodoUtente.utente_id == utente_id,
+            StatoNodoUtente.nodo_id.in_(nodi),
+            StatoNodoUtente.livello == "in_corso",
+            ha_primo_tentativo,
+        )
+        .values(livello="operativo", ultima_interazione=adesso)
+        .returning(StatoNodoUtente.nodo_id)
     )
+    promossi = list(result.scalars().all())
 
-    # Cascata sblocco
-    nodi_sbloccati = await _cascata_sblocco(db, utente_id, nodo_id)
+    promozioni: list[dict] = []
+    if promossi:
+        dopo_rollback(db, partial(cache_livelli.invalida, utente_id))
+    for nodo_id in promossi:
+        cache_livelli.aggiorna(utente_id, nodo_id, "operativo")
+        logger.info(
+            "PROMOZIONE: nodo=%s → operativo, utente=%s",
+            nodo_id, utente_id,
+        )
+        nodi_sbloccati = await _cascata_sblocco(db, utente_id, nodo_id)
+        promozioni.append({
+            "nodo_id": nodo_id,
+            "nuovo_livello": "operativo",
+            "nodi_sbloccati": nodi_sbloccati,
+        })
 
-    return {
-        "nodo_id": nodo_id,
-        "nuovo_livello": "operativo",
-        "nodi_sbloccati": nodi_sbloccati,
-    }
+    return promozioni
 
 
 async def _cascata_sblocco(
@@ -408,7 +565,7 @@ async def _cascata_sblocco(
     livelli[nodo_promosso] = "operativo"
 
     sbloccati = nodi_sbloccati_dopo_promozione(
-        grafo_knowledge.grafo, nodo_promosso, livelli
+        grafo_knowledge.grafo, nodo_promosso, livelli, indice=grafo_knowledge.indice
     )
 
     if sbloccati:
@@ -420,20 +577,35 @@ async def _cascata_sblocco(
     return sbloccati
 
 
-async def _processa_prossimo_passo(
+async def _processa_segnali_sessione(
     db: AsyncSession,
-    params: dict,
+    segnali: list[tuple[str, dict]],
     sessione_id: uuid.UUID,
+    sessione: Sessione | None,
 ) -> None:
-    """prossimo_passo_raccomandato → salva nella sessione."""
-    result = await db.execute(
-        select(Sessione).where(Sessione.id == sessione_id)
-    )
-    sess = result.scalar_one_or_none()
-    if not sess:
-        return
+    """Segnali che scrivono sullo stato_orchestratore: una sola mutazione + flush."""
+    sess = sessione
+    if sess is None:
+        result = await db.execute(
+            select(Sessione).where(Sessione.id == sessione_id)
+        )
+        sess = result.scalar_one_or_none()
+        if not sess:
+            return
+
+    # Nuovo dict: l'assegnazione marca la colonna JSONB come modificata
+    stato = dict(sess.stato_orchestratore or {})
+    for nome, params in segnali:
+        if nome == "prossimo_passo_raccomandato":
+            _applica_prossimo_passo(stato, params)
+        else:
+            _applica_punto_partenza(stato, params, sessione_id)
+    sess.stato_orchestratore = stato
+    await db.flush()
 
-    stato = sess.stato_orchestratore or {}
+
+def _applica_prossimo_passo(stato: dict, params: dict) -> None:
+    """prossimo_passo_raccomandato → salva nella sessione."""
     tipo_passo = params.get("tipo", "continua_spiegazione")
 
     # Aggiorna attivita_corrente solo per tipi mappabili
@@ -450,28 +622,14 @@ async def _processa_prossimo_passo(
         stato["attivita_corrente"] = mapping_attivita[tipo_passo]
 
     stato["prossimo_passo"] = params
-    sess.stato_orchestratore = stato
-    await db.flush()
 
 
-async def _processa_punto_partenza(
-    db: AsyncSession,
-    params: dict,
-    sessione_id: uuid.UUID,
+def _applica_punto_partenza(
+    stato: dict, params: dict, sessione_id: uuid.UUID
 ) -> None:
     """punto_partenza_suggerito → salva nella sessione (onboarding)."""
-    result = await db.execute(
-        select(Sessione).where(Sessione.id == sessione_id)
-    )
-    sess = result.scalar_one_or_none()
-    if not sess:
-        return
-
-    stato = sess.stato_orchestratore or {}
     stato["punto_partenza_suggerito"] = params.get("tema_o_concetto", "")
     stato["punto_partenza_motivazione"] = params.get("motivazione", "")
-    sess.stato_orchestratore = stato
-    await db.flush()
 
     logger.info(
         "Punto partenza suggerito: %s (sessione=%s)",
@@ -509,7 +667,7 @@ async def aggiorna_nodo_dopo_promozione(
     ).get("tema_id")
 
     prossimo = path_planner(
-        grafo_knowledge.grafo, livelli, tema_corrente
+        grafo_knowledge.grafo, livelli, tema_corrente, indice=grafo_knowledge.indice
     )
 
     # Aggiorna sessione
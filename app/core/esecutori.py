@@ -0,0 +1,167 @@
+"""Protezione dell'event loop — lavoro CPU fuori dal loop e misura del lag.
+
+Un solo event loop serve tutte le richieste, compresi gli stream SSE dei
+turni: una chiamata bcrypt (~200 ms) o la compilazione degli indici del
+grafo eseguite inline fermano ogni altro stream per tutta la durata.
+
+`esecutori.esegui(tipo, fn, *args)` esegue la funzione in un pool di thread
+condiviso, con un limite di concorrenza per tipo di lavoro (lo stesso
+semaforo con metriche dei limiti LLM): oltre il limite le chiamate restano
+in coda sul loop invece di saturare il pool. Tipi:
+- hash: bcrypt (hash_password / verifica_password)
+- grafo: compilazione di grafo, indici di ricerca ed embedding
+- serializzazione: serializzazione in blocco dei contenuti editoriali
+
+bcrypt e NumPy rilasciano il GIL; per il codice Python puro il thread non
+rende il lavoro parallelo ma lascia al loop i suoi turni (il GIL passa di
+mano ogni pochi ms) invece di bloccarlo fino alla fine.
+
+`monitor_loop` campiona il ritardo del loop: dorme INTERVALLO e misura di
+quanto si e' svegliato in ritardo. Espone p50/p99/max sugli ultimi campioni,
+logga ogni blocco oltre la soglia e un riepilogo a ogni finestra completa.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from collections.abc import Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, TypeVar
+
+from app.config import settings
+from app.llm.limiti import LimitatoreModello
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Esecutori:
+    """Pool di thread condiviso + limite di concorrenza per tipo di lavoro."""
+
+    def __init__(self, limiti: Mapping[str, int]) -> None:
+        self._limitatori = {tipo: LimitatoreModello(n) for tipo, n in limiti.items()}
+        self._max_thread = max(1, sum(limiti.values()))
+        self._pool: ThreadPoolExecutor | None = None
+
+    def _esecutore(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self._max_thread, thread_name_prefix="dydat-cpu"
+            )
+        return self._pool
+
+    async def esegui(self, tipo: str, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+        """Esegue fn(*args, **kwargs) nel pool, entro il limite del tipo.
+
+        Raises:
+            ValueError: se il tipo di lavoro non e' configurato.
+        """
+        limitatore = self._limitatori.get(tipo)
+        if limitatore is None:
+            raise ValueError(f"Tipo di lavoro sconosciuto: {tipo}")
+        async with limitatore.slot():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._esecutore(), partial(fn, *args, **kwargs))
+
+    def chiudi(self) -> None:
+        """Attende i lavori in corso e chiude il pool (ricreato al primo uso)."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def statistiche(self) -> dict[str, dict]:
+        return {tipo: lim.statistiche() for tipo, lim in self._limitatori.items()}
+
+
+esecutori = Esecutori({
+    "hash": settings.ESECUTORE_HASH_CONCORRENZA,
+    "grafo": settings.ESECUTORE_GRAFO_CONCORRENZA,
+    "serializzazione": settings.ESECUTORE_SERIALIZZAZIONE_CONCORRENZA,
+})
+
+
+# ---------------------------------------------------------------------------
+# Monitor del ritardo dell'event loop
+# ---------------------------------------------------------------------------
+
+
+def _percentile(ordinati: list[float], q: float) -> float:
+    """Percentile nearest-rank su una lista gia' ordinata (0.0 se vuota)."""
+    if not ordinati:
+        return 0.0
+    return ordinati[max(0, math.ceil(q * len(ordinati)) - 1)]
+
+
+class MonitorLoop:
+    """Task asyncio che misura il ritardo di risveglio del loop."""
+
+    def __init__(self, intervallo_sec: float, campioni: int, soglia_sec: float) -> None:
+        self._intervallo_sec = intervallo_sec
+        self._soglia_sec = soglia_sec
+        self._campioni: deque[float] = deque(maxlen=max(1, campioni))
+        self._task: asyncio.Task | None = None
+        self.misure = 0
+        self.blocchi = 0
+
+    @property
+    def attivo(self) -> bool:
+        return self._task is not None
+
+    def avvia(self) -> None:
+        if self._task is not None or self._intervallo_sec <= 0:
+            return
+        self._task = asyncio.create_task(self._ciclo(), name="monitor-loop")
+        logger.info(
+            "Monitor event loop: campione ogni %.0f ms, soglia %.0f ms",
+            self._intervallo_sec * 1000, self._soglia_sec * 1000,
+        )
+
+    async def ferma(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def registra(self, ritardo_sec: float) -> None:
+        self._campioni.append(ritardo_sec)
+        self.misure += 1
+        if ritardo_sec >= self._soglia_sec:
+            self.blocchi += 1
+            logger.warning("Event loop bloccato per %.0f ms", ritardo_sec * 1000)
+        if self.misure % self._campioni.maxlen == 0:
+            stats = self.statistiche()
+            logger.info(
+                "Ritardo event loop: p50 %.1f ms, p99 %.1f ms, max %.1f ms",
+                stats["p50_ms"], stats["p99_ms"], stats["max_ms"],
+            )
+
+    async def _ciclo(self) -> None:
+        while True:
+            inizio = time.monotonic()
+            await asyncio.sleep(self._intervallo_sec)
+            self.registra(max(0.0, time.monotonic() - inizio - self._intervallo_sec))
+
+    def statistiche(self) -> dict:
+        ordinati = sorted(self._campioni)
+        return {
+            "campioni": len(ordinati),
+            "misure": self.misure,
+            "blocchi": self.blocchi,
+            "p50_ms": _percentile(ordinati, 0.50) * 1000,
+            "p99_ms": _percentile(ordinati, 0.99) * 1000,
+            "max_ms": (ordinati[-1] if ordinati else 0.0) * 1000,
+        }
+
+
+monitor_loop = MonitorLoop(
+    intervallo_sec=settings.LOOP_LAG_INTERVALLO_MS / 1000,
+    campioni=settings.LOOP_LAG_CAMPIONI,
+    soglia_sec=settings.LOOP_LAG_SOGLIA_MS / 1000,
+)
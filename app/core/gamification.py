@@ -1,8 +1,15 @@
 """Achievement checker + statistiche.
 
-Verifica condizioni achievement dopo ogni turno.
-Calcolo streak (giorni consecutivi obiettivo raggiunto).
-Aggiornamento statistiche_giornaliere.
+Verifica achievement guidata dagli eventi (dal worker outbox): le definizioni
+sono in un catalogo in RAM indicizzato per metrica, ogni evento (risposta
+esercizio, promozione, obiettivo giornaliero, sessione completata) tocca solo
+le sue metriche, e i valori vengono da contatori per utente su utenti invece
+che da COUNT(*) sullo storico.
+Statistiche giornaliere a contatori incrementali: ogni evento (esercizi
+risposti, nodi promossi, minuti di sessione) applica un UPSERT atomico alla
+riga del giorno; lo streak corrente/migliore e' memorizzato su utenti e
+avanza quando l'obiettivo del giorno scatta. riconcilia_statistiche, eseguita
+periodicamente, ricalcola da zero righe e streak per correggere la deriva.
 
 Achievement Loop 1 (8 definizioni dal brief):
   - primo_nodo: nodi_completati >= 1
@@ -19,12 +26,15 @@ from __future__ import annotations
 
 import logging
 import uuid
+from collections.abc import Iterable
+from dataclasses import dataclass
 from datetime import date, datetime, timedelta, timezone
 
-from sqlalchemy import func, select
+from sqlalchemy import case, func, or_, select, update
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.db.crud.utenti import invalida_utente
 from app.db.models.gamification import (
     AchievementDefinizione,
     AchievementUtente,
@@ -32,9 +42,15 @@ from app.db.models.gamification import (
 )
 from app.db.models.stato_utente import StatoNodoUtente, StoricoEsercizi
 from app.db.models.utenti import Sessione, Utente
+from app.grafo.struttura import grafo_knowledge
 
 logger = logging.getLogger(__name__)
 
+OBIETTIVO_DEFAULT_MIN = 20
+
+# Esiti che contano come esercizio risolto
+ESITI_CORRETTI = ("primo_tentativo", "con_aiuto")
+
 # 8 achievement iniziali dal brief
 ACHIEVEMENT_SEED: list[dict] = [
     {
@@ -117,120 +133,328 @@ async def seed_achievement(db: AsyncSession) -> int:
     return count
 
 
+# ===================================================================
+# Catalogo definizioni (in memoria, indicizzato per metrica)
+# ===================================================================
+
+# Metriche toccate da ciascun evento: si valutano solo le condizioni su queste
+METRICHE_PER_EVENTO: dict[str, tuple[str, ...]] = {
+    "risposta_esercizio": ("esercizi_risolti", "esercizi_consecutivi_ok"),
+    "promozione": ("nodi_completati", "tema_completato"),
+    "obiettivo_giornaliero": ("streak",),
+    "sessione_completata": ("sessioni_completate",),
+    "chiudi_sessione": ("sessioni_completate",),
+}
+
+
+def metriche_per_eventi(eventi: Iterable[str]) -> set[str]:
+    """Unione delle metriche toccate dagli eventi (nomi sconosciuti ignorati)."""
+    metriche: set[str] = set()
+    for evento in eventi:
+        metriche.update(METRICHE_PER_EVENTO.get(evento, ()))
+    return metriche
+
+
+@dataclass(frozen=True, slots=True)
+class DefinizioneAchievement:
+    """Copia immutabile di una riga achievement_definizioni."""
+
+    id: str
+    nome: str
+    tipo: str
+    descrizione: str | None
+    condizione: dict
+    metrica: str
+    soglia: int
+
+
+class CatalogoAchievement:
+    """Definizioni achievement caricate all'avvio. Singleton.
+
+    Le definizioni cambiano solo col seed: tenerle in RAM evita di rileggere
+    la tabella a ogni verifica, e l'indice per metrica permette di valutare
+    solo le condizioni toccate dagli eventi del turno.
+    """
+
+    def __init__(self) -> None:
+        self._definizioni: tuple[DefinizioneAchievement, ...] | None = None
+        self._per_metrica: dict[str, tuple[DefinizioneAchievement, ...]] = {}
+
+    @property
+    def caricato(self) -> bool:
+        return self._definizioni is not None
+
+    @property
+    def definizioni(self) -> tuple[DefinizioneAchievement, ...]:
+        if self._definizioni is None:
+            raise RuntimeError("Catalogo achievement non caricato. Chiamare carica() all'avvio.")
+        return self._definizioni
+
+    async def carica(self, db: AsyncSession) -> None:
+        result = await db.execute(
+            select(AchievementDefinizione).order_by(AchievementDefinizione.id)
+        )
+        definizioni = []
+        for defn in result.scalars().all():
+            condizione = defn.condizione or {}
+            definizioni.append(DefinizioneAchievement(
+                id=defn.id,
+                nome=defn.nome,
+                tipo=defn.tipo,
+                descrizione=defn.descrizione,
+                condizione=condizione,
+                metrica=condizione.get("tipo", ""),
+                soglia=condizione.get("valore", 0),
+            ))
+
+        per_metrica: dict[str, list[DefinizioneAchievement]] = {}
+        for defn in definizioni:
+            per_metrica.setdefault(defn.metrica, []).append(defn)
+
+        self._definizioni = tuple(definizioni)
+        self._per_metrica = {
+            m: tuple(sorted(defs, key=lambda d: d.soglia)) for m, defs in per_metrica.items()
+        }
+        logger.info(
+            "Catalogo achievement: %d definizioni su %d metriche",
+            len(definizioni), len(per_metrica),
+        )
+
+    def per_metriche(
+        self, metriche: Iterable[str] | None = None
+    ) -> list[DefinizioneAchievement]:
+        """Definizioni con condizione su una delle metriche (None = tutte)."""
+        if metriche is None:
+            return list(self.definizioni)
+        return [d for m in metriche for d in self._per_metrica.get(m, ())]
+
+
+catalogo_achievement = CatalogoAchievement()
+
+
+# ===================================================================
+# Verifica achievement
+# ===================================================================
+
+
 async def verifica_achievement(
-    utente_id: uuid.UUID, db: AsyncSession
+    utente_id: uuid.UUID,
+    db: AsyncSession,
+    metriche: Iterable[str] | None = None,
 ) -> list[dict]:
-    """Verifica e sblocca achievement dopo un turno. Ritorna lista di nuovi achievement.
+    """Verifica e sblocca achievement. Ritorna lista di nuovi achievement.
 
-    Per ogni achievement non ancora sbloccato, verifica se la condizione è soddisfatta.
-    Se sì, inserisce in achievement_utente e lo aggiunge alla lista di ritorno.
+    Valuta solo le condizioni sulle `metriche` toccate dagli eventi
+    (None = tutte). I valori vengono dai contatori su utenti (una lettura
+    per chiave primaria); lo sblocco e' un INSERT ... ON CONFLICT DO NOTHING
+    che ritorna solo gli achievement effettivamente nuovi.
     """
-    # Carica definizioni e achievement già sbloccati
-    result_def = await db.execute(select(AchievementDefinizione))
-    definizioni = list(result_def.scalars().all())
+    if not catalogo_achievement.caricato:
+        await catalogo_achievement.carica(db)
 
-    result_sbloccati = await db.execute(
-        select(AchievementUtente.achievement_id).where(
-            AchievementUtente.utente_id == utente_id
-        )
-    )
-    ids_sbloccati = set(result_sbloccati.scalars().all())
+    definizioni = catalogo_achievement.per_metriche(metriche)
+    if not definizioni:
+        return []
 
-    # Filtra solo quelli non ancora sbloccati
-    da_verificare = [d for d in definizioni if d.id not in ids_sbloccati]
-    if not da_verificare:
+    valori = await leggi_metriche(db, utente_id)
+    candidati = {
+        d.id: d for d in definizioni if valori.get(d.metrica, 0) >= d.soglia
+    }
+    if not candidati:
         return []
 
-    # Calcola metriche necessarie (lazy, solo se servono)
-    metriche: dict[str, int | None] = {}
+    result = await db.execute(
+        pg_insert(AchievementUtente)
+        .values([
+            {"utente_id": utente_id, "achievement_id": ach_id} for ach_id in candidati
+        ])
+        .on_conflict_do_nothing(index_elements=["utente_id", "achievement_id"])
+        .returning(AchievementUtente.achievement_id)
+    )
+
     nuovi: list[dict] = []
+    for ach_id in result.scalars().all():
+        defn = candidati[ach_id]
+        nuovi.append({"id": defn.id, "nome": defn.nome, "tipo": defn.tipo})
+        logger.info(
+            "Achievement sbloccato: %s (%s) per utente=%s",
+            defn.id, defn.nome, utente_id,
+        )
 
-    for defn in da_verificare:
-        condizione = defn.condizione or {}
-        tipo_cond = condizione.get("tipo", "")
-        valore_richiesto = condizione.get("valore", 0)
+    return nuovi
 
-        valore_corrente = await _calcola_metrica(
-            db, utente_id, tipo_cond, metriche
+
+async def preleva_achievement_da_notificare(
+    utente_id: uuid.UUID, db: AsyncSession
+) -> list[dict]:
+    """Achievement sbloccati dal worker outbox e non ancora inviati al client.
+
+    Un solo UPDATE ... RETURNING: li marca notificati e ne ritorna i dati.
+    """
+    result = await db.execute(
+        update(AchievementUtente)
+        .where(
+            AchievementUtente.utente_id == utente_id,
+            AchievementUtente.notificato == False,  # noqa: E712
+            AchievementUtente.achievement_id == AchievementDefinizione.id,
+        )
+        .values(notificato=True)
+        .returning(
+            AchievementDefinizione.id,
+            AchievementDefinizione.nome,
+            AchievementDefinizione.tipo,
         )
+    )
+    return [
+        {"id": riga.id, "nome": riga.nome, "tipo": riga.tipo}
+        for riga in result.all()
+    ]
 
-        if valore_corrente is not None and valore_corrente >= valore_richiesto:
-            # Sblocca!
-            db.add(AchievementUtente(
-                utente_id=utente_id,
-                achievement_id=defn.id,
-            ))
-            await db.flush()
 
-            nuovi.append({
-                "id": defn.id,
-                "nome": defn.nome,
-                "tipo": defn.tipo,
-            })
-            logger.info(
-                "Achievement sbloccato: %s (%s) per utente=%s",
-                defn.id, defn.nome, utente_id,
-            )
+# ===================================================================
+# Contatori per utente (metriche achievement)
+# ===================================================================
 
-    return nuovi
+# Metrica → colonna contatore su utenti ("streak" e' calcolata da streak_attuale)
+_COLONNE_METRICA = {
+    "nodi_completati": Utente.nodi_completati,
+    "esercizi_risolti": Utente.esercizi_risolti,
+    "esercizi_consecutivi_ok": Utente.esercizi_consecutivi_max,
+    "tema_completato": Utente.temi_completati,
+    "sessioni_completate": Utente.sessioni_completate,
+}
 
 
-async def _calcola_metrica(
+async def leggi_metriche(db: AsyncSession, utente_id: uuid.UUID) -> dict[str, int]:
+    """Valori correnti di tutte le metriche achievement (una sola lettura)."""
+    result = await db.execute(
+        select(
+            *_COLONNE_METRICA.values(),
+            Utente.streak_corrente,
+            Utente.streak_ultimo_giorno,
+        ).where(Utente.id == utente_id)
+    )
+    riga = result.one_or_none()
+    if riga is None:
+        return {}
+    valori = {
+        metrica: getattr(riga, colonna.key) or 0
+        for metrica, colonna in _COLONNE_METRICA.items()
+    }
+    valori["streak"] = streak_attuale(riga.streak_corrente, riga.streak_ultimo_giorno)
+    return valori
+
+
+async def incrementa_contatori_utente(
     db: AsyncSession,
     utente_id: uuid.UUID,
-    tipo_cond: str,
-    cache: dict[str, int | None],
-) -> int | None:
-    """Calcola una metrica per le condizioni achievement, con cache per evitare query ripetute."""
-    if tipo_cond in cache:
-        return cache[tipo_cond]
-
-    valore: int | None = None
+    *,
+    nodi_completati: int = 0,
+    esercizi_risolti: int = 0,
+    temi_completati: int = 0,
+    sessioni_completate: int = 0,
+    consecutivi_ok: int = 0,
+) -> None:
+    """Applica i delta di un evento ai contatori su utenti (un solo UPDATE).
 
-    if tipo_cond == "nodi_completati":
-        result = await db.execute(
-            select(func.count()).where(
-                StatoNodoUtente.utente_id == utente_id,
-                StatoNodoUtente.livello == "operativo",
-                StatoNodoUtente.presunto == False,  # noqa: E712
-            )
+    consecutivi_ok e' il massimo corrente del turno: il contatore ne tiene
+    il massimo storico, che basta per la soglia dell'achievement.
+    """
+    valori = {}
+    if nodi_completati:
+        valori["nodi_completati"] = Utente.nodi_completati + nodi_completati
+    if esercizi_risolti:
+        valori["esercizi_risolti"] = Utente.esercizi_risolti + esercizi_risolti
+    if temi_completati:
+        valori["temi_completati"] = Utente.temi_completati + temi_completati
+    if sessioni_completate:
+        valori["sessioni_completate"] = Utente.sessioni_completate + sessioni_completate
+    if consecutivi_ok:
+        valori["esercizi_consecutivi_max"] = func.greatest(
+            Utente.esercizi_consecutivi_max, consecutivi_ok
         )
-        valore = result.scalar_one()
+    if not valori:
+        return
+    await db.execute(update(Utente).where(Utente.id == utente_id).values(**valori))
+    invalida_utente(db, utente_id)
 
-    elif tipo_cond == "esercizi_risolti":
-        result = await db.execute(
-            select(func.count()).where(
-                StoricoEsercizi.utente_id == utente_id,
-                StoricoEsercizi.esito.in_(["primo_tentativo", "con_aiuto"]),
-            )
-        )
-        valore = result.scalar_one()
 
-    elif tipo_cond == "streak":
-        valore = await calcola_streak(utente_id, db)
+def temi_completati_da(nodi_promossi: Iterable[str], livelli: dict[str, str]) -> int:
+    """Temi completati dalle promozioni del turno (grafo in RAM, nessuna query).
 
-    elif tipo_cond == "tema_completato":
-        valore = await _conta_temi_completati(db, utente_id)
+    Un tema e' completato quando tutti i suoi nodi non di contesto sono
+    operativi. I nodi promossi erano in_corso: i loro temi non erano
+    completati prima, quindi ogni tema contato e' nuovo.
+    """
+    if not grafo_knowledge.caricato:
+        return 0
+    grafo = grafo_knowledge.grafo
+    temi: set[str] = set()
+    for nodo_id in nodi_promossi:
+        if nodo_id not in grafo or grafo.nodes[nodo_id].get("tipo_nodo") == "contesto":
+            continue
+        temi.update(grafo_knowledge.temi_nodo(nodo_id))
 
-    elif tipo_cond == "esercizi_consecutivi_ok":
-        result = await db.execute(
-            select(func.max(StatoNodoUtente.esercizi_consecutivi_ok)).where(
-                StatoNodoUtente.utente_id == utente_id,
-            )
+    completati = 0
+    for tema_id in temi:
+        tema = grafo_knowledge.tema(tema_id)
+        if tema and tema.nodi_progresso and all(
+            livelli.get(n) == "operativo" for n in tema.nodi_progresso
+        ):
+            completati += 1
+    return completati
+
+
+async def ricalcola_contatori_utente(db: AsyncSession, utente_id: uuid.UUID) -> None:
+    """Ricalcola da zero i contatori achievement (riconciliazione)."""
+    result = await db.execute(
+        select(func.count()).where(
+            StatoNodoUtente.utente_id == utente_id,
+            StatoNodoUtente.livello == "operativo",
+            StatoNodoUtente.presunto == False,  # noqa: E712
         )
-        valore = result.scalar_one() or 0
+    )
+    nodi_completati = result.scalar_one()
 
-    elif tipo_cond == "sessioni_completate":
-        result = await db.execute(
-            select(func.count()).where(
-                Sessione.utente_id == utente_id,
-                Sessione.stato == "completata",
-            )
+    result = await db.execute(
+        select(func.count()).where(
+            StoricoEsercizi.utente_id == utente_id,
+            StoricoEsercizi.esito.in_(ESITI_CORRETTI),
         )
-        valore = result.scalar_one()
+    )
+    esercizi_risolti = result.scalar_one()
 
-    cache[tipo_cond] = valore
-    return valore
+    result = await db.execute(
+        select(func.max(StatoNodoUtente.esercizi_consecutivi_ok)).where(
+            StatoNodoUtente.utente_id == utente_id,
+        )
+    )
+    consecutivi_max = result.scalar_one() or 0
+
+    result = await db.execute(
+        select(func.count()).where(
+            Sessione.utente_id == utente_id,
+            Sessione.stato == "completata",
+        )
+    )
+    sessioni_completate = result.scalar_one()
+
+    temi_completati = await _conta_temi_completati(db, utente_id)
+
+    await db.execute(
+        update(Utente)
+        .where(Utente.id == utente_id)
+        .values(
+            nodi_completati=nodi_completati,
+            esercizi_risolti=esercizi_risolti,
+            # Massimo storico: non scende sotto quanto gia' registrato
+            esercizi_consecutivi_max=func.greatest(
+                Utente.esercizi_consecutivi_max, consecutivi_max
+            ),
+            temi_completati=temi_completati,
+            sessioni_completate=sessioni_completate,
+        )
+    )
 
 
 async def _conta_temi_completati(
@@ -278,14 +502,57 @@ async def _conta_temi_completati(
     return completati
 
 
+# ===================================================================
+# Streak (memorizzato su utenti, aggiornato quando l'obiettivo scatta)
+# ===================================================================
+
+
+def streak_attuale(
+    streak_corrente: int | None,
+    ultimo_giorno: date | None,
+    oggi: date | None = None,
+) -> int:
+    """Streak valido oggi dai valori memorizzati.
+
+    Lo streak resta vivo se l'ultimo giorno con obiettivo raggiunto e' oggi
+    o ieri (oggi non ha ancora studiato); altrimenti e' interrotto.
+    """
+    oggi = oggi or date.today()
+    if ultimo_giorno is None or ultimo_giorno < oggi - timedelta(days=1):
+        return 0
+    return streak_corrente or 0
+
+
 async def calcola_streak(utente_id: uuid.UUID, db: AsyncSession) -> int:
-    """Calcola lo streak corrente (giorni consecutivi con obiettivo raggiunto).
+    """Streak corrente (giorni consecutivi con obiettivo raggiunto).
+
+    Una lettura per chiave primaria dei contatori su utenti, mantenuti da
+    registra_attivita_giornaliera e corretti da riconcilia_statistiche.
+    """
+    result = await db.execute(
+        select(Utente.streak_corrente, Utente.streak_ultimo_giorno).where(
+            Utente.id == utente_id
+        )
+    )
+    riga = result.one_or_none()
+    if riga is None:
+        return 0
+    return streak_attuale(riga.streak_corrente, riga.streak_ultimo_giorno)
+
+
+async def ricalcola_streak(
+    utente_id: uuid.UUID, db: AsyncSession
+) -> tuple[int, date | None]:
+    """Ricalcola lo streak da statistiche_giornaliere (riconciliazione).
 
     HARD CONSTRAINT sulla logica (dal brief):
     1. Query statistiche_giornaliere per l'utente, ordinate per data DESC
     2. Contare i giorni consecutivi con obiettivo_raggiunto = true
        partendo da oggi (o da ieri se oggi non ha ancora studiato)
     3. Un giorno senza record equivale a obiettivo_raggiunto = false
+
+    Returns:
+        (streak, ultimo giorno con obiettivo raggiunto dello streak o None)
     """
     oggi = date.today()
 
@@ -308,30 +575,180 @@ async def calcola_streak(utente_id: uuid.UUID, db: AsyncSession) -> int:
     if giorno not in date_ok:
         giorno = oggi - timedelta(days=1)
         if giorno not in date_ok:
-            return 0
+            return 0, None
 
+    ultimo_giorno = giorno
     streak = 0
     while giorno in date_ok:
         streak += 1
         giorno -= timedelta(days=1)
 
-    return streak
+    return streak, ultimo_giorno
 
 
-async def aggiorna_statistiche_giornaliere(
-    utente_id: uuid.UUID, db: AsyncSession
+async def _avanza_streak(
+    db: AsyncSession, utente_id: uuid.UUID, giorno: date
 ) -> None:
-    """Aggiorna le statistiche della giornata corrente.
+    """Obiettivo di `giorno` appena raggiunto: estende o riavvia lo streak."""
+    nuovo_streak = case(
+        (
+            Utente.streak_ultimo_giorno == giorno - timedelta(days=1),
+            Utente.streak_corrente + 1,
+        ),
+        else_=1,
+    )
+    await db.execute(
+        update(Utente)
+        .where(
+            Utente.id == utente_id,
+            or_(
+                Utente.streak_ultimo_giorno.is_(None),
+                Utente.streak_ultimo_giorno < giorno,
+            ),
+        )
+        .values(
+            streak_corrente=nuovo_streak,
+            streak_migliore=func.greatest(Utente.streak_migliore, nuovo_streak),
+            streak_ultimo_giorno=giorno,
+        )
+    )
+    invalida_utente(db, utente_id)
+
+
+# ===================================================================
+# Statistiche giornaliere (contatori incrementali per evento)
+# ===================================================================
 
-    Incrementa esercizi_svolti e esercizi_corretti basandosi sull'ultimo turno.
-    Aggiorna obiettivo_raggiunto se minuti_studio >= obiettivo_giornaliero_min.
+
+async def registra_attivita_giornaliera(
+    db: AsyncSession,
+    utente_id: uuid.UUID,
+    giorno: date | None = None,
+    *,
+    esercizi_svolti: int = 0,
+    esercizi_corretti: int = 0,
+    nodi_completati: int = 0,
+    minuti_studio: int = 0,
+) -> bool:
+    """Applica un evento alla riga del giorno con incrementi atomici.
+
+    Eventi: esercizi risposti (processa_segnali), nodi promossi (idem),
+    minuti di una sessione chiusa o sospesa (core.sessione / onboarding).
+    Un solo UPSERT; se i minuti fanno scattare l'obiettivo del giorno
+    aggiorna anche lo streak memorizzato.
+
+    Returns:
+        True se con questo evento l'obiettivo del giorno e' stato raggiunto.
     """
-    oggi = date.today()
+    giorno = giorno or date.today()
+    obiettivo = (
+        select(func.coalesce(Utente.obiettivo_giornaliero_min, OBIETTIVO_DEFAULT_MIN))
+        .where(Utente.id == utente_id)
+        .scalar_subquery()
+    )
+    stmt = pg_insert(StatisticaGiornaliera).values(
+        utente_id=utente_id,
+        data=giorno,
+        esercizi_svolti=esercizi_svolti,
+        esercizi_corretti=esercizi_corretti,
+        nodi_completati=nodi_completati,
+        minuti_studio=minuti_studio,
+        obiettivo_raggiunto=minuti_studio >= obiettivo,
+    )
+    nuovi = stmt.excluded
+    minuti_aggiornati = StatisticaGiornaliera.minuti_studio + nuovi.minuti_studio
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["utente_id", "data"],
+        set_={
+            "esercizi_svolti": StatisticaGiornaliera.esercizi_svolti + nuovi.esercizi_svolti,
+            "esercizi_corretti": (
+                StatisticaGiornaliera.esercizi_corretti + nuovi.esercizi_corretti
+            ),
+            "nodi_completati": StatisticaGiornaliera.nodi_completati + nuovi.nodi_completati,
+            "minuti_studio": minuti_aggiornati,
+            "obiettivo_raggiunto": or_(
+                StatisticaGiornaliera.obiettivo_raggiunto,
+                minuti_aggiornati >= obiettivo,
+            ),
+        },
+    ).returning(
+        StatisticaGiornaliera.minuti_studio,
+        StatisticaGiornaliera.obiettivo_raggiunto,
+        obiettivo.label("obiettivo"),
+    )
+    result = await db.execute(stmt)
+    riga = result.one()
+
+    # Scatta solo se prima dell'evento i minuti erano sotto obiettivo
+    raggiunto_ora = (
+        minuti_studio > 0
+        and riga.obiettivo_raggiunto
+        and riga.minuti_studio - minuti_studio < riga.obiettivo
+    )
+    if raggiunto_ora:
+        await _avanza_streak(db, utente_id, giorno)
+        logger.info("Obiettivo giornaliero raggiunto: utente=%s, data=%s", utente_id, giorno)
+    return raggiunto_ora
+
+
+async def registra_chiusura_sessione(
+    db: AsyncSession,
+    sessione: Sessione,
+    durata_min: int,
+    *,
+    completata: bool,
+) -> set[str]:
+    """Imposta la durata della sessione e ne registra gli eventi.
+
+    - minuti: una sessione sospesa e poi chiusa viene registrata due volte,
+      conta solo la differenza rispetto a durata_effettiva_min gia' salvata;
+      i minuti vanno al giorno di inizio della sessione (come nella
+      riconciliazione)
+    - completata: contatore sessioni_completate
+
+    Se gli eventi toccano metriche achievement accoda la loro verifica
+    nella transazione del chiamante.
+
+    Returns:
+        Metriche achievement toccate.
+    """
+    from app.core.outbox import LAVORO_ACHIEVEMENT, accoda_lavoro
+
+    eventi: list[str] = []
+    delta = durata_min - (sessione.durata_effettiva_min or 0)
+    sessione.durata_effettiva_min = durata_min
+    if delta > 0:
+        giorno = sessione.created_at.astimezone(timezone.utc).date()
+        if await registra_attivita_giornaliera(
+            db, sessione.utente_id, giorno, minuti_studio=delta
+        ):
+            eventi.append("obiettivo_giornaliero")
+    if completata:
+        await incrementa_contatori_utente(db, sessione.utente_id, sessioni_completate=1)
+        eventi.append("sessione_completata")
+
+    metriche = metriche_per_eventi(eventi)
+    if metriche:
+        accoda_lavoro(
+            db,
+            LAVORO_ACHIEVEMENT,
+            utente_id=sessione.utente_id,
+            sessione_id=sessione.id,
+            payload={"metriche": sorted(metriche)},
+        )
+    return metriche
+
 
-    # UPSERT riga di oggi
+async def ricalcola_statistiche_giornaliere(
+    utente_id: uuid.UUID, db: AsyncSession, giorno: date | None = None
+) -> None:
+    """Ricalcola da zero la riga di un giorno (riconciliazione dei contatori)."""
+    giorno = giorno or date.today()
+
+    # UPSERT riga del giorno
     stmt = pg_insert(StatisticaGiornaliera).values(
         utente_id=utente_id,
-        data=oggi,
+        data=giorno,
     )
     stmt = stmt.on_conflict_do_nothing(
         index_elements=["utente_id", "data"],
@@ -339,11 +756,10 @@ async def aggiorna_statistiche_giornaliere(
     await db.execute(stmt)
     await db.flush()
 
-    # Calcola statistiche attuali dalla giornata
-    # Esercizi svolti oggi (tutti gli esiti)
-    inizio_giornata = datetime.combine(oggi, datetime.min.time(), tzinfo=timezone.utc)
+    inizio_giornata = datetime.combine(giorno, datetime.min.time(), tzinfo=timezone.utc)
     fine_giornata = inizio_giornata + timedelta(days=1)
 
+    # Esercizi svolti nel giorno (tutti gli esiti)
     result_esercizi = await db.execute(
         select(func.count()).where(
             StoricoEsercizi.utente_id == utente_id,
@@ -358,12 +774,12 @@ async def aggiorna_statistiche_giornaliere(
             StoricoEsercizi.utente_id == utente_id,
             StoricoEsercizi.created_at >= inizio_giornata,
             StoricoEsercizi.created_at < fine_giornata,
-            StoricoEsercizi.esito.in_(["primo_tentativo", "con_aiuto"]),
+            StoricoEsercizi.esito.in_(ESITI_CORRETTI),
         )
     )
     esercizi_corretti = result_corretti.scalar_one()
 
-    # Nodi completati oggi
+    # Nodi completati nel giorno
     result_nodi = await db.execute(
         select(func.count()).where(
             StatoNodoUtente.utente_id == utente_id,
@@ -375,7 +791,7 @@ async def aggiorna_statistiche_giornaliere(
     )
     nodi_completati = result_nodi.scalar_one()
 
-    # Minuti studio: somma durata sessioni di oggi
+    # Minuti studio: somma durata sessioni del giorno
     result_minuti = await db.execute(
         select(func.coalesce(func.sum(Sessione.durata_effettiva_min), 0)).where(
             Sessione.utente_id == utente_id,
@@ -389,33 +805,79 @@ async def aggiorna_statistiche_giornaliere(
     result_utente = await db.execute(
         select(Utente.obiettivo_giornaliero_min).where(Utente.id == utente_id)
     )
-    obiettivo_min = result_utente.scalar_one_or_none() or 20
+    obiettivo_min = result_utente.scalar_one_or_none() or OBIETTIVO_DEFAULT_MIN
     obiettivo_raggiunto = minuti_studio >= obiettivo_min
 
-    # Aggiorna la riga
-    result_stat = await db.execute(
-        select(StatisticaGiornaliera).where(
+    await db.execute(
+        update(StatisticaGiornaliera)
+        .where(
             StatisticaGiornaliera.utente_id == utente_id,
-            StatisticaGiornaliera.data == oggi,
+            StatisticaGiornaliera.data == giorno,
+        )
+        .values(
+            esercizi_svolti=esercizi_svolti,
+            esercizi_corretti=esercizi_corretti,
+            nodi_completati=nodi_completati,
+            minuti_studio=minuti_studio,
+            obiettivo_raggiunto=obiettivo_raggiunto,
         )
     )
-    stat = result_stat.scalar_one_or_none()
-    if stat:
-        stat.esercizi_svolti = esercizi_svolti
-        stat.esercizi_corretti = esercizi_corretti
-        stat.nodi_completati = nodi_completati
-        stat.minuti_studio = minuti_studio
-        stat.obiettivo_raggiunto = obiettivo_raggiunto
-        await db.flush()
 
     logger.info(
-        "Statistiche giornaliere aggiornate: utente=%s, data=%s, "
+        "Statistiche giornaliere ricalcolate: utente=%s, data=%s, "
         "esercizi=%d, corretti=%d, nodi=%d, minuti=%d, obiettivo=%s",
-        utente_id, oggi, esercizi_svolti, esercizi_corretti,
+        utente_id, giorno, esercizi_svolti, esercizi_corretti,
         nodi_completati, minuti_studio, obiettivo_raggiunto,
     )
 
 
+async def riconcilia_statistiche(
+    db: AsyncSession, giorni: tuple[date, ...] | None = None
+) -> int:
+    """Corregge la deriva dei contatori incrementali.
+
+    Per ogni utente con attivita' nei giorni indicati (default: ieri e oggi)
+    ricalcola le righe di statistiche_giornaliere, i contatori achievement e
+    lo streak memorizzato.
+
+    Returns:
+        Numero di utenti riconciliati.
+    """
+    oggi = date.today()
+    giorni = giorni or (oggi - timedelta(days=1), oggi)
+    inizio = datetime.combine(min(giorni), datetime.min.time(), tzinfo=timezone.utc)
+
+    result = await db.execute(
+        select(StatisticaGiornaliera.utente_id)
+        .where(StatisticaGiornaliera.data.in_(giorni))
+        .union(
+            select(StoricoEsercizi.utente_id).where(StoricoEsercizi.created_at >= inizio),
+            select(Sessione.utente_id).where(Sessione.created_at >= inizio),
+        )
+    )
+    utenti = list(result.scalars().all())
+
+    for utente_id in utenti:
+        for giorno in giorni:
+            await ricalcola_statistiche_giornaliere(utente_id, db, giorno)
+        await ricalcola_contatori_utente(db, utente_id)
+        streak, ultimo_giorno = await ricalcola_streak(utente_id, db)
+        await db.execute(
+            update(Utente)
+            .where(Utente.id == utente_id)
+            .values(
+                streak_corrente=streak,
+                streak_ultimo_giorno=ultimo_giorno,
+                streak_migliore=func.greatest(Utente.streak_migliore, streak),
+            )
+        )
+        invalida_utente(db, utente_id)
+        await db.commit()
+
+    logger.info("Riconciliazione statistiche: %d utenti, giorni=%s", len(utenti), giorni)
+    return len(utenti)
+
+
 async def lista_achievement_utente(
     utente_id: uuid.UUID, db: AsyncSession
 ) -> dict:
@@ -424,9 +886,8 @@ async def lista_achievement_utente(
     Returns:
         {"sbloccati": [...], "prossimi": [...]}
     """
-    # Tutte le definizioni
-    result_def = await db.execute(select(AchievementDefinizione))
-    definizioni = list(result_def.scalars().all())
+    if not catalogo_achievement.caricato:
+        await catalogo_achievement.carica(db)
 
     # Sbloccati
     result_sbl = await db.execute(
@@ -438,13 +899,9 @@ async def lista_achievement_utente(
 
     sbloccati = []
     prossimi = []
-    metriche: dict[str, int | None] = {}
-
-    for defn in definizioni:
-        condizione = defn.condizione or {}
-        tipo_cond = condizione.get("tipo", "")
-        valore_richiesto = condizione.get("valore", 0)
+    valori: dict[str, int] | None = None
 
+    for defn in catalogo_achievement.definizioni:
         if defn.id in sbloccati_db:
             sbloccati.append({
                 "id": defn.id,
@@ -456,18 +913,17 @@ async def lista_achievement_utente(
                 else None,
             })
         else:
-            valore_corrente = await _calcola_metrica(
-                db, utente_id, tipo_cond, metriche
-            )
+            if valori is None:
+                valori = await leggi_metriche(db, utente_id)
             prossimi.append({
                 "id": defn.id,
                 "nome": defn.nome,
                 "tipo": defn.tipo,
                 "descrizione": defn.descrizione,
-                "condizione": condizione,
+                "condizione": defn.condizione,
                 "progresso": {
-                    "corrente": valore_corrente or 0,
-                    "richiesto": valore_richiesto,
+                    "corrente": valori.get(defn.metrica, 0),
+                    "richiesto": defn.soglia,
                 },
             })
 
@@ -9,14 +9,23 @@ from __future__ import annotations
 
 import logging
 import uuid
+from collections import Counter
 from datetime import datetime, timezone
+from functools import partial
 
 from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import settings
+from app.core.gamification import registra_chiusura_sessione
+from app.db.crud.utenti import invalida_utente
 from app.db.models.stato_utente import StatoNodoUtente
 from app.db.models.utenti import PercorsoUtente, Sessione, TurnoConversazione, Utente
-from app.grafo.algoritmi import ordinamento_topologico
+from app.db.transazioni import dopo_commit
+from app.grafo.ricerca import BONUS_ESATTO, PESO_TEMA, tokenizza
+from app.grafo.semantica import embedding_nodi
+from app.grafo.stato import cache_livelli
 from app.grafo.struttura import grafo_knowledge
 
 logger = logging.getLogger(__name__)
@@ -24,6 +33,14 @@ logger = logging.getLogger(__name__)
 # Dopo quanti turni in "conoscenza" si passa a "conclusione"
 TURNI_CONOSCENZA_MAX = 8
 
+# Righe per INSERT multi-riga (6 parametri a riga, limite asyncpg 32767)
+RIGHE_PER_INSERT = 1000
+
+# Ripiego semantico: parole intere di almeno N lettere, trovate almeno nei temi
+# del nodo (PESO_TEMA x BONUS_ESATTO; escluse le corrispondenze solo sugli id)
+SEMANTICO_MIN_CARATTERI = 4
+SEMANTICO_MIN_PUNTEGGIO = PESO_TEMA * BONUS_ESATTO
+
 
 async def crea_utente_temporaneo(db: AsyncSession) -> Utente:
     """Crea un utente temporaneo (UUID, senza email/password)."""
@@ -124,6 +141,7 @@ async def completa_onboarding(
     if preferenze_tutor:
         utente.preferenze_tutor = preferenze_tutor
     await db.flush()
+    invalida_utente(db, utente.id)
 
     # 2. Chiudi sessione onboarding
     sessione.stato = "completata"
@@ -131,7 +149,7 @@ async def completa_onboarding(
     durata = (
         datetime.now(timezone.utc) - sessione.created_at
     ).total_seconds() / 60
-    sessione.durata_effettiva_min = int(durata)
+    await registra_chiusura_sessione(db, sessione, int(durata), completata=True)
     await db.flush()
 
     # 3. Gestisci punto di partenza personalizzato
@@ -154,7 +172,7 @@ async def completa_onboarding(
     db.add(percorso)
     await db.flush()
 
-    # 5. Inizializza stato_nodi_utente per tutti i nodi operativi
+    # 5. Inizializza stato_nodi_utente (scrittura in blocco)
     nodi_init = await _inizializza_stato_nodi(
         db, utente.id, nodo_override
     )
@@ -178,28 +196,55 @@ async def completa_onboarding(
 def _trova_nodo_per_tema(tema_o_concetto: str) -> str | None:
     """Cerca nel grafo il nodo più vicino al tema/concetto indicato.
 
-    Match per nome nodo o tema_id (case-insensitive, substring).
+    Usa l'indice di ricerca del grafo: match per nome (italiano, senza
+    accenti), parole chiave, nome/slug del tema e id del nodo. Se il miglior
+    risultato e' un tema, ritorna il suo primo nodo operativo. Se nessun nodo
+    contiene tutte le parole, ripiega su _trova_nodo_semantico.
     """
     if not grafo_knowledge.caricato:
         return None
 
-    query = tema_o_concetto.lower().replace(" ", "_")
-    grafo = grafo_knowledge.grafo
+    for risultato in grafo_knowledge.ricerca.cerca(tema_o_concetto, limite=5):
+        if risultato.nodo_id is not None:
+            return risultato.nodo_id
+    return _trova_nodo_semantico(tema_o_concetto)
 
-    # Match per tema_id (spazi normalizzati a underscore)
-    for nodo_id, attrs in grafo.nodes(data=True):
-        if attrs.get("tipo_nodo") != "operativo":
+
+def _trova_nodo_semantico(tema_o_concetto: str) -> str | None:
+    """Match parziale: i nodi trovati dalle singole parole fanno da semi.
+
+    Il nodo scelto marca come presunti tutti quelli che lo precedono, quindi
+    contano solo parole intere di almeno SEMANTICO_MIN_CARATTERI lettere
+    trovate nel nome, nelle parole chiave o nei temi del nodo
+    (punteggio >= SEMANTICO_MIN_PUNTEGGIO): "un po' tutto" non deve
+    diventare "Potenze". Senza semi ritorna None.
+
+    Con gli embedding caricati ritorna il nodo operativo piu' vicino al
+    centroide dei semi (una sola moltiplicazione matrice); altrimenti il
+    seme trovato dal maggior numero di parole.
+    """
+    ricerca = grafo_knowledge.ricerca
+    semi: Counter[str] = Counter()
+    for token in dict.fromkeys(tokenizza(tema_o_concetto)):
+        if len(token) < SEMANTICO_MIN_CARATTERI:
             continue
-        tema_id = attrs.get("tema_id", "")
-        if tema_id and query in tema_id.lower():
-            return nodo_id
+        semi.update({
+            r.nodo_id for r in ricerca.cerca(token, limite=5, prefissi=False)
+            if r.nodo_id is not None and r.punteggio >= SEMANTICO_MIN_PUNTEGGIO
+        })
+    if not semi:
+        return None
 
-    # Fallback: match per nodo_id
-    for nodo_id in grafo.nodes:
-        if query in nodo_id.lower():
-            return nodo_id
+    if embedding_nodi.caricato:
+        vettori = embedding_nodi.indice.vettori(semi)
+        if len(vettori):
+            vicini = embedding_nodi.indice.cerca(
+                vettori.mean(axis=0), k=1, candidati=grafo_knowledge.nodi_operativi()
+            )[0]
+            if vicini:
+                return vicini[0][0]
 
-    return None
+    return semi.most_common(1)[0][0]
 
 
 async def _inizializza_stato_nodi(
@@ -207,62 +252,60 @@ async def _inizializza_stato_nodi(
     utente_id: uuid.UUID,
     nodo_override: str | None,
 ) -> int:
-    """Inizializza stato_nodi_utente per tutti i nodi operativi.
+    """Inizializza stato_nodi_utente per i nodi operativi in blocco.
 
     Se c'è un nodo_override, i nodi precedenti nell'ordine topologico
     vengono marcati come operativo + presunto=true.
 
+    Le righe sono costruite in memoria e scritte con INSERT multi-riga
+    (ON CONFLICT DO NOTHING) a lotti di RIGHE_PER_INSERT. In modalità
+    sparsa (ONBOARDING_STATO_SPARSO) le righe non_iniziato non vengono
+    materializzate: una riga mancante vale già non_iniziato per tutti i
+    lettori, e i segnali del tutor la creano con un UPSERT al primo uso.
+
     Returns:
-        Numero di nodi inizializzati.
+        Numero di righe inizializzate.
     """
     if not grafo_knowledge.caricato:
         return 0
 
     grafo = grafo_knowledge.grafo
-    ordine = ordinamento_topologico(grafo)
+    ordine = list(grafo_knowledge.indice.ordine_topologico)
     nodi_prima_override: set[str] = set()
 
     if nodo_override and nodo_override in ordine:
         idx = ordine.index(nodo_override)
         nodi_prima_override = set(ordine[:idx])
 
-    from sqlalchemy.dialects.postgresql import insert as pg_insert
-
-    count = 0
+    adesso = datetime.now(timezone.utc)
+    righe: list[dict] = []
     for nodo_id in ordine:
         attrs = grafo.nodes.get(nodo_id, {})
         if attrs.get("tipo_nodo") != "operativo":
             continue
 
-        if nodo_id in nodi_prima_override:
+        presunto = nodo_id in nodi_prima_override
+        if not presunto and settings.ONBOARDING_STATO_SPARSO:
+            continue
+        righe.append({
+            "utente_id": utente_id,
+            "nodo_id": nodo_id,
             # Nodo prima del punto di partenza → operativo + presunto
-            stmt = pg_insert(StatoNodoUtente).values(
-                utente_id=utente_id,
-                nodo_id=nodo_id,
-                livello="operativo",
-                presunto=True,
-                spiegazione_data=False,
-                ultima_interazione=datetime.now(timezone.utc),
-            )
-            stmt = stmt.on_conflict_do_nothing(
-                index_elements=["utente_id", "nodo_id"]
-            )
-        else:
-            # Nodo normale → non_iniziato
-            stmt = pg_insert(StatoNodoUtente).values(
-                utente_id=utente_id,
-                nodo_id=nodo_id,
-                livello="non_iniziato",
-                presunto=False,
-                spiegazione_data=False,
-                ultima_interazione=datetime.now(timezone.utc),
-            )
-            stmt = stmt.on_conflict_do_nothing(
-                index_elements=["utente_id", "nodo_id"]
-            )
-
-        await db.execute(stmt)
-        count += 1
+            "livello": "operativo" if presunto else "non_iniziato",
+            "presunto": presunto,
+            "spiegazione_data": False,
+            "ultima_interazione": adesso,
+        })
+
+    for inizio in range(0, len(righe), RIGHE_PER_INSERT):
+        stmt = pg_insert(StatoNodoUtente).values(righe[inizio:inizio + RIGHE_PER_INSERT])
+        await db.execute(
+            stmt.on_conflict_do_nothing(index_elements=["utente_id", "nodo_id"])
+        )
 
     await db.flush()
-    return count
+    # Di nuovo dopo il commit: una lettura concorrente puo' aver rimesso in
+    # cache lo stato precedente
+    cache_livelli.invalida(utente_id)
+    dopo_commit(db, partial(cache_livelli.invalida, utente_id))
+    return len(righe)
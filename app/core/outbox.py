@@ -0,0 +1,281 @@
+"""Outbox transazionale — post-processing del turno fuori dal percorso critico.
+
+Il turno scrive un LavoroOutbox nello stesso commit in cui salva la risposta
+del tutor; la verifica achievement la esegue poi un pool di worker asincroni
+nel processo (le statistiche giornaliere sono contatori incrementali aggiornati
+dagli eventi stessi, vedi core.gamification).
+
+Garanzie:
+- nessun lavoro perso: la riga esiste solo se il turno e' committato, e resta
+  in_attesa finche' un worker non committa l'esito (crash a meta' lavoro =
+  rollback, il lavoro viene ripreso)
+- worker concorrenti (anche su piu' processi) prelevano righe diverse con
+  SELECT ... FOR UPDATE SKIP LOCKED
+- un lavoro che fallisce viene ritentato con backoff esponenziale, fino a
+  OUTBOX_MAX_TENTATIVI; poi resta in stato fallito per l'analisi
+- i lavori completati vengono eliminati dopo OUTBOX_RETENZIONE_ORE (pulizia
+  a lotti nel ciclo dei worker, al piu' una volta ogni PULIZIA_INTERVALLO_SEC)
+
+Gli achievement sbloccati dal worker restano con notificato=false e
+raggiungono il client come eventi SSE all'inizio del turno successivo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.engine import async_session
+from app.db.models.outbox import LavoroOutbox
+
+logger = logging.getLogger(__name__)
+
+LAVORO_POST_TURNO = "post_turno"
+LAVORO_ACHIEVEMENT = "achievement"
+
+BACKOFF_MAX_SEC = 300
+
+PULIZIA_INTERVALLO_SEC = 3600
+PULIZIA_LOTTO = 1000
+
+
+def accoda_lavoro(
+    db: AsyncSession,
+    tipo: str,
+    utente_id: uuid.UUID,
+    sessione_id: uuid.UUID | None = None,
+    payload: dict | None = None,
+) -> LavoroOutbox:
+    """Aggiunge un lavoro alla transazione corrente (committato col chiamante)."""
+    lavoro = LavoroOutbox(
+        tipo=tipo,
+        utente_id=utente_id,
+        sessione_id=sessione_id,
+        payload=payload,
+    )
+    db.add(lavoro)
+    return lavoro
+
+
+# ---------------------------------------------------------------------------
+# Gestori per tipo di lavoro
+# ---------------------------------------------------------------------------
+
+async def _esegui_verifica_achievement(db: AsyncSession, lavoro: LavoroOutbox) -> None:
+    """Verifica achievement sulle metriche toccate dagli eventi del lavoro.
+
+    payload {"metriche": [...]}; senza payload (lavori accodati prima
+    dell'indice per metrica) si valutano tutte le condizioni.
+    """
+    from app.core.gamification import verifica_achievement
+
+    metriche = (lavoro.payload or {}).get("metriche")
+    await verifica_achievement(lavoro.utente_id, db, metriche)
+
+
+GESTORI_OUTBOX: dict[str, Callable[[AsyncSession, LavoroOutbox], Awaitable[None]]] = {
+    LAVORO_POST_TURNO: _esegui_verifica_achievement,
+    LAVORO_ACHIEVEMENT: _esegui_verifica_achievement,
+}
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+class WorkerOutbox:
+    """Pool di worker asyncio che svuotano outbox_lavori a lotti."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        n_worker: int,
+        intervallo_sec: float,
+        lotto: int,
+        max_tentativi: int,
+        retenzione_sec: float = 0,
+    ) -> None:
+        self._session_factory = session_factory
+        self._n_worker = n_worker
+        self._intervallo_sec = intervallo_sec
+        self._lotto = lotto
+        self._max_tentativi = max_tentativi
+        self._retenzione_sec = retenzione_sec
+        self._prossima_pulizia = 0.0
+        self._sveglia = asyncio.Event()
+        self._task: list[asyncio.Task] = []
+        self.completati = 0
+        self.ritentati = 0
+        self.falliti = 0
+        self.eliminati = 0
+
+    @property
+    def attivo(self) -> bool:
+        return bool(self._task)
+
+    def avvia(self) -> None:
+        if self._task or self._n_worker <= 0:
+            return
+        self._task = [
+            asyncio.create_task(self._ciclo(), name=f"outbox-worker-{i}")
+            for i in range(self._n_worker)
+        ]
+        logger.info("Worker outbox avviati: %d", self._n_worker)
+
+    async def ferma(self) -> None:
+        """Cancella i worker: i lotti in corso vanno in rollback e restano in coda."""
+        for task in self._task:
+            task.cancel()
+        await asyncio.gather(*self._task, return_exceptions=True)
+        self._task = []
+
+    def sveglia(self) -> None:
+        """Segnala lavori appena committati (evita di attendere l'intervallo)."""
+        self._sveglia.set()
+
+    async def _ciclo(self) -> None:
+        while True:
+            self._sveglia.clear()
+            try:
+                async with self._session_factory() as db:
+                    eseguiti = await self.esegui_lotto(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Worker outbox: errore nel prelievo lotto")
+                eseguiti = 0
+
+            if eseguiti < self._lotto:
+                await self._pulizia_periodica()
+                try:
+                    await asyncio.wait_for(self._sveglia.wait(), self._intervallo_sec)
+                except TimeoutError:
+                    pass
+
+    async def esegui_lotto(self, db: AsyncSession) -> int:
+        """Preleva ed esegue un lotto di lavori in una transazione. Ritorna quanti."""
+        adesso = datetime.now(timezone.utc)
+        result = await db.execute(
+            select(LavoroOutbox)
+            .where(
+                LavoroOutbox.stato == "in_attesa",
+                LavoroOutbox.disponibile_da <= adesso,
+            )
+            .order_by(LavoroOutbox.id)
+            .limit(self._lotto)
+            .with_for_update(skip_locked=True)
+        )
+        lavori = list(result.scalars().all())
+
+        for lavoro in lavori:
+            await self._esegui(db, lavoro)
+
+        if lavori:
+            await db.commit()
+        return len(lavori)
+
+    async def _esegui(self, db: AsyncSession, lavoro: LavoroOutbox) -> None:
+        gestore = GESTORI_OUTBOX.get(lavoro.tipo)
+        try:
+            if gestore is None:
+                raise ValueError(f"Tipo lavoro outbox sconosciuto: {lavoro.tipo}")
+            # Savepoint: un lavoro che fallisce non annulla gli altri del lotto
+            async with db.begin_nested():
+                await gestore(db, lavoro)
+        except Exception as e:
+            lavoro.tentativi = (lavoro.tentativi or 0) + 1
+            lavoro.errore = f"{type(e).__name__}: {e}"
+            if lavoro.tentativi >= self._max_tentativi:
+                lavoro.stato = "fallito"
+                self.falliti += 1
+                logger.exception(
+                    "Lavoro outbox %d (%s) fallito definitivamente dopo %d tentativi",
+                    lavoro.id, lavoro.tipo, lavoro.tentativi,
+                )
+            else:
+                attesa = min(2 ** lavoro.tentativi, BACKOFF_MAX_SEC)
+                lavoro.disponibile_da = datetime.now(timezone.utc) + timedelta(seconds=attesa)
+                self.ritentati += 1
+                logger.warning(
+                    "Lavoro outbox %d (%s) fallito, nuovo tentativo tra %ds: %s",
+                    lavoro.id, lavoro.tipo, attesa, e,
+                )
+            return
+
+        lavoro.stato = "completato"
+        lavoro.completato_at = datetime.now(timezone.utc)
+        self.completati += 1
+
+    # ------------------------------------------------------------------
+    # Retenzione
+    # ------------------------------------------------------------------
+
+    async def _pulizia_periodica(self) -> None:
+        """Pulizia dei completati se dovuta (una sola tra i worker del processo)."""
+        adesso = time.monotonic()
+        if self._retenzione_sec <= 0 or adesso < self._prossima_pulizia:
+            return
+        self._prossima_pulizia = adesso + PULIZIA_INTERVALLO_SEC
+        try:
+            async with self._session_factory() as db:
+                eliminati = await self.pulisci(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Worker outbox: errore nella pulizia dei completati")
+            return
+        if eliminati:
+            logger.info("Outbox: eliminati %d lavori completati", eliminati)
+
+    async def pulisci(self, db: AsyncSession) -> int:
+        """Elimina a lotti i lavori completati da oltre la retenzione. Ritorna quanti.
+
+        I lavori falliti restano per l'analisi.
+        """
+        limite = datetime.now(timezone.utc) - timedelta(seconds=self._retenzione_sec)
+        totale = 0
+        while True:
+            scaduti = (
+                select(LavoroOutbox.id)
+                .where(
+                    LavoroOutbox.stato == "completato",
+                    LavoroOutbox.completato_at < limite,
+                )
+                .limit(PULIZIA_LOTTO)
+            )
+            result = await db.execute(
+                delete(LavoroOutbox).where(LavoroOutbox.id.in_(scaduti))
+            )
+            await db.commit()
+            totale += result.rowcount
+            if result.rowcount < PULIZIA_LOTTO:
+                break
+        self.eliminati += totale
+        return totale
+
+    def statistiche(self) -> dict:
+        return {
+            "worker": len(self._task),
+            "completati": self.completati,
+            "ritentati": self.ritentati,
+            "falliti": self.falliti,
+            "eliminati": self.eliminati,
+        }
+
+
+worker_outbox = WorkerOutbox(
+    session_factory=async_session,
+    n_worker=settings.OUTBOX_WORKER,
+    intervallo_sec=settings.OUTBOX_INTERVALLO_SEC,
+    lotto=settings.OUTBOX_LOTTO,
+    max_tentativi=settings.OUTBOX_MAX_TENTATIVI,
+    retenzione_sec=settings.OUTBOX_RETENZIONE_ORE * 3600,
+)
@@ -0,0 +1,193 @@
+"""Ricarica a caldo del knowledge graph (embedding e contenuti editoriali).
+
+Dopo scripts/import_extraction.py i worker leggono ancora il grafo caricato
+all'avvio. `ricarica_grafo.avvia()` ricostruisce in background grafo,
+embedding dei nodi e contenuti con una sessione propria: GrafoKnowledge.carica()
+valida la nuova versione (sottografo bloccante aciclico, grafo non vuoto; nodi
+senza tema e temi vuoti sono segnalati) e la sostituisce con un solo
+assegnamento. I turni in corso restano sulla versione con cui sono partiti
+(fissa_versione in core.turno). Se la validazione fallisce resta in uso la
+versione corrente, e con essa embedding e contenuti.
+
+Trigger:
+- POST /admin/grafo/ricarica (api.admin, protetto da ADMIN_TOKEN)
+- NOTIFY sul canale GRAFO_RICARICA_CANALE: lo script di import lo invia dopo
+  il commit, ogni worker in ascolto (LISTEN, connessione asyncpg dedicata)
+  ricarica da solo.
+
+Richieste ravvicinate si accorpano: durante una ricarica se ne accoda al
+massimo un'altra, eseguita subito dopo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.engine import async_session
+from app.grafo.contenuti import contenuti
+from app.grafo.semantica import embedding_nodi
+from app.grafo.struttura import grafo_knowledge
+
+logger = logging.getLogger(__name__)
+
+
+class RicaricaGrafo:
+    """Task di ricarica in background + ascolto LISTEN/NOTIFY."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        canale: str,
+        attesa_riconnessione_sec: float = 5.0,
+    ) -> None:
+        self._session_factory = session_factory
+        self._canale = canale
+        self._attesa_riconnessione_sec = attesa_riconnessione_sec
+        self._task: asyncio.Task | None = None
+        self._da_ripetere = False
+        self._ascolto: asyncio.Task | None = None
+        self.ricariche = 0
+        self.fallite = 0
+        self.ultimo_errore: str | None = None
+        self.ultima_durata_sec: float | None = None
+
+    @property
+    def in_corso(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # ------------------------------------------------------------------
+    # Ricarica
+    # ------------------------------------------------------------------
+
+    def avvia(self) -> bool:
+        """Avvia una ricarica in background. False se accodata a una in corso."""
+        if self.in_corso:
+            self._da_ripetere = True
+            return False
+        self._task = asyncio.create_task(self._ciclo(), name="ricarica-grafo")
+        return True
+
+    async def attendi(self) -> None:
+        """Attende la fine della ricarica in corso (se c'e')."""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def esegui(self) -> None:
+        """Una ricarica di grafo + embedding + contenuti.
+
+        Embedding e contenuti si ricaricano solo se il nuovo grafo e' valido,
+        cosi' i nodi nuovi hanno subito i loro vettori (fallback semantico
+        dell'onboarding, nodi simili).
+
+        Raises:
+            ValueError: se il nuovo grafo non e' valido.
+        """
+        inizio = time.monotonic()
+        async with self._session_factory() as db:
+            versione = await grafo_knowledge.carica(db)
+            await embedding_nodi.carica(db)
+            await contenuti.ricarica(db)
+        self.ricariche += 1
+        self.ultimo_errore = None
+        self.ultima_durata_sec = time.monotonic() - inizio
+        logger.info(
+            "Ricarica completata: grafo versione %d, %d embedding, "
+            "contenuti versione %d in %.0f ms",
+            versione.numero, len(embedding_nodi.indice.nodi), contenuti.versione,
+            self.ultima_durata_sec * 1000,
+        )
+
+    async def _ciclo(self) -> None:
+        while True:
+            self._da_ripetere = False
+            try:
+                await self.esegui()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.fallite += 1
+                self.ultimo_errore = str(e)
+                logger.exception("Ricarica grafo fallita: versione corrente mantenuta")
+            if not self._da_ripetere:
+                return
+
+    # ------------------------------------------------------------------
+    # LISTEN / NOTIFY
+    # ------------------------------------------------------------------
+
+    def avvia_ascolto(self) -> None:
+        if self._ascolto is not None or not self._canale:
+            return
+        self._ascolto = asyncio.create_task(self._ascolta(), name="ricarica-grafo-listen")
+
+    async def ferma(self) -> None:
+        for task in (self._ascolto, self._task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._ascolto = None
+        self._task = None
+
+    def _su_notifica(self, connessione, pid: int, canale: str, payload: str) -> None:
+        logger.info("NOTIFY %s (%s): ricarica grafo", canale, payload or "-")
+        self.avvia()
+
+    async def _ascolta(self) -> None:
+        import asyncpg
+
+        dsn = settings.DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+        while True:
+            try:
+                connessione = await asyncpg.connect(dsn)
+                chiusa = asyncio.Event()
+                connessione.add_termination_listener(lambda _: chiusa.set())
+                try:
+                    await connessione.add_listener(self._canale, self._su_notifica)
+                    logger.info("In ascolto su %s per la ricarica del grafo", self._canale)
+                    await chiusa.wait()
+                    logger.warning("Connessione LISTEN %s chiusa", self._canale)
+                finally:
+                    await connessione.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN %s fallito", self._canale)
+            await asyncio.sleep(self._attesa_riconnessione_sec)
+
+    # ------------------------------------------------------------------
+    # Stato (per /health)
+    # ------------------------------------------------------------------
+
+    def stato(self) -> dict:
+        stato: dict = {"caricato": grafo_knowledge.caricato}
+        if grafo_knowledge.caricato:
+            versione = grafo_knowledge.versione
+            stato.update(
+                versione=versione.numero,
+                firma=versione.firma,
+                caricato_at=versione.caricato_at.isoformat(),
+                durata_caricamento_ms=round(versione.durata_sec * 1000, 1),
+                anomalie=len(versione.anomalie),
+            )
+        stato.update(
+            ricarica_in_corso=self.in_corso,
+            ricariche=self.ricariche,
+            ultima_ricarica_ms=(
+                round(self.ultima_durata_sec * 1000, 1)
+                if self.ultima_durata_sec is not None else None
+            ),
+            ultimo_errore=self.ultimo_errore,
+        )
+        return stato
+
+
+ricarica_grafo = RicaricaGrafo(
+    session_factory=async_session,
+    canale=settings.GRAFO_RICARICA_CANALE,
+)
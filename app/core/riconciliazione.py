@@ -0,0 +1,81 @@
+"""Riconciliazione periodica delle statistiche giornaliere.
+
+Le statistiche e lo streak sono contatori incrementali aggiornati dagli
+eventi (core.gamification.registra_attivita_giornaliera): un evento perso
+(es. crash tra commit e aggiornamento) o una correzione manuale dei dati li
+farebbe divergere. Questo task, all'avvio e poi ogni
+STATISTICHE_RICONCILIAZIONE_SEC, ricalcola da zero ieri e oggi per gli
+utenti attivi e riallinea lo streak memorizzato. E' idempotente: piu'
+processi che riconciliano insieme producono lo stesso risultato.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.engine import async_session
+
+logger = logging.getLogger(__name__)
+
+
+class RiconciliazioneStatistiche:
+    """Task asyncio che esegue riconcilia_statistiche a intervalli regolari."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        intervallo_sec: float,
+    ) -> None:
+        self._session_factory = session_factory
+        self._intervallo_sec = intervallo_sec
+        self._task: asyncio.Task | None = None
+        self.esecuzioni = 0
+        self.utenti_riconciliati = 0
+
+    @property
+    def attivo(self) -> bool:
+        return self._task is not None
+
+    def avvia(self) -> None:
+        if self._task is not None or self._intervallo_sec <= 0:
+            return
+        self._task = asyncio.create_task(self._ciclo(), name="riconciliazione-statistiche")
+        logger.info("Riconciliazione statistiche ogni %ss", self._intervallo_sec)
+
+    async def ferma(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def esegui(self) -> int:
+        """Una passata di riconciliazione. Ritorna il numero di utenti."""
+        from app.core.gamification import riconcilia_statistiche
+
+        async with self._session_factory() as db:
+            utenti = await riconcilia_statistiche(db)
+        self.esecuzioni += 1
+        self.utenti_riconciliati += utenti
+        return utenti
+
+    async def _ciclo(self) -> None:
+        while True:
+            try:
+                await self.esegui()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Riconciliazione statistiche fallita")
+            await asyncio.sleep(self._intervallo_sec)
+
+
+riconciliazione_statistiche = RiconciliazioneStatistiche(
+    session_factory=async_session,
+    intervallo_sec=settings.STATISTICHE_RICONCILIAZIONE_SEC,
+)
@@ -14,6 +14,7 @@ from datetime import datetime, timezone
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.gamification import registra_chiusura_sessione
 from app.db.models.stato_utente import StatoNodoUtente
 from app.db.models.utenti import Sessione
 from app.grafo.algoritmi import path_planner
@@ -117,7 +118,7 @@ async def sospendi_sessione(
 
     # Calcola durata
     durata = (datetime.now(timezone.utc) - sessione.created_at).total_seconds() / 60
-    sessione.durata_effettiva_min = int(durata)
+    await registra_chiusura_sessione(db, sessione, int(durata), completata=False)
 
     # Annota nella stato_orchestratore il contesto di sospensione
     stato = sessione.stato_orchestratore or {}
@@ -146,7 +147,7 @@ async def termina_sessione(
         )
 
     durata = (datetime.now(timezone.utc) - sessione.created_at).total_seconds() / 60
-    sessione.durata_effettiva_min = int(durata)
+    await registra_chiusura_sessione(db, sessione, int(durata), completata=True)
     sessione.stato = "completata"
     sessione.completed_at = datetime.now(timezone.utc)
     await db.flush()
@@ -269,7 +270,7 @@ async def _scegli_nodo(
         return None
 
     livelli = await get_livelli_utente(utente_id, db)
-    prossimo = path_planner(grafo_knowledge.grafo, livelli)
+    prossimo = path_planner(grafo_knowledge.grafo, livelli, indice=grafo_knowledge.indice)
 
     if prossimo:
         logger.info("Path planner → nodo: %s", prossimo)
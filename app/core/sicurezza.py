@@ -2,8 +2,16 @@
 
 Modulo core (non HTTP): usato sia da api/auth che da api/deps.
 Usa bcrypt direttamente (passlib ha problemi con bcrypt >= 5.0).
+
+I token gia' verificati restano in `cache_token` (chiave: SHA-256 del token,
+LRU + TTL, mai oltre il claim exp): ogni richiesta autenticata, compresi i
+turni SSE e i poll di mappa/statistiche, evita la decodifica python-jose.
+I token invalidi non vengono memorizzati.
 """
 
+import hashlib
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 
 import bcrypt
@@ -29,17 +37,83 @@ def crea_token(utente_id: str) -> str:
     return jwt.encode(payload, settings.JWT_SECRET, algorithm="HS256")
 
 
+class CacheToken:
+    """Cache LRU/TTL dei JWT verificati: digest del token → (scadenza, utente_id).
+
+    La scadenza di una voce e' il minimo tra TTL e claim exp (tempo Unix),
+    quindi un token scaduto non viene mai accettato dalla cache.
+    """
+
+    def __init__(self, max_voci: int, ttl_sec: float) -> None:
+        self._max_voci = max_voci
+        self._ttl_sec = ttl_sec
+        self._voci: OrderedDict[bytes, tuple[float, str]] = OrderedDict()
+        self.hit = 0
+        self.miss = 0
+
+    @staticmethod
+    def _chiave(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def leggi(self, token: str) -> str | None:
+        chiave = self._chiave(token)
+        voce = self._voci.get(chiave)
+        if voce is None or time.time() >= voce[0]:
+            if voce is not None:
+                del self._voci[chiave]
+            self.miss += 1
+            return None
+        self._voci.move_to_end(chiave)
+        self.hit += 1
+        return voce[1]
+
+    def scrivi(self, token: str, utente_id: str, exp: float | None = None) -> None:
+        if self._max_voci <= 0:
+            return
+        scadenza = time.time() + self._ttl_sec
+        if exp is not None:
+            scadenza = min(scadenza, exp)
+        chiave = self._chiave(token)
+        self._voci[chiave] = (scadenza, utente_id)
+        self._voci.move_to_end(chiave)
+        while len(self._voci) > self._max_voci:
+            self._voci.popitem(last=False)
+
+    def svuota(self) -> None:
+        self._voci.clear()
+
+    def statistiche(self) -> dict:
+        totale = self.hit + self.miss
+        return {
+            "voci": len(self._voci),
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_ratio": self.hit / totale if totale else 0.0,
+        }
+
+
+cache_token = CacheToken(
+    max_voci=settings.CACHE_TOKEN_MAX_VOCI,
+    ttl_sec=settings.CACHE_TOKEN_TTL_SEC,
+)
+
+
 def verifica_token(token: str) -> str:
-    """Decodifica e valida JWT. Ritorna utente_id.
+    """Decodifica e valida JWT (passando da cache_token). Ritorna utente_id.
 
     Raises:
         ValueError: se il token e' invalido o scaduto.
     """
+    utente_id = cache_token.leggi(token)
+    if utente_id is not None:
+        return utente_id
+
     try:
         payload = jwt.decode(token, settings.JWT_SECRET, algorithms=["HS256"])
-        utente_id: str | None = payload.get("sub")
-        if utente_id is None:
-            raise ValueError("Token senza claim 'sub'")
-        return utente_id
     except JWTError as e:
         raise ValueError(f"Token non valido: {e}") from e
+    utente_id = payload.get("sub")
+    if utente_id is None:
+        raise ValueError("Token senza claim 'sub'")
+    cache_token.scrivi(token, utente_id, payload.get("exp"))
+    return utente_id
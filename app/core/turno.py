@@ -2,41 +2,66 @@
 
 Fase 1: Preparazione (carica stato, assembla context package)
 Fase 2: Chiamata LLM (streaming, parsing, eventi SSE)
-Fase 3: Post-processing (segnali, achievement)
+Fase 3: Post-processing (segnali e statistiche; achievement via outbox)
+
+Fase 1 e fase 3 usano ciascuna una sessione DB breve: durante lo stream LLM
+(fino a TIMEOUT_LLM_SEC) nessuna connessione del pool resta occupata.
+Il messaggio utente si salva in fase 3 insieme alla risposta; se il turno
+non arriva a quel commit (errore, client disconnesso a meta' stream)
+esegui_turno lo salva da solo, al riparo dalla cancellazione.
+La verifica achievement, limitata alle metriche toccate dagli eventi del
+turno, e' un lavoro outbox scritto nello stesso commit del turno ed eseguito
+dai worker (app.core.outbox); gli achievement sbloccati arrivano come eventi
+all'inizio del turno successivo.
+
+Il turno legge il grafo alla versione con cui e' partito
+(grafo_knowledge.fissa_versione): una ricarica a caldo a meta' turno non
+cambia prerequisiti o nodi tra una fase e l'altra.
 
 HARD CONSTRAINT: il flusso delle 3 fasi è visibile in un posto.
 """
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import uuid
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Callable
+from contextlib import aclosing
+from dataclasses import dataclass
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.contesto import assembla_context_package
-from app.core.conversazione import salva_turno
+from app.core.conversazione import NuovoTurno, salva_turni, salva_turno
 from app.core.elaborazione import (
     aggiorna_nodo_dopo_promozione,
     esegui_azione,
     processa_segnali,
 )
+from app.core.gamification import metriche_per_eventi
+from app.core.outbox import LAVORO_POST_TURNO, accoda_lavoro, worker_outbox
+from app.db.engine import async_session
 from app.db.models.utenti import Sessione
+from app.grafo.struttura import grafo_knowledge
 from app.llm.client import chiama_tutor
 
 logger = logging.getLogger(__name__)
 
 
 async def esegui_turno(
-    db: AsyncSession,
     sessione_id: uuid.UUID,
     utente_id: uuid.UUID,
     messaggio_utente: str | None = None,
+    session_factory: Callable[[], AsyncSession] = async_session,
 ) -> AsyncGenerator[dict, None]:
     """Esegue un turno completo: preparazione → LLM → post-processing.
 
+    Nessuna connessione DB resta occupata durante lo stream LLM: fase 1 e
+    fase 3 aprono ciascuna una sessione breve da `session_factory`, le azioni
+    che scrivono a meta' stream ne prendono in prestito una per la sola azione.
+
     Yield eventi SSE strutturati:
         {"event": "text_delta", "data": {"testo": "..."}}
         {"event": "azione", "data": {"tipo": "...", "params": {...}}}
@@ -44,7 +69,36 @@ async def esegui_turno(
         {"event": "turno_completo", "data": {"turno_id": ..., "nodo_focale": ...}}
         {"event": "errore", "data": {"codice": "...", "messaggio": "..."}}
     """
-
+    esito = _EsitoTurno()
+    try:
+        with grafo_knowledge.fissa_versione():
+            async with aclosing(
+                _esegui_turno(sessione_id, utente_id, messaggio_utente, session_factory, esito)
+            ) as eventi:
+                async for evento in eventi:
+                    yield evento
+    finally:
+        # Turno interrotto prima del commit di fase 3 (anche GeneratorExit o
+        # CancelledError): le azioni della fase 2 sono gia' committate, il
+        # messaggio che le ha causate non deve andare perso
+        if messaggio_utente and not esito.messaggio_salvato:
+            await asyncio.shield(
+                _salva_solo_messaggio_utente(session_factory, sessione_id, messaggio_utente)
+            )
+
+
+@dataclass(slots=True)
+class _EsitoTurno:
+    messaggio_salvato: bool = False
+
+
+async def _esegui_turno(
+    sessione_id: uuid.UUID,
+    utente_id: uuid.UUID,
+    messaggio_utente: str | None,
+    session_factory: Callable[[], AsyncSession],
+    esito: _EsitoTurno,
+) -> AsyncGenerator[dict, None]:
     # =================================================================
     # FASE 1 — Preparazione
     # =================================================================
@@ -53,30 +107,37 @@ async def esegui_turno(
         sessione_id, utente_id,
     )
 
-    # Salva messaggio utente (se presente — non c'è nel primo turno)
-    if messaggio_utente:
-        await salva_turno(
-            db=db,
-            sessione_id=sessione_id,
-            ruolo="utente",
-            contenuto=messaggio_utente,
-        )
-        await db.commit()
+    async with session_factory() as db:
+        # Achievement sbloccati dal worker outbox dopo il turno precedente
+        achievement_pendenti = await _preleva_achievement_safe(utente_id, db)
+        if achievement_pendenti:
+            await db.commit()
+
+        # Assembla context package (blocchi 1-6). Il messaggio utente (assente
+        # nel primo turno) entra nei messages ma si salva in fase 3, insieme
+        # alla risposta
+        ctx = None
+        errore_contesto = ""
+        try:
+            ctx = await assembla_context_package(
+                sessione_id=sessione_id,
+                utente_id=utente_id,
+                db=db,
+                messaggio_utente=messaggio_utente,
+            )
+        except ValueError as e:
+            logger.error("Errore assemblaggio contesto: %s", e)
+            errore_contesto = str(e)
+
+    for ach in achievement_pendenti:
+        yield _evento_sse("achievement", ach)
 
-    # Assembla context package (blocchi 1-6)
-    try:
-        ctx = await assembla_context_package(
-            sessione_id=sessione_id,
-            utente_id=utente_id,
-            db=db,
-        )
-    except ValueError as e:
-        logger.error("Errore assemblaggio contesto: %s", e)
-        yield _evento_errore("context_error", str(e))
+    if ctx is None:
+        yield _evento_errore("context_error", errore_contesto)
         return
 
     # =================================================================
-    # FASE 2 — Chiamata LLM (streaming)
+    # FASE 2 — Chiamata LLM (streaming, nessuna sessione DB aperta)
     # =================================================================
     logger.info(
         "Turno: fase 2 (LLM streaming) sessione=%s, modello=%s",
@@ -106,12 +167,16 @@ async def esegui_turno(
                 }
                 azioni_accumulate.append(azione_raw)
 
-                azione_result = await esegui_azione(
-                    db=db,
-                    azione=azione_raw,
-                    sessione_id=sessione_id,
-                    utente_id=utente_id,
-                )
+                # Sessione in prestito solo per l'azione, rilasciata prima
+                # di tornare allo stream
+                async with session_factory() as db:
+                    azione_result = await esegui_azione(
+                        db=db,
+                        azione=azione_raw,
+                        sessione_id=sessione_id,
+                        utente_id=utente_id,
+                    )
+                    await db.commit()
                 if azione_result:
                     yield _evento_sse("azione", azione_result)
             else:
@@ -143,71 +208,88 @@ async def esegui_turno(
         len(segnali_accumulati),
     )
 
-    # Salva turno assistente (solo testo, azioni e segnali separati)
-    stato_orch = None
-    sess_result = await db.execute(
-        select(Sessione).where(Sessione.id == sessione_id)
-    )
-    sess = sess_result.scalar_one_or_none()
-    if sess:
-        stato_orch = sess.stato_orchestratore or {}
-
-    turno_salvato = await salva_turno(
-        db=db,
-        sessione_id=sessione_id,
-        ruolo="assistente",
-        contenuto=risultato_llm.testo_completo or None,
-        azioni=azioni_accumulate if azioni_accumulate else None,
-        segnali=segnali_accumulati if segnali_accumulati else None,
-        nodo_focale_id=stato_orch.get("nodo_focale_id") if stato_orch else None,
-        modello=risultato_llm.modello,
-        token_input=risultato_llm.token_input,
-        token_output=risultato_llm.token_output,
-        costo_stimato=risultato_llm.costo_stimato,
-    )
-
-    # Processa segnali
-    promozioni = await processa_segnali(
-        db=db,
-        segnali=segnali_accumulati,
-        sessione_id=sessione_id,
-        utente_id=utente_id,
-    )
-
-    # Gestisci promozioni
-    for promo in promozioni:
-        nodo_promosso = promo["nodo_id"]
-        prossimo_nodo = await aggiorna_nodo_dopo_promozione(
+    async with session_factory() as db:
+        # Salva turno assistente (solo testo, azioni e segnali separati)
+        stato_orch = None
+        sess_result = await db.execute(
+            select(Sessione).where(Sessione.id == sessione_id)
+        )
+        sess = sess_result.scalar_one_or_none()
+        if sess:
+            stato_orch = sess.stato_orchestratore or {}
+
+        # Turno utente + assistente: un UPDATE sul contatore ordine e un INSERT
+        turni = []
+        if messaggio_utente:
+            turni.append(NuovoTurno(ruolo="utente", contenuto=messaggio_utente))
+        turni.append(NuovoTurno(
+            ruolo="assistente",
+            contenuto=risultato_llm.testo_completo or None,
+            azioni=azioni_accumulate if azioni_accumulate else None,
+            segnali=segnali_accumulati if segnali_accumulati else None,
+            nodo_focale_id=stato_orch.get("nodo_focale_id") if stato_orch else None,
+            modello=risultato_llm.modello,
+            token_input=risultato_llm.token_input,
+            token_output=risultato_llm.token_output,
+            costo_stimato=risultato_llm.costo_stimato,
+        ))
+        turno_salvato = (await salva_turni(db, sessione_id, turni))[-1]
+
+        # Processa segnali
+        promozioni = await processa_segnali(
             db=db,
+            segnali=segnali_accumulati,
             sessione_id=sessione_id,
             utente_id=utente_id,
-            nodo_promosso=nodo_promosso,
-        )
-        logger.info(
-            "Promozione %s → operativo, prossimo: %s",
-            nodo_promosso, prossimo_nodo,
+            sessione=sess,
         )
 
-    # Aggiorna statistiche giornaliere
-    await _aggiorna_stats_safe(utente_id, db)
+        # Gestisci promozioni
+        for promo in promozioni:
+            nodo_promosso = promo["nodo_id"]
+            prossimo_nodo = await aggiorna_nodo_dopo_promozione(
+                db=db,
+                sessione_id=sessione_id,
+                utente_id=utente_id,
+                nodo_promosso=nodo_promosso,
+            )
+            logger.info(
+                "Promozione %s → operativo, prossimo: %s",
+                nodo_promosso, prossimo_nodo,
+            )
+
+        # Achievement: lavoro outbox nello stesso commit del turno, solo se gli
+        # eventi del turno toccano qualche metrica
+        eventi = [s["name"] for s in segnali_accumulati]
+        eventi += [a["name"] for a in azioni_accumulate]
+        if promozioni:
+            eventi.append("promozione")
+        metriche = metriche_per_eventi(eventi)
+        if metriche:
+            accoda_lavoro(
+                db,
+                LAVORO_POST_TURNO,
+                utente_id=utente_id,
+                sessione_id=sessione_id,
+                payload={"metriche": sorted(metriche)},
+            )
+
+        # Commit finale
+        await db.commit()
+        esito.messaggio_salvato = True
 
-    # Achievement check
-    achievement_nuovi = await _verifica_achievement_safe(utente_id, db)
-    for ach in achievement_nuovi:
-        yield _evento_sse("achievement", ach)
+        nodo_focale_id = None
+        if sess:
+            await db.refresh(sess)
+            stato_orch = sess.stato_orchestratore or {}
+            nodo_focale_id = stato_orch.get("nodo_focale_id")
+        turno_id = turno_salvato.id
 
-    # Commit finale
-    await db.commit()
+    worker_outbox.sveglia()
 
     # Evento turno_completo
-    nodo_focale_id = None
-    if sess:
-        await db.refresh(sess)
-        stato_orch = sess.stato_orchestratore or {}
-        nodo_focale_id = stato_orch.get("nodo_focale_id")
-
     yield _evento_sse("turno_completo", {
-        "turno_id": turno_salvato.id,
+        "turno_id": turno_id,
         "nodo_focale": nodo_focale_id,
     })
 
@@ -215,7 +297,7 @@ async def esegui_turno(
         "Turno completato: sessione=%s, turno_id=%d, "
         "token_in=%d, token_out=%d, $%.4f",
         sessione_id,
-        turno_salvato.id,
+        turno_id,
         risultato_llm.token_input,
         risultato_llm.token_output,
         risultato_llm.costo_stimato,
@@ -236,32 +318,39 @@ def _evento_errore(codice: str, messaggio: str) -> dict:
     return _evento_sse("errore", {"codice": codice, "messaggio": messaggio})
 
 
-async def _aggiorna_stats_safe(
+async def _preleva_achievement_safe(
     utente_id: uuid.UUID,
     db: AsyncSession,
-) -> None:
-    """Wrapper safe per aggiornamento statistiche giornaliere."""
+) -> list[dict]:
+    """Wrapper safe per gli achievement da notificare — non bloccante se fallisce."""
     try:
-        from app.core.gamification import aggiorna_statistiche_giornaliere
-        await aggiorna_statistiche_giornaliere(utente_id, db)
+        from app.core.gamification import preleva_achievement_da_notificare
+        return await preleva_achievement_da_notificare(utente_id, db)
     except Exception:
         logger.warning(
-            "Errore aggiornamento statistiche (non bloccante)",
+            "Errore lettura achievement da notificare (non bloccante)",
             exc_info=True,
         )
+        await db.rollback()
+        return []
 
 
-async def _verifica_achievement_safe(
-    utente_id: uuid.UUID,
-    db: AsyncSession,
-) -> list[dict]:
-    """Wrapper safe per verifica achievement — non bloccante se fallisce."""
+async def _salva_solo_messaggio_utente(
+    session_factory: Callable[[], AsyncSession],
+    sessione_id: uuid.UUID,
+    messaggio_utente: str | None,
+) -> None:
+    """Turno interrotto prima del commit di fase 3: il messaggio utente resta nello storico."""
     try:
-        from app.core.gamification import verifica_achievement
-        return await verifica_achievement(utente_id, db)
+        async with session_factory() as db:
+            await salva_turno(
+                db=db,
+                sessione_id=sessione_id,
+                ruolo="utente",
+                contenuto=messaggio_utente,
+            )
+            await db.commit()
+    except ValueError:
+        logger.warning("Messaggio utente non salvato: sessione %s assente", sessione_id)
     except Exception:
-        logger.warning(
-            "Errore verifica achievement (non bloccante)",
-            exc_info=True,
-        )
-        return []
+        logger.exception("Messaggio utente non salvato: sessione %s", sessione_id)
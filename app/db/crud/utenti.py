@@ -1,12 +1,83 @@
-"""CRUD utenti — accesso al database SOLO tramite queste funzioni."""
-
+"""CRUD utenti — accesso al database SOLO tramite queste funzioni.
+
+`get_utente_autenticato` (usata da api/deps) passa da `cache_utenti`: le
+istanze in cache sono staccate da ogni sessione e vanno trattate in sola
+lettura (per modificare un utente si ricarica con get_utente_by_id). Chi
+scrive su utenti chiama `invalida_utente` nella stessa transazione: la voce
+cade dopo il commit, cosi' una richiesta concorrente non rimette in cache la
+riga vecchia. Per gli UPDATE dei contatori da altri processi il limite alla
+deriva e' CACHE_UTENTI_TTL_SEC.
+"""
+
+import time
 import uuid
+from collections import OrderedDict
+from functools import partial
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.config import settings
+from app.core.esecutori import esecutori
 from app.core.sicurezza import hash_password
 from app.db.models.utenti import Utente
+from app.db.transazioni import dopo_commit
+
+
+class CacheUtenti:
+    """Cache LRU/TTL delle righe utenti per id (istanze staccate, sola lettura)."""
+
+    def __init__(self, max_voci: int, ttl_sec: float) -> None:
+        self._max_voci = max_voci
+        self._ttl_sec = ttl_sec
+        self._voci: OrderedDict[uuid.UUID, tuple[float, Utente]] = OrderedDict()
+        self.hit = 0
+        self.miss = 0
+
+    def leggi(self, utente_id: uuid.UUID) -> Utente | None:
+        voce = self._voci.get(utente_id)
+        if voce is None or time.monotonic() - voce[0] > self._ttl_sec:
+            if voce is not None:
+                del self._voci[utente_id]
+            self.miss += 1
+            return None
+        self._voci.move_to_end(utente_id)
+        self.hit += 1
+        return voce[1]
+
+    def scrivi(self, utente: Utente) -> None:
+        if self._max_voci <= 0:
+            return
+        self._voci[utente.id] = (time.monotonic(), utente)
+        self._voci.move_to_end(utente.id)
+        while len(self._voci) > self._max_voci:
+            self._voci.popitem(last=False)
+
+    def invalida(self, utente_id: uuid.UUID) -> None:
+        self._voci.pop(utente_id, None)
+
+    def svuota(self) -> None:
+        self._voci.clear()
+
+    def statistiche(self) -> dict:
+        totale = self.hit + self.miss
+        return {
+            "voci": len(self._voci),
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_ratio": self.hit / totale if totale else 0.0,
+        }
+
+
+cache_utenti = CacheUtenti(
+    max_voci=settings.CACHE_UTENTI_MAX_VOCI,
+    ttl_sec=settings.CACHE_UTENTI_TTL_SEC,
+)
+
+
+def invalida_utente(db: AsyncSession, utente_id: uuid.UUID) -> None:
+    """Rimuove l'utente da cache_utenti dopo il commit della transazione corrente di db."""
+    dopo_commit(db, partial(cache_utenti.invalida, utente_id))
 
 
 async def crea_utente(
@@ -26,7 +97,7 @@ async def crea_utente(
 
     utente = Utente(
         email=email,
-        password_hash=hash_password(password),
+        password_hash=await esecutori.esegui("hash", hash_password, password),
         nome=nome,
     )
     db.add(utente)
@@ -47,6 +118,21 @@ async def get_utente_by_id(db: AsyncSession, utente_id: uuid.UUID) -> Utente | N
     return result.scalar_one_or_none()
 
 
+async def get_utente_autenticato(db: AsyncSession, utente_id: uuid.UUID) -> Utente | None:
+    """Come get_utente_by_id, ma da cache_utenti (istanza staccata, sola lettura)."""
+    utente = cache_utenti.leggi(utente_id)
+    if utente is not None:
+        return utente
+
+    utente = await get_utente_by_id(db, utente_id)
+    if utente is not None:
+        # Fuori dall'identity map della richiesta: le modifiche in questa
+        # sessione (es. aggiorna_profilo) lavorano su un'istanza propria
+        db.expunge(utente)
+        cache_utenti.scrivi(utente)
+    return utente
+
+
 async def aggiorna_profilo(
     db: AsyncSession,
     utente_id: uuid.UUID,
@@ -70,6 +156,7 @@ async def aggiorna_profilo(
             raise ValueError(f"Campo non ammesso: {campo}")
         setattr(utente, campo, valore)
 
+    invalida_utente(db, utente_id)
     await db.commit()
     await db.refresh(utente)
     return utente
@@ -1,5 +1,7 @@
+import time
 from collections.abc import AsyncGenerator
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.config import settings
@@ -12,3 +14,57 @@ async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
+
+
+# ---------------------------------------------------------------------------
+# Metriche pool connessioni
+# ---------------------------------------------------------------------------
+
+class MetrichePool:
+    """Checkout e tempo di possesso delle connessioni del pool.
+
+    hold time = checkout → checkin di una connessione: misura quanto a lungo
+    una richiesta tiene occupato uno slot del pool (es. durante lo stream LLM).
+    """
+
+    def __init__(self) -> None:
+        self.checkout = 0
+        self.in_uso = 0
+        self.in_uso_max = 0
+        self.possesso_totale_sec = 0.0
+        self.possesso_max_sec = 0.0
+
+    def registra(self, engine_sync) -> None:
+        event.listen(engine_sync, "checkout", self._on_checkout)
+        event.listen(engine_sync, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_conn, record, proxy) -> None:
+        record.info["checkout_at"] = time.monotonic()
+        self.checkout += 1
+        self.in_uso += 1
+        self.in_uso_max = max(self.in_uso_max, self.in_uso)
+
+    def _on_checkin(self, dbapi_conn, record) -> None:
+        inizio = record.info.pop("checkout_at", None)
+        if inizio is None:
+            return
+        possesso = time.monotonic() - inizio
+        self.in_uso -= 1
+        self.possesso_totale_sec += possesso
+        self.possesso_max_sec = max(self.possesso_max_sec, possesso)
+
+    def statistiche(self) -> dict:
+        rilasciate = self.checkout - self.in_uso
+        return {
+            "checkout": self.checkout,
+            "in_uso": self.in_uso,
+            "in_uso_max": self.in_uso_max,
+            "possesso_medio_sec": (
+                self.possesso_totale_sec / rilasciate if rilasciate else 0.0
+            ),
+            "possesso_max_sec": self.possesso_max_sec,
+        }
+
+
+metriche_pool = MetrichePool()
+metriche_pool.registra(engine.sync_engine)
@@ -1,4 +1,5 @@
 from app.db.models.grafo import Esercizio, Nodo, NodoTema, Relazione, Tema
+from app.db.models.outbox import LavoroOutbox
 from app.db.models.stato_utente import StoricoErrori, StoricoEsercizi, StatoNodoUtente
 from app.db.models.utenti import PercorsoUtente, Sessione, TurnoConversazione, Utente
 from app.db.models.gamification import (
@@ -27,4 +28,5 @@ __all__ = [
     "AchievementDefinizione",
     "AchievementUtente",
     "StatisticaGiornaliera",
+    "LavoroOutbox",
 ]
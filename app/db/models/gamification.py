@@ -56,6 +56,8 @@ class AchievementUtente(Base):
         Text, ForeignKey("achievement_definizioni.id"), primary_key=True
     )
     sbloccato_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
+    # Sbloccato dal worker outbox: inviato al client come evento SSE al turno successivo
+    notificato: Mapped[bool] = mapped_column(Boolean, server_default=text("false"))
 
 
 class StatisticaGiornaliera(Base):
@@ -0,0 +1,40 @@
+"""Gruppo 5 — Outbox: lavori post-turno scritti nello stesso commit del turno."""
+
+import uuid
+from datetime import datetime
+
+from sqlalchemy import ForeignKey, Index, Integer, Text, text
+from sqlalchemy.dialects.postgresql import JSONB, TIMESTAMP, UUID
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base import Base
+
+
+class LavoroOutbox(Base):
+    __tablename__ = "outbox_lavori"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    tipo: Mapped[str] = mapped_column(Text, nullable=False)
+    utente_id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), ForeignKey("utenti.id"), nullable=False
+    )
+    sessione_id: Mapped[uuid.UUID | None] = mapped_column(
+        UUID(as_uuid=True), ForeignKey("sessioni.id")
+    )
+    payload: Mapped[dict | None] = mapped_column(JSONB)
+
+    # in_attesa → completato | fallito (dopo OUTBOX_MAX_TENTATIVI)
+    stato: Mapped[str] = mapped_column(Text, server_default="in_attesa")
+    tentativi: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    errore: Mapped[str | None] = mapped_column(Text)
+    disponibile_da: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), server_default=text("now()")
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), server_default=text("now()")
+    )
+    completato_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        Index("ix_outbox_lavori_stato_disponibile", "stato", "disponibile_da"),
+    )
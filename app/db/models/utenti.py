@@ -1,9 +1,9 @@
 """Gruppo 3 — Utenti, sessioni, conversazioni."""
 
 import uuid
-from datetime import datetime
+from datetime import date, datetime
 
-from sqlalchemy import Float, ForeignKey, Index, Integer, Text, text
+from sqlalchemy import Date, Float, ForeignKey, Index, Integer, Text, UniqueConstraint, text
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TIMESTAMP, UUID
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -27,6 +27,16 @@ class Utente(Base):
     materie_attive: Mapped[list | None] = mapped_column(ARRAY(Text))
     obiettivo_giornaliero_min: Mapped[int] = mapped_column(Integer, server_default=text("20"))
     impostazioni_promemoria: Mapped[dict | None] = mapped_column(JSONB)
+    # Streak memorizzato (avanzato quando l'obiettivo del giorno scatta)
+    streak_corrente: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    streak_migliore: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    streak_ultimo_giorno: Mapped[date | None] = mapped_column(Date)
+    # Contatori metriche achievement (incrementati dagli eventi, riconciliati)
+    nodi_completati: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    esercizi_risolti: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    esercizi_consecutivi_max: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    temi_completati: Mapped[int] = mapped_column(Integer, server_default=text("0"))
+    sessioni_completate: Mapped[int] = mapped_column(Integer, server_default=text("0"))
 
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
     updated_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
@@ -67,6 +77,11 @@ class Sessione(Base):
     riepilogo: Mapped[str | None] = mapped_column(Text)
     stato: Mapped[str] = mapped_column(Text, server_default="attiva")
     stato_orchestratore: Mapped[dict | None] = mapped_column(JSONB)
+    # Riassunto progressivo dei turni esclusi dalla compattazione (fino a ordine incluso)
+    riassunto_conversazione: Mapped[str | None] = mapped_column(Text)
+    riassunto_fino_a_ordine: Mapped[int | None] = mapped_column(Integer)
+    # Ultimo ordine assegnato in turni_conversazione (contatore UPDATE ... RETURNING)
+    ultimo_ordine_turno: Mapped[int] = mapped_column(Integer, server_default=text("0"))
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
     completed_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
 
@@ -95,5 +110,7 @@ class TurnoConversazione(Base):
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
 
     __table_args__ = (
-        Index("ix_turni_conversazione_sessione_ordine", "sessione_id", "ordine"),
+        UniqueConstraint(
+            "sessione_id", "ordine", name="uq_turni_conversazione_sessione_ordine"
+        ),
     )
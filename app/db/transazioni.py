@@ -0,0 +1,69 @@
+"""Effetti in memoria legati all'esito della transazione di una sessione.
+
+Cache e buffer in RAM (livelli, esercizi tentati, utenti, conversazione)
+devono riflettere solo dati arrivati davvero nel DB:
+- `dopo_commit(db, fn)`: fn() dopo il commit della transazione corrente;
+  scartata se la transazione termina senza commit (rollback, eccezione, close)
+- `dopo_rollback(db, fn)`: fn() se la transazione corrente termina senza
+  commit; scartata al commit. Per le cache in write-through: la scrittura
+  anticipata resta visibile nel turno, l'invalidazione la annulla se il
+  turno non arriva al commit.
+
+Le callback valgono per la transazione radice: commit e rollback dei
+savepoint (begin_nested) non le eseguono ne' le scartano. Un errore in una
+callback e' loggato e non propagato.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[], object]
+
+# sessione sync → (callback dopo commit, callback dopo rollback)
+_hook: WeakKeyDictionary[Session, tuple[list[Callback], list[Callback]]] = WeakKeyDictionary()
+
+
+def dopo_commit(db: AsyncSession, callback: Callback) -> None:
+    """Esegue callback() dopo il commit della transazione corrente di db."""
+    _hook.setdefault(db.sync_session, ([], []))[0].append(callback)
+
+
+def dopo_rollback(db: AsyncSession, callback: Callback) -> None:
+    """Esegue callback() se la transazione corrente di db termina senza commit."""
+    _hook.setdefault(db.sync_session, ([], []))[1].append(callback)
+
+
+def _esegui(callbacks: list[Callback]) -> None:
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.exception("Callback di fine transazione fallita")
+
+
+@event.listens_for(Session, "after_commit")
+def _su_commit(session: Session) -> None:
+    if session.in_nested_transaction():
+        return
+    hook = _hook.pop(session, None)
+    if hook is not None:
+        _esegui(hook[0])
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _su_fine_transazione(session: Session, transaction: SessionTransaction) -> None:
+    if transaction.parent is not None:
+        return
+    # Dopo un commit _su_commit ha gia' rimosso le callback
+    hook = _hook.pop(session, None)
+    if hook is not None:
+        _esegui(hook[1])
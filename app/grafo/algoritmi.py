@@ -3,12 +3,20 @@
 Ordinamento topologico, sblocco nodo, path planner.
 Preferenza stesso tema in caso di parita'.
 Funzioni pure: prendono il grafo e lo stato utente come parametri, nessun accesso DB.
+Se viene passato l'indice compilato (app.grafo.indice), sblocco, path planner e
+cascata usano le bitmask precalcolate invece di visitare il grafo.
 """
 
+from __future__ import annotations
+
 import logging
+from typing import TYPE_CHECKING
 
 import networkx as nx
 
+if TYPE_CHECKING:
+    from app.grafo.indice import IndiceGrafo
+
 logger = logging.getLogger(__name__)
 
 LIVELLI_COMPLETI = frozenset({"operativo", "comprensivo", "connesso"})
@@ -43,6 +51,7 @@ def verifica_sblocco(
     grafo: nx.DiGraph,
     nodo_id: str,
     livelli_utente: dict[str, str],
+    indice: IndiceGrafo | None = None,
 ) -> bool:
     """Verifica se un nodo e' sbloccato (tutti prerequisiti bloccanti >= operativo).
 
@@ -50,6 +59,12 @@ def verifica_sblocco(
     - Ignora predecessori con tipo_nodo='contesto'
     - Nodo senza predecessori bloccanti -> sempre sbloccato
     """
+    if indice is not None:
+        posizione = indice.posizioni.get(nodo_id)
+        if posizione is None:
+            return True
+        return indice.sbloccato(posizione, indice.maschera_completati(livelli_utente))
+
     for pred_id, _, edge_attrs in grafo.in_edges(nodo_id, data=True):
         if edge_attrs.get("dipendenza") != "bloccante":
             continue
@@ -66,6 +81,7 @@ def path_planner(
     grafo: nx.DiGraph,
     livelli_utente: dict[str, str],
     tema_corrente: str | None = None,
+    indice: IndiceGrafo | None = None,
 ) -> str | None:
     """Path planner: prossimo nodo non completato con prerequisiti soddisfatti.
 
@@ -74,6 +90,9 @@ def path_planner(
     3. Tie-break: preferenza stesso tema di tema_corrente
     4. Ritorna None se tutti completati
     """
+    if indice is not None:
+        return _path_planner_indice(indice, livelli_utente, tema_corrente)
+
     ordine = ordinamento_topologico(grafo)
     candidati: list[str] = []
 
@@ -97,16 +116,52 @@ def path_planner(
     return candidati[0]
 
 
+def _path_planner_indice(
+    indice: IndiceGrafo,
+    livelli_utente: dict[str, str],
+    tema_corrente: str | None,
+) -> str | None:
+    """Path planner sulle bitmask: stesso risultato della versione su grafo."""
+    completati = indice.maschera_completati(livelli_utente)
+    primo: int | None = None
+
+    for i in indice.ordine_posizioni:
+        if completati >> i & 1:
+            continue
+        if not indice.sbloccato(i, completati):
+            continue
+        if primo is None:
+            primo = i
+            if not tema_corrente:
+                break
+        if tema_corrente and indice.temi[i] == tema_corrente:
+            return indice.nodi[i]
+
+    return indice.nodi[primo] if primo is not None else None
+
+
 def nodi_sbloccati_dopo_promozione(
     grafo: nx.DiGraph,
     nodo_promosso: str,
     livelli_utente: dict[str, str],
+    indice: IndiceGrafo | None = None,
 ) -> list[str]:
     """Trova i nodi sbloccati dalla promozione di un nodo a operativo.
 
     Controlla i successori diretti (via archi bloccanti) del nodo promosso
     e verifica se ora sono sbloccati.
     """
+    if indice is not None:
+        posizione = indice.posizioni.get(nodo_promosso)
+        if posizione is None:
+            return []
+        completati = indice.maschera_completati(livelli_utente)
+        return [
+            indice.nodi[s]
+            for s in indice.successori[posizione]
+            if not completati >> s & 1 and indice.sbloccato(s, completati)
+        ]
+
     sbloccati: list[str] = []
 
     for _, succ_id, edge_attrs in grafo.out_edges(nodo_promosso, data=True):
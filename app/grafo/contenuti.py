@@ -0,0 +1,254 @@
+"""Contenuti editoriali in memoria — nodi ed esercizi, versionati e immutabili.
+
+Il contenuto di nodi ed esercizi cambia solo con scripts/import_extraction.py:
+viene caricato una volta all'avvio (lifespan) e servito da RAM, cosi' il turno
+non rilegge dal DB le colonne JSONB del nodo focale ne' i suoi esercizi.
+
+Ogni caricamento produce uno SnapshotContenuti nuovo con versione crescente;
+`ricarica()` lo sostituisce con un solo assegnamento, quindi chi ha gia' preso
+lo snapshot continua a leggere dati coerenti.
+Il blocco testuale del nodo focale (dati statici + esercizi) e' serializzato
+una volta sola al caricamento.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.esecutori import esecutori
+from app.db.models.grafo import Esercizio, Nodo
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class EsercizioContenuto:
+    id: str
+    nodo_id: str
+    testo: str
+    tipo: str | None
+    difficolta: int | None
+    soluzione: dict | None
+
+
+@dataclass(frozen=True, slots=True)
+class ContenutoNodo:
+    """Dati editoriali del nodo usati da direttive e contesto attivo."""
+
+    id: str
+    nome: str
+    definizioni_formali: dict | None
+    formule_proprieta: list | None
+    errori_comuni: list | None
+    esempi_applicazione: list | None
+    esercizi: tuple[EsercizioContenuto, ...]
+    blocco: str  # parte statica di <nodo_focale>, gia' serializzata
+
+
+def _chiave_difficolta(es: Any) -> tuple[bool, int]:
+    return (es.difficolta is None, es.difficolta or 0)
+
+
+def serializza_nodo(nodo: Any, esercizi: Iterable[Any]) -> str:
+    """Parte statica del blocco <nodo_focale>: dati del nodo + esercizi disponibili."""
+    parti = [
+        f"ID: {nodo.id}",
+        f"Nome: {nodo.nome}",
+    ]
+
+    if nodo.definizioni_formali:
+        parti.append(
+            f"Definizioni formali: {json.dumps(nodo.definizioni_formali, ensure_ascii=False)}"
+        )
+    if nodo.formule_proprieta:
+        parti.append(
+            f"Formule e proprietà: {json.dumps(nodo.formule_proprieta, ensure_ascii=False)}"
+        )
+    if nodo.errori_comuni:
+        parti.append(
+            f"Errori comuni: {json.dumps(nodo.errori_comuni, ensure_ascii=False)}"
+        )
+    if nodo.esempi_applicazione:
+        parti.append(
+            f"Esempi: {json.dumps(nodo.esempi_applicazione, ensure_ascii=False)}"
+        )
+
+    # Esercizi disponibili (id + testo + difficoltà)
+    lista_es = [
+        f"  - [{es.id}] (diff={es.difficolta}) {es.testo[:200]}"
+        for es in esercizi
+    ]
+    if lista_es:
+        parti.append("Esercizi disponibili:\n" + "\n".join(lista_es))
+
+    return "\n".join(parti)
+
+
+def crea_contenuto_nodo(nodo: Any, esercizi: Iterable[Any]) -> ContenutoNodo:
+    """Costruisce il ContenutoNodo (esercizi ordinati per difficoltà)."""
+    ordinati = tuple(
+        EsercizioContenuto(
+            id=es.id,
+            nodo_id=es.nodo_id,
+            testo=es.testo,
+            tipo=es.tipo,
+            difficolta=es.difficolta,
+            soluzione=es.soluzione,
+        )
+        for es in sorted(esercizi, key=_chiave_difficolta)
+    )
+    return ContenutoNodo(
+        id=nodo.id,
+        nome=nodo.nome,
+        definizioni_formali=nodo.definizioni_formali,
+        formule_proprieta=nodo.formule_proprieta,
+        errori_comuni=nodo.errori_comuni,
+        esempi_applicazione=nodo.esempi_applicazione,
+        esercizi=ordinati,
+        blocco=serializza_nodo(nodo, ordinati),
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class SnapshotContenuti:
+    """Vista immutabile di tutti i contenuti editoriali a una data versione."""
+
+    versione: int
+    nodi: Mapping[str, ContenutoNodo]
+    esercizi: Mapping[str, EsercizioContenuto]
+    per_difficolta: Mapping[tuple[str, int | None], tuple[EsercizioContenuto, ...]]
+
+    @classmethod
+    def costruisci(
+        cls, versione: int, nodi: Iterable[Any], esercizi: Iterable[Any]
+    ) -> SnapshotContenuti:
+        esercizi_per_nodo: dict[str, list[Any]] = {}
+        for es in esercizi:
+            esercizi_per_nodo.setdefault(es.nodo_id, []).append(es)
+
+        contenuti = {
+            nodo.id: crea_contenuto_nodo(nodo, esercizi_per_nodo.get(nodo.id, ()))
+            for nodo in nodi
+        }
+
+        per_id: dict[str, EsercizioContenuto] = {}
+        per_difficolta: dict[tuple[str, int | None], list[EsercizioContenuto]] = {}
+        for contenuto in contenuti.values():
+            for es in contenuto.esercizi:
+                per_id[es.id] = es
+                per_difficolta.setdefault((contenuto.id, es.difficolta), []).append(es)
+
+        return cls(
+            versione=versione,
+            nodi=MappingProxyType(contenuti),
+            esercizi=MappingProxyType(per_id),
+            per_difficolta=MappingProxyType(
+                {k: tuple(v) for k, v in per_difficolta.items()}
+            ),
+        )
+
+
+class StoreContenuti:
+    """Contenuti editoriali caricati in RAM all'avvio. Singleton."""
+
+    def __init__(self) -> None:
+        self._snapshot: SnapshotContenuti | None = None
+
+    @property
+    def snapshot(self) -> SnapshotContenuti:
+        if self._snapshot is None:
+            raise RuntimeError("Contenuti non caricati. Chiamare carica() all'avvio.")
+        return self._snapshot
+
+    @property
+    def caricato(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def versione(self) -> int:
+        return self._snapshot.versione if self._snapshot is not None else 0
+
+    async def carica(self, db: AsyncSession) -> None:
+        """Carica nodi ed esercizi dal database (niente embedding/metadata)."""
+        result = await db.execute(
+            select(
+                Nodo.id,
+                Nodo.nome,
+                Nodo.definizioni_formali,
+                Nodo.formule_proprieta,
+                Nodo.errori_comuni,
+                Nodo.esempi_applicazione,
+            )
+        )
+        nodi = result.all()
+
+        result = await db.execute(
+            select(
+                Esercizio.id,
+                Esercizio.nodo_id,
+                Esercizio.testo,
+                Esercizio.tipo,
+                Esercizio.difficolta,
+                Esercizio.soluzione,
+            )
+        )
+        esercizi = result.all()
+
+        snapshot = await esecutori.esegui(
+            "serializzazione", SnapshotContenuti.costruisci, self.versione + 1, nodi, esercizi
+        )
+        self._snapshot = snapshot
+        logger.info(
+            "Contenuti caricati: versione %d, %d nodi, %d esercizi",
+            snapshot.versione,
+            len(snapshot.nodi),
+            len(snapshot.esercizi),
+        )
+
+    async def ricarica(self, db: AsyncSession) -> int:
+        """Ricarica i contenuti (es. dopo un import) e ritorna la nuova versione."""
+        await self.carica(db)
+        return self.versione
+
+    # ------------------------------------------------------------------
+    # Lookup
+    # ------------------------------------------------------------------
+
+    def nodo(self, nodo_id: str) -> ContenutoNodo | None:
+        return self.snapshot.nodi.get(nodo_id)
+
+    def esercizio(self, esercizio_id: str) -> EsercizioContenuto | None:
+        return self.snapshot.esercizi.get(esercizio_id)
+
+    def esercizi_nodo(self, nodo_id: str) -> tuple[EsercizioContenuto, ...]:
+        """Esercizi del nodo ordinati per difficoltà."""
+        contenuto = self.snapshot.nodi.get(nodo_id)
+        return contenuto.esercizi if contenuto else ()
+
+    def esercizi_per_difficolta(
+        self,
+        nodo_id: str,
+        min_diff: int,
+        max_diff: int,
+        evita_ids: Iterable[str] = (),
+    ) -> list[EsercizioContenuto]:
+        """Esercizi del nodo con difficoltà in [min_diff, max_diff], esclusi evita_ids."""
+        evita = set(evita_ids)
+        per_difficolta = self.snapshot.per_difficolta
+        return [
+            es
+            for diff in range(min_diff, max_diff + 1)
+            for es in per_difficolta.get((nodo_id, diff), ())
+            if es.id not in evita
+        ]
+
+
+contenuti = StoreContenuti()
@@ -0,0 +1,95 @@
+"""Indice compilato del knowledge graph — prerequisiti come bitmask.
+
+Costruito una volta da GrafoKnowledge.carica() e poi immutabile:
+- id interi per ogni nodo (posizione nella tupla `nodi`)
+- ordinamento topologico del sottografo bloccante in cache
+- per ogni nodo, la maschera dei prerequisiti bloccanti (esclusi i nodi contesto)
+- per ogni nodo, i successori bloccanti operativi
+
+Lo stato utente diventa una maschera "completati": sblocco, path planner e
+cascata si riducono a operazioni bit a bit, senza visitare il grafo NetworkX.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import networkx as nx
+
+from app.grafo.algoritmi import LIVELLI_COMPLETI, ordinamento_topologico
+
+
+@dataclass(frozen=True, slots=True)
+class IndiceGrafo:
+    """Vista compilata e immutabile del sottografo bloccante."""
+
+    nodi: tuple[str, ...]
+    posizioni: Mapping[str, int]
+    ordine_topologico: tuple[str, ...]
+    ordine_posizioni: tuple[int, ...]
+    prerequisiti: tuple[int, ...]
+    successori: tuple[tuple[int, ...], ...]
+    temi: tuple[str | None, ...]
+    operativi: int
+
+    @classmethod
+    def compila(cls, grafo: nx.DiGraph, ordine: Sequence[str] | None = None) -> IndiceGrafo:
+        """Compila l'indice da un DiGraph con attributi tipo_nodo/tema_id/dipendenza.
+
+        `ordine` e' un ordinamento topologico gia' calcolato (es. dallo
+        snapshot del grafo); se assente viene calcolato qui.
+
+        Raises:
+            ValueError: se il sottografo bloccante contiene un ciclo.
+        """
+        nodi = tuple(grafo.nodes)
+        posizioni = {nodo_id: i for i, nodo_id in enumerate(nodi)}
+
+        prerequisiti = [0] * len(nodi)
+        successori: list[list[int]] = [[] for _ in nodi]
+        operativi = 0
+
+        for i, nodo_id in enumerate(nodi):
+            if grafo.nodes[nodo_id].get("tipo_nodo") == "operativo":
+                operativi |= 1 << i
+
+        for u, v, attrs in grafo.edges(data=True):
+            if attrs.get("dipendenza") != "bloccante":
+                continue
+            iu, iv = posizioni[u], posizioni[v]
+            # Stessa regola di verifica_sblocco: i predecessori contesto non bloccano
+            if grafo.nodes[u].get("tipo_nodo") != "contesto":
+                prerequisiti[iv] |= 1 << iu
+            # Stessa regola di nodi_sbloccati_dopo_promozione: solo successori operativi
+            if operativi >> iv & 1:
+                successori[iu].append(iv)
+
+        ordine = tuple(ordinamento_topologico(grafo) if ordine is None else ordine)
+
+        return cls(
+            nodi=nodi,
+            posizioni=MappingProxyType(posizioni),
+            ordine_topologico=ordine,
+            ordine_posizioni=tuple(posizioni[n] for n in ordine),
+            prerequisiti=tuple(prerequisiti),
+            successori=tuple(tuple(s) for s in successori),
+            temi=tuple(grafo.nodes[n].get("tema_id") for n in nodi),
+            operativi=operativi,
+        )
+
+    def maschera_completati(self, livelli_utente: dict[str, str]) -> int:
+        """Converte {nodo_id: livello} nella bitmask dei nodi completati."""
+        maschera = 0
+        posizioni = self.posizioni
+        for nodo_id, livello in livelli_utente.items():
+            if livello in LIVELLI_COMPLETI:
+                i = posizioni.get(nodo_id)
+                if i is not None:
+                    maschera |= 1 << i
+        return maschera
+
+    def sbloccato(self, posizione: int, completati: int) -> bool:
+        """True se tutti i prerequisiti bloccanti del nodo sono nella maschera."""
+        return self.prerequisiti[posizione] & ~completati == 0
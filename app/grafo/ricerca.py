@@ -0,0 +1,240 @@
+"""Indice di ricerca lessicale su nodi e temi — costruito con il grafo.
+
+Compilato una volta da GrafoKnowledge.carica() e poi immutabile:
+- testi normalizzati (minuscolo, senza accenti, slug `_` → spazio) e
+  tokenizzati, senza le parole vuote italiane
+- per ogni token le occorrenze (documento, peso del campo): nome > parole
+  chiave > nomi dei temi del nodo > slug (id nodo / tema_id)
+- vocabolario ordinato: i token con un prefisso sono un intervallo contiguo
+  trovato con bisect (equivalente alla visita di un trie, senza oggetti per
+  nodo dell'albero)
+
+Ogni voce porta anche il nodo da cui iniziare: il nodo stesso, o per un tema
+il primo nodo operativo del tema in ordine topologico.
+
+Una ricerca e' AND sui token della query (ciascuno come prefisso): costa
+O(token query · log vocabolario + occorrenze), indipendente dal numero di
+nodi che non corrispondono.
+"""
+
+from __future__ import annotations
+
+import unicodedata
+from bisect import bisect_left
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import networkx as nx
+
+# Pesi per campo (un token conta una volta per documento, col peso massimo)
+PESO_NOME = 4.0
+PESO_PAROLE_CHIAVE = 3.0
+PESO_TEMA = 2.0
+PESO_SLUG = 1.0
+
+# Token della query trovato come parola intera e non solo come prefisso
+BONUS_ESATTO = 1.5
+
+PAROLE_VUOTE = frozenset({
+    "a", "ad", "al", "alla", "alle", "allo", "agli", "ai",
+    "con", "da", "dal", "dalla", "dei", "del", "della", "delle", "dello", "degli",
+    "di", "e", "ed", "fra", "gli", "i", "il", "in", "la", "le", "lo",
+    "nei", "nel", "nella", "nelle", "per", "su", "sul", "sulla", "tra",
+    "un", "una", "uno",
+})
+
+
+def normalizza(testo: str) -> str:
+    """Minuscolo, accenti rimossi, tutto cio' che non e' alfanumerico → spazio."""
+    scomposto = unicodedata.normalize("NFKD", testo.lower())
+    senza_accenti = "".join(c for c in scomposto if not unicodedata.combining(c))
+    return "".join(c if c.isalnum() else " " for c in senza_accenti)
+
+
+def tokenizza(testo: str) -> list[str]:
+    """Token normalizzati, senza parole vuote (ordine preservato)."""
+    return [t for t in normalizza(testo).split() if t not in PAROLE_VUOTE]
+
+
+def _temi_nodo(attrs: Mapping) -> tuple[str, ...]:
+    temi = attrs.get("temi")
+    if temi:
+        return tuple(temi)
+    tema_id = attrs.get("tema_id")
+    return (tema_id,) if tema_id else ()
+
+
+@dataclass(frozen=True, slots=True)
+class Documento:
+    """Voce ricercabile: un nodo operativo o un tema."""
+
+    tipo: str  # "nodo" | "tema"
+    id: str
+    nome: str
+    tema_id: str | None
+    nodo_id: str | None
+    n_token_nome: int
+
+
+@dataclass(frozen=True, slots=True)
+class RisultatoRicerca:
+    tipo: str
+    id: str
+    nome: str
+    tema_id: str | None
+    nodo_id: str | None
+    punteggio: float
+
+
+@dataclass(frozen=True, slots=True)
+class IndiceRicerca:
+    """Indice invertito immutabile con vocabolario ordinato per i prefissi."""
+
+    documenti: tuple[Documento, ...]
+    vocabolario: tuple[str, ...]
+    occorrenze: Mapping[str, tuple[tuple[int, float], ...]]
+
+    @classmethod
+    def compila(
+        cls,
+        grafo: nx.DiGraph,
+        temi: Iterable[tuple[str, str]],
+        ordine: Iterable[str] | None = None,
+    ) -> IndiceRicerca:
+        """Compila l'indice dai nodi operativi del grafo e dai temi.
+
+        Args:
+            grafo: DiGraph con attributi nome, tipo_nodo, tema_id, temi,
+                parole_chiave.
+            temi: coppie (tema_id, nome).
+            ordine: ordine topologico dei nodi (per il nodo d'ingresso dei
+                temi); default l'ordine di inserimento nel grafo.
+        """
+        nomi_temi = dict(temi)
+        documenti: list[Documento] = []
+        pesi: dict[str, dict[int, float]] = {}
+
+        ingresso_tema: dict[str, str] = {}
+        for nodo_id in grafo.nodes if ordine is None else ordine:
+            attrs = grafo.nodes[nodo_id]
+            if attrs.get("tipo_nodo") != "operativo":
+                continue
+            for tema_id in _temi_nodo(attrs):
+                ingresso_tema.setdefault(tema_id, nodo_id)
+
+        def indicizza(doc_id: int, testo: str | None, peso: float) -> None:
+            for token in tokenizza(testo or ""):
+                per_doc = pesi.setdefault(token, {})
+                if per_doc.get(doc_id, 0.0) < peso:
+                    per_doc[doc_id] = peso
+
+        for nodo_id, attrs in grafo.nodes(data=True):
+            if attrs.get("tipo_nodo") != "operativo":
+                continue
+            nome = attrs.get("nome") or nodo_id
+            doc_id = len(documenti)
+            documenti.append(Documento(
+                tipo="nodo",
+                id=nodo_id,
+                nome=nome,
+                tema_id=attrs.get("tema_id"),
+                nodo_id=nodo_id,
+                n_token_nome=len(tokenizza(nome)),
+            ))
+            indicizza(doc_id, nome, PESO_NOME)
+            for parola in attrs.get("parole_chiave") or ():
+                if isinstance(parola, str):
+                    indicizza(doc_id, parola, PESO_PAROLE_CHIAVE)
+            for tema_id in _temi_nodo(attrs):
+                indicizza(doc_id, nomi_temi.get(tema_id), PESO_TEMA)
+                indicizza(doc_id, tema_id, PESO_SLUG)
+            indicizza(doc_id, nodo_id, PESO_SLUG)
+
+        for tema_id, nome in nomi_temi.items():
+            doc_id = len(documenti)
+            documenti.append(Documento(
+                tipo="tema",
+                id=tema_id,
+                nome=nome,
+                tema_id=tema_id,
+                nodo_id=ingresso_tema.get(tema_id),
+                n_token_nome=len(tokenizza(nome)),
+            ))
+            indicizza(doc_id, nome, PESO_NOME)
+            indicizza(doc_id, tema_id, PESO_SLUG)
+
+        return cls(
+            documenti=tuple(documenti),
+            vocabolario=tuple(sorted(pesi)),
+            occorrenze=MappingProxyType({
+                token: tuple(per_doc.items()) for token, per_doc in pesi.items()
+            }),
+        )
+
+    def _token_con_prefisso(self, prefisso: str) -> Iterable[str]:
+        i = bisect_left(self.vocabolario, prefisso)
+        while i < len(self.vocabolario) and self.vocabolario[i].startswith(prefisso):
+            yield self.vocabolario[i]
+            i += 1
+
+    def cerca(
+        self,
+        query: str,
+        limite: int = 10,
+        tipo: str | None = None,
+        prefissi: bool = True,
+    ) -> list[RisultatoRicerca]:
+        """Documenti che contengono tutti i token della query (come prefissi,
+        o solo come parole intere con prefissi=False).
+
+        Punteggio: somma per token della query del peso del campo migliore
+        (x BONUS_ESATTO se la parola e' intera). A parita', nomi piu' corti
+        prima (la corrispondenza copre una parte maggiore del nome).
+        """
+        token_query = tokenizza(query)
+        if not token_query or limite <= 0:
+            return []
+
+        punteggi: dict[int, float] | None = None
+        for token in dict.fromkeys(token_query):
+            migliori: dict[int, float] = {}
+            parole = (
+                self._token_con_prefisso(token) if prefissi
+                else (token,) if token in self.occorrenze else ()
+            )
+            for parola in parole:
+                bonus = BONUS_ESATTO if parola == token else 1.0
+                for doc_id, peso in self.occorrenze[parola]:
+                    valore = peso * bonus
+                    if migliori.get(doc_id, 0.0) < valore:
+                        migliori[doc_id] = valore
+            if punteggi is None:
+                punteggi = migliori
+            else:
+                punteggi = {
+                    doc_id: punteggio + migliori[doc_id]
+                    for doc_id, punteggio in punteggi.items()
+                    if doc_id in migliori
+                }
+            if not punteggi:
+                return []
+
+        candidati = [
+            (doc_id, punteggio) for doc_id, punteggio in punteggi.items()
+            if tipo is None or self.documenti[doc_id].tipo == tipo
+        ]
+        candidati.sort(key=lambda c: (
+            -c[1], self.documenti[c[0]].n_token_nome, self.documenti[c[0]].nome,
+        ))
+        return [
+            RisultatoRicerca(
+                tipo=self.documenti[doc_id].tipo,
+                id=self.documenti[doc_id].id,
+                nome=self.documenti[doc_id].nome,
+                tema_id=self.documenti[doc_id].tema_id,
+                nodo_id=self.documenti[doc_id].nodo_id,
+                punteggio=round(punteggio, 2),
+            )
+            for doc_id, punteggio in candidati[:limite]
+        ]
@@ -0,0 +1,273 @@
+"""Ricerca semantica sui nodi — matrice degli embedding in memoria.
+
+`Nodo.embedding` (importato da scripts/import_extraction.py) viene caricato
+una volta all'avvio in una matrice float32 con righe normalizzate: la
+similarita' coseno diventa un prodotto scalare e k ricerche in blocco
+costano una sola moltiplicazione matrice (k × d) · (d × n) + argpartition.
+
+Snapshot opzionale (EMBEDDING_SNAPSHOT_PATH): la matrice e' salvata in un
+file .npy (ids e firma in un .ids.json accanto) e ai riavvii successivi viene
+mappata in memoria invece di rileggere i JSONB dal database. La firma e' lo
+SHA-256 di (id, embedding) calcolato da Postgres (`firma_embedding`): lo
+snapshot e' usato solo se coincide con quella del DB, altrimenti la matrice
+e' ricostruita e lo snapshot riscritto (anche da scripts/import_extraction.py).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from collections import Counter
+from collections.abc import Collection, Iterable, Mapping, Sequence
+from dataclasses import dataclass, replace
+from pathlib import Path
+from types import MappingProxyType
+
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.core.esecutori import esecutori
+from app.db.models.grafo import Nodo
+from app.grafo.snapshot import sostituisci_atomico
+
+logger = logging.getLogger(__name__)
+
+_FIRMA_SQL = text(r"""
+SELECT encode(sha256(convert_to(coalesce(string_agg(
+    json_build_array(id, embedding)::text, E'\n' ORDER BY id), ''), 'UTF8')), 'hex')
+FROM nodi
+WHERE embedding IS NOT NULL
+""")
+
+
+async def firma_embedding(db: AsyncSession) -> str:
+    """SHA-256 (hex) di id ed embedding dei nodi, calcolato lato database."""
+    result = await db.execute(_FIRMA_SQL)
+    return result.scalar_one()
+
+
+@dataclass(frozen=True, slots=True)
+class IndiceEmbedding:
+    """Matrice (n × d) float32 a righe unitarie + id dei nodi per riga."""
+
+    nodi: tuple[str, ...]
+    posizioni: Mapping[str, int]
+    matrice: np.ndarray
+    firma: str | None = None
+
+    @classmethod
+    def compila(cls, righe: Iterable[tuple[str, Sequence[float] | None]]) -> IndiceEmbedding:
+        """Compila l'indice da coppie (nodo_id, vettore).
+
+        Scarta i vettori mancanti, nulli o di dimensione diversa da quella
+        prevalente (import parziali o modelli diversi).
+        """
+        validi = [(nodo_id, v) for nodo_id, v in righe if v]
+        if not validi:
+            return cls._da_matrice((), np.zeros((0, 0), dtype=np.float32))
+
+        dimensione = Counter(len(v) for _, v in validi).most_common(1)[0][0]
+        coerenti = [(nodo_id, v) for nodo_id, v in validi if len(v) == dimensione]
+        if len(coerenti) < len(validi):
+            logger.warning(
+                "Embedding scartati: %d con dimensione diversa da %d",
+                len(validi) - len(coerenti), dimensione,
+            )
+
+        matrice = np.asarray([v for _, v in coerenti], dtype=np.float32)
+        norme = np.linalg.norm(matrice, axis=1)
+        non_nulli = norme > 0
+        matrice = matrice[non_nulli] / norme[non_nulli, None]
+        nodi = tuple(nodo_id for (nodo_id, _), ok in zip(coerenti, non_nulli) if ok)
+        return cls._da_matrice(nodi, np.ascontiguousarray(matrice))
+
+    @classmethod
+    def _da_matrice(
+        cls, nodi: tuple[str, ...], matrice: np.ndarray, firma: str | None = None
+    ) -> IndiceEmbedding:
+        matrice.flags.writeable = False
+        return cls(
+            nodi=nodi,
+            posizioni=MappingProxyType({nodo_id: i for i, nodo_id in enumerate(nodi)}),
+            matrice=matrice,
+            firma=firma,
+        )
+
+    # ------------------------------------------------------------------
+    # Snapshot su file
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _percorso_ids(percorso: Path) -> Path:
+        return percorso.with_suffix(".ids.json")
+
+    def salva(self, percorso: str | os.PathLike) -> None:
+        """Scrive matrice (.npy) e id + firma (.ids.json), ciascuno in modo atomico.
+
+        I file temporanei hanno nome unico: piu' worker possono riscrivere lo
+        stesso snapshot insieme senza sovrapporsi.
+        """
+        percorso = Path(percorso)
+        percorso.parent.mkdir(parents=True, exist_ok=True)
+        meta = json.dumps({"firma": self.firma, "nodi": list(self.nodi)}).encode()
+        sostituisci_atomico(percorso, lambda f: np.save(f, self.matrice))
+        sostituisci_atomico(self._percorso_ids(percorso), lambda f: f.write(meta))
+
+    @classmethod
+    def da_snapshot(cls, percorso: str | os.PathLike, mmap: bool = True) -> IndiceEmbedding:
+        """Legge uno snapshot scritto da salva(), mappato in memoria (sola lettura)."""
+        percorso = Path(percorso)
+        try:
+            meta = json.loads(cls._percorso_ids(percorso).read_text(encoding="utf-8"))
+            nodi, firma = tuple(meta["nodi"]), meta["firma"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            raise ValueError(f"Snapshot embedding non valido: {percorso}") from e
+        matrice = np.load(percorso, mmap_mode="r" if mmap else None)
+        if matrice.dtype != np.float32 or matrice.ndim != 2 or len(matrice) != len(nodi):
+            raise ValueError(f"Snapshot embedding non valido: {percorso}")
+        return cls._da_matrice(nodi, matrice, firma)
+
+    # ------------------------------------------------------------------
+    # Ricerca
+    # ------------------------------------------------------------------
+
+    @property
+    def dimensione(self) -> int:
+        return self.matrice.shape[1]
+
+    def vettori(self, nodi_id: Iterable[str]) -> np.ndarray:
+        """Righe (normalizzate) dei nodi indicati; quelli senza embedding sono saltati."""
+        posizioni = [self.posizioni[n] for n in nodi_id if n in self.posizioni]
+        return self.matrice[posizioni]
+
+    def cerca(
+        self,
+        query: np.ndarray,
+        k: int = 5,
+        candidati: Collection[str] | None = None,
+        escludi: Sequence[Collection[str]] | None = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Top-k per similarita' coseno di ogni riga di `query`, in blocco.
+
+        Args:
+            query: vettore (d,) o matrice (q × d); non serve normalizzarla.
+            k: risultati per riga.
+            candidati: se indicato, solo questi nodi possono comparire.
+            escludi: per ogni riga della query, nodi da escludere.
+
+        Returns:
+            Per ogni riga, lista di (nodo_id, similarita') decrescente.
+        """
+        query = np.atleast_2d(np.asarray(query, dtype=np.float32))
+        if k <= 0 or not self.nodi or query.shape[1] != self.dimensione:
+            return [[] for _ in range(len(query))]
+
+        norme = np.linalg.norm(query, axis=1, keepdims=True)
+        norme[norme == 0] = 1.0
+        punteggi = (query / norme) @ self.matrice.T  # (q × n)
+
+        if candidati is not None:
+            ammessi = np.zeros(len(self.nodi), dtype=bool)
+            ammessi[[self.posizioni[n] for n in candidati if n in self.posizioni]] = True
+            punteggi[:, ~ammessi] = -np.inf
+        if escludi is not None:
+            for riga, esclusi in enumerate(escludi):
+                posizioni = [self.posizioni[n] for n in esclusi if n in self.posizioni]
+                punteggi[riga, posizioni] = -np.inf
+
+        k = min(k, len(self.nodi))
+        migliori = np.argpartition(-punteggi, k - 1, axis=1)[:, :k]
+        risultati = []
+        for riga, posizioni in enumerate(migliori):
+            valori = punteggi[riga, posizioni]
+            ordine = np.argsort(-valori, kind="stable")
+            risultati.append([
+                (self.nodi[posizioni[i]], float(valori[i]))
+                for i in ordine
+                if np.isfinite(valori[i])
+            ])
+        return risultati
+
+    def simili(
+        self,
+        nodi_id: Sequence[str],
+        k: int = 5,
+        candidati: Collection[str] | None = None,
+    ) -> dict[str, list[tuple[str, float]]]:
+        """Nodi piu' simili a ciascuno dei nodi indicati (se stesso escluso).
+
+        Una sola moltiplicazione per tutto il blocco; i nodi senza embedding
+        non compaiono nel risultato.
+        """
+        presenti = [n for n in nodi_id if n in self.posizioni]
+        if not presenti:
+            return {}
+        risultati = self.cerca(
+            self.vettori(presenti), k, candidati=candidati,
+            escludi=[(n,) for n in presenti],
+        )
+        return dict(zip(presenti, risultati))
+
+
+class EmbeddingNodi:
+    """Indice embedding dei nodi caricato all'avvio. Singleton."""
+
+    def __init__(self) -> None:
+        self._indice: IndiceEmbedding | None = None
+
+    @property
+    def caricato(self) -> bool:
+        return self._indice is not None and len(self._indice.nodi) > 0
+
+    @property
+    def indice(self) -> IndiceEmbedding:
+        if self._indice is None:
+            raise RuntimeError("Embedding non caricati. Chiamare carica() all'avvio.")
+        return self._indice
+
+    async def carica(self, db: AsyncSession, percorso_snapshot: str | None = None) -> None:
+        """Carica la matrice da snapshot (se la firma coincide col DB) o dal database."""
+        percorso = percorso_snapshot
+        if percorso is None:
+            percorso = settings.EMBEDDING_SNAPSHOT_PATH or None
+
+        indice = None
+        firma = None
+        if percorso:
+            firma = await firma_embedding(db)
+            if Path(percorso).exists():
+                indice = self._da_snapshot_valido(percorso, firma)
+
+        if indice is None:
+            result = await db.execute(
+                select(Nodo.id, Nodo.embedding).where(Nodo.embedding.is_not(None))
+            )
+            indice = await esecutori.esegui("grafo", IndiceEmbedding.compila, result.all())
+            indice = replace(indice, firma=firma)
+            if percorso and indice.nodi:
+                await esecutori.esegui("grafo", indice.salva, percorso)
+                logger.info("Snapshot embedding scritto: %s", percorso)
+
+        self._indice = indice
+        logger.info(
+            "Embedding caricati: %d nodi, dimensione %d",
+            len(indice.nodi), indice.dimensione,
+        )
+
+    def _da_snapshot_valido(self, percorso: str, firma: str) -> IndiceEmbedding | None:
+        try:
+            indice = IndiceEmbedding.da_snapshot(percorso)
+        except (OSError, ValueError) as e:
+            logger.warning("Snapshot embedding illeggibile (%s): ricostruzione dal DB", e)
+            return None
+
+        if indice.firma != firma:
+            logger.info("Snapshot embedding non allineato al DB: ricostruzione")
+            return None
+        return indice
+
+
+embedding_nodi = EmbeddingNodi()
@@ -0,0 +1,247 @@
+"""Snapshot binario del grafo compilato — avvio senza ricostruire da DB.
+
+GrafoKnowledge.carica() legge nodi, nodi_temi, relazioni e temi e ricostruisce
+il DiGraph a ogni avvio di worker. Lo snapshot (GRAFO_SNAPSHOT_PATH, scritto
+da scripts/import_extraction.py o dal primo worker che carica dal DB) contiene
+lo stesso grafo in forma compatta, in un unico .npz non compresso:
+- archi in formato CSR: `indptr` (n+1) e `indici` (m) sulle posizioni dei
+  nodi, `dipendenze` come codici uint8 sul vocabolario in `meta`
+- `ordine`: ordine topologico del sottografo bloccante (posizioni), cosi'
+  IndiceGrafo non lo ricalcola
+- `meta`: JSON (in un array uint8) con formato, firma, attributi dei nodi e temi
+
+La firma e' lo SHA-256 calcolato da Postgres sulle colonne lette da carica()
+(`firma_contenuto`, una sola query che ritorna 64 caratteri): un worker usa lo
+snapshot solo se la firma coincide con quella del DB, altrimenti ricostruisce.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import zipfile
+from collections.abc import Callable, Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO
+
+import networkx as nx
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+FORMATO = 1
+
+# Ogni sezione e' preceduta dal nome: una tabella vuota non sposta le altre
+_FIRMA_SQL = text(r"""
+SELECT encode(sha256(convert_to(concat_ws(E'\n',
+    'nodi',
+    (SELECT string_agg(
+        json_build_array(id, nome, tipo_nodo, tipo, materia, parole_chiave)::text,
+        E'\n' ORDER BY id) FROM nodi),
+    'nodi_temi',
+    (SELECT string_agg(
+        json_build_array(nodo_id, tema_id)::text,
+        E'\n' ORDER BY nodo_id, tema_id) FROM nodi_temi),
+    'relazioni',
+    (SELECT string_agg(
+        json_build_array(nodo_da, nodo_a, dipendenza)::text,
+        E'\n' ORDER BY nodo_da, nodo_a) FROM relazioni),
+    'temi',
+    (SELECT string_agg(
+        json_build_array(id, nome, materia, descrizione, ordine_visualizzazione)::text,
+        E'\n' ORDER BY id) FROM temi)
+), 'UTF8')), 'hex')
+""")
+
+
+async def firma_contenuto(db: AsyncSession) -> str:
+    """SHA-256 (hex) dei dati del grafo, calcolato lato database."""
+    result = await db.execute(_FIRMA_SQL)
+    return result.scalar_one()
+
+
+def sostituisci_atomico(percorso: Path, scrivi: Callable[[IO[bytes]], object]) -> None:
+    """scrivi(file) su un temporaneo unico nella stessa cartella, poi rename.
+
+    Piu' processi (worker, script di import) possono scrivere lo stesso file:
+    ognuno ha il suo temporaneo e l'ultimo rename vince con un file completo.
+    """
+    with tempfile.NamedTemporaryFile(
+        dir=percorso.parent, prefix=percorso.name + ".", suffix=".tmp", delete=False
+    ) as f:
+        temporaneo = Path(f.name)
+        try:
+            scrivi(f)
+        except BaseException:
+            f.close()
+            temporaneo.unlink(missing_ok=True)
+            raise
+    os.replace(temporaneo, percorso)
+
+
+@dataclass(frozen=True, slots=True)
+class SnapshotGrafo:
+    """Grafo compilato in forma serializzabile (posizioni = ordine dei nodi)."""
+
+    firma: str
+    nodi: tuple[tuple, ...]  # (id, nome, tipo_nodo, tipo, materia, parole_chiave, temi)
+    indptr: np.ndarray
+    indici: np.ndarray
+    dipendenze: np.ndarray
+    vocabolario_dipendenze: tuple[str | None, ...]
+    ordine: np.ndarray
+    temi: tuple[tuple, ...]  # (id, nome, materia, descrizione, nodi_progresso)
+    nodi_per_tema: Mapping[str, tuple[str, ...]]
+
+    @classmethod
+    def da_grafo(
+        cls,
+        firma: str,
+        grafo: nx.DiGraph,
+        temi: Sequence[tuple],
+        nodi_per_tema: Mapping[str, Sequence[str]],
+        ordine_topologico: Sequence[str],
+    ) -> SnapshotGrafo:
+        nodi = tuple(grafo.nodes)
+        posizioni = {nodo_id: i for i, nodo_id in enumerate(nodi)}
+
+        vocabolario: dict[str | None, int] = {}
+        indptr = np.zeros(len(nodi) + 1, dtype=np.int32)
+        indici: list[int] = []
+        codici: list[int] = []
+        for i, nodo_id in enumerate(nodi):
+            for succ, attrs in grafo.succ[nodo_id].items():
+                indici.append(posizioni[succ])
+                codici.append(vocabolario.setdefault(attrs.get("dipendenza"), len(vocabolario)))
+            indptr[i + 1] = len(indici)
+
+        return cls(
+            firma=firma,
+            nodi=tuple(
+                (
+                    nodo_id,
+                    attrs.get("nome"),
+                    attrs.get("tipo_nodo"),
+                    attrs.get("tipo"),
+                    attrs.get("materia"),
+                    tuple(attrs.get("parole_chiave") or ()),
+                    tuple(attrs.get("temi") or ()),
+                )
+                for nodo_id, attrs in grafo.nodes(data=True)
+            ),
+            indptr=indptr,
+            indici=np.asarray(indici, dtype=np.int32),
+            dipendenze=np.asarray(codici, dtype=np.uint8),
+            vocabolario_dipendenze=tuple(vocabolario),
+            ordine=np.asarray([posizioni[n] for n in ordine_topologico], dtype=np.int32),
+            temi=tuple(tuple(t) for t in temi),
+            nodi_per_tema={t: tuple(n) for t, n in nodi_per_tema.items()},
+        )
+
+    # ------------------------------------------------------------------
+    # File
+    # ------------------------------------------------------------------
+
+    def salva(self, percorso: str | os.PathLike) -> None:
+        """Scrive lo snapshot in modo atomico (file temporaneo + rename)."""
+        percorso = Path(percorso)
+        percorso.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "formato": FORMATO,
+            "firma": self.firma,
+            "nodi": [list(n[:5]) + [list(n[5]), list(n[6])] for n in self.nodi],
+            "vocabolario_dipendenze": list(self.vocabolario_dipendenze),
+            "temi": [list(t[:4]) + [list(t[4])] for t in self.temi],
+            "nodi_per_tema": {t: list(n) for t, n in self.nodi_per_tema.items()},
+        }
+        sostituisci_atomico(percorso, lambda f: np.savez(
+            f,
+            meta=np.frombuffer(
+                json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode(),
+                dtype=np.uint8,
+            ),
+            indptr=self.indptr,
+            indici=self.indici,
+            dipendenze=self.dipendenze,
+            ordine=self.ordine,
+        ))
+
+    @classmethod
+    def leggi(cls, percorso: str | os.PathLike) -> SnapshotGrafo:
+        """Legge uno snapshot scritto da salva().
+
+        Raises:
+            OSError: file mancante o illeggibile.
+            ValueError: formato diverso o contenuto incoerente.
+        """
+        try:
+            with np.load(percorso, allow_pickle=False) as dati:
+                meta = json.loads(dati["meta"].tobytes())
+                indptr, indici = dati["indptr"], dati["indici"]
+                dipendenze, ordine = dati["dipendenze"], dati["ordine"]
+        except (KeyError, zipfile.BadZipFile, json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise ValueError(f"Snapshot grafo non valido: {percorso}") from e
+
+        if meta.get("formato") != FORMATO:
+            raise ValueError(f"Formato snapshot grafo {meta.get('formato')} != {FORMATO}")
+        n = len(meta["nodi"])
+        if (
+            len(indptr) != n + 1
+            or len(indici) != len(dipendenze)
+            or indptr[-1] != len(indici)
+            or (len(indici) and not 0 <= indici.min() <= indici.max() < n)
+            or (len(ordine) and not 0 <= ordine.min() <= ordine.max() < n)
+        ):
+            raise ValueError(f"Snapshot grafo incoerente: {percorso}")
+
+        return cls(
+            firma=meta["firma"],
+            nodi=tuple(
+                (*riga[:5], tuple(riga[5]), tuple(riga[6])) for riga in meta["nodi"]
+            ),
+            indptr=indptr,
+            indici=indici,
+            dipendenze=dipendenze,
+            vocabolario_dipendenze=tuple(meta["vocabolario_dipendenze"]),
+            ordine=ordine,
+            temi=tuple((*riga[:4], tuple(riga[4])) for riga in meta["temi"]),
+            nodi_per_tema={t: tuple(n) for t, n in meta["nodi_per_tema"].items()},
+        )
+
+    # ------------------------------------------------------------------
+    # Ricostruzione
+    # ------------------------------------------------------------------
+
+    def grafo(self) -> nx.DiGraph:
+        """DiGraph con gli stessi attributi prodotti da GrafoKnowledge.carica()."""
+        g = nx.DiGraph()
+        g.add_nodes_from(
+            (
+                nodo_id,
+                {
+                    "nome": nome,
+                    "tipo_nodo": tipo_nodo,
+                    "tipo": tipo,
+                    "materia": materia,
+                    "parole_chiave": parole_chiave,
+                    "tema_id": temi[0] if temi else None,
+                    "temi": temi,
+                },
+            )
+            for nodo_id, nome, tipo_nodo, tipo, materia, parole_chiave, temi in self.nodi
+        )
+        ids = [n[0] for n in self.nodi]
+        indptr = self.indptr.tolist()
+        indici = self.indici.tolist()
+        dipendenze = self.dipendenze.tolist()
+        g.add_edges_from(
+            (ids[i], ids[indici[k]], {"dipendenza": self.vocabolario_dipendenze[dipendenze[k]]})
+            for i in range(len(ids))
+            for k in range(indptr[i], indptr[i + 1])
+        )
+        return g
+
+    def ordine_topologico(self) -> tuple[str, ...]:
+        return tuple(self.nodi[i][0] for i in self.ordine.tolist())
@@ -1,16 +1,162 @@
 """Query sullo stato utente rispetto al grafo.
 
 Livelli: non_iniziato -> in_corso -> operativo -> comprensivo -> connesso.
+
+I livelli per utente passano da una cache in memoria (LRU + TTL, locale al
+processo). Chi scrive su stato_nodi_utente aggiorna la cache in write-through
+tramite `cache_livelli`, cosi' le letture successive nello stesso turno non
+rileggono l'intera tabella. Chi scrive prima del commit registra
+l'invalidazione con app.db.transazioni.dopo_rollback: se la transazione non
+arriva al commit la cache non conserva livelli mai salvati.
+
+Allo stesso modo `cache_tentati` tiene, per (utente, nodo), gli esercizi gia'
+proposti o risolti (da storico_esercizi): proponi_esercizio li evita senza
+dipendere dagli evita_ids del tutor.
 """
 
+import time
 import uuid
+from collections import OrderedDict
+from collections.abc import Iterable
 from datetime import datetime, timezone
 
 from sqlalchemy import select
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models.stato_utente import StatoNodoUtente
+from app.config import settings
+from app.db.models.stato_utente import StatoNodoUtente, StoricoEsercizi
+
+
+class CacheLivelli:
+    """Cache LRU/TTL di {nodo_id: livello} per utente.
+
+    Ritorna sempre copie: i chiamanti possono modificare il dict ricevuto
+    (es. forzare il nodo appena promosso) senza sporcare la cache.
+    """
+
+    def __init__(self, max_utenti: int, ttl_sec: float) -> None:
+        self._max_utenti = max_utenti
+        self._ttl_sec = ttl_sec
+        self._voci: OrderedDict[uuid.UUID, tuple[float, dict[str, str]]] = OrderedDict()
+        self.hit = 0
+        self.miss = 0
+
+    def leggi(self, utente_id: uuid.UUID) -> dict[str, str] | None:
+        voce = self._voci.get(utente_id)
+        if voce is None or time.monotonic() - voce[0] > self._ttl_sec:
+            if voce is not None:
+                del self._voci[utente_id]
+            self.miss += 1
+            return None
+        self._voci.move_to_end(utente_id)
+        self.hit += 1
+        return dict(voce[1])
+
+    def scrivi(self, utente_id: uuid.UUID, livelli: dict[str, str]) -> None:
+        self._voci[utente_id] = (time.monotonic(), dict(livelli))
+        self._voci.move_to_end(utente_id)
+        while len(self._voci) > self._max_utenti:
+            self._voci.popitem(last=False)
+
+    def aggiorna(
+        self,
+        utente_id: uuid.UUID,
+        nodo_id: str,
+        livello: str,
+        solo_se_assente: bool = False,
+    ) -> None:
+        """Write-through di un singolo livello (no-op se l'utente non e' in cache).
+
+        solo_se_assente=True replica un INSERT ... ON CONFLICT che non tocca
+        il livello di una riga gia' esistente.
+        """
+        voce = self._voci.get(utente_id)
+        if voce is None:
+            return
+        livelli = voce[1]
+        if solo_se_assente and nodo_id in livelli:
+            return
+        livelli[nodo_id] = livello
+
+    def invalida(self, utente_id: uuid.UUID) -> None:
+        self._voci.pop(utente_id, None)
+
+    def svuota(self) -> None:
+        self._voci.clear()
+
+    def statistiche(self) -> dict:
+        totale = self.hit + self.miss
+        return {
+            "utenti": len(self._voci),
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_ratio": self.hit / totale if totale else 0.0,
+        }
+
+
+cache_livelli = CacheLivelli(
+    max_utenti=settings.CACHE_LIVELLI_MAX_UTENTI,
+    ttl_sec=settings.CACHE_LIVELLI_TTL_SEC,
+)
+
+
+class CacheEserciziTentati:
+    """Cache LRU/TTL degli esercizi gia' visti per (utente, nodo).
+
+    Lettura con `leggi` (copia frozenset), write-through con `aggiungi`
+    (no-op se la coppia non e' in cache: alla prossima lettura la query su
+    storico_esercizi la include comunque).
+    """
+
+    def __init__(self, max_voci: int, ttl_sec: float) -> None:
+        self._max_voci = max_voci
+        self._ttl_sec = ttl_sec
+        self._voci: OrderedDict[tuple[uuid.UUID, str], tuple[float, set[str]]] = OrderedDict()
+        self.hit = 0
+        self.miss = 0
+
+    def leggi(self, utente_id: uuid.UUID, nodo_id: str) -> frozenset[str] | None:
+        chiave = (utente_id, nodo_id)
+        voce = self._voci.get(chiave)
+        if voce is None or time.monotonic() - voce[0] > self._ttl_sec:
+            if voce is not None:
+                del self._voci[chiave]
+            self.miss += 1
+            return None
+        self._voci.move_to_end(chiave)
+        self.hit += 1
+        return frozenset(voce[1])
+
+    def scrivi(self, utente_id: uuid.UUID, nodo_id: str, esercizi: Iterable[str]) -> None:
+        chiave = (utente_id, nodo_id)
+        self._voci[chiave] = (time.monotonic(), set(esercizi))
+        self._voci.move_to_end(chiave)
+        while len(self._voci) > self._max_voci:
+            self._voci.popitem(last=False)
+
+    def aggiungi(self, utente_id: uuid.UUID, nodo_id: str, esercizio_id: str) -> None:
+        voce = self._voci.get((utente_id, nodo_id))
+        if voce is not None:
+            voce[1].add(esercizio_id)
+
+    def svuota(self) -> None:
+        self._voci.clear()
+
+    def statistiche(self) -> dict:
+        totale = self.hit + self.miss
+        return {
+            "voci": len(self._voci),
+            "hit": self.hit,
+            "miss": self.miss,
+            "hit_ratio": self.hit / totale if totale else 0.0,
+        }
+
+
+cache_tentati = CacheEserciziTentati(
+    max_voci=settings.CACHE_TENTATI_MAX_VOCI,
+    ttl_sec=settings.CACHE_TENTATI_TTL_SEC,
+)
 
 
 async def get_livelli_utente(utente_id: uuid.UUID, db: AsyncSession) -> dict[str, str]:
@@ -19,12 +165,41 @@ async def get_livelli_utente(utente_id: uuid.UUID, db: AsyncSession) -> dict[str
     Ritorna {nodo_id: livello}. Nodi non presenti in stato_nodi_utente
     hanno livello implicito 'non_iniziato' (gestito dal chiamante).
     """
+    livelli = cache_livelli.leggi(utente_id)
+    if livelli is not None:
+        return livelli
+
     result = await db.execute(
         select(StatoNodoUtente.nodo_id, StatoNodoUtente.livello).where(
             StatoNodoUtente.utente_id == utente_id
         )
     )
-    return dict(result.all())
+    livelli = dict(result.all())
+    cache_livelli.scrivi(utente_id, livelli)
+    return livelli
+
+
+async def get_esercizi_tentati(
+    utente_id: uuid.UUID, nodo_id: str, db: AsyncSession
+) -> frozenset[str]:
+    """Esercizi del nodo gia' svolti (o proposti in questo processo) dall'utente."""
+    tentati = cache_tentati.leggi(utente_id, nodo_id)
+    if tentati is not None:
+        return tentati
+
+    # Usa ix_storico_esercizi_utente_nodo
+    result = await db.execute(
+        select(StoricoEsercizi.esercizio_id)
+        .where(
+            StoricoEsercizi.utente_id == utente_id,
+            StoricoEsercizi.nodo_focale_id == nodo_id,
+            StoricoEsercizi.esercizio_id.is_not(None),
+        )
+        .distinct()
+    )
+    tentati = frozenset(result.scalars().all())
+    cache_tentati.scrivi(utente_id, nodo_id, tentati)
+    return tentati
 
 
 async def aggiorna_livello(
@@ -46,3 +221,4 @@ async def aggiorna_livello(
     )
     await db.execute(stmt)
     await db.commit()
+    cache_livelli.aggiorna(utente_id, nodo_id, livello)
@@ -2,59 +2,286 @@
 
 Nodi operativi + relazioni (bloccante, consigliato, nessuna).
 Usato dal path planner e dalla logica di sblocco.
+Al caricamento viene compilato anche l'indice a bitmask (app.grafo.indice)
+e l'indice di ricerca lessicale su nodi e temi (app.grafo.ricerca), in un
+thread di app.core.esecutori per non fermare l'event loop. Con
+GRAFO_SNAPSHOT_PATH il grafo viene letto da uno snapshot binario verificato
+con la firma del contenuto (app.grafo.snapshot).
+
+Tutto lo stato compilato sta in una VersioneGrafo immutabile: carica()
+costruisce e valida la nuova versione a parte e la sostituisce con un solo
+assegnamento (ricarica a caldo: app.core.ricarica_grafo). Un turno che ha
+chiamato `fissa_versione()` continua a leggere la versione con cui e' partito.
+
+Espone anche le lookup sui dati editoriali statici (prerequisiti, successori,
+temi, nomi): i chiamanti non devono interrogare `relazioni`/`nodi_temi`/`temi`
+per informazioni gia' presenti in RAM. Per ogni tema sono precalcolati i nodi
+che contano per il progresso (esclusi quelli di contesto).
 """
 
 import logging
+import time
+from collections.abc import Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import astuple, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from types import MappingProxyType
 
 import networkx as nx
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.models.grafo import Nodo, NodoTema, Relazione
+from app.config import settings
+from app.core.esecutori import esecutori
+from app.db.models.grafo import Nodo, NodoTema, Relazione, Tema
+from app.grafo.indice import IndiceGrafo
+from app.grafo.ricerca import IndiceRicerca
+from app.grafo.snapshot import SnapshotGrafo, firma_contenuto
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True, slots=True)
+class InfoTema:
+    """Dati editoriali di un tema + nodi che contano per il progresso."""
+
+    id: str
+    nome: str
+    materia: str
+    descrizione: str | None
+    nodi_progresso: tuple[str, ...]
+
+
+def _compila_indici(
+    g: nx.DiGraph,
+    temi: list[tuple[str, str]],
+    ordine: Sequence[str] | None = None,
+) -> tuple[IndiceGrafo, IndiceRicerca]:
+    """Indice a bitmask + indice di ricerca (CPU: eseguito fuori dal loop)."""
+    indice = IndiceGrafo.compila(g, ordine)
+    ricerca = IndiceRicerca.compila(g, temi, ordine=indice.ordine_topologico)
+    return indice, ricerca
+
+
+@dataclass(frozen=True, slots=True)
+class VersioneGrafo:
+    """Grafo compilato a una data versione. Sostituito in blocco, mai modificato."""
+
+    numero: int
+    firma: str | None
+    grafo: nx.DiGraph
+    indice: IndiceGrafo
+    ricerca: IndiceRicerca
+    nodi_per_tema: Mapping[str, tuple[str, ...]]
+    temi: Mapping[str, InfoTema]
+    # Candidati delle ricerche per embedding (backtrack, fallback onboarding)
+    nodi_operativi: tuple[str, ...]
+    anomalie: tuple[str, ...]
+    caricato_at: datetime
+    durata_sec: float
+
+
+def anomalie_grafo(g: nx.DiGraph, temi: Mapping[str, InfoTema]) -> tuple[str, ...]:
+    """Nodi operativi senza tema e temi senza nodi (segnalati, non bloccanti)."""
+    anomalie = [
+        f"nodo senza tema: {nodo_id}"
+        for nodo_id, attrs in g.nodes(data=True)
+        if attrs.get("tipo_nodo") == "operativo" and not attrs.get("temi")
+    ]
+    anomalie.extend(f"tema senza nodi: {t.id}" for t in temi.values() if not t.nodi_progresso)
+    return tuple(anomalie)
+
+
+# Versione fissata dal turno corrente (vedi GrafoKnowledge.fissa_versione)
+_versione_turno: ContextVar[VersioneGrafo | None] = ContextVar("versione_grafo", default=None)
+
+
 class GrafoKnowledge:
     """Knowledge graph caricato in RAM all'avvio. Singleton."""
 
     def __init__(self) -> None:
-        self._grafo: nx.DiGraph | None = None
+        self._versione: VersioneGrafo | None = None
 
     @property
-    def grafo(self) -> nx.DiGraph:
-        if self._grafo is None:
+    def versione(self) -> VersioneGrafo:
+        """Versione fissata dal turno corrente, altrimenti l'ultima caricata."""
+        versione = _versione_turno.get() or self._versione
+        if versione is None:
             raise RuntimeError("Grafo non caricato. Chiamare carica() all'avvio.")
-        return self._grafo
+        return versione
+
+    @property
+    def grafo(self) -> nx.DiGraph:
+        return self.versione.grafo
+
+    @property
+    def indice(self) -> IndiceGrafo:
+        return self.versione.indice
+
+    @property
+    def ricerca(self) -> IndiceRicerca:
+        return self.versione.ricerca
 
     @property
     def caricato(self) -> bool:
-        return self._grafo is not None
+        return self._versione is not None
+
+    @property
+    def firma(self) -> str | None:
+        """Firma del contenuto del grafo caricato (None se non calcolata)."""
+        return self._versione.firma if self._versione is not None else None
 
-    async def carica(self, db: AsyncSession) -> None:
-        """Carica il knowledge graph in RAM dal database."""
+    @contextmanager
+    def fissa_versione(self) -> Iterator[VersioneGrafo | None]:
+        """Per la durata del blocco (e dei task creati al suo interno) il grafo
+        letto nel contesto corrente resta quello attuale, anche se ricaricato."""
+        token = _versione_turno.set(self._versione)
+        try:
+            yield self._versione
+        finally:
+            try:
+                _versione_turno.reset(token)
+            except ValueError:
+                # Chiusura da un altro contesto (es. aclose() di un generatore)
+                pass
+
+    async def carica(
+        self, db: AsyncSession, percorso_snapshot: str | None = None
+    ) -> VersioneGrafo:
+        """Carica il knowledge graph in RAM, da snapshot (se valido) o dal database.
+
+        Con uno snapshot configurato (GRAFO_SNAPSHOT_PATH) la firma del
+        contenuto viene chiesta al DB: se coincide con quella dello snapshot il
+        grafo e' ricostruito dal file, altrimenti dal DB e lo snapshot riscritto.
+
+        La nuova versione sostituisce la corrente solo se valida.
+
+        Raises:
+            ValueError: ciclo nel sottografo bloccante, o grafo vuoto al posto
+                di uno gia' caricato (la versione corrente resta in uso).
+        """
+        inizio = time.monotonic()
+        percorso = percorso_snapshot
+        if percorso is None:
+            percorso = settings.GRAFO_SNAPSHOT_PATH or None
+
+        firma = None
+        snapshot = None
+        if percorso:
+            firma = await firma_contenuto(db)
+            snapshot = await self._da_snapshot_valido(percorso, firma)
+
+        if snapshot is not None:
+            g = snapshot.grafo()
+            temi = {t[0]: InfoTema(*t) for t in snapshot.temi}
+            nodi_per_tema: Mapping[str, Sequence[str]] = snapshot.nodi_per_tema
+            ordine = snapshot.ordine_topologico()
+        else:
+            g, temi, nodi_per_tema = await self._leggi_dal_db(db)
+            ordine = None
+
+        # Un ciclo bloccante fa fallire la compilazione (ValueError)
+        indice, ricerca = await esecutori.esegui(
+            "grafo", _compila_indici, g, [(t.id, t.nome) for t in temi.values()], ordine
+        )
+
+        corrente = self._versione
+        if corrente is not None and corrente.grafo.number_of_nodes() and not g.number_of_nodes():
+            raise ValueError("Grafo vuoto: versione corrente mantenuta")
+
+        versione = VersioneGrafo(
+            numero=(corrente.numero + 1) if corrente is not None else 1,
+            firma=firma,
+            grafo=g,
+            indice=indice,
+            ricerca=ricerca,
+            nodi_per_tema=MappingProxyType({t: tuple(n) for t, n in nodi_per_tema.items()}),
+            temi=MappingProxyType(temi),
+            nodi_operativi=tuple(
+                n for n, attrs in g.nodes(data=True) if attrs.get("tipo_nodo") == "operativo"
+            ),
+            anomalie=anomalie_grafo(g, temi),
+            caricato_at=datetime.now(timezone.utc),
+            durata_sec=time.monotonic() - inizio,
+        )
+        self._versione = versione
+
+        logger.info(
+            "Grafo caricato (versione %d%s): %d nodi, %d archi, %d nodi in ordine "
+            "topologico, %d termini di ricerca, %d anomalie in %.0f ms",
+            versione.numero,
+            ", da snapshot" if snapshot is not None else "",
+            g.number_of_nodes(),
+            g.number_of_edges(),
+            len(indice.ordine_topologico),
+            len(ricerca.vocabolario),
+            len(versione.anomalie),
+            versione.durata_sec * 1000,
+        )
+        for anomalia in versione.anomalie[:20]:
+            logger.warning("Grafo: %s", anomalia)
+
+        if percorso and snapshot is None:
+            nuovo = SnapshotGrafo.da_grafo(
+                firma, g, [astuple(t) for t in temi.values()], nodi_per_tema,
+                indice.ordine_topologico,
+            )
+            await esecutori.esegui("grafo", nuovo.salva, percorso)
+            logger.info("Snapshot grafo scritto: %s", percorso)
+        return versione
+
+    async def _da_snapshot_valido(self, percorso: str, firma: str) -> SnapshotGrafo | None:
+        if not Path(percorso).exists():
+            return None
+        try:
+            snapshot = await esecutori.esegui("grafo", SnapshotGrafo.leggi, percorso)
+        except (OSError, ValueError) as e:
+            logger.warning("Snapshot grafo illeggibile (%s): ricostruzione dal DB", e)
+            return None
+        if snapshot.firma != firma:
+            logger.info("Snapshot grafo non allineato al DB: ricostruzione")
+            return None
+        return snapshot
+
+    async def _leggi_dal_db(
+        self, db: AsyncSession
+    ) -> tuple[nx.DiGraph, dict[str, InfoTema], dict[str, list[str]]]:
         g = nx.DiGraph()
 
         # Carica nodi
-        result = await db.execute(select(Nodo.id, Nodo.tipo_nodo, Nodo.tipo, Nodo.materia))
+        result = await db.execute(
+            select(
+                Nodo.id, Nodo.nome, Nodo.tipo_nodo, Nodo.tipo, Nodo.materia,
+                Nodo.parole_chiave,
+            )
+        )
         nodi = result.all()
-        for nodo_id, tipo_nodo, tipo, materia in nodi:
+        for nodo_id, nome, tipo_nodo, tipo, materia, parole_chiave in nodi:
             g.add_node(
                 nodo_id,
+                nome=nome,
                 tipo_nodo=tipo_nodo,
                 tipo=tipo,
                 materia=materia,
+                parole_chiave=tuple(parole_chiave or ()),
                 tema_id=None,
+                temi=(),
             )
 
-        # Carica tema_id per ogni nodo (primo tema associato)
+        # Carica temi per ogni nodo (tema_id = primo tema associato)
         result = await db.execute(select(NodoTema.nodo_id, NodoTema.tema_id))
         nodi_temi = result.all()
-        temi_assegnati: set[str] = set()
+        nodi_per_tema: dict[str, list[str]] = {}
         for nodo_id, tema_id in nodi_temi:
-            if nodo_id in g and nodo_id not in temi_assegnati:
-                g.nodes[nodo_id]["tema_id"] = tema_id
-                temi_assegnati.add(nodo_id)
+            if nodo_id not in g:
+                continue
+            attrs = g.nodes[nodo_id]
+            if attrs["tema_id"] is None:
+                attrs["tema_id"] = tema_id
+            attrs["temi"] = (*attrs["temi"], tema_id)
+            nodi_per_tema.setdefault(tema_id, []).append(nodo_id)
 
         # Carica relazioni
         result = await db.execute(
@@ -65,12 +292,89 @@ class GrafoKnowledge:
             if nodo_da in g and nodo_a in g:
                 g.add_edge(nodo_da, nodo_a, dipendenza=dipendenza)
 
-        self._grafo = g
-        logger.info(
-            "Grafo caricato: %d nodi, %d archi",
-            g.number_of_nodes(),
-            g.number_of_edges(),
+        # Carica temi (ordine di visualizzazione)
+        result = await db.execute(
+            select(Tema.id, Tema.nome, Tema.materia, Tema.descrizione)
+            .order_by(Tema.ordine_visualizzazione.asc().nulls_last())
         )
+        temi = {
+            tema_id: InfoTema(
+                id=tema_id,
+                nome=nome,
+                materia=materia,
+                descrizione=descrizione,
+                nodi_progresso=tuple(
+                    n for n in nodi_per_tema.get(tema_id, ())
+                    if g.nodes[n]["tipo_nodo"] != "contesto"
+                ),
+            )
+            for tema_id, nome, materia, descrizione in result.all()
+        }
+        return g, temi, nodi_per_tema
+
+    # ------------------------------------------------------------------
+    # Lookup sui dati statici del grafo
+    # ------------------------------------------------------------------
+
+    def nome(self, nodo_id: str) -> str | None:
+        """Nome del nodo, None se il nodo non e' nel grafo."""
+        if nodo_id not in self.grafo:
+            return None
+        return self.grafo.nodes[nodo_id].get("nome") or nodo_id
+
+    def prerequisiti_diretti(self, nodo_id: str) -> list[str]:
+        """Predecessori con dipendenza bloccante (contesto inclusi)."""
+        g = self.grafo
+        if nodo_id not in g:
+            return []
+        return [
+            pred for pred in g.predecessors(nodo_id)
+            if g.edges[pred, nodo_id].get("dipendenza") == "bloccante"
+        ]
+
+    def prerequisiti_transitivi(self, nodo_id: str) -> set[str]:
+        """Tutti gli antenati raggiungibili via archi bloccanti."""
+        visitati: set[str] = set()
+        da_visitare = self.prerequisiti_diretti(nodo_id)
+        while da_visitare:
+            corrente = da_visitare.pop()
+            if corrente in visitati:
+                continue
+            visitati.add(corrente)
+            da_visitare.extend(self.prerequisiti_diretti(corrente))
+        return visitati
+
+    def successori(self, nodo_id: str) -> list[str]:
+        """Successori con dipendenza bloccante."""
+        g = self.grafo
+        if nodo_id not in g:
+            return []
+        return [
+            succ for succ in g.successors(nodo_id)
+            if g.edges[nodo_id, succ].get("dipendenza") == "bloccante"
+        ]
+
+    def temi_nodo(self, nodo_id: str) -> tuple[str, ...]:
+        """Tutti i temi a cui appartiene il nodo (ordine di caricamento)."""
+        if nodo_id not in self.grafo:
+            return ()
+        return self.grafo.nodes[nodo_id].get("temi", ())
+
+    def nodi_tema(self, tema_id: str) -> tuple[str, ...]:
+        """Nodi appartenenti al tema."""
+        return self.versione.nodi_per_tema.get(tema_id, ())
+
+    def nodi_operativi(self) -> tuple[str, ...]:
+        """Nodi con tipo_nodo 'operativo' (precalcolati al caricamento)."""
+        return self.versione.nodi_operativi
+
+    def temi(self) -> tuple[InfoTema, ...]:
+        """Tutti i temi in ordine di visualizzazione."""
+        return tuple(self.versione.temi.values())
+
+    def tema(self, tema_id: str) -> InfoTema | None:
+        """Tema per id, None se non esiste."""
+        return self.versione.temi.get(tema_id)
 
 
 grafo_knowledge = GrafoKnowledge()
@@ -2,6 +2,10 @@
 
 Ogni turno = UNA singola chiamata messages.create() con streaming.
 NON si rimanda tool_result a Claude (fire-and-forget).
+
+Il client AsyncAnthropic e' unico per processo: aperto nel lifespan
+(apri_client/chiudi_client), riusa il pool di connessioni HTTP keep-alive.
+La concorrenza verso l'API e' limitata per modello (app.llm.limiti).
 """
 
 from __future__ import annotations
@@ -13,8 +17,10 @@ from collections.abc import AsyncGenerator
 from dataclasses import dataclass, field
 
 import anthropic
+import httpx
 
 from app.config import settings
+from app.llm.limiti import LimitiLLM
 from app.llm.tools import get_tool_schemas, is_azione, is_segnale
 
 logger = logging.getLogger(__name__)
@@ -26,6 +32,10 @@ _COSTI_PER_MILIONE: dict[str, tuple[float, float]] = {
     "claude-haiku-4-5-20251001": (0.80, 4.0),
 }
 
+# Prompt caching: token letti/scritti in cache, come multipli del prezzo input
+FATTORE_CACHE_LETTURA = 0.1
+FATTORE_CACHE_SCRITTURA = 1.25
+
 MAX_TOKENS_DEFAULT = 4096
 
 
@@ -54,19 +64,78 @@ class RisultatoTurno:
     costo_stimato: float
     modello: str
     stop_reason: str | None = None
+    token_cache_lettura: int = 0
+    token_cache_scrittura: int = 0
+
+
+def _stima_costo(
+    modello: str,
+    token_input: int,
+    token_output: int,
+    token_cache_lettura: int = 0,
+    token_cache_scrittura: int = 0,
+) -> float:
+    """Costo stimato in USD. token_input esclude i token serviti o scritti in cache."""
+    costi = _COSTI_PER_MILIONE.get(modello, (3.0, 15.0))
+    input_equivalente = (
+        token_input
+        + token_cache_lettura * FATTORE_CACHE_LETTURA
+        + token_cache_scrittura * FATTORE_CACHE_SCRITTURA
+    )
+    return (input_equivalente * costi[0] + token_output * costi[1]) / 1_000_000
 
 
-def _stima_costo(modello: str, token_input: int, token_output: int) -> float:
-    costi = _COSTI_PER_MILIONE.get(modello, (3.0, 15.0))
-    return (token_input * costi[0] + token_output * costi[1]) / 1_000_000
+# ---------------------------------------------------------------------------
+# Client condiviso + limiti di concorrenza
+# ---------------------------------------------------------------------------
+
+_client: anthropic.AsyncAnthropic | None = None
+
+limiti_llm = LimitiLLM(settings.LLM_CONCORRENZA_PER_MODELLO)
+
+
+def _crea_client(http_client: httpx.AsyncClient | None = None) -> anthropic.AsyncAnthropic:
+    if http_client is None:
+        http_client = anthropic.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNESSIONI,
+                max_keepalive_connections=settings.LLM_KEEPALIVE_CONNESSIONI,
+                keepalive_expiry=settings.LLM_KEEPALIVE_SEC,
+            ),
+            http2=settings.LLM_HTTP2,
+        )
+    return anthropic.AsyncAnthropic(
+        api_key=settings.ANTHROPIC_API_KEY,
+        base_url=settings.LLM_BASE_URL or None,
+        http_client=http_client,
+    )
+
+
+async def apri_client(http_client: httpx.AsyncClient | None = None) -> None:
+    """Crea il client condiviso (lifespan). http_client permette di iniettare un trasporto."""
+    global _client
+    if _client is None:
+        _client = _crea_client(http_client)
+
+
+async def chiudi_client() -> None:
+    """Chiude il client condiviso e il suo pool di connessioni (lifespan)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
 
 
 def _get_client() -> anthropic.AsyncAnthropic:
-    return anthropic.AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+    global _client
+    if _client is None:
+        # Fuori dal lifespan (script, test): creato al primo uso e poi riusato
+        _client = _crea_client()
+    return _client
 
 
 async def chiama_tutor(
-    system: str,
+    system: str | list[dict],
     messages: list[dict],
     tools: list[dict] | None = None,
     modello: str | None = None,
@@ -74,6 +143,9 @@ async def chiama_tutor(
 ) -> AsyncGenerator[dict, None]:
     """Chiama Claude in streaming. Yield eventi strutturati.
 
+    `system` puo' essere una stringa o la lista di blocchi con cache_control
+    prodotta dal context builder.
+
     Eventi generati:
         {"tipo": "text_delta", "testo": "..."}
         {"tipo": "tool_use", "name": "...", "input": {...}, "categoria": "azione"|"segnale"}
@@ -83,6 +155,7 @@ async def chiama_tutor(
     modello = modello or settings.LLM_MODEL_TUTOR
     tool_schemas = tools if tools is not None else get_tool_schemas()
     client = _get_client()
+    limitatore = limiti_llm.per_modello(modello)
 
     testo_parti: list[str] = []
     azioni: list[dict] = []
@@ -90,10 +163,12 @@ async def chiama_tutor(
     tool_corrente: ToolUseAccumulatore | None = None
     token_input = 0
     token_output = 0
+    token_cache_lettura = 0
+    token_cache_scrittura = 0
     stop_reason: str | None = None
 
     try:
-        async with asyncio.timeout(settings.TIMEOUT_LLM_SEC):
+        async with asyncio.timeout(settings.TIMEOUT_LLM_SEC), limitatore.slot():
             async with client.messages.stream(
                 model=modello,
                 max_tokens=max_tokens,
@@ -167,7 +242,14 @@ async def chiama_tutor(
                     # --- Messaggio completo ---
                     elif event.type == "message_start":
                         if hasattr(event, "message") and hasattr(event.message, "usage"):
-                            token_input = event.message.usage.input_tokens
+                            usage = event.message.usage
+                            token_input = usage.input_tokens
+                            token_cache_lettura = (
+                                getattr(usage, "cache_read_input_tokens", None) or 0
+                            )
+                            token_cache_scrittura = (
+                                getattr(usage, "cache_creation_input_tokens", None) or 0
+                            )
 
                     elif event.type == "message_delta":
                         if hasattr(event, "usage") and event.usage:
@@ -190,14 +272,22 @@ async def chiama_tutor(
         segnali=segnali,
         token_input=token_input,
         token_output=token_output,
-        costo_stimato=_stima_costo(modello, token_input, token_output),
+        costo_stimato=_stima_costo(
+            modello, token_input, token_output,
+            token_cache_lettura, token_cache_scrittura,
+        ),
         modello=modello,
         stop_reason=stop_reason,
+        token_cache_lettura=token_cache_lettura,
+        token_cache_scrittura=token_cache_scrittura,
     )
 
     logger.info(
-        "Turno LLM completato: %d token in, %d token out, $%.4f, %d azioni, %d segnali",
+        "Turno LLM completato: %d token in (+%d cache read, %d cache write), "
+        "%d token out, $%.4f, %d azioni, %d segnali",
         token_input,
+        token_cache_lettura,
+        token_cache_scrittura,
         token_output,
         risultato.costo_stimato,
         len(azioni),
@@ -205,3 +295,37 @@ async def chiama_tutor(
     )
 
     yield {"tipo": "stop", "risultato": risultato}
+
+
+async def genera_testo(
+    system: str,
+    messages: list[dict],
+    modello: str | None = None,
+    max_tokens: int = 1024,
+) -> str:
+    """Chiamata non in streaming, senza tool, per i job di pipeline (es. riassunti).
+
+    Condivide client e limiti del tutor. Le eccezioni (timeout, APIError)
+    sono lasciate al chiamante, che gira in background.
+    """
+    modello = modello or settings.LLM_MODEL_PIPELINE
+    client = _get_client()
+
+    async with asyncio.timeout(settings.TIMEOUT_LLM_SEC), limiti_llm.per_modello(modello).slot():
+        risposta = await client.messages.create(
+            model=modello,
+            max_tokens=max_tokens,
+            system=system,
+            messages=messages,
+        )
+
+    testo = "".join(
+        blocco.text for blocco in risposta.content if getattr(blocco, "type", None) == "text"
+    )
+    logger.info(
+        "Pipeline LLM completata: modello=%s, %d token in, %d token out",
+        modello,
+        risposta.usage.input_tokens,
+        risposta.usage.output_tokens,
+    )
+    return testo
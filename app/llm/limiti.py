@@ -0,0 +1,81 @@
+"""Limiti di concorrenza verso l'API LLM — un semaforo per modello.
+
+Oltre il limite le richieste restano in coda (FIFO, come asyncio.Semaphore)
+invece di fallire con 429 durante i picchi. Ogni modello tiene le proprie
+metriche: richieste attive, in coda, attesa media/massima.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+
+class LimitatoreModello:
+    """Semaforo con metriche per un singolo modello."""
+
+    def __init__(self, concorrenza: int) -> None:
+        self._semaforo = asyncio.Semaphore(concorrenza)
+        self.concorrenza = concorrenza
+        self.attive = 0
+        self.in_coda = 0
+        self.richieste = 0
+        self.accodate = 0
+        self.attesa_totale_sec = 0.0
+        self.attesa_max_sec = 0.0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Occupa uno slot per la durata del blocco, accodando se non disponibile."""
+        inizio = time.monotonic()
+        if self._semaforo.locked():
+            self.accodate += 1
+        self.in_coda += 1
+        try:
+            await self._semaforo.acquire()
+        finally:
+            self.in_coda -= 1
+
+        attesa = time.monotonic() - inizio
+        self.richieste += 1
+        self.attesa_totale_sec += attesa
+        self.attesa_max_sec = max(self.attesa_max_sec, attesa)
+        self.attive += 1
+        try:
+            yield
+        finally:
+            self.attive -= 1
+            self._semaforo.release()
+
+    def statistiche(self) -> dict:
+        return {
+            "concorrenza": self.concorrenza,
+            "attive": self.attive,
+            "in_coda": self.in_coda,
+            "richieste": self.richieste,
+            "accodate": self.accodate,
+            "attesa_media_sec": (
+                self.attesa_totale_sec / self.richieste if self.richieste else 0.0
+            ),
+            "attesa_max_sec": self.attesa_max_sec,
+        }
+
+
+class LimitiLLM:
+    """Registro dei limitatori, creati al primo uso di ciascun modello."""
+
+    def __init__(self, concorrenza_per_modello: int) -> None:
+        self._concorrenza = concorrenza_per_modello
+        self._per_modello: dict[str, LimitatoreModello] = {}
+
+    def per_modello(self, modello: str) -> LimitatoreModello:
+        limitatore = self._per_modello.get(modello)
+        if limitatore is None:
+            limitatore = LimitatoreModello(self._concorrenza)
+            self._per_modello[modello] = limitatore
+        return limitatore
+
+    def statistiche(self) -> dict[str, dict]:
+        return {m: lim.statistiche() for m, lim in self._per_modello.items()}
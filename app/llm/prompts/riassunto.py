@@ -0,0 +1,36 @@
+"""Prompt per il riassunto progressivo della conversazione (pipeline).
+
+Il riassunto sostituisce, nei messages del tutor, i turni centrali esclusi
+dalla compattazione. Viene aggiornato in modo incrementale: riassunto
+precedente + turni nuovi → riassunto nuovo.
+"""
+
+from __future__ import annotations
+
+RIASSUNTO_SYSTEM_PROMPT = """\
+Riassumi una conversazione tra uno studente e il suo tutor personale di Dydat.
+Il riassunto sostituirà i turni originali nel contesto del tutor: deve
+permettergli di continuare la lezione senza ripetersi.
+
+Conserva:
+- concetti spiegati e come sono stati spiegati (esempi, analogie usate)
+- esercizi svolti, con esito ed errori commessi dallo studente
+- dubbi, difficoltà e preferenze espresse dallo studente
+- impegni presi dal tutor (es. "dopo torniamo su...")
+
+Scrivi in italiano, in terza persona, in forma compatta (elenco puntato).
+Non inventare nulla che non sia nei turni. Rispondi solo con il riassunto."""
+
+
+def messaggio_riassunto(riassunto_precedente: str | None, turni: list[dict]) -> str:
+    """Testo utente per la richiesta di riassunto incrementale."""
+    righe = [
+        f"{'STUDENTE' if t['role'] == 'user' else 'TUTOR'}: {t['content']}"
+        for t in turni
+    ]
+    parti = []
+    if riassunto_precedente:
+        parti.append(f"RIASSUNTO FINORA:\n{riassunto_precedente}")
+    parti.append("TURNI DA AGGIUNGERE AL RIASSUNTO:\n" + "\n\n".join(righe))
+    parti.append("Produci il riassunto aggiornato che copre tutto quanto sopra.")
+    return "\n\n".join(parti)
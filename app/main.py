@@ -1,24 +1,72 @@
+import asyncio
 import logging
+from collections.abc import Awaitable, Callable
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api import achievement, auth, onboarding, percorsi, sessione, temi, utente
-from app.db.engine import async_session
+from app.api import (
+    achievement,
+    admin,
+    auth,
+    nodi,
+    onboarding,
+    percorsi,
+    sessione,
+    temi,
+    utente,
+)
+from app.core.esecutori import esecutori, monitor_loop
+from app.core.outbox import worker_outbox
+from app.core.ricarica_grafo import ricarica_grafo
+from app.core.riconciliazione import riconciliazione_statistiche
+from app.core.sicurezza import cache_token
+from app.db.crud.utenti import cache_utenti
+from app.db.engine import async_session, metriche_pool
+from app.grafo.contenuti import contenuti
+from app.grafo.semantica import embedding_nodi
+from app.grafo.stato import cache_livelli, cache_tentati
 from app.grafo.struttura import grafo_knowledge
+from app.llm.client import apri_client, chiudi_client, limiti_llm
 
 logger = logging.getLogger(__name__)
 
 
+async def _con_sessione(carica: Callable[[AsyncSession], Awaitable[object]]) -> None:
+    async with async_session() as db:
+        await carica(db)
+
+
+async def _carica_achievement(db: AsyncSession) -> None:
+    # Seed achievement definizioni (UPSERT idempotente)
+    from app.core.gamification import catalogo_achievement, seed_achievement
+    await seed_achievement(db)
+    await db.commit()
+    await catalogo_achievement.carica(db)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with async_session() as db:
-        await grafo_knowledge.carica(db)
-        # Seed achievement definizioni (UPSERT idempotente)
-        from app.core.gamification import seed_achievement
-        await seed_achievement(db)
-        await db.commit()
+    monitor_loop.avvia()
+    # Caricamenti indipendenti: una sessione ciascuno, in parallelo
+    await asyncio.gather(
+        _con_sessione(grafo_knowledge.carica),
+        _con_sessione(contenuti.carica),
+        _con_sessione(embedding_nodi.carica),
+        _con_sessione(_carica_achievement),
+    )
+    await apri_client()
+    worker_outbox.avvia()
+    riconciliazione_statistiche.avvia()
+    ricarica_grafo.avvia_ascolto()
     yield
+    await ricarica_grafo.ferma()
+    await riconciliazione_statistiche.ferma()
+    await worker_outbox.ferma()
+    await chiudi_client()
+    await monitor_loop.ferma()
+    esecutori.chiudi()
 
 
 app = FastAPI(title="Dydat Backend", version="0.1.0", lifespan=lifespan)
@@ -30,9 +78,25 @@ app.include_router(onboarding.router)
 app.include_router(sessione.router)
 app.include_router(percorsi.router)
 app.include_router(temi.router)
+app.include_router(nodi.router)
 app.include_router(achievement.router)
+app.include_router(admin.router)
+
+
+def _metriche() -> dict:
+    """Contatori in memoria del worker (per processo, azzerati al riavvio)."""
+    return {
+        "pool": metriche_pool.statistiche(),
+        "cache_token": cache_token.statistiche(),
+        "cache_utenti": cache_utenti.statistiche(),
+        "cache_livelli": cache_livelli.statistiche(),
+        "cache_tentati": cache_tentati.statistiche(),
+        "llm": limiti_llm.statistiche(),
+        "esecutori": esecutori.statistiche(),
+    }
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    """Stato del worker: versione del grafo, ultima ricarica e metriche."""
+    return {"status": "ok", "grafo": ricarica_grafo.stato(), "metriche": _metriche()}
@@ -9,6 +9,9 @@ Features:
 - Extracts themes from nodes' tema_id field
 - Handles multiple folders (Algebra1 + Algebra2)
 - Handles _fix_ exercises with reduced schema
+- Writes the binary graph snapshot loaded by the workers (GRAFO_SNAPSHOT_PATH)
+- Refreshes the node embedding snapshot (EMBEDDING_SNAPSHOT_PATH)
+- Notifies running workers to hot-reload the graph (GRAFO_RICARICA_CANALE)
 """
 
 import asyncio
@@ -22,7 +25,10 @@ from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 
 from app.config import settings
+from app.core.esecutori import esecutori
 from app.db.models.grafo import Esercizio, Nodo, NodoTema, Relazione, Tema
+from app.grafo.semantica import EmbeddingNodi
+from app.grafo.struttura import GrafoKnowledge
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 log = logging.getLogger(__name__)
@@ -310,6 +316,42 @@ async def verify_integrity(session: AsyncSession) -> None:
     log.info(f"  Exercise coverage: {nodi_with_ex}/{total_op} operative nodes")
 
 
+async def write_graph_snapshot(session: AsyncSession) -> None:
+    """Rebuild the binary graph snapshot (GRAFO_SNAPSHOT_PATH) if the content changed."""
+    if not settings.GRAFO_SNAPSHOT_PATH:
+        log.info("GRAFO_SNAPSHOT_PATH not set: graph snapshot skipped")
+        return
+    grafo = GrafoKnowledge()
+    await grafo.carica(session, percorso_snapshot=settings.GRAFO_SNAPSHOT_PATH)
+    log.info(f"Graph snapshot {settings.GRAFO_SNAPSHOT_PATH}: content hash {grafo.firma}")
+
+
+async def write_embedding_snapshot(session: AsyncSession) -> None:
+    """Rebuild the embedding snapshot (EMBEDDING_SNAPSHOT_PATH) if the vectors changed."""
+    if not settings.EMBEDDING_SNAPSHOT_PATH:
+        log.info("EMBEDDING_SNAPSHOT_PATH not set: embedding snapshot skipped")
+        return
+    embedding = EmbeddingNodi()
+    await embedding.carica(session, percorso_snapshot=settings.EMBEDDING_SNAPSHOT_PATH)
+    log.info(
+        f"Embedding snapshot {settings.EMBEDDING_SNAPSHOT_PATH}: "
+        f"content hash {embedding.indice.firma}"
+    )
+
+
+async def notify_workers(session: AsyncSession) -> None:
+    """NOTIFY the workers listening on GRAFO_RICARICA_CANALE to reload graph and contents."""
+    if not settings.GRAFO_RICARICA_CANALE:
+        log.info("GRAFO_RICARICA_CANALE not set: workers not notified")
+        return
+    await session.execute(
+        text("SELECT pg_notify(:canale, :payload)"),
+        {"canale": settings.GRAFO_RICARICA_CANALE, "payload": "import_extraction"},
+    )
+    await session.commit()
+    log.info(f"Workers notified on channel {settings.GRAFO_RICARICA_CANALE}")
+
+
 async def main(folders: list[str]) -> None:
     engine = create_async_engine(settings.DATABASE_URL)
     session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -329,6 +371,13 @@ async def main(folders: list[str]) -> None:
         log.info(f"Import complete. Totals: {total_stats}")
 
         await verify_integrity(session)
+        try:
+            await write_embedding_snapshot(session)
+            await write_graph_snapshot(session)
+        finally:
+            # Both snapshots build on the process-wide executor: shut it down once
+            esecutori.chiudi()
+        await notify_workers(session)
 
     await engine.dispose()
 
@@ -1,5 +1,8 @@
 """Test algoritmi del knowledge graph con grafi sintetici (no DB)."""
 
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
 import networkx as nx
 import pytest
 
@@ -9,7 +12,10 @@ from app.grafo.algoritmi import (
     path_planner,
     verifica_sblocco,
 )
-
+from app.grafo.indice import IndiceGrafo
+from app.grafo.ricerca import IndiceRicerca, normalizza, tokenizza
+from app.grafo.snapshot import SnapshotGrafo, sostituisci_atomico
+from app.grafo.struttura import GrafoKnowledge
 
 # ---------------------------------------------------------------------------
 # Helper per creare grafi di test
@@ -297,3 +303,483 @@ class TestNodiSbloccatiDopoPromozione:
         # B non ha archi bloccanti da A, quindi non appare nella cascata
         sbloccati = nodi_sbloccati_dopo_promozione(g, "A", livelli)
         assert sbloccati == []
+
+
+# ---------------------------------------------------------------------------
+# Test indice compilato (bitmask)
+# ---------------------------------------------------------------------------
+
+def grafo_misto() -> nx.DiGraph:
+    """Grafo con contesto, archi non bloccanti e due temi, per confronto indice/grafo."""
+    g = grafo_diamante()
+    g.add_node("CTX", **_nodo(tipo_nodo="contesto"))
+    g.add_node("E", **_nodo(tema_id="tema2"))
+    g.add_node("F", **_nodo(tema_id="tema2"))
+    g.add_edge("CTX", "E", dipendenza="bloccante")
+    g.add_edge("A", "E", dipendenza="bloccante")
+    g.add_edge("E", "F", dipendenza="bloccante")
+    g.add_edge("B", "F", dipendenza="consigliato")
+    g.add_edge("D", "CTX", dipendenza="bloccante")
+    return g
+
+
+class TestIndiceGrafo:
+    def test_ordine_topologico_in_cache(self):
+        g = grafo_misto()
+        indice = IndiceGrafo.compila(g)
+        assert list(indice.ordine_topologico) == ordinamento_topologico(g)
+        assert [indice.nodi[i] for i in indice.ordine_posizioni] == list(indice.ordine_topologico)
+
+    def test_maschera_prerequisiti_esclude_contesto_e_non_bloccanti(self):
+        g = grafo_misto()
+        indice = IndiceGrafo.compila(g)
+        pos = indice.posizioni
+        assert indice.prerequisiti[pos["E"]] == 1 << pos["A"]
+        assert indice.prerequisiti[pos["F"]] == 1 << pos["E"]
+        assert indice.prerequisiti[pos["A"]] == 0
+
+    def test_successori_solo_operativi(self):
+        g = grafo_misto()
+        indice = IndiceGrafo.compila(g)
+        pos = indice.posizioni
+        assert indice.successori[pos["D"]] == ()
+
+    def test_maschera_completati(self):
+        g = grafo_lineare()
+        indice = IndiceGrafo.compila(g)
+        pos = indice.posizioni
+        livelli = {"A": "operativo", "B": "in_corso", "X": "operativo"}
+        assert indice.maschera_completati(livelli) == 1 << pos["A"]
+
+    def test_indice_immutabile(self):
+        indice = IndiceGrafo.compila(grafo_lineare())
+        with pytest.raises(AttributeError):
+            indice.operativi = 0
+        with pytest.raises(TypeError):
+            indice.posizioni["Z"] = 99
+
+    def test_ciclo_solleva_errore(self):
+        g = nx.DiGraph()
+        g.add_node("A", **_nodo())
+        g.add_node("B", **_nodo())
+        g.add_edge("A", "B", dipendenza="bloccante")
+        g.add_edge("B", "A", dipendenza="bloccante")
+        with pytest.raises(ValueError, match="Ciclo"):
+            IndiceGrafo.compila(g)
+
+    def test_nodo_sconosciuto(self):
+        indice = IndiceGrafo.compila(grafo_lineare())
+        g = grafo_lineare()
+        assert verifica_sblocco(g, "Z", {}, indice=indice) is True
+        assert nodi_sbloccati_dopo_promozione(g, "Z", {}, indice=indice) == []
+
+    @pytest.mark.parametrize("tema", [None, "tema1", "tema2", "tema_inesistente"])
+    def test_stessi_risultati_del_grafo(self, tema):
+        """Per ogni stato utente possibile, indice e grafo danno lo stesso risultato."""
+        import itertools
+
+        g = grafo_misto()
+        indice = IndiceGrafo.compila(g)
+        nodi = list(g.nodes)
+
+        for livelli_tuple in itertools.product(
+            ["in_corso", "operativo"], repeat=len(nodi)
+        ):
+            livelli = dict(zip(nodi, livelli_tuple))
+            assert path_planner(g, livelli, tema, indice=indice) == path_planner(
+                g, livelli, tema
+            )
+            for nodo_id in nodi:
+                assert verifica_sblocco(g, nodo_id, livelli, indice=indice) == (
+                    verifica_sblocco(g, nodo_id, livelli)
+                )
+                assert nodi_sbloccati_dopo_promozione(
+                    g, nodo_id, livelli, indice=indice
+                ) == nodi_sbloccati_dopo_promozione(g, nodo_id, livelli)
+
+    def test_grafo_vuoto(self):
+        g = nx.DiGraph()
+        indice = IndiceGrafo.compila(g)
+        assert indice.ordine_topologico == ()
+        assert path_planner(g, {}, indice=indice) is None
+
+
+# ---------------------------------------------------------------------------
+# Test indice di ricerca lessicale
+# ---------------------------------------------------------------------------
+
+def grafo_ricerca() -> nx.DiGraph:
+    """Nodi con nomi italiani, parole chiave e due temi (uno con accenti)."""
+    g = nx.DiGraph()
+    g.add_node("mat_eq2", nome="Equazioni di secondo grado", tipo_nodo="operativo",
+               tema_id="equazioni", temi=("equazioni",), parole_chiave=("discriminante",))
+    g.add_node("mat_eq1", nome="Equazioni lineari", tipo_nodo="operativo",
+               tema_id="equazioni", temi=("equazioni",), parole_chiave=())
+    g.add_node("mat_prob", nome="Probabilità classica", tipo_nodo="operativo",
+               tema_id="probabilita", temi=("probabilita",), parole_chiave=("eventi",))
+    g.add_node("mat_ctx", nome="Equivalenze", tipo_nodo="contesto",
+               tema_id="equazioni", temi=("equazioni",), parole_chiave=())
+    g.add_edge("mat_eq1", "mat_eq2", dipendenza="bloccante")
+    return g
+
+
+TEMI_RICERCA = (("equazioni", "Equazioni"), ("probabilita", "Probabilità"))
+
+
+class TestIndiceRicerca:
+    def test_normalizzazione(self):
+        assert normalizza("Probabilità_Classica") == "probabilita classica"
+        assert tokenizza("Equazioni di secondo grado") == ["equazioni", "secondo", "grado"]
+
+    def test_prefisso_e_accenti(self):
+        indice = IndiceRicerca.compila(grafo_ricerca(), TEMI_RICERCA)
+        risultati = indice.cerca("PROBABILITÀ")
+        assert [(r.tipo, r.id) for r in risultati] == [
+            ("tema", "probabilita"), ("nodo", "mat_prob"),
+        ]
+        assert [r.id for r in indice.cerca("probab", tipo="nodo")] == ["mat_prob"]
+
+    def test_solo_parole_intere(self):
+        indice = IndiceRicerca.compila(grafo_ricerca(), TEMI_RICERCA)
+        assert indice.cerca("probab", prefissi=False) == []
+        assert [r.id for r in indice.cerca("probabilita", tipo="nodo", prefissi=False)] == [
+            "mat_prob",
+        ]
+
+    def test_tutti_i_token_devono_corrispondere(self):
+        indice = IndiceRicerca.compila(grafo_ricerca(), TEMI_RICERCA)
+        assert [r.id for r in indice.cerca("equazioni second")] == ["mat_eq2"]
+        assert indice.cerca("equazioni quantistiche") == []
+        assert indice.cerca("di la") == []  # solo parole vuote
+
+    def test_ranking_nome_prima_di_parole_chiave_e_tema(self):
+        indice = IndiceRicerca.compila(grafo_ricerca(), TEMI_RICERCA)
+        risultati = indice.cerca("equazioni", tipo="nodo")
+        # Stesso punteggio (nome): il nome piu' corto prima; contesto escluso
+        assert [r.id for r in risultati] == ["mat_eq1", "mat_eq2"]
+        assert [r.id for r in indice.cerca("discriminante")] == ["mat_eq2"]
+        assert indice.cerca("eventi")[0].punteggio < indice.cerca("classica")[0].punteggio
+
+    def test_tema_porta_al_primo_nodo_in_ordine(self):
+        g = grafo_ricerca()
+        indice = IndiceRicerca.compila(g, TEMI_RICERCA, ordine=ordinamento_topologico(g))
+        tema = indice.cerca("equazioni", tipo="tema")[0]
+        assert (tema.id, tema.nodo_id) == ("equazioni", "mat_eq1")
+
+    def test_limite(self):
+        indice = IndiceRicerca.compila(grafo_ricerca(), TEMI_RICERCA)
+        assert len(indice.cerca("eq", limite=2)) == 2
+        assert indice.cerca("equazioni", limite=0) == []
+
+
+# ===================================================================
+# Test: lookup su GrafoKnowledge (dati statici dal grafo in RAM)
+# ===================================================================
+
+
+def _result_all(rows):
+    result = MagicMock()
+    result.all.return_value = rows
+    return result
+
+
+def _risultati_grafo() -> list[MagicMock]:
+    """A -> B -> D, A -> C -> D bloccanti; C -> E consigliato; B in due temi."""
+    return [
+        _result_all([
+            ("A", "Insiemi", "contesto", "standard", "matematica", None),
+            ("B", "Frazioni", "operativo", "standard", "matematica", ["quoziente"]),
+            ("C", "Potenze", "operativo", "standard", "matematica", None),
+            ("D", "Equazioni", "operativo", "standard", "matematica", ["incognita"]),
+            ("E", None, "operativo", "standard", "matematica", []),
+        ]),
+        _result_all([
+            ("A", "t1"), ("B", "t1"), ("B", "t2"), ("C", "t2"), ("D", "t3"),
+        ]),
+        _result_all([
+            ("A", "B", "bloccante"),
+            ("A", "C", "bloccante"),
+            ("B", "D", "bloccante"),
+            ("C", "D", "bloccante"),
+            ("C", "E", "consigliato"),
+        ]),
+        _result_all([
+            ("t2", "Potenze", "matematica", None),
+            ("t1", "Insiemi", "matematica", "Primo tema"),
+            ("t3", "Equazioni", "matematica", None),
+            ("t4", "Vuoto", "matematica", None),
+        ]),
+    ]
+
+
+async def _grafo_caricato() -> GrafoKnowledge:
+    db = AsyncMock()
+    db.execute = AsyncMock(side_effect=_risultati_grafo())
+    gk = GrafoKnowledge()
+    await gk.carica(db)
+    return gk
+
+
+class TestGrafoKnowledgeLookup:
+    @pytest.mark.asyncio
+    async def test_nomi(self):
+        gk = await _grafo_caricato()
+        assert gk.nome("B") == "Frazioni"
+        assert gk.nome("E") == "E"  # nome mancante: fallback sull'id
+        assert gk.nome("Z") is None
+
+    @pytest.mark.asyncio
+    async def test_prerequisiti_diretti_e_transitivi(self):
+        gk = await _grafo_caricato()
+        assert sorted(gk.prerequisiti_diretti("D")) == ["B", "C"]
+        assert gk.prerequisiti_diretti("E") == []  # arco consigliato ignorato
+        assert gk.prerequisiti_transitivi("D") == {"A", "B", "C"}
+        assert gk.prerequisiti_transitivi("A") == set()
+        assert gk.prerequisiti_transitivi("Z") == set()
+
+    @pytest.mark.asyncio
+    async def test_successori(self):
+        gk = await _grafo_caricato()
+        assert sorted(gk.successori("A")) == ["B", "C"]
+        assert gk.successori("C") == ["D"]
+
+    @pytest.mark.asyncio
+    async def test_temi(self):
+        gk = await _grafo_caricato()
+        assert gk.temi_nodo("B") == ("t1", "t2")
+        assert gk.grafo.nodes["B"]["tema_id"] == "t1"
+        assert gk.temi_nodo("E") == ()
+        assert gk.nodi_tema("t2") == ("B", "C")
+        assert gk.nodi_tema("inesistente") == ()
+
+    @pytest.mark.asyncio
+    async def test_nodi_operativi_precalcolati(self):
+        gk = await _grafo_caricato()
+        assert gk.nodi_operativi() == ("B", "C", "D", "E")  # A e' di contesto
+        assert gk.nodi_operativi() is gk.nodi_operativi()
+
+    @pytest.mark.asyncio
+    async def test_info_temi_con_nodi_progresso(self):
+        gk = await _grafo_caricato()
+        assert [t.id for t in gk.temi()] == ["t2", "t1", "t3", "t4"]
+        t1 = gk.tema("t1")
+        assert t1.descrizione == "Primo tema"
+        assert t1.nodi_progresso == ("B",)  # A e' di contesto
+        assert gk.tema("t4").nodi_progresso == ()
+        assert gk.tema("inesistente") is None
+
+    @pytest.mark.asyncio
+    async def test_indice_ricerca(self):
+        gk = await _grafo_caricato()
+        assert [r.id for r in gk.ricerca.cerca("incognita")] == ["D"]
+        assert [r.id for r in gk.ricerca.cerca("insiemi")] == ["t1", "B"]  # A e' contesto
+        assert gk.ricerca.cerca("insiemi")[0].nodo_id == "B"
+        assert gk.grafo.nodes["B"]["parole_chiave"] == ("quoziente",)
+
+    def test_non_caricato(self):
+        with pytest.raises(RuntimeError):
+            GrafoKnowledge().ricerca
+        with pytest.raises(RuntimeError):
+            GrafoKnowledge().nodi_tema("t1")
+        with pytest.raises(RuntimeError):
+            GrafoKnowledge().temi()
+
+
+# ===================================================================
+# Test: snapshot binario del grafo
+# ===================================================================
+
+
+def _result_scalar(valore):
+    result = MagicMock()
+    result.scalar_one.return_value = valore
+    return result
+
+
+def _stesso_grafo(a: GrafoKnowledge, b: GrafoKnowledge) -> None:
+    assert list(a.grafo.nodes(data=True)) == list(b.grafo.nodes(data=True))
+    assert sorted(a.grafo.edges(data=True)) == sorted(b.grafo.edges(data=True))
+    assert a.indice == b.indice
+    assert a.temi() == b.temi()
+    assert a.nodi_operativi() == b.nodi_operativi()
+    assert [a.nodi_tema(t.id) for t in a.temi()] == [b.nodi_tema(t.id) for t in b.temi()]
+    assert a.ricerca.vocabolario == b.ricerca.vocabolario
+
+
+class TestSnapshotGrafo:
+    def test_round_trip_file(self, tmp_path):
+        g = nx.DiGraph()
+        g.add_node("a", nome="À", tipo_nodo="operativo", tipo="standard", materia="m",
+                   parole_chiave=("x",), tema_id="t", temi=("t",))
+        g.add_node("b", nome=None, tipo_nodo="contesto", tipo="standard", materia="m",
+                   parole_chiave=(), tema_id=None, temi=())
+        g.add_edge("b", "a", dipendenza="bloccante")
+        snapshot = SnapshotGrafo.da_grafo(
+            "f1", g, [("t", "Tema", "m", None, ("a",))], {"t": ["a"]}, ["b", "a"],
+        )
+        snapshot.salva(tmp_path / "grafo.npz")
+
+        letto = SnapshotGrafo.leggi(tmp_path / "grafo.npz")
+        assert letto.firma == "f1"
+        assert list(letto.grafo().nodes(data=True)) == list(g.nodes(data=True))
+        assert list(letto.grafo().edges(data=True)) == list(g.edges(data=True))
+        assert letto.ordine_topologico() == ("b", "a")
+        assert letto.temi == (("t", "Tema", "m", None, ("a",)),)
+        assert not list(tmp_path.glob("*.tmp"))
+
+    def test_sostituzione_con_temporaneo_unico(self, tmp_path):
+        percorso = tmp_path / "grafo.npz"
+        percorso.write_bytes(b"vecchio")
+        (tmp_path / "grafo.npz.tmp").write_bytes(b"altro processo")
+
+        def scrivi_e_fallisci(f):
+            f.write(b"parziale")
+            raise OSError("disco pieno")
+
+        with pytest.raises(OSError):
+            sostituisci_atomico(percorso, scrivi_e_fallisci)
+        sostituisci_atomico(percorso, lambda f: f.write(b"nuovo"))
+
+        assert percorso.read_bytes() == b"nuovo"
+        assert [p.name for p in tmp_path.glob("*.tmp")] == ["grafo.npz.tmp"]
+
+    def test_file_corrotto(self, tmp_path):
+        percorso = tmp_path / "grafo.npz"
+        percorso.write_bytes(b"non e' uno zip")
+        with pytest.raises(ValueError):
+            SnapshotGrafo.leggi(percorso)
+
+    @pytest.mark.asyncio
+    async def test_scrive_poi_carica_senza_query_del_grafo(self, tmp_path):
+        percorso = str(tmp_path / "grafo.npz")
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_scalar("f1"), *_risultati_grafo()])
+        dal_db = GrafoKnowledge()
+        await dal_db.carica(db, percorso_snapshot=percorso)
+        assert dal_db.firma == "f1"
+
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_scalar("f1")])
+        da_file = GrafoKnowledge()
+        with patch("app.grafo.indice.ordinamento_topologico") as topo:
+            await da_file.carica(db, percorso_snapshot=percorso)
+        topo.assert_not_called()
+        assert db.execute.await_count == 1
+        _stesso_grafo(dal_db, da_file)
+        assert da_file.firma == "f1"
+
+    @pytest.mark.asyncio
+    async def test_firma_diversa_ricostruisce_e_riscrive(self, tmp_path):
+        percorso = str(tmp_path / "grafo.npz")
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_scalar("f1"), *_risultati_grafo()])
+        await GrafoKnowledge().carica(db, percorso_snapshot=percorso)
+
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_scalar("f2"), *_risultati_grafo()])
+        gk = GrafoKnowledge()
+        await gk.carica(db, percorso_snapshot=percorso)
+        assert db.execute.await_count == 5
+        assert gk.firma == "f2"
+        assert SnapshotGrafo.leggi(percorso).firma == "f2"
+
+    @pytest.mark.asyncio
+    async def test_snapshot_illeggibile_ricostruisce(self, tmp_path):
+        percorso = tmp_path / "grafo.npz"
+        percorso.write_bytes(b"rotto")
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_scalar("f1"), *_risultati_grafo()])
+        gk = GrafoKnowledge()
+        await gk.carica(db, percorso_snapshot=str(percorso))
+        assert gk.nome("B") == "Frazioni"
+        assert SnapshotGrafo.leggi(percorso).firma == "f1"
+
+    @pytest.mark.asyncio
+    async def test_senza_percorso_nessuna_firma(self):
+        gk = await _grafo_caricato()
+        assert gk.firma is None
+
+
+# ===================================================================
+# Test: versioni del grafo (ricarica a caldo)
+# ===================================================================
+
+
+def _risultati_grafo_ciclico() -> list[MagicMock]:
+    """A -> B -> A bloccanti."""
+    return [
+        _result_all([
+            ("A", "Uno", "operativo", "standard", "matematica", None),
+            ("B", "Due", "operativo", "standard", "matematica", None),
+        ]),
+        _result_all([("A", "t1"), ("B", "t1")]),
+        _result_all([("A", "B", "bloccante"), ("B", "A", "bloccante")]),
+        _result_all([("t1", "Tema", "matematica", None)]),
+    ]
+
+
+async def _ricarica(gk: GrafoKnowledge, risultati: list[MagicMock]):
+    db = AsyncMock()
+    db.execute = AsyncMock(side_effect=risultati)
+    return await gk.carica(db)
+
+
+async def _versione_di(gk: GrafoKnowledge):
+    return gk.versione
+
+
+class TestVersioniGrafo:
+    @pytest.mark.asyncio
+    async def test_ricarica_incrementa_versione(self):
+        gk = await _grafo_caricato()
+        prima = gk.versione
+        assert prima.numero == 1
+
+        versione = await _ricarica(gk, _risultati_grafo())
+        assert versione.numero == 2
+        assert gk.versione is versione
+        assert gk.grafo is not prima.grafo
+
+    @pytest.mark.asyncio
+    async def test_anomalie_segnalate(self):
+        gk = await _grafo_caricato()
+        assert gk.versione.anomalie == ("nodo senza tema: E", "tema senza nodi: t4")
+
+    @pytest.mark.asyncio
+    async def test_ciclo_mantiene_versione_corrente(self):
+        gk = await _grafo_caricato()
+        prima = gk.versione
+        with pytest.raises(ValueError):
+            await _ricarica(gk, _risultati_grafo_ciclico())
+        assert gk.versione is prima
+        assert gk.nome("D") == "Equazioni"
+
+    @pytest.mark.asyncio
+    async def test_grafo_vuoto_mantiene_versione_corrente(self):
+        gk = await _grafo_caricato()
+        prima = gk.versione
+        with pytest.raises(ValueError, match="vuoto"):
+            await _ricarica(gk, [_result_all([]) for _ in range(4)])
+        assert gk.versione is prima
+
+    @pytest.mark.asyncio
+    async def test_fissa_versione_durante_ricarica(self):
+        gk = await _grafo_caricato()
+        prima = gk.versione
+
+        with gk.fissa_versione() as fissata:
+            assert fissata is prima
+            await _ricarica(gk, _risultati_grafo())
+            assert gk.versione is prima
+            # I task creati nel blocco ereditano la versione fissata
+            assert await asyncio.create_task(_versione_di(gk)) is prima
+
+        assert gk.versione.numero == 2
+
+    @pytest.mark.asyncio
+    async def test_fissa_versione_non_caricato(self):
+        gk = GrafoKnowledge()
+        with gk.fissa_versione() as fissata:
+            assert fissata is None
+            await _ricarica(gk, _risultati_grafo())
+            assert gk.versione.numero == 1
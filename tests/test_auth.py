@@ -1,8 +1,24 @@
 """Test autenticazione: sicurezza JWT + API auth + protezione endpoint."""
 
+import time
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
 import pytest
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.sicurezza import crea_token, hash_password, verifica_password, verifica_token
+from app.api.deps import get_utente_corrente
+from app.core.sicurezza import (
+    CacheToken,
+    cache_token,
+    crea_token,
+    hash_password,
+    verifica_password,
+    verifica_token,
+)
+from app.db.crud.utenti import aggiorna_profilo, cache_utenti
 
 
 # ---------------------------------------------------------------------------
@@ -56,6 +72,101 @@ class TestJWT:
         assert verifica_token(token) == uid
 
 
+class TestCacheToken:
+    @pytest.fixture(autouse=True)
+    def _cache_pulita(self):
+        cache_token.svuota()
+        yield
+        cache_token.svuota()
+
+    def test_seconda_verifica_senza_decodifica(self):
+        token = crea_token("user-cache")
+        assert verifica_token(token) == "user-cache"
+        with patch("app.core.sicurezza.jwt.decode") as decode:
+            assert verifica_token(token) == "user-cache"
+        decode.assert_not_called()
+
+    def test_token_invalido_non_memorizzato(self):
+        with pytest.raises(ValueError):
+            verifica_token("token.completamente.invalido")
+        assert cache_token.statistiche()["voci"] == 0
+
+    def test_scadenza_dal_claim_exp(self):
+        cache = CacheToken(max_voci=10, ttl_sec=3600)
+        cache.scrivi("t", "u1", exp=time.time() - 1)
+        assert cache.leggi("t") is None
+
+    def test_lru_limitata(self):
+        cache = CacheToken(max_voci=2, ttl_sec=60)
+        cache.scrivi("a", "u1")
+        cache.scrivi("b", "u2")
+        cache.leggi("a")
+        cache.scrivi("c", "u3")
+        assert cache.leggi("b") is None
+        assert cache.leggi("a") == "u1"
+
+    def test_statistiche(self):
+        cache = CacheToken(max_voci=10, ttl_sec=60)
+        cache.scrivi("a", "u1")
+        assert cache.leggi("a") == "u1"
+        assert cache.leggi("b") is None
+        assert cache.statistiche() == {"voci": 1, "hit": 1, "miss": 1, "hit_ratio": 0.5}
+
+
+class TestGetUtenteCorrente:
+    @pytest.fixture(autouse=True)
+    def _cache_pulite(self):
+        cache_token.svuota()
+        cache_utenti.svuota()
+        yield
+        cache_token.svuota()
+        cache_utenti.svuota()
+
+    @staticmethod
+    def _db_con_utente(utente):
+        result = MagicMock()
+        result.scalar_one_or_none.return_value = utente
+        db = MagicMock()
+        db.execute = AsyncMock(return_value=result)
+        return db
+
+    async def test_seconda_richiesta_senza_query(self):
+        utente = SimpleNamespace(id=uuid.uuid4())
+        header = f"Bearer {crea_token(str(utente.id))}"
+        db = self._db_con_utente(utente)
+
+        assert await get_utente_corrente(header, db) is utente
+        assert await get_utente_corrente(header, db) is utente
+
+        db.execute.assert_awaited_once()
+        db.expunge.assert_called_once_with(utente)
+        assert cache_utenti.statistiche()["hit"] == 1
+
+    async def test_utente_inesistente_non_memorizzato(self):
+        header = f"Bearer {crea_token(str(uuid.uuid4()))}"
+        db = self._db_con_utente(None)
+
+        with pytest.raises(HTTPException) as exc:
+            await get_utente_corrente(header, db)
+        assert exc.value.status_code == 401
+        assert cache_utenti.statistiche()["voci"] == 0
+
+    async def test_aggiorna_profilo_invalida_dopo_commit(self):
+        utente = SimpleNamespace(id=uuid.uuid4(), nome="Vecchio")
+        token = crea_token(str(utente.id))
+        await get_utente_corrente(f"Bearer {token}", self._db_con_utente(utente))
+
+        # Sessione senza DB con transazione aperta: il commit esegue gli hook
+        db = AsyncSession()
+        db.execute = self._db_con_utente(utente).execute
+        db.refresh = AsyncMock()
+        db.sync_session.begin()
+        await aggiorna_profilo(db, utente.id, nome="Nuovo")
+
+        assert cache_utenti.leggi(utente.id) is None
+        assert cache_token.leggi(token) == str(utente.id)
+
+
 # ---------------------------------------------------------------------------
 # Test API auth (richiedono DB PostgreSQL)
 # ---------------------------------------------------------------------------
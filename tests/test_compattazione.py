@@ -0,0 +1,251 @@
+"""Test compattazione conversazione a budget di token e riassunto progressivo."""
+
+from __future__ import annotations
+
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.core.compattazione import (
+    TURNI_RECENTI_MIN,
+    _riassunti_in_corso,
+    aggiorna_riassunto,
+    compatta_conversazione,
+    pianifica_riassunto,
+    stima_token,
+)
+from app.core.conversazione import FinestraConversazione
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+
+def _msg(i: int, lunghezza: int = 40) -> dict:
+    ruolo = "user" if i % 2 == 0 else "assistant"
+    return {"role": ruolo, "content": f"{i:03d}" + "x" * (lunghezza - 3)}
+
+
+def _finestra(n: int, lunghezza: int = 40) -> FinestraConversazione:
+    finestra = FinestraConversazione()
+    for i in range(n):
+        finestra.aggiungi(i + 1, _msg(i, lunghezza))
+    finestra.ultimo_ordine = n
+    return finestra
+
+
+# Ogni messaggio da 40 caratteri costa 40 // 4 + 4 = 14 token
+TOKEN_MSG = stima_token("x" * 40)
+
+
+# ===================================================================
+# Test: compatta_conversazione
+# ===================================================================
+
+
+class TestCompattaConversazione:
+    def test_sotto_budget_nessun_taglio(self):
+        finestra = _finestra(10)
+        esito = compatta_conversazione(finestra, budget_token=10_000)
+        assert esito.messages == [_msg(i) for i in range(10)]
+        assert esito.omessi == 0
+        assert esito.da_riassumere is None
+        assert esito.token_stimati == 10 * TOKEN_MSG
+
+    def test_sopra_budget_tiene_iniziali_e_recenti(self):
+        finestra = _finestra(40)
+        esito = compatta_conversazione(finestra, budget_token=12 * TOKEN_MSG)
+
+        assert esito.messages[:2] == [_msg(0), _msg(1)]
+        assert "Nota di sistema" in esito.messages[2]["content"]
+        recenti = esito.messages[3:]
+        assert recenti == [_msg(i) for i in range(40 - len(recenti), 40)]
+        assert esito.omessi == 40 - 2 - len(recenti)
+        assert str(esito.omessi) in esito.messages[2]["content"]
+
+    def test_minimo_recenti_anche_oltre_budget(self):
+        finestra = _finestra(20, lunghezza=4000)
+        esito = compatta_conversazione(finestra, budget_token=100)
+        assert esito.messages[-TURNI_RECENTI_MIN:] == [
+            _msg(i, 4000) for i in range(20 - TURNI_RECENTI_MIN, 20)
+        ]
+        assert len(esito.messages) == 2 + 1 + TURNI_RECENTI_MIN
+
+    def test_riassunto_al_posto_della_nota(self):
+        finestra = _finestra(40)
+        budget = 12 * TOKEN_MSG
+        senza = compatta_conversazione(finestra, budget_token=budget)
+        primo_tenuto = 40 - (len(senza.messages) - 3) + 1
+
+        esito = compatta_conversazione(
+            finestra,
+            budget_token=budget + stima_token("riassunto"),
+            riassunto="riassunto",
+            riassunto_fino_a=primo_tenuto - 1,
+        )
+
+        raccordo = esito.messages[2]["content"]
+        assert raccordo.startswith("[Riassunto dei turni precedenti: riassunto")
+        assert "omessi" not in raccordo
+        assert esito.da_riassumere is None
+
+    def test_riassunto_parziale_richiede_aggiornamento(self):
+        finestra = _finestra(40)
+        esito = compatta_conversazione(
+            finestra,
+            budget_token=12 * TOKEN_MSG,
+            riassunto="vecchio",
+            riassunto_fino_a=10,
+        )
+        assert "omessi per brevità" in esito.messages[2]["content"]
+        assert esito.da_riassumere is not None
+        da, fino_a = esito.da_riassumere
+        assert da == 10
+        assert fino_a == 40 - (len(esito.messages) - 3)
+
+    def test_soglia_minima_turni_da_riassumere(self):
+        finestra = _finestra(40)
+        esito = compatta_conversazione(
+            finestra, budget_token=12 * TOKEN_MSG, min_turni_riassunto=100
+        )
+        assert esito.omessi > 0
+        assert esito.da_riassumere is None
+
+        esito = compatta_conversazione(
+            finestra, budget_token=12 * TOKEN_MSG, min_turni_riassunto=5
+        )
+        assert esito.da_riassumere[0] == 2  # dopo i turni iniziali
+
+    def test_finestra_vuota(self):
+        esito = compatta_conversazione(FinestraConversazione(), budget_token=1000)
+        assert esito.messages == []
+        assert esito.token_stimati == 0
+
+
+# ===================================================================
+# Test: riassunto progressivo
+# ===================================================================
+
+
+def _result_one(riga):
+    result = MagicMock()
+    result.one_or_none.return_value = riga
+    return result
+
+
+def _result_all(righe):
+    result = MagicMock()
+    result.all.return_value = righe
+    return result
+
+
+def _result_update(rowcount):
+    result = MagicMock()
+    result.rowcount = rowcount
+    return result
+
+
+class _Sessioni:
+    """session_factory finta: una AsyncMock per sessione, con stato aperta/chiusa."""
+
+    def __init__(self, *risultati_per_sessione):
+        self.db = []
+        self._risultati = list(risultati_per_sessione)
+        self.aperte = 0
+
+    @asynccontextmanager
+    async def __call__(self):
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=self._risultati.pop(0))
+        self.db.append(db)
+        self.aperte += 1
+        try:
+            yield db
+        finally:
+            self.aperte -= 1
+
+
+class TestAggiornaRiassunto:
+    @pytest.mark.asyncio
+    async def test_estende_riassunto_precedente(self):
+        sessioni = _Sessioni(
+            [
+                _result_one(("già detto", 4)),
+                _result_all([
+                    ("utente", "domanda"), ("assistente", None), ("assistente", "risposta"),
+                ]),
+            ],
+            [_result_update(1)],
+        )
+        aperte_durante_llm = []
+
+        async def _genera(**_kwargs):
+            aperte_durante_llm.append(sessioni.aperte)
+            return "nuovo riassunto"
+
+        genera = AsyncMock(side_effect=_genera)
+        with patch("app.core.compattazione.genera_testo", genera):
+            aggiornato = await aggiorna_riassunto(sessioni, uuid.uuid4(), 2, 10)
+
+        assert aggiornato is True
+        contenuto = genera.call_args.kwargs["messages"][0]["content"]
+        assert "già detto" in contenuto
+        assert "domanda" in contenuto and "risposta" in contenuto
+        assert aperte_durante_llm == [0]  # nessuna connessione durante la chiamata LLM
+        lettura, scrittura = sessioni.db
+        lettura.commit.assert_not_awaited()
+        scrittura.commit.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_gia_coperto_nessuna_chiamata(self):
+        sessioni = _Sessioni([_result_one(("ok", 12))])
+        genera = AsyncMock()
+
+        with patch("app.core.compattazione.genera_testo", genera):
+            aggiornato = await aggiorna_riassunto(sessioni, uuid.uuid4(), 2, 10)
+
+        assert aggiornato is False
+        genera.assert_not_awaited()
+        assert len(sessioni.db) == 1
+        assert sessioni.db[0].execute.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_update_concorrente_non_sovrascrive(self):
+        sessioni = _Sessioni(
+            [_result_one((None, None)), _result_all([("utente", "domanda")])],
+            [_result_update(0)],
+        )
+
+        with patch("app.core.compattazione.genera_testo", AsyncMock(return_value="r")):
+            aggiornato = await aggiorna_riassunto(sessioni, uuid.uuid4(), 2, 10)
+
+        assert aggiornato is False
+
+
+class TestPianificaRiassunto:
+    @pytest.mark.asyncio
+    async def test_un_job_per_sessione(self):
+        sid = uuid.uuid4()
+        sblocca = asyncio.Event()
+
+        async def _lento(*_args):
+            await sblocca.wait()
+            return True
+
+        factory = MagicMock()
+        factory.return_value.__aenter__ = AsyncMock(return_value=AsyncMock())
+        factory.return_value.__aexit__ = AsyncMock(return_value=False)
+
+        with patch("app.core.compattazione.aggiorna_riassunto", side_effect=_lento) as mock:
+            assert pianifica_riassunto(sid, 2, 10, session_factory=factory) is True
+            assert pianifica_riassunto(sid, 2, 12, session_factory=factory) is False
+            await asyncio.sleep(0)
+            sblocca.set()
+            for _ in range(5):
+                await asyncio.sleep(0)
+
+        assert mock.call_count == 1
+        assert sid not in _riassunti_in_corso
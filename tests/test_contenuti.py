@@ -0,0 +1,243 @@
+"""Test store contenuti editoriali in memoria (no DB reale)."""
+
+from __future__ import annotations
+
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.grafo.contenuti import StoreContenuti
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+
+def _riga_nodo(nodo_id, nome, **kwargs):
+    base = {
+        "id": nodo_id,
+        "nome": nome,
+        "definizioni_formali": None,
+        "formule_proprieta": None,
+        "errori_comuni": None,
+        "esempi_applicazione": None,
+    }
+    base.update(kwargs)
+    return SimpleNamespace(**base)
+
+
+def _riga_esercizio(es_id, nodo_id, difficolta, testo="testo"):
+    return SimpleNamespace(
+        id=es_id, nodo_id=nodo_id, testo=testo, tipo="calcolo",
+        difficolta=difficolta, soluzione={"risultato": 1},
+    )
+
+
+def _result_all(rows):
+    result = MagicMock()
+    result.all.return_value = rows
+    return result
+
+
+def _db_contenuti():
+    db = AsyncMock()
+    db.execute = AsyncMock(side_effect=[
+        _result_all([
+            _riga_nodo("A", "Frazioni", formule_proprieta=[{"formula": "a/b"}]),
+            _riga_nodo("B", "Potenze"),
+        ]),
+        _result_all([
+            _riga_esercizio("es_3", "A", 3),
+            _riga_esercizio("es_1", "A", 1),
+            _riga_esercizio("es_2", "A", 2),
+            _riga_esercizio("es_x", "A", None),
+        ]),
+    ])
+    return db
+
+
+async def _store_caricato() -> StoreContenuti:
+    store = StoreContenuti()
+    await store.carica(_db_contenuti())
+    return store
+
+
+# ===================================================================
+# Test: StoreContenuti
+# ===================================================================
+
+
+class TestStoreContenuti:
+    @pytest.mark.asyncio
+    async def test_nodo_con_blocco_serializzato(self):
+        store = await _store_caricato()
+        nodo = store.nodo("A")
+        assert nodo.nome == "Frazioni"
+        assert "ID: A" in nodo.blocco
+        assert "a/b" in nodo.blocco
+        assert "[es_1] (diff=1)" in nodo.blocco
+        assert store.nodo("Z") is None
+
+    @pytest.mark.asyncio
+    async def test_esercizi_ordinati_per_difficolta(self):
+        store = await _store_caricato()
+        assert [e.id for e in store.esercizi_nodo("A")] == ["es_1", "es_2", "es_3", "es_x"]
+        assert store.esercizi_nodo("B") == ()
+
+    @pytest.mark.asyncio
+    async def test_esercizi_per_difficolta(self):
+        store = await _store_caricato()
+        assert [e.id for e in store.esercizi_per_difficolta("A", 1, 2)] == ["es_1", "es_2"]
+        assert [e.id for e in store.esercizi_per_difficolta("A", 1, 2, ["es_1"])] == ["es_2"]
+        assert store.esercizi_per_difficolta("A", 4, 5) == []
+        assert store.esercizio("es_3").difficolta == 3
+
+    @pytest.mark.asyncio
+    async def test_ricarica_incrementa_versione(self):
+        store = await _store_caricato()
+        vecchio = store.snapshot
+        assert store.versione == 1
+
+        versione = await store.ricarica(_db_contenuti())
+
+        assert versione == 2
+        assert store.snapshot is not vecchio
+        assert vecchio.versione == 1  # lo snapshot precedente resta coerente
+
+    @pytest.mark.asyncio
+    async def test_snapshot_immutabile(self):
+        store = await _store_caricato()
+        with pytest.raises(TypeError):
+            store.snapshot.nodi["C"] = None  # type: ignore[index]
+
+    def test_non_caricato(self):
+        store = StoreContenuti()
+        assert store.caricato is False
+        assert store.versione == 0
+        with pytest.raises(RuntimeError):
+            store.nodo("A")
+
+
+# ===================================================================
+# Test: proponi_esercizio servito dallo store
+# ===================================================================
+
+
+class TestProponiEsercizioDaStore:
+    @pytest.mark.asyncio
+    async def test_nessuna_query_sugli_esercizi(self):
+        from app.core.elaborazione import _esegui_proponi_esercizio
+
+        store = await _store_caricato()
+        sess = SimpleNamespace(stato_orchestratore={})
+        result_sess = MagicMock()
+        result_sess.scalar_one_or_none.return_value = sess
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result_sess)
+
+        with (
+            patch("app.core.elaborazione.contenuti", store),
+            patch(
+                "app.core.elaborazione.get_esercizi_tentati",
+                new_callable=AsyncMock,
+                return_value=frozenset(),
+            ),
+        ):
+            risultato = await _esegui_proponi_esercizio(
+                db, {"nodo_id": "A", "difficolta": "intermedio"}, uuid.uuid4(), uuid.uuid4()
+            )
+
+        # Solo la lettura della sessione
+        assert db.execute.call_count == 1
+        assert risultato["params"]["esercizio_id"] == "es_3"
+        assert sess.stato_orchestratore["esercizio_corrente_id"] == "es_3"
+        assert sess.stato_orchestratore["esercizio_corrente_soluzione"] == {"risultato": 1}
+
+    @pytest.mark.asyncio
+    async def test_fallback_su_tutti_gli_esercizi_del_nodo(self):
+        from app.core.elaborazione import _esegui_proponi_esercizio
+
+        store = await _store_caricato()
+        db = AsyncMock()
+        result_sess = MagicMock()
+        result_sess.scalar_one_or_none.return_value = None
+        db.execute = AsyncMock(return_value=result_sess)
+
+        with (
+            patch("app.core.elaborazione.contenuti", store),
+            patch(
+                "app.core.elaborazione.get_esercizi_tentati",
+                new_callable=AsyncMock,
+                return_value=frozenset(),
+            ),
+        ):
+            risultato = await _esegui_proponi_esercizio(
+                db,
+                {"nodo_id": "A", "difficolta": "avanzato", "evita_ids": ["es_1", "es_2", "es_3"]},
+                uuid.uuid4(),
+                uuid.uuid4(),
+            )
+
+        assert risultato["params"]["esercizio_id"] == "es_x"
+
+
+class TestEvitaRipetizioni:
+    @pytest.mark.asyncio
+    async def test_esercizi_gia_svolti_evitati(self):
+        from app.core.elaborazione import _scegli_esercizio
+
+        store = await _store_caricato()
+        with patch("app.core.elaborazione.contenuti", store):
+            scelti = {
+                _scegli_esercizio("A", 1, 2, [], frozenset({"es_1"})).id for _ in range(20)
+            }
+        assert scelti == {"es_2"}
+
+    @pytest.mark.asyncio
+    async def test_fuori_range_prima_di_ripetere(self):
+        from app.core.elaborazione import _scegli_esercizio
+
+        store = await _store_caricato()
+        with patch("app.core.elaborazione.contenuti", store):
+            es = _scegli_esercizio("A", 1, 2, [], frozenset({"es_1", "es_2", "es_3"}))
+        assert es.id == "es_x"
+
+    @pytest.mark.asyncio
+    async def test_banco_esaurito_ripete_nel_range(self):
+        from app.core.elaborazione import _scegli_esercizio
+
+        store = await _store_caricato()
+        tutti = frozenset({"es_1", "es_2", "es_3", "es_x"})
+        with patch("app.core.elaborazione.contenuti", store):
+            es = _scegli_esercizio("A", 3, 3, [], tutti)
+            nessuno = _scegli_esercizio("B", 1, 5, [], frozenset())
+        assert es.id == "es_3"
+        assert nessuno is None
+
+    @pytest.mark.asyncio
+    async def test_proposta_registrata_senza_riletture(self):
+        from app.core.elaborazione import _esegui_proponi_esercizio
+        from app.grafo.stato import cache_tentati
+
+        store = await _store_caricato()
+        utente_id = uuid.uuid4()
+        cache_tentati.scrivi(utente_id, "A", ["es_1"])
+        result_sess = MagicMock()
+        result_sess.scalar_one_or_none.return_value = None
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result_sess)
+
+        with patch("app.core.elaborazione.contenuti", store):
+            primo = await _esegui_proponi_esercizio(
+                db, {"nodo_id": "A", "difficolta": "base"}, uuid.uuid4(), utente_id
+            )
+            secondo = await _esegui_proponi_esercizio(
+                db, {"nodo_id": "A", "difficolta": "base"}, uuid.uuid4(), utente_id
+            )
+
+        # es_1 gia' svolto → es_2; poi es_2 proposto → fuori range (es_3/es_x)
+        assert primo["params"]["esercizio_id"] == "es_2"
+        assert secondo["params"]["esercizio_id"] in {"es_3", "es_x"}
+        assert db.execute.call_count == 2  # solo le letture della sessione
@@ -2,18 +2,26 @@
 
 from __future__ import annotations
 
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
 from app.core.contesto import (
-    SOGLIA_TURNI,
-    TURNI_FINALI,
-    TURNI_INIZIALI,
     ContextPackage,
+    DatiContesto,
     _blocco_contesto_attivo,
     _blocco_direttiva,
     _blocco_memoria,
+    _blocco_nodo_focale,
     _blocco_profilo_utente,
     _blocco_system_prompt,
-    tronca_conversazione,
+    _carica_dati_contesto,
+    _genera_direttiva,
+    assembla_context_package,
 )
+from app.grafo.contenuti import crea_contenuto_nodo
 from app.llm.prompts.direttive import (
     direttiva_esercizio,
     direttiva_feynman,
@@ -24,52 +32,6 @@ from app.llm.prompts.direttive import (
 )
 from app.llm.prompts.system_prompt import SYSTEM_PROMPT
 
-# ===================================================================
-# Test: troncamento conversazione
-# ===================================================================
-
-
-class TestTroncaConversazione:
-    def test_no_troncamento_sotto_soglia(self):
-        messages = [{"role": "user", "content": f"msg {i}"} for i in range(30)]
-        result = tronca_conversazione(messages)
-        assert result == messages
-
-    def test_no_troncamento_a_soglia(self):
-        messages = [{"role": "user", "content": f"msg {i}"} for i in range(SOGLIA_TURNI)]
-        result = tronca_conversazione(messages)
-        assert result == messages
-
-    def test_troncamento_sopra_soglia(self):
-        n = 80
-        messages = [{"role": "user", "content": f"msg {i}"} for i in range(n)]
-        result = tronca_conversazione(messages)
-
-        # Lunghezza: iniziali + raccordo + finali
-        assert len(result) == TURNI_INIZIALI + 1 + TURNI_FINALI
-
-        # Primi 2 preservati
-        assert result[0]["content"] == "msg 0"
-        assert result[1]["content"] == "msg 1"
-
-        # Raccordo
-        raccordo = result[TURNI_INIZIALI]
-        omessi = n - TURNI_INIZIALI - TURNI_FINALI
-        assert str(omessi) in raccordo["content"]
-        assert "omessi" in raccordo["content"]
-
-        # Ultimi 20 preservati
-        assert result[-1]["content"] == f"msg {n - 1}"
-        assert result[-TURNI_FINALI]["content"] == f"msg {n - TURNI_FINALI}"
-
-    def test_troncamento_lista_vuota(self):
-        assert tronca_conversazione([]) == []
-
-    def test_troncamento_un_elemento(self):
-        messages = [{"role": "user", "content": "solo"}]
-        assert tronca_conversazione(messages) == messages
-
-
 # ===================================================================
 # Test: blocchi XML
 # ===================================================================
@@ -125,26 +87,36 @@ class TestBlocchiXML:
 
         class FakeEsercizio:
             id = "es_001"
+            nodo_id = "nodo_test_1"
+            tipo = None
             difficolta = 2
             testo = "Risolvi 3x + 1 = 10"
+            soluzione = None
 
-        esercizi = [FakeEsercizio()]
+        nodo = crea_contenuto_nodo(FakeNodo(), [FakeEsercizio()])
         storico_errori = [{"esito": "non_risolto", "tipo_errore": "segno", "data": "2026-02-17"}]
         nodi_supporto = {
             "prereq_1": {"livello": "operativo", "esercizi_completati": 3, "errori_in_corso": 0}
         }
 
-        result = _blocco_contesto_attivo(FakeNodo(), esercizi, storico_errori, nodi_supporto)
+        statico = _blocco_nodo_focale(nodo)
+        assert "<nodo_focale>" in statico
+        assert "</nodo_focale>" in statico
+        assert "nodo_test_1" in statico
+        assert "Equazioni di primo grado" in statico
+        assert "es_001" in statico
+
+        result = _blocco_contesto_attivo(nodo, storico_errori, nodi_supporto)
 
         assert "<contesto_attivo>" in result
-        assert "<nodo_focale>" in result
-        assert "</nodo_focale>" in result
+        assert "<stato_nodo_focale>" in result
         assert "<nodi_supporto>" in result
         assert "nodo_test_1" in result
-        assert "Equazioni di primo grado" in result
-        assert "es_001" in result
+        assert "segno" in result
         assert "prereq_1" in result
         assert "operativo" in result
+        # Il contenuto editoriale sta solo nel blocco stabile
+        assert "Equazioni di primo grado" not in result
 
     def test_blocco_contesto_attivo_senza_supporto(self):
         class FakeNodo:
@@ -155,7 +127,7 @@ class TestBlocchiXML:
             errori_comuni = None
             esempi_applicazione = None
 
-        result = _blocco_contesto_attivo(FakeNodo(), [], [], {})
+        result = _blocco_contesto_attivo(crea_contenuto_nodo(FakeNodo(), []), [], {})
         assert "nessun prerequisito" in result
 
 
@@ -278,6 +250,247 @@ class TestContextPackage:
         assert "test" in pkg.system
         assert len(pkg.messages) == 1
         assert pkg.modello == "claude-sonnet-4-5-20250929"
+        assert pkg.system_testo == pkg.system
+
+    def test_system_testo_da_blocchi(self):
+        pkg = ContextPackage(
+            system=[{"type": "text", "text": "a"}, {"type": "text", "text": "b"}],
+            messages=[],
+            modello="m",
+        )
+        assert pkg.system_testo == "a\n\nb"
+
+
+class TestLayoutPromptCaching:
+    """Blocchi system ordinati dal piu' stabile al piu' volatile."""
+
+    async def _assembla(self, nodo):
+        sessione = _fake_sessione({
+            "nodo_focale_id": "nodo_x" if nodo else None,
+            "attivita_corrente": "esercizio",
+            "esercizio_corrente_testo": "Risolvi 2x = 4",
+        })
+        dati = DatiContesto(utente=_fake_utente(), sessione=sessione, nodo=nodo)
+        with patch(
+            "app.core.contesto._carica_dati_contesto",
+            AsyncMock(return_value=dati),
+        ):
+            return await assembla_context_package(uuid.uuid4(), uuid.uuid4(), AsyncMock())
+
+    @pytest.mark.asyncio
+    async def test_ordine_e_breakpoint(self):
+        pkg = await self._assembla(_fake_nodo())
+
+        testi = [b["text"] for b in pkg.system]
+        assert testi[0].startswith("<system_prompt>")
+        assert testi[1].startswith("<nodo_focale>")
+        assert testi[2].startswith("<profilo_utente>")
+        assert "<direttiva>" in testi[3]
+        assert testi[3].rstrip().endswith("</direttiva>")
+
+        cache = [b.get("cache_control") for b in pkg.system]
+        assert cache == [{"type": "ephemeral"}] * 3 + [None]
+
+    @pytest.mark.asyncio
+    async def test_prefisso_stabile_tra_turni(self):
+        """Cambiando attivita', i blocchi in cache restano identici."""
+        nodo = _fake_nodo()
+        primo = await self._assembla(nodo)
+        secondo = await self._assembla(nodo)
+        assert primo.system[:3] == secondo.system[:3]
+
+    @pytest.mark.asyncio
+    async def test_senza_nodo_focale(self):
+        pkg = await self._assembla(None)
+        assert len(pkg.system) == 3
+        assert all("<nodo_focale>" not in b["text"] for b in pkg.system)
+
+
+# ===================================================================
+# Test: caricamento dati condiviso tra direttiva e blocchi
+# ===================================================================
+
+
+def _fake_nodo(esercizi=(), **kwargs):
+    base = {
+        "id": "nodo_x",
+        "nome": "Nodo X",
+        "definizioni_formali": None,
+        "formule_proprieta": None,
+        "errori_comuni": None,
+        "esempi_applicazione": None,
+    }
+    base.update(kwargs)
+    return crea_contenuto_nodo(SimpleNamespace(**base), esercizi)
+
+
+def _fake_esercizio(id, difficolta, testo):
+    return SimpleNamespace(
+        id=id, nodo_id="nodo_x", testo=testo, tipo=None,
+        difficolta=difficolta, soluzione=None,
+    )
+
+
+def _fake_sessione(stato_orchestratore, tipo="media"):
+    return SimpleNamespace(
+        id=uuid.uuid4(),
+        riassunto_conversazione=None,
+        riassunto_fino_a_ordine=None,
+        tipo=tipo,
+        stato_orchestratore=stato_orchestratore,
+        durata_prevista_min=None,
+        created_at=None,
+    )
+
+
+def _fake_utente():
+    return SimpleNamespace(
+        id=uuid.uuid4(),
+        preferenze_tutor=None,
+        contesto_personale=None,
+        profilo_sintetizzato=None,
+    )
+
+
+def _result_all(rows):
+    result = MagicMock()
+    result.all.return_value = rows
+    return result
+
+
+class TestCaricaDatiContesto:
+    @pytest.mark.asyncio
+    async def test_quattro_query_con_nodo_focale(self):
+        """utente+sessione, storico, prerequisiti, conversazione: 4 round-trip.
+
+        Nodo ed esercizi arrivano dallo store contenuti, non dal DB.
+        """
+        es_facile = _fake_esercizio("es_1", 1, "facile")
+        es_difficile = _fake_esercizio("es_2", 4, "difficile")
+        nodo = _fake_nodo(esercizi=[es_difficile, es_facile])
+        utente = _fake_utente()
+        sessione = _fake_sessione({"nodo_focale_id": "nodo_x"})
+
+        result_principale = MagicMock()
+        result_principale.first.return_value = (utente, sessione)
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            result_principale,
+            _result_all([("non_risolto", "segno", "2026-02-17")]),
+            _result_all([("prereq_1", "operativo", True, 3, 0)]),
+            _result_all([
+                SimpleNamespace(
+                    ruolo="utente", contenuto="ciao", ordine=1,
+                    totale=1, ultimo_ordine=2, ha_testo=True,
+                ),
+                SimpleNamespace(
+                    ruolo="assistente", contenuto="", ordine=2,
+                    totale=1, ultimo_ordine=2, ha_testo=False,
+                ),
+            ]),
+        ])
+
+        with (
+            patch("app.core.contesto.grafo_knowledge") as mock_grafo,
+            patch("app.core.contesto.contenuti") as mock_contenuti,
+        ):
+            mock_grafo.prerequisiti_diretti.return_value = ["prereq_1"]
+            mock_contenuti.nodo.return_value = nodo
+            dati = await _carica_dati_contesto(db, uuid.uuid4(), utente.id)
+
+        assert db.execute.call_count == 4
+        mock_contenuti.nodo.assert_called_once_with("nodo_x")
+        assert dati.nodo is nodo
+        assert [e.id for e in dati.nodo.esercizi] == ["es_1", "es_2"]
+        assert dati.storico_errori[0]["tipo_errore"] == "segno"
+        assert dati.nodi_supporto["prereq_1"]["livello"] == "operativo"
+        assert dati.messages == [{"role": "user", "content": "ciao"}]
+
+    @pytest.mark.asyncio
+    async def test_nodo_senza_prerequisiti_salta_query_stati(self):
+        """I prerequisiti arrivano dal grafo: se non ce ne sono, niente query."""
+        result_principale = MagicMock()
+        result_principale.first.return_value = (
+            _fake_utente(), _fake_sessione({"nodo_focale_id": "nodo_x"})
+        )
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            result_principale, _result_all([]), _result_all([]),
+        ])
+
+        with (
+            patch("app.core.contesto.grafo_knowledge") as mock_grafo,
+            patch("app.core.contesto.contenuti") as mock_contenuti,
+        ):
+            mock_grafo.prerequisiti_diretti.return_value = []
+            mock_contenuti.nodo.return_value = _fake_nodo()
+            dati = await _carica_dati_contesto(db, uuid.uuid4(), uuid.uuid4())
+
+        assert db.execute.call_count == 3
+        assert dati.nodi_supporto == {}
+
+    @pytest.mark.asyncio
+    async def test_senza_nodo_focale_due_query(self):
+        result_principale = MagicMock()
+        result_principale.first.return_value = (_fake_utente(), _fake_sessione({}))
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[result_principale, _result_all([])])
+
+        dati = await _carica_dati_contesto(db, uuid.uuid4(), uuid.uuid4())
+
+        assert db.execute.call_count == 2
+        assert dati.nodo is None
+        assert dati.nodi_supporto == {}
+
+    @pytest.mark.asyncio
+    async def test_utente_inesistente(self):
+        result_principale = MagicMock()
+        result_principale.first.return_value = None
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result_principale)
+
+        with pytest.raises(ValueError, match="Utente non trovato"):
+            await _carica_dati_contesto(db, uuid.uuid4(), uuid.uuid4())
+
+    @pytest.mark.asyncio
+    async def test_sessione_inesistente(self):
+        result_principale = MagicMock()
+        result_principale.first.return_value = (_fake_utente(), None)
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result_principale)
+
+        with pytest.raises(ValueError, match="Sessione non trovata"):
+            await _carica_dati_contesto(db, uuid.uuid4(), uuid.uuid4())
+
+
+class TestGeneraDirettiva:
+    def test_spiegazione_usa_prerequisiti_caricati(self):
+        dati = DatiContesto(
+            utente=_fake_utente(),
+            sessione=_fake_sessione({"attivita_corrente": "spiegazione"}),
+            nodo=_fake_nodo(),
+            nodi_supporto={
+                "prereq_ok": {"livello": "operativo"},
+                "prereq_no": {"livello": "in_corso"},
+            },
+        )
+        result = _genera_direttiva(dati)
+        assert "prereq_ok" in result
+        assert "prereq_no" not in result
+
+    def test_esercizio_usa_storico_caricato(self):
+        dati = DatiContesto(
+            utente=_fake_utente(),
+            sessione=_fake_sessione({
+                "attivita_corrente": "esercizio",
+                "esercizio_corrente_testo": "Risolvi 2x = 4",
+            }),
+            nodo=_fake_nodo(),
+            storico_errori=[{"esito": "non_risolto", "tipo_errore": "segno_sbagliato"}],
+        )
+        result = _genera_direttiva(dati)
+        assert "Risolvi 2x = 4" in result
+        assert "segno_sbagliato" in result
 
 
 # ===================================================================
@@ -0,0 +1,292 @@
+"""Test Conversation Manager — finestra conversazione e buffer per sessione (no DB reale)."""
+
+from __future__ import annotations
+
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.conversazione import (
+    TURNI_INIZIALI,
+    TURNI_RECENTI_MAX,
+    BufferConversazioni,
+    FinestraConversazione,
+    NuovoTurno,
+    buffer_conversazioni,
+    carica_finestra_conversazione,
+    riserva_ordini,
+    salva_turni,
+    salva_turno,
+)
+
+
+def _result_contatore(ultimo: int | None):
+    result = MagicMock()
+    result.scalar_one_or_none.return_value = ultimo
+    return result
+
+
+def _result_inseriti(righe):
+    result = MagicMock()
+    result.all.return_value = righe
+    return result
+
+
+def _sessione(risultati) -> AsyncSession:
+    """Sessione senza DB con execute finto e transazione aperta (commit/rollback reali)."""
+    db = AsyncSession()
+    db.execute = AsyncMock(side_effect=risultati)
+    db.sync_session.begin()
+    return db
+
+
+def _msg(i: int) -> dict:
+    return {"role": "user" if i % 2 == 0 else "assistant", "content": f"msg {i}"}
+
+
+def _riga(i: int, totale: int, ultimo_ordine: int, contenuto: str | None = None):
+    testo = f"msg {i}" if contenuto is None else contenuto
+    return SimpleNamespace(
+        ruolo="utente" if i % 2 == 0 else "assistente",
+        contenuto=testo,
+        ordine=i + 1,
+        totale=totale,
+        ultimo_ordine=ultimo_ordine,
+        ha_testo=bool(testo),
+    )
+
+
+def _db_con_righe(righe):
+    result = MagicMock()
+    result.all.return_value = righe
+    db = AsyncMock()
+    db.execute = AsyncMock(return_value=result)
+    return db
+
+
+# ===================================================================
+# Test: FinestraConversazione
+# ===================================================================
+
+
+class TestFinestraConversazione:
+    def test_sessione_corta_iniziali_prefisso_dei_recenti(self):
+        finestra = FinestraConversazione()
+        for i in range(5):
+            finestra.aggiungi(i + 1, _msg(i))
+        assert [o for o, _ in finestra.iniziali] == [1, 2]
+        assert len(finestra.recenti) == 5
+        assert [o for o, _ in finestra.successivi_agli_iniziali()] == [3, 4, 5]
+
+    def test_recenti_limitati(self):
+        finestra = FinestraConversazione()
+        for i in range(TURNI_RECENTI_MAX + 10):
+            finestra.aggiungi(i + 1, _msg(i))
+        assert finestra.totale == TURNI_RECENTI_MAX + 10
+        assert len(finestra.recenti) == TURNI_RECENTI_MAX
+        assert finestra.iniziali[0][1] == _msg(0)
+        assert finestra.recenti[-1][1] == _msg(TURNI_RECENTI_MAX + 9)
+
+
+# ===================================================================
+# Test: caricamento finestrato
+# ===================================================================
+
+
+class TestCaricaFinestra:
+    @pytest.mark.asyncio
+    async def test_sessione_corta_tutti_i_messaggi(self):
+        sid = uuid.uuid4()
+        righe = [_riga(0, 2, 3), _riga(1, 2, 3), _riga(2, 2, 3, contenuto="")]
+        db = _db_con_righe(righe)
+
+        finestra = await carica_finestra_conversazione(db, sid)
+
+        assert finestra.totale == 2
+        assert finestra.ultimo_ordine == 3
+        assert [m["content"] for _, m in finestra.recenti] == ["msg 0", "msg 1"]
+        buffer_conversazioni.invalida(sid)
+
+    @pytest.mark.asyncio
+    async def test_sessione_lunga_solo_estremi(self):
+        """Il DB ritorna solo primi + ultimi: il totale arriva dalla window function."""
+        sid = uuid.uuid4()
+        totale = 150
+        indici = list(range(TURNI_INIZIALI)) + list(range(totale - TURNI_RECENTI_MAX, totale))
+        db = _db_con_righe([_riga(i, totale, totale) for i in indici])
+
+        finestra = await carica_finestra_conversazione(db, sid)
+
+        assert finestra.totale == totale
+        assert [m for _, m in finestra.iniziali] == [_msg(0), _msg(1)]
+        assert [m for _, m in finestra.recenti] == [
+            _msg(i) for i in range(totale - TURNI_RECENTI_MAX, totale)
+        ]
+        buffer_conversazioni.invalida(sid)
+
+    @pytest.mark.asyncio
+    async def test_seconda_lettura_dal_buffer(self):
+        sid = uuid.uuid4()
+        db = _db_con_righe([_riga(0, 1, 1)])
+
+        await carica_finestra_conversazione(db, sid)
+        await carica_finestra_conversazione(db, sid)
+
+        assert db.execute.call_count == 1
+        buffer_conversazioni.invalida(sid)
+
+
+# ===================================================================
+# Test: BufferConversazioni + salva_turno
+# ===================================================================
+
+
+class TestBufferConversazioni:
+    def test_append_in_ordine(self):
+        buffer = BufferConversazioni(max_sessioni=10, ttl_sec=60)
+        sid = uuid.uuid4()
+        buffer.scrivi(sid, FinestraConversazione(ultimo_ordine=0))
+
+        buffer.aggiungi_turno(sid, 1, "utente", "ciao")
+        buffer.aggiungi_turno(sid, 2, "assistente", None)  # solo azioni: niente testo
+        buffer.aggiungi_turno(sid, 3, "assistente", "salve")
+
+        finestra = buffer.leggi(sid)
+        assert finestra.ultimo_ordine == 3
+        assert list(finestra.recenti) == [
+            (1, {"role": "user", "content": "ciao"}),
+            (3, {"role": "assistant", "content": "salve"}),
+        ]
+
+    def test_ordine_non_contiguo_invalida(self):
+        buffer = BufferConversazioni(max_sessioni=10, ttl_sec=60)
+        sid = uuid.uuid4()
+        buffer.scrivi(sid, FinestraConversazione(ultimo_ordine=4))
+
+        buffer.aggiungi_turno(sid, 6, "utente", "ciao")
+
+        assert buffer.leggi(sid) is None
+
+    def test_sessione_assente_noop(self):
+        buffer = BufferConversazioni(max_sessioni=10, ttl_sec=60)
+        sid = uuid.uuid4()
+        buffer.aggiungi_turno(sid, 1, "utente", "ciao")
+        assert buffer.leggi(sid) is None
+
+    def test_disattivo_con_zero_sessioni(self):
+        buffer = BufferConversazioni(max_sessioni=0, ttl_sec=60)
+        sid = uuid.uuid4()
+        buffer.scrivi(sid, FinestraConversazione())
+        assert buffer.leggi(sid) is None
+
+    def test_scadenza_ttl(self):
+        buffer = BufferConversazioni(max_sessioni=10, ttl_sec=60)
+        sid = uuid.uuid4()
+        with patch("app.core.conversazione.time.monotonic", return_value=100.0):
+            buffer.scrivi(sid, FinestraConversazione())
+        with patch("app.core.conversazione.time.monotonic", return_value=161.0):
+            assert buffer.leggi(sid) is None
+
+    @pytest.mark.asyncio
+    async def test_salva_turno_aggiorna_buffer(self):
+        sid = uuid.uuid4()
+        buffer_conversazioni.scrivi(sid, FinestraConversazione(ultimo_ordine=1))
+
+        db = _sessione([_result_contatore(2), _result_inseriti([(10, 2)])])
+
+        salvato = await salva_turno(db=db, sessione_id=sid, ruolo="utente", contenuto="nuovo")
+        assert buffer_conversazioni.leggi(sid).ultimo_ordine == 1  # non ancora committato
+        await db.commit()
+
+        finestra = await carica_finestra_conversazione(db, sid)
+        assert (salvato.id, salvato.ordine) == (10, 2)
+        assert finestra.recenti[-1] == (2, {"role": "user", "content": "nuovo"})
+        assert db.execute.call_count == 2  # contatore + INSERT, nessun max(ordine)
+        buffer_conversazioni.invalida(sid)
+
+    @pytest.mark.asyncio
+    async def test_rollback_non_aggiorna_buffer(self):
+        sid = uuid.uuid4()
+        buffer_conversazioni.scrivi(sid, FinestraConversazione(ultimo_ordine=1))
+
+        async with _sessione([_result_contatore(2), _result_inseriti([(10, 2)])]) as db:
+            await salva_turno(db=db, sessione_id=sid, ruolo="utente", contenuto="perso")
+            await db.rollback()
+
+        finestra = buffer_conversazioni.leggi(sid)
+        assert finestra.ultimo_ordine == 1
+        assert not finestra.recenti
+        buffer_conversazioni.invalida(sid)
+
+
+# ===================================================================
+# Test: ordine turni (contatore su sessioni) + scrittura in blocco
+# ===================================================================
+
+
+class TestOrdineTurni:
+    @pytest.mark.asyncio
+    async def test_riserva_ordini_con_update_returning(self):
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=_result_contatore(7))
+
+        primo = await riserva_ordini(db, uuid.uuid4(), 2)
+
+        assert primo == 6
+        sql = str(db.execute.call_args[0][0])
+        assert "UPDATE sessioni" in sql
+        assert "RETURNING" in sql
+
+    @pytest.mark.asyncio
+    async def test_sessione_inesistente(self):
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=_result_contatore(None))
+
+        with pytest.raises(ValueError):
+            await riserva_ordini(db, uuid.uuid4(), 1)
+
+    @pytest.mark.asyncio
+    async def test_salva_turni_un_solo_insert(self):
+        sid = uuid.uuid4()
+        buffer_conversazioni.scrivi(sid, FinestraConversazione(ultimo_ordine=4))
+        db = _sessione([
+            _result_contatore(6),
+            _result_inseriti([(21, 6), (20, 5)]),
+        ])
+
+        salvati = await salva_turni(db, sid, [
+            NuovoTurno(ruolo="utente", contenuto="domanda"),
+            NuovoTurno(ruolo="assistente", contenuto="risposta", modello="m"),
+        ])
+        await db.commit()
+
+        assert [(t.id, t.ordine) for t in salvati] == [(20, 5), (21, 6)]
+        assert db.execute.call_count == 2
+        inserimento = db.execute.call_args_list[1][0][0]
+        parametri = inserimento.compile().params
+        assert (parametri["ordine_m0"], parametri["ordine_m1"]) == (5, 6)
+        finestra = buffer_conversazioni.leggi(sid)
+        assert finestra.ultimo_ordine == 6
+        assert [m["content"] for _, m in finestra.recenti] == ["domanda", "risposta"]
+        buffer_conversazioni.invalida(sid)
+
+    @pytest.mark.asyncio
+    async def test_nessun_turno_nessuna_query(self):
+        db = AsyncMock()
+        assert await salva_turni(db, uuid.uuid4(), []) == []
+        db.execute.assert_not_awaited()
+
+    def test_con_turno_non_modifica_la_finestra(self):
+        finestra = FinestraConversazione(ultimo_ordine=3)
+        finestra.aggiungi(3, _msg(3))
+
+        copia = finestra.con_turno("utente", "nuovo")
+
+        assert copia.ultimo_ordine == 4
+        assert copia.recenti[-1] == (4, {"role": "user", "content": "nuovo"})
+        assert copia.totale == 2
+        assert finestra.totale == 1
+        assert finestra.ultimo_ordine == 3
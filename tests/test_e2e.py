@@ -11,6 +11,7 @@ Verifica il flusso completo:
 from __future__ import annotations
 
 import uuid
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from unittest.mock import AsyncMock, MagicMock, patch
 
@@ -52,9 +53,20 @@ class FakeSessione:
     stato_orchestratore: dict = field(default_factory=lambda: {"nodo_focale_id": "nodo_A"})
 
 
+def _factory(db):
+    """session_factory per esegui_turno che restituisce sempre il db mock."""
+
+    @asynccontextmanager
+    async def _sessione():
+        yield db
+
+    return _sessione
+
+
 def _make_db_mock(sessione=None):
     """Crea un AsyncMock per il database con sessione configurata."""
     db = AsyncMock()
+    db.add = MagicMock()
     db.commit = AsyncMock()
     db.refresh = AsyncMock()
     sess = sessione or FakeSessione()
@@ -97,12 +109,12 @@ class TestFlussoE2ESpiegazionePromozione:
             patch("app.core.turno.assembla_context_package",
                   return_value=FakeContextPackage()),
             patch("app.core.turno.chiama_tutor", side_effect=fake_llm),
-            patch("app.core.turno.salva_turno", return_value=FakeTurno()),
+            patch("app.core.turno.salva_turni", return_value=[FakeTurno()]),
             patch("app.core.turno.processa_segnali", return_value=[]) as mock_segnali,
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente=None,
@@ -155,13 +167,13 @@ class TestFlussoE2ESpiegazionePromozione:
             patch("app.core.turno.assembla_context_package",
                   return_value=FakeContextPackage()),
             patch("app.core.turno.chiama_tutor", side_effect=fake_llm),
-            patch("app.core.turno.salva_turno", return_value=FakeTurno()),
+            patch("app.core.turno.salva_turni", return_value=[FakeTurno()]),
             patch("app.core.turno.esegui_azione", return_value=azione_result),
             patch("app.core.turno.processa_segnali", return_value=[]),
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente="Ok, sono pronto",
@@ -175,7 +187,11 @@ class TestFlussoE2ESpiegazionePromozione:
 
     @pytest.mark.asyncio
     async def test_passo_3_promozione_dopo_terzo_esercizio(self):
-        """Passo 3: dopo il 3° esercizio corretto, promozione + achievement."""
+        """Passo 3: dopo il 3° esercizio corretto, promozione + achievement.
+
+        L'achievement arriva dal worker outbox: viene notificato all'inizio
+        del turno successivo a quello che lo ha sbloccato.
+        """
 
         async def fake_llm(**kwargs):
             yield {"tipo": "text_delta", "testo": "Bravo!"}
@@ -205,18 +221,18 @@ class TestFlussoE2ESpiegazionePromozione:
             patch("app.core.turno.assembla_context_package",
                   return_value=FakeContextPackage()),
             patch("app.core.turno.chiama_tutor", side_effect=fake_llm),
-            patch("app.core.turno.salva_turno", return_value=FakeTurno()),
+            patch("app.core.turno.salva_turni", return_value=[FakeTurno()]),
             patch("app.core.turno.processa_segnali", return_value=promozione),
             patch("app.core.turno.aggiorna_nodo_dopo_promozione",
                   return_value="nodo_B") as mock_promo,
-            patch("app.core.gamification.verifica_achievement",
+            patch("app.core.gamification.preleva_achievement_da_notificare",
                   return_value=[{"id": "primo_nodo", "nome": "Primo passo!",
                                  "tipo": "sigillo"}]),
-            patch("app.core.gamification.aggiorna_statistiche_giornaliere"),
+            patch("app.core.turno.accoda_lavoro") as mock_outbox,
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente="√2 è irrazionale",
@@ -226,7 +242,10 @@ class TestFlussoE2ESpiegazionePromozione:
         # Promozione processata
         mock_promo.assert_called_once()
 
-        # Achievement emesso
+        # Statistiche + achievement accodati nell'outbox, non eseguiti nel turno
+        mock_outbox.assert_called_once()
+
+        # Achievement sbloccato dal worker dopo il turno precedente: emesso ora
         achievements = [e for e in eventi if e["event"] == "achievement"]
         assert len(achievements) == 1
         assert achievements[0]["data"]["id"] == "primo_nodo"
@@ -249,7 +268,7 @@ class TestFlussoE2ESpiegazionePromozione:
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente="ciao",
@@ -285,12 +304,137 @@ class TestAPIPercorsiSchemas:
         assert "/temi/" in paths
         assert "/temi/{tema_id}" in paths
 
+    def test_router_nodi_ha_cerca(self):
+        from app.api.nodi import router
+        paths = [r.path for r in router.routes]
+        assert "/nodi/cerca" in paths
+
     def test_router_utente_ha_statistiche(self):
         from app.api.utente import router
         paths = [r.path for r in router.routes]
         assert "/utente/me/statistiche" in paths
 
 
+# ===================================================================
+# Test: API temi (progresso dal grafo in RAM + mappa livelli)
+# ===================================================================
+
+
+def _grafo_temi():
+    import networkx as nx
+
+    from app.grafo.struttura import InfoTema
+
+    g = nx.DiGraph()
+    g.add_node("a", nome="A", tipo="standard")
+    g.add_node("b", nome="B", tipo="standard")
+    temi = (
+        InfoTema(id="t1", nome="Uno", materia="matematica", descrizione=None,
+                 nodi_progresso=("a", "b")),
+        InfoTema(id="t2", nome="Due", materia="matematica", descrizione=None,
+                 nodi_progresso=("b",)),
+    )
+    mock = MagicMock()
+    mock.caricato = True
+    mock.grafo = g
+    mock.temi.return_value = temi
+    mock.tema.side_effect = lambda t: {tema.id: tema for tema in temi}.get(t)
+    return mock
+
+
+class TestAPITemi:
+    @pytest.mark.asyncio
+    async def test_lista_temi_senza_query_per_tema(self):
+        from app.api.temi import lista_temi
+
+        db = AsyncMock()
+        utente = MagicMock(id=uuid.uuid4())
+        with (
+            patch("app.api.temi.grafo_knowledge", _grafo_temi()),
+            patch(
+                "app.api.temi.get_livelli_utente",
+                new_callable=AsyncMock,
+                return_value={"b": "operativo", "a": "in_corso"},
+            ),
+        ):
+            temi = await lista_temi(utente=utente, db=db)
+
+        db.execute.assert_not_awaited()
+        assert [(t["id"], t["nodi_completati"], t["nodi_totali"]) for t in temi] == [
+            ("t1", 1, 2), ("t2", 1, 1),
+        ]
+        assert [t["completato"] for t in temi] == [False, True]
+
+    @pytest.mark.asyncio
+    async def test_dettaglio_tema_una_query(self):
+        from types import SimpleNamespace
+
+        from app.api.temi import dettaglio_tema
+
+        result = MagicMock()
+        result.all.return_value = [SimpleNamespace(
+            nodo_id="a", livello="operativo", presunto=False,
+            spiegazione_data=True, esercizi_completati=3,
+        )]
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result)
+        utente = MagicMock(id=uuid.uuid4())
+
+        with patch("app.api.temi.grafo_knowledge", _grafo_temi()):
+            tema = await dettaglio_tema("t1", utente=utente, db=db)
+
+        assert db.execute.await_count == 1
+        assert tema["nodi_completati"] == 1
+        assert [n["livello"] for n in tema["nodi"]] == ["operativo", "non_iniziato"]
+        assert tema["nodi"][0]["nome"] == "A"
+
+    @pytest.mark.asyncio
+    async def test_dettaglio_tema_inesistente_404(self):
+        from fastapi import HTTPException
+
+        from app.api.temi import dettaglio_tema
+
+        with patch("app.api.temi.grafo_knowledge", _grafo_temi()):
+            with pytest.raises(HTTPException) as exc:
+                await dettaglio_tema("zz", utente=MagicMock(), db=AsyncMock())
+        assert exc.value.status_code == 404
+
+
+class TestAPINodiCerca:
+    @pytest.mark.asyncio
+    async def test_cerca_dall_indice(self):
+        import networkx as nx
+
+        from app.api.nodi import cerca_nodi
+        from app.grafo.ricerca import IndiceRicerca
+
+        g = nx.DiGraph()
+        g.add_node("mat_pit", nome="Teorema di Pitagora", tipo_nodo="operativo",
+                   tema_id="geometria", temi=("geometria",))
+        mock = MagicMock()
+        mock.caricato = True
+        mock.ricerca = IndiceRicerca.compila(g, [("geometria", "Geometria piana")])
+
+        with patch("app.api.nodi.grafo_knowledge", mock):
+            risultati = await cerca_nodi(q="pitag", limite=10, tipo=None,
+                                         utente=MagicMock())
+
+        assert [(r["tipo"], r["id"], r["nodo_id"]) for r in risultati] == [
+            ("nodo", "mat_pit", "mat_pit"),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_grafo_non_caricato_503(self):
+        from fastapi import HTTPException
+
+        from app.api.nodi import cerca_nodi
+
+        with patch("app.api.nodi.grafo_knowledge", MagicMock(caricato=False)):
+            with pytest.raises(HTTPException) as exc:
+                await cerca_nodi(q="x", limite=10, tipo=None, utente=MagicMock())
+        assert exc.value.status_code == 503
+
+
 # ===================================================================
 # Test: statistiche helper
 # ===================================================================
@@ -11,6 +11,9 @@ Test critici di dominio:
 
 from __future__ import annotations
 
+import uuid
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
@@ -18,9 +21,23 @@ import pytest
 from app.core.elaborazione import (
     DIFFICOLTA_MAPPING,
     ESERCIZI_PER_PROMOZIONE,
-    _verifica_promozione,
+    _aggrega_risposte,
+    _esegui_suggerisci_backtrack,
+    _promuovibile,
+    processa_segnali,
 )
 
+
+def _factory(db):
+    """session_factory per esegui_turno che restituisce sempre il db mock."""
+
+    @asynccontextmanager
+    async def _sessione():
+        yield db
+
+    return _sessione
+
+
 # ===================================================================
 # Test: mapping difficoltà
 # ===================================================================
@@ -51,125 +68,179 @@ class TestLogicaPromozione:
     Tre condizioni devono essere TUTTE vere:
     1. spiegazione_data = true
     2. esercizi_completati >= 3
-    3. almeno 1 esercizio con esito='primo_tentativo'
+    3. almeno 1 esercizio con esito='primo_tentativo' (filtrata dall'UPDATE)
     """
 
-    @pytest.mark.asyncio
-    async def test_promozione_tutte_condizioni_soddisfatte(self):
-        """Con tutte le condizioni soddisfatte, promozione avviene."""
-        # Mock stato nodo
-        stato_mock = MagicMock()
-        stato_mock.livello = "in_corso"
-        stato_mock.spiegazione_data = True
-        stato_mock.esercizi_completati = 3
-        stato_mock.ultima_interazione = None
-
-        # Mock DB
-        db = AsyncMock()
-        # Prima query: stato nodo
-        result_stato = MagicMock()
-        result_stato.scalar_one_or_none.return_value = stato_mock
-        # Seconda query: count primo_tentativo
-        result_pt = MagicMock()
-        result_pt.scalar_one.return_value = 2  # 2 primi tentativi
+    def _stato(self, **kwargs):
+        base = {
+            "livello": "in_corso",
+            "spiegazione_data": True,
+            "esercizi_completati": 3,
+        }
+        base.update(kwargs)
+        return SimpleNamespace(**base)
 
-        db.execute = AsyncMock(side_effect=[result_stato, result_pt])
-        db.flush = AsyncMock()
+    def test_promuovibile_con_condizioni_soddisfatte(self):
+        assert _promuovibile(self._stato()) is True
 
-        import uuid
+    def test_no_promozione_senza_spiegazione(self):
+        assert _promuovibile(self._stato(spiegazione_data=False)) is False
 
-        result = await _verifica_promozione(db, uuid.uuid4(), "nodo_test")
+    def test_no_promozione_pochi_esercizi(self):
+        assert _promuovibile(self._stato(esercizi_completati=2)) is False
 
-        assert result is not None
-        assert result["nodo_id"] == "nodo_test"
-        assert result["nuovo_livello"] == "operativo"
-        assert stato_mock.livello == "operativo"
+    def test_no_promozione_gia_operativo(self):
+        assert _promuovibile(self._stato(livello="operativo")) is False
 
-    @pytest.mark.asyncio
-    async def test_no_promozione_senza_spiegazione(self):
-        """Senza spiegazione, no promozione."""
-        stato_mock = MagicMock()
-        stato_mock.livello = "in_corso"
-        stato_mock.spiegazione_data = False
-        stato_mock.esercizi_completati = 5
+    def test_aggrega_risposte_per_nodo(self):
+        per_nodo = _aggrega_risposte([
+            {"nodo_focale": "A", "esito": "primo_tentativo"},
+            {"nodo_focale": "A", "esito": "non_risolto"},
+            {"nodo_focale": "B", "esito": "primo_tentativo"},
+            {"nodo_focale": "A", "esito": "primo_tentativo"},
+        ])
+        assert per_nodo["A"].completati == 3
+        assert per_nodo["A"].non_risolti == 1
+        assert per_nodo["A"].consecutivi_ok == 1
+        assert per_nodo["B"].consecutivi_ok == per_nodo["B"].completati == 1
 
-        db = AsyncMock()
-        result_stato = MagicMock()
-        result_stato.scalar_one_or_none.return_value = stato_mock
-        db.execute = AsyncMock(return_value=result_stato)
 
-        import uuid
+# ===================================================================
+# Test: processa_segnali a blocchi
+# ===================================================================
 
-        result = await _verifica_promozione(db, uuid.uuid4(), "nodo_test")
-        assert result is None
 
-    @pytest.mark.asyncio
-    async def test_no_promozione_pochi_esercizi(self):
-        """Con meno di 3 esercizi, no promozione."""
-        stato_mock = MagicMock()
-        stato_mock.livello = "in_corso"
-        stato_mock.spiegazione_data = True
-        stato_mock.esercizi_completati = 2
+def _result_righe(righe):
+    result = MagicMock()
+    result.all.return_value = righe
+    return result
 
-        db = AsyncMock()
-        result_stato = MagicMock()
-        result_stato.scalar_one_or_none.return_value = stato_mock
-        db.execute = AsyncMock(return_value=result_stato)
 
-        import uuid
+def _result_promossi(nodi):
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = nodi
+    return result
 
-        result = await _verifica_promozione(db, uuid.uuid4(), "nodo_test")
-        assert result is None
 
-    @pytest.mark.asyncio
-    async def test_no_promozione_senza_primo_tentativo(self):
-        """Senza nessun primo_tentativo, no promozione."""
-        stato_mock = MagicMock()
-        stato_mock.livello = "in_corso"
-        stato_mock.spiegazione_data = True
-        stato_mock.esercizi_completati = 5
+def _result_statistiche():
+    result = MagicMock()
+    result.one.return_value = SimpleNamespace(
+        minuti_studio=0, obiettivo_raggiunto=False, obiettivo=20
+    )
+    return result
 
-        db = AsyncMock()
-        result_stato = MagicMock()
-        result_stato.scalar_one_or_none.return_value = stato_mock
-        result_pt = MagicMock()
-        result_pt.scalar_one.return_value = 0  # zero primi tentativi
 
-        db.execute = AsyncMock(side_effect=[result_stato, result_pt])
+def _risposta(nodo, esito="primo_tentativo"):
+    return {"name": "risposta_esercizio", "input": {"nodo_focale": nodo, "esito": esito}}
 
-        import uuid
 
-        result = await _verifica_promozione(db, uuid.uuid4(), "nodo_test")
-        assert result is None
+class TestProcessaSegnaliBatch:
+    @pytest.mark.asyncio
+    async def test_statement_costanti_con_molti_segnali(self):
+        """10 risposte + 2 concetti + 2 segnali sessione = 6 statement."""
+        riga = SimpleNamespace(
+            nodo_id="A", livello="in_corso", spiegazione_data=True,
+            esercizi_completati=10, esercizi_consecutivi_ok=10,
+        )
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            MagicMock(),                 # UPSERT concetti
+            MagicMock(),                 # INSERT storico
+            _result_righe([riga]),       # UPSERT contatori RETURNING
+            _result_promossi(["A"]),     # UPDATE promozione RETURNING
+            _result_statistiche(),       # UPSERT statistiche del giorno
+            MagicMock(),                 # UPDATE contatori achievement utente
+        ])
+        sess = SimpleNamespace(stato_orchestratore={"nodo_focale_id": "A"})
+        segnali = (
+            [{"name": "concetto_spiegato", "input": {"nodo_id": n}} for n in ("A", "B")]
+            + [_risposta("A") for _ in range(10)]
+            + [
+                {"name": "prossimo_passo_raccomandato", "input": {"tipo": "esercizio"}},
+                {"name": "punto_partenza_suggerito", "input": {"tema_o_concetto": "T"}},
+                {"name": "energia_utente", "input": {"livello": "alta"}},
+            ]
+        )
+
+        with patch("app.core.elaborazione.grafo_knowledge") as mock_grafo:
+            mock_grafo.caricato = False
+            promozioni = await processa_segnali(
+                db, segnali, uuid.uuid4(), uuid.uuid4(), sessione=sess
+            )
+
+        assert db.execute.call_count == 6
+        contatori = db.execute.await_args_list[5].args[0].compile().params
+        assert contatori["nodi_completati_1"] == 1
+        assert contatori["esercizi_risolti_1"] == 10
+        assert contatori["greatest_1"] == 10
+        stats = str(db.execute.await_args_list[4].args[0])
+        assert "statistiche_giornaliere" in stats
+        params = db.execute.await_args_list[4].args[0].compile().params
+        assert params["esercizi_svolti"] == 10
+        assert params["esercizi_corretti"] == 10
+        assert params["nodi_completati"] == 1
+        db.flush.assert_awaited_once()
+        assert promozioni == [
+            {"nodo_id": "A", "nuovo_livello": "operativo", "nodi_sbloccati": []}
+        ]
+        assert sess.stato_orchestratore["attivita_corrente"] == "esercizio"
+        assert sess.stato_orchestratore["punto_partenza_suggerito"] == "T"
+        assert sess.stato_orchestratore["nodo_focale_id"] == "A"
 
     @pytest.mark.asyncio
-    async def test_no_promozione_gia_operativo(self):
-        """Un nodo già operativo non viene promosso di nuovo."""
-        stato_mock = MagicMock()
-        stato_mock.livello = "operativo"
+    async def test_nessun_candidato_nessun_update(self):
+        riga = SimpleNamespace(
+            nodo_id="A", livello="in_corso", spiegazione_data=False,
+            esercizi_completati=5, esercizi_consecutivi_ok=0,
+        )
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            MagicMock(), _result_righe([riga]), _result_statistiche(), MagicMock(),
+        ])
+
+        promozioni = await processa_segnali(
+            db, [_risposta("A"), _risposta("A", "non_risolto")], uuid.uuid4(), uuid.uuid4()
+        )
+
+        assert promozioni == []
+        assert db.execute.call_count == 4
 
+    @pytest.mark.asyncio
+    async def test_update_filtra_senza_primo_tentativo(self):
+        """Candidato senza primo_tentativo nello storico: l'UPDATE non lo ritorna."""
+        riga = SimpleNamespace(
+            nodo_id="A", livello="in_corso", spiegazione_data=True,
+            esercizi_completati=3, esercizi_consecutivi_ok=0,
+        )
         db = AsyncMock()
-        result_stato = MagicMock()
-        result_stato.scalar_one_or_none.return_value = stato_mock
-        db.execute = AsyncMock(return_value=result_stato)
+        db.execute = AsyncMock(side_effect=[
+            MagicMock(), _result_righe([riga]), _result_promossi([]), _result_statistiche(),
+        ])
 
-        import uuid
+        promozioni = await processa_segnali(
+            db, [_risposta("A", "non_risolto")], uuid.uuid4(), uuid.uuid4()
+        )
 
-        result = await _verifica_promozione(db, uuid.uuid4(), "nodo_test")
-        assert result is None
+        assert promozioni == []
+        assert db.execute.call_count == 4
 
     @pytest.mark.asyncio
-    async def test_no_promozione_nodo_inesistente(self):
-        """Nodo senza stato nel DB non viene promosso."""
+    async def test_segnali_sessione_senza_sessione_caricata(self):
+        sess = SimpleNamespace(stato_orchestratore=None)
+        result_sess = MagicMock()
+        result_sess.scalar_one_or_none.return_value = sess
         db = AsyncMock()
-        result_stato = MagicMock()
-        result_stato.scalar_one_or_none.return_value = None
-        db.execute = AsyncMock(return_value=result_stato)
+        db.execute = AsyncMock(return_value=result_sess)
 
-        import uuid
+        await processa_segnali(
+            db,
+            [{"name": "prossimo_passo_raccomandato", "input": {"tipo": "feynman"}}],
+            uuid.uuid4(),
+            uuid.uuid4(),
+        )
 
-        result = await _verifica_promozione(db, uuid.uuid4(), "nodo_fantasma")
-        assert result is None
+        assert db.execute.call_count == 1
+        assert sess.stato_orchestratore["attivita_corrente"] == "feynman"
 
 
 # ===================================================================
@@ -296,7 +367,7 @@ class TestTurnoCoordinatore:
             yield {"tipo": "stop", "risultato": FakeRisultato()}
 
         db = AsyncMock()
-        # Mock per salva_turno (2 chiamate: utente + assistente)
+        # salva_turni mockato (utente + assistente in un solo INSERT)
         # Mock per commit, refresh
         db.commit = AsyncMock()
         db.refresh = AsyncMock()
@@ -312,15 +383,15 @@ class TestTurnoCoordinatore:
             patch(
                 "app.core.turno.assembla_context_package",
                 return_value=FakeContextPackage(),
-            ),
+            ) as assembla_mock,
             patch(
                 "app.core.turno.chiama_tutor",
                 side_effect=fake_chiama_tutor,
             ),
             patch(
-                "app.core.turno.salva_turno",
-                return_value=FakeTurno(),
-            ),
+                "app.core.turno.salva_turni",
+                return_value=[FakeTurno()],
+            ) as salva_turni_mock,
             patch(
                 "app.core.turno.processa_segnali",
                 return_value=[],
@@ -328,13 +399,21 @@ class TestTurnoCoordinatore:
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente="ciao",
             ):
                 eventi.append(ev)
 
+        # Messaggio utente nel contesto, salvato a fine turno con la risposta
+        assert assembla_mock.call_args[1]["messaggio_utente"] == "ciao"
+        salva_turni_mock.assert_awaited_once()
+        turni = salva_turni_mock.call_args[0][2]
+        assert [(t.ruolo, t.contenuto) for t in turni] == [
+            ("utente", "ciao"), ("assistente", "Ciao studente!"),
+        ]
+
         # Verifiche
         text_deltas = [
             e for e in eventi if e.get("event") == "text_delta"
@@ -442,8 +521,8 @@ class TestTurnoCoordinatore:
                 side_effect=fake_chiama_tutor,
             ),
             patch(
-                "app.core.turno.salva_turno",
-                return_value=FakeTurno(),
+                "app.core.turno.salva_turni",
+                return_value=[FakeTurno()],
             ),
             patch(
                 "app.core.turno.esegui_azione",
@@ -456,7 +535,7 @@ class TestTurnoCoordinatore:
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente="ok",
@@ -500,11 +579,13 @@ class TestTurnoCoordinatore:
                 "app.core.turno.chiama_tutor",
                 side_effect=fake_chiama_errore,
             ),
-            patch("app.core.turno.salva_turno", return_value=MagicMock(id=1)),
+            patch(
+                "app.core.turno.salva_turno", return_value=MagicMock(id=1)
+            ) as salva_turno_mock,
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente="ciao",
@@ -514,6 +595,56 @@ class TestTurnoCoordinatore:
         errori = [e for e in eventi if e.get("event") == "errore"]
         assert len(errori) == 1
         assert "Timeout" in errori[0]["data"]["messaggio"]
+        # Il messaggio utente resta nello storico anche se il turno fallisce
+        salva_turno_mock.assert_awaited_once()
+        assert salva_turno_mock.call_args[1]["ruolo"] == "utente"
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("interruzione", ["aclose", "cancel"])
+    async def test_client_disconnesso_salva_messaggio_utente(self, interruzione):
+        """Stream interrotto a meta' (GeneratorExit o cancellazione del task)."""
+        import asyncio
+        import uuid
+        from contextlib import aclosing
+
+        from app.core.turno import esegui_turno
+
+        ctx = SimpleNamespace(system="test", messages=[], modello="test-model")
+        bloccato = asyncio.Event()
+
+        async def fake_chiama_tutor(**kwargs):
+            yield {"tipo": "text_delta", "testo": "Ciao"}
+            bloccato.set()
+            await asyncio.Event().wait()  # il modello non finisce mai
+            yield {"tipo": "stop", "risultato": None}
+
+        db = AsyncMock()
+
+        with (
+            patch("app.core.turno._preleva_achievement_safe", return_value=[]),
+            patch("app.core.turno.assembla_context_package", return_value=ctx),
+            patch("app.core.turno.chiama_tutor", side_effect=fake_chiama_tutor),
+            patch("app.core.turno.salva_turni") as salva_turni_mock,
+            patch("app.core.turno.salva_turno", return_value=MagicMock(id=1)) as salva_turno_mock,
+        ):
+            async with aclosing(esegui_turno(
+                session_factory=_factory(db),
+                sessione_id=uuid.uuid4(),
+                utente_id=uuid.uuid4(),
+                messaggio_utente="ciao",
+            )) as eventi:
+                assert (await anext(eventi))["event"] == "text_delta"
+                if interruzione == "cancel":
+                    task = asyncio.create_task(anext(eventi))
+                    await bloccato.wait()
+                    task.cancel()
+                    with pytest.raises(asyncio.CancelledError):
+                        await task
+
+        salva_turni_mock.assert_not_awaited()
+        salva_turno_mock.assert_awaited_once()
+        assert salva_turno_mock.call_args[1]["ruolo"] == "utente"
+        assert salva_turno_mock.call_args[1]["contenuto"] == "ciao"
 
     @pytest.mark.asyncio
     async def test_turno_primo_senza_messaggio_utente(self):
@@ -564,7 +695,7 @@ class TestTurnoCoordinatore:
         sess_result.scalar_one_or_none.return_value = FakeSessione()
         db.execute = AsyncMock(return_value=sess_result)
 
-        salva_turno_mock = AsyncMock(return_value=MagicMock(id=1))
+        salva_turni_mock = AsyncMock(return_value=[MagicMock(id=1)])
 
         import uuid
 
@@ -578,8 +709,8 @@ class TestTurnoCoordinatore:
                 side_effect=fake_chiama_tutor,
             ),
             patch(
-                "app.core.turno.salva_turno",
-                salva_turno_mock,
+                "app.core.turno.salva_turni",
+                salva_turni_mock,
             ),
             patch(
                 "app.core.turno.processa_segnali",
@@ -588,17 +719,17 @@ class TestTurnoCoordinatore:
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente=None,  # Primo turno: nessun msg utente
             ):
                 eventi.append(ev)
 
-        # salva_turno chiamato solo 1 volta (assistente, no utente)
-        assert salva_turno_mock.call_count == 1
-        call_kwargs = salva_turno_mock.call_args[1]
-        assert call_kwargs["ruolo"] == "assistente"
+        # Un solo turno salvato (assistente, no utente)
+        assert salva_turni_mock.call_count == 1
+        turni = salva_turni_mock.call_args[0][2]
+        assert [t.ruolo for t in turni] == ["assistente"]
 
     @pytest.mark.asyncio
     async def test_turno_con_promozione(self):
@@ -669,8 +800,8 @@ class TestTurnoCoordinatore:
                 side_effect=fake_chiama_tutor,
             ),
             patch(
-                "app.core.turno.salva_turno",
-                return_value=MagicMock(id=3),
+                "app.core.turno.salva_turni",
+                return_value=[MagicMock(id=3)],
             ),
             patch(
                 "app.core.turno.processa_segnali",
@@ -683,7 +814,7 @@ class TestTurnoCoordinatore:
         ):
             eventi = []
             async for ev in esegui_turno(
-                db=db,
+                session_factory=_factory(db),
                 sessione_id=uuid.uuid4(),
                 utente_id=uuid.uuid4(),
                 messaggio_utente="x = 2",
@@ -699,6 +830,62 @@ class TestTurnoCoordinatore:
         assert len(turno_completo) == 1
 
 
+# ===================================================================
+# Test: suggerisci_backtrack (validazione nodo + alternative simili)
+# ===================================================================
+
+
+def _grafo_backtrack():
+    import networkx as nx
+
+    from app.grafo.ricerca import IndiceRicerca
+
+    g = nx.DiGraph()
+    g.add_node("mat_fraz", nome="Frazioni", tipo_nodo="operativo")
+    g.add_node("mat_mcm", nome="Minimo comune multiplo", tipo_nodo="operativo")
+    g.add_node("mat_ctx", nome="Numeri", tipo_nodo="contesto")
+    mock = MagicMock()
+    mock.caricato = True
+    mock.grafo = g
+    mock.ricerca = IndiceRicerca.compila(g, ())
+    mock.nodi_operativi.return_value = ("mat_fraz", "mat_mcm")
+    mock.nome.side_effect = lambda n: g.nodes[n]["nome"]
+    return mock
+
+
+class TestSuggerisciBacktrack:
+    def test_nodo_valido_senza_embedding(self):
+        with patch("app.core.elaborazione.grafo_knowledge", _grafo_backtrack()):
+            evento = _esegui_suggerisci_backtrack({"nodo_id": "mat_fraz", "motivo": "m"})
+        assert evento == {
+            "tipo": "suggerisci_backtrack",
+            "params": {"nodo_id": "mat_fraz", "motivo": "m"},
+        }
+
+    def test_nodo_inesistente_risolto_per_nome(self):
+        with patch("app.core.elaborazione.grafo_knowledge", _grafo_backtrack()):
+            evento = _esegui_suggerisci_backtrack({"nodo_id": "minimo comune", "motivo": "m"})
+        assert evento["params"]["nodo_id"] == "mat_mcm"
+
+    def test_alternative_da_embedding_solo_operative(self):
+        from app.grafo.semantica import EmbeddingNodi, IndiceEmbedding
+
+        embedding = EmbeddingNodi()
+        embedding._indice = IndiceEmbedding.compila([
+            ("mat_fraz", [1.0, 0.0]),
+            ("mat_mcm", [0.8, 0.6]),
+            ("mat_ctx", [0.9, 0.1]),
+        ])
+        with (
+            patch("app.core.elaborazione.grafo_knowledge", _grafo_backtrack()),
+            patch("app.core.elaborazione.embedding_nodi", embedding),
+        ):
+            evento = _esegui_suggerisci_backtrack({"nodo_id": "mat_fraz", "motivo": "m"})
+
+        assert [a["nodo_id"] for a in evento["alternative"]] == ["mat_mcm"]
+        assert evento["alternative"][0]["nome"] == "Minimo comune multiplo"
+
+
 # ===================================================================
 # Test: helper eventi SSE
 # ===================================================================
@@ -719,3 +906,90 @@ class TestEventiSSE:
         assert ev["event"] == "errore"
         assert ev["data"]["codice"] == "timeout"
         assert ev["data"]["messaggio"] == "LLM non risponde"
+
+
+# ===================================================================
+# Test: sessioni DB brevi nel turno + metriche pool
+# ===================================================================
+
+
+class TestSessioniBreviTurno:
+    @pytest.mark.asyncio
+    async def test_nessuna_sessione_aperta_durante_stream(self):
+        """Fase 2 non tiene sessioni: l'azione ne prende una solo per se'."""
+        from app.core.turno import esegui_turno
+
+        aperte = 0
+        aperte_durante_stream: list[int] = []
+        db = AsyncMock()
+        sess_result = MagicMock()
+        sess_result.scalar_one_or_none.return_value = SimpleNamespace(
+            stato_orchestratore={"nodo_focale_id": "A"}
+        )
+        db.execute = AsyncMock(return_value=sess_result)
+
+        @asynccontextmanager
+        async def factory():
+            nonlocal aperte
+            aperte += 1
+            try:
+                yield db
+            finally:
+                aperte -= 1
+
+        async def fake_chiama_tutor(**kwargs):
+            aperte_durante_stream.append(aperte)
+            yield {"tipo": "text_delta", "testo": "Ciao"}
+            aperte_durante_stream.append(aperte)
+            yield {
+                "tipo": "tool_use", "categoria": "azione",
+                "name": "mostra_formula", "input": {"formula": "a+b"},
+            }
+            aperte_durante_stream.append(aperte)
+            yield {"tipo": "stop", "risultato": MagicMock(
+                testo_completo="Ciao", modello="m", token_input=1,
+                token_output=1, costo_stimato=0.0,
+            )}
+
+        esegui_azione = AsyncMock(return_value={"tipo": "mostra_formula", "params": {}})
+        with (
+            patch(
+                "app.core.turno.assembla_context_package",
+                return_value=SimpleNamespace(system=[], messages=[], modello="m"),
+            ),
+            patch("app.core.turno.chiama_tutor", side_effect=fake_chiama_tutor),
+            patch("app.core.turno.esegui_azione", esegui_azione),
+            patch("app.core.turno.salva_turni", return_value=[SimpleNamespace(id=7)]),
+            patch("app.core.turno.processa_segnali", return_value=[]),
+        ):
+            eventi = [
+                ev async for ev in esegui_turno(
+                    sessione_id=uuid.uuid4(),
+                    utente_id=uuid.uuid4(),
+                    messaggio_utente="ciao",
+                    session_factory=factory,
+                )
+            ]
+
+        assert aperte_durante_stream == [0, 0, 0]
+        assert aperte == 0
+        esegui_azione.assert_awaited_once()
+        assert eventi[-1]["data"]["turno_id"] == 7
+
+    def test_metriche_pool_possesso(self):
+        from app.db.engine import MetrichePool
+
+        metriche = MetrichePool()
+        record = SimpleNamespace(info={})
+        with patch("app.db.engine.time.monotonic", return_value=10.0):
+            metriche._on_checkout(None, record, None)
+        assert metriche.statistiche()["in_uso"] == 1
+        with patch("app.db.engine.time.monotonic", return_value=12.5):
+            metriche._on_checkin(None, record)
+
+        stats = metriche.statistiche()
+        assert stats["checkout"] == 1
+        assert stats["in_uso"] == 0
+        assert stats["in_uso_max"] == 1
+        assert stats["possesso_medio_sec"] == pytest.approx(2.5)
+        assert stats["possesso_max_sec"] == pytest.approx(2.5)
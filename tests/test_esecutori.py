@@ -0,0 +1,147 @@
+"""Test esecutori CPU (pool + limiti per tipo) e monitor del ritardo del loop."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core.esecutori import Esecutori, MonitorLoop, _percentile
+
+# ---------------------------------------------------------------------------
+# Test: esecutori
+# ---------------------------------------------------------------------------
+
+
+class TestEsecutori:
+    async def test_esegue_fuori_dal_loop(self):
+        esecutori = Esecutori({"hash": 2})
+        try:
+            thread = await esecutori.esegui("hash", threading.get_ident)
+        finally:
+            esecutori.chiudi()
+        assert thread != threading.get_ident()
+
+    async def test_argomenti_e_risultato(self):
+        esecutori = Esecutori({"grafo": 1})
+        try:
+            risultato = await esecutori.esegui("grafo", sorted, [3, 1, 2], reverse=True)
+        finally:
+            esecutori.chiudi()
+        assert risultato == [3, 2, 1]
+
+    async def test_tipo_sconosciuto(self):
+        esecutori = Esecutori({"hash": 1})
+        with pytest.raises(ValueError, match="sconosciuto"):
+            await esecutori.esegui("video", print)
+
+    async def test_limite_per_tipo(self):
+        esecutori = Esecutori({"hash": 1, "grafo": 2})
+        attivi = 0
+        massimo = 0
+        lock = threading.Lock()
+
+        def lavoro():
+            nonlocal attivi, massimo
+            with lock:
+                attivi += 1
+                massimo = max(massimo, attivi)
+            time.sleep(0.02)
+            with lock:
+                attivi -= 1
+
+        try:
+            await asyncio.gather(*(esecutori.esegui("hash", lavoro) for _ in range(3)))
+        finally:
+            esecutori.chiudi()
+
+        assert massimo == 1
+        stats = esecutori.statistiche()["hash"]
+        assert stats["richieste"] == 3
+        assert stats["accodate"] >= 1
+        assert stats["attive"] == 0
+
+    async def test_loop_libero_durante_il_lavoro(self):
+        esecutori = Esecutori({"hash": 1})
+        battiti = 0
+
+        async def battito():
+            nonlocal battiti
+            while True:
+                battiti += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(battito())
+        try:
+            await esecutori.esegui("hash", time.sleep, 0.1)
+        finally:
+            task.cancel()
+            esecutori.chiudi()
+        assert battiti >= 5
+
+    async def test_eccezione_propagata(self):
+        esecutori = Esecutori({"hash": 1})
+
+        def errore():
+            raise RuntimeError("bcrypt")
+
+        try:
+            with pytest.raises(RuntimeError, match="bcrypt"):
+                await esecutori.esegui("hash", errore)
+        finally:
+            esecutori.chiudi()
+        assert esecutori.statistiche()["hash"]["attive"] == 0
+
+
+# ---------------------------------------------------------------------------
+# Test: monitor del loop
+# ---------------------------------------------------------------------------
+
+
+class TestMonitorLoop:
+    def test_percentile_nearest_rank(self):
+        valori = [float(i) for i in range(1, 101)]
+        assert _percentile(valori, 0.50) == 50.0
+        assert _percentile(valori, 0.99) == 99.0
+        assert _percentile([], 0.5) == 0.0
+
+    def test_statistiche_e_blocchi(self, caplog):
+        monitor = MonitorLoop(intervallo_sec=0.1, campioni=4, soglia_sec=0.05)
+        with caplog.at_level("INFO", logger="app.core.esecutori"):
+            for ritardo in (0.001, 0.002, 0.003, 0.2):
+                monitor.registra(ritardo)
+
+        stats = monitor.statistiche()
+        assert stats["campioni"] == 4
+        assert stats["blocchi"] == 1
+        assert stats["p50_ms"] == pytest.approx(2.0)
+        assert stats["p99_ms"] == pytest.approx(200.0)
+        assert "bloccato per 200 ms" in caplog.text
+        assert "p50 2.0 ms" in caplog.text
+
+    def test_finestra_limitata(self):
+        monitor = MonitorLoop(intervallo_sec=0.1, campioni=2, soglia_sec=1.0)
+        for ritardo in (0.5, 0.001, 0.002):
+            monitor.registra(ritardo)
+        assert monitor.statistiche()["max_ms"] == pytest.approx(2.0)
+        assert monitor.misure == 3
+
+    async def test_misura_un_blocco_del_loop(self):
+        monitor = MonitorLoop(intervallo_sec=0.01, campioni=100, soglia_sec=0.04)
+        monitor.avvia()
+        try:
+            await asyncio.sleep(0.03)
+            time.sleep(0.08)  # blocca il loop
+            await asyncio.sleep(0.03)
+        finally:
+            await monitor.ferma()
+        assert not monitor.attivo
+        assert monitor.blocchi >= 1
+        assert monitor.statistiche()["max_ms"] >= 40
+
+    async def test_disattivato(self):
+        monitor = MonitorLoop(intervallo_sec=0, campioni=10, soglia_sec=0.1)
+        monitor.avvia()
+        assert not monitor.attivo
@@ -4,8 +4,8 @@ Test critici di dominio:
 - Achievement seed (8 definizioni dal brief)
 - Condizioni achievement (nodi_completati, esercizi_risolti, streak, tema_completato,
   esercizi_consecutivi_ok, sessioni_completate)
-- Calcolo streak (HARD CONSTRAINT)
-- Aggiornamento statistiche giornaliere
+- Calcolo streak (HARD CONSTRAINT) e streak memorizzato
+- Statistiche giornaliere incrementali
 - Lista achievement con progresso
 - API endpoint /achievement
 - Schemas Pydantic
@@ -15,17 +15,31 @@ from __future__ import annotations
 
 import uuid
 from datetime import date, timedelta
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.gamification import (
+    _COLONNE_METRICA,
     ACHIEVEMENT_SEED,
+    METRICHE_PER_EVENTO,
+    CatalogoAchievement,
     calcola_streak,
+    incrementa_contatori_utente,
     lista_achievement_utente,
+    metriche_per_eventi,
+    registra_attivita_giornaliera,
+    registra_chiusura_sessione,
+    ricalcola_streak,
     seed_achievement,
+    streak_attuale,
+    temi_completati_da,
     verifica_achievement,
 )
+from app.db.crud.utenti import cache_utenti
+from app.grafo.struttura import InfoTema
 
 # ===================================================================
 # Test: seed achievement
@@ -80,7 +94,7 @@ class TestSeedAchievement:
 # ===================================================================
 
 
-class TestCalcoloStreak:
+class TestRicalcoloStreak:
     """HARD CONSTRAINT: streak = giorni consecutivi con obiettivo_raggiunto.
 
     - Si conta all'indietro da oggi (o da ieri se oggi non ha studiato)
@@ -95,7 +109,7 @@ class TestCalcoloStreak:
         result.all.return_value = []
         db.execute = AsyncMock(return_value=result)
 
-        streak = await calcola_streak(uuid.uuid4(), db)
+        streak, _ = await ricalcola_streak(uuid.uuid4(), db)
         assert streak == 0
 
     @pytest.mark.asyncio
@@ -109,7 +123,7 @@ class TestCalcoloStreak:
         ]
         db.execute = AsyncMock(return_value=result)
 
-        streak = await calcola_streak(uuid.uuid4(), db)
+        streak, _ = await ricalcola_streak(uuid.uuid4(), db)
         assert streak == 1
 
     @pytest.mark.asyncio
@@ -125,7 +139,7 @@ class TestCalcoloStreak:
         ]
         db.execute = AsyncMock(return_value=result)
 
-        streak = await calcola_streak(uuid.uuid4(), db)
+        streak, _ = await ricalcola_streak(uuid.uuid4(), db)
         assert streak == 3
 
     @pytest.mark.asyncio
@@ -141,7 +155,7 @@ class TestCalcoloStreak:
         ]
         db.execute = AsyncMock(return_value=result)
 
-        streak = await calcola_streak(uuid.uuid4(), db)
+        streak, _ = await ricalcola_streak(uuid.uuid4(), db)
         assert streak == 1
 
     @pytest.mark.asyncio
@@ -157,7 +171,7 @@ class TestCalcoloStreak:
         ]
         db.execute = AsyncMock(return_value=result)
 
-        streak = await calcola_streak(uuid.uuid4(), db)
+        streak, _ = await ricalcola_streak(uuid.uuid4(), db)
         assert streak == 1
 
     @pytest.mark.asyncio
@@ -173,7 +187,7 @@ class TestCalcoloStreak:
         ]
         db.execute = AsyncMock(return_value=result)
 
-        streak = await calcola_streak(uuid.uuid4(), db)
+        streak, _ = await ricalcola_streak(uuid.uuid4(), db)
         assert streak == 2
 
     @pytest.mark.asyncio
@@ -187,178 +201,399 @@ class TestCalcoloStreak:
         ]
         db.execute = AsyncMock(return_value=result)
 
-        streak = await calcola_streak(uuid.uuid4(), db)
+        streak, _ = await ricalcola_streak(uuid.uuid4(), db)
         assert streak == 0
 
 
+class TestStreakMemorizzato:
+    def test_streak_vivo_oggi_o_ieri(self):
+        oggi = date.today()
+        assert streak_attuale(4, oggi, oggi) == 4
+        assert streak_attuale(4, oggi - timedelta(days=1), oggi) == 4
+
+    def test_streak_interrotto(self):
+        oggi = date.today()
+        assert streak_attuale(4, oggi - timedelta(days=2), oggi) == 0
+        assert streak_attuale(0, None, oggi) == 0
+
+    @pytest.mark.asyncio
+    async def test_calcola_streak_legge_utente(self):
+        """Una sola lettura per chiave primaria, nessuna scansione storico."""
+        db = AsyncMock()
+        result = MagicMock()
+        result.one_or_none.return_value = MagicMock(
+            streak_corrente=5, streak_ultimo_giorno=date.today()
+        )
+        db.execute = AsyncMock(return_value=result)
+
+        assert await calcola_streak(uuid.uuid4(), db) == 5
+        assert db.execute.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_ricalcola_ritorna_ultimo_giorno(self):
+        ieri = date.today() - timedelta(days=1)
+        db = AsyncMock()
+        result = MagicMock()
+        result.all.return_value = [MagicMock(data=ieri, obiettivo_raggiunto=True)]
+        db.execute = AsyncMock(return_value=result)
+
+        assert await ricalcola_streak(uuid.uuid4(), db) == (1, ieri)
+
+
+class TestContatoriUtente:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("commit", [True, False])
+    async def test_cache_utenti_invalidata_solo_dopo_commit(self, commit):
+        utente = SimpleNamespace(id=uuid.uuid4())
+        cache_utenti.scrivi(utente)
+        db = AsyncSession()
+        db.execute = AsyncMock()
+        db.sync_session.begin()
+
+        await incrementa_contatori_utente(db, utente.id, esercizi_risolti=1)
+        assert cache_utenti.leggi(utente.id) is utente  # non ancora committato
+        await (db.commit() if commit else db.rollback())
+
+        assert (cache_utenti.leggi(utente.id) is None) is commit
+        cache_utenti.invalida(utente.id)
+
+
 # ===================================================================
-# Test: verifica achievement
+# Test: statistiche giornaliere incrementali
 # ===================================================================
 
 
-class TestVerificaAchievement:
-    """Test che le condizioni achievement vengano valutate correttamente."""
+def _db_upsert_statistiche(minuti_studio: int, obiettivo_raggiunto: bool, obiettivo: int = 20):
+    result = MagicMock()
+    result.one.return_value = MagicMock(
+        minuti_studio=minuti_studio,
+        obiettivo_raggiunto=obiettivo_raggiunto,
+        obiettivo=obiettivo,
+    )
+    db = AsyncMock()
+    db.execute = AsyncMock(return_value=result)
+    return db
+
 
+class TestStatisticheIncrementali:
     @pytest.mark.asyncio
-    async def test_nessun_achievement_se_nessuna_definizione(self):
-        """Se non ci sono definizioni, lista vuota."""
-        db = AsyncMock()
-        # Definizioni vuote
-        result_def = MagicMock()
-        result_def.scalars.return_value.all.return_value = []
-        # Sbloccati vuoti
-        result_sbl = MagicMock()
-        result_sbl.scalars.return_value.all.return_value = []
+    async def test_esercizi_un_solo_upsert(self):
+        db = _db_upsert_statistiche(minuti_studio=0, obiettivo_raggiunto=False)
 
-        db.execute = AsyncMock(side_effect=[result_def, result_sbl])
+        raggiunto = await registra_attivita_giornaliera(
+            db, uuid.uuid4(), esercizi_svolti=3, esercizi_corretti=2
+        )
 
-        nuovi = await verifica_achievement(uuid.uuid4(), db)
-        assert nuovi == []
+        assert raggiunto is False
+        assert db.execute.await_count == 1
+        sql = str(db.execute.call_args.args[0])
+        assert "ON CONFLICT" in sql
+        assert (
+            "esercizi_svolti = (statistiche_giornaliere.esercizi_svolti"
+            " + excluded.esercizi_svolti)"
+        ) in sql
 
     @pytest.mark.asyncio
-    async def test_achievement_gia_sbloccato_non_ricalcolato(self):
-        """Achievement già sbloccato non viene verificato di nuovo."""
-        db = AsyncMock()
+    async def test_obiettivo_scatta_avanza_streak(self):
+        # 15 minuti prima + 10 ora = 25 >= 20
+        db = _db_upsert_statistiche(minuti_studio=25, obiettivo_raggiunto=True)
 
-        defn = MagicMock()
-        defn.id = "primo_nodo"
-        defn.condizione = {"tipo": "nodi_completati", "valore": 1}
+        raggiunto = await registra_attivita_giornaliera(db, uuid.uuid4(), minuti_studio=10)
 
-        result_def = MagicMock()
-        result_def.scalars.return_value.all.return_value = [defn]
+        assert raggiunto is True
+        assert db.execute.await_count == 2
+        update_streak = str(db.execute.call_args.args[0])
+        assert "UPDATE utenti" in update_streak
+        assert "streak_corrente" in update_streak
 
-        result_sbl = MagicMock()
-        result_sbl.scalars.return_value.all.return_value = ["primo_nodo"]
+    @pytest.mark.asyncio
+    async def test_obiettivo_gia_raggiunto_non_ritocca_streak(self):
+        # 30 minuti prima + 10 ora: l'obiettivo era gia' raggiunto
+        db = _db_upsert_statistiche(minuti_studio=40, obiettivo_raggiunto=True)
 
-        db.execute = AsyncMock(side_effect=[result_def, result_sbl])
+        raggiunto = await registra_attivita_giornaliera(db, uuid.uuid4(), minuti_studio=10)
 
-        nuovi = await verifica_achievement(uuid.uuid4(), db)
-        assert nuovi == []
+        assert raggiunto is False
+        assert db.execute.await_count == 1
 
     @pytest.mark.asyncio
-    async def test_sblocca_primo_nodo(self):
-        """Sblocca 'primo_nodo' quando nodi_completati >= 1."""
-        db = AsyncMock()
+    async def test_minuti_sessione_solo_delta(self):
+        """Sessione sospesa a 15 min e chiusa a 25: si accreditano 10 minuti."""
+        from datetime import datetime, timezone
 
-        defn = MagicMock()
-        defn.id = "primo_nodo"
-        defn.nome = "Primo passo!"
-        defn.tipo = "sigillo"
-        defn.condizione = {"tipo": "nodi_completati", "valore": 1}
+        sessione = MagicMock(
+            utente_id=uuid.uuid4(),
+            durata_effettiva_min=15,
+            created_at=datetime.now(timezone.utc),
+        )
+        db = MagicMock()
+        with patch(
+            "app.core.gamification.registra_attivita_giornaliera",
+            new_callable=AsyncMock,
+            return_value=False,
+        ) as registra:
+            await registra_chiusura_sessione(db, sessione, 25, completata=False)
+            metriche = await registra_chiusura_sessione(db, sessione, 25, completata=False)
+
+        assert sessione.durata_effettiva_min == 25
+        registra.assert_awaited_once()
+        assert registra.call_args.kwargs["minuti_studio"] == 10
+        assert metriche == set()
+        db.add.assert_not_called()
 
-        result_def = MagicMock()
-        result_def.scalars.return_value.all.return_value = [defn]
+    @pytest.mark.asyncio
+    async def test_sessione_completata_accoda_verifica(self):
+        """Obiettivo raggiunto + sessione completata → lavoro su streak e sessioni."""
+        from datetime import datetime, timezone
 
-        result_sbl = MagicMock()
-        result_sbl.scalars.return_value.all.return_value = []
+        sessione = MagicMock(
+            utente_id=uuid.uuid4(),
+            durata_effettiva_min=None,
+            created_at=datetime.now(timezone.utc),
+        )
+        db = MagicMock()
+        db.execute = AsyncMock()
+        with patch(
+            "app.core.gamification.registra_attivita_giornaliera",
+            new_callable=AsyncMock,
+            return_value=True,
+        ):
+            metriche = await registra_chiusura_sessione(db, sessione, 30, completata=True)
 
-        # Metrica: count nodi completati = 1
-        result_count = MagicMock()
-        result_count.scalar_one.return_value = 1
+        assert metriche == {"streak", "sessioni_completate"}
+        assert "sessioni_completate" in str(db.execute.call_args.args[0])
+        lavoro = db.add.call_args.args[0]
+        assert lavoro.tipo == "achievement"
+        assert lavoro.payload == {"metriche": ["sessioni_completate", "streak"]}
 
-        db.execute = AsyncMock(side_effect=[result_def, result_sbl, result_count])
-        db.add = MagicMock()
-        db.flush = AsyncMock()
 
-        nuovi = await verifica_achievement(uuid.uuid4(), db)
-        assert len(nuovi) == 1
-        assert nuovi[0]["id"] == "primo_nodo"
-        assert nuovi[0]["nome"] == "Primo passo!"
+# ===================================================================
+# Test: verifica achievement
+# ===================================================================
+
 
+def _defn(id_, metrica, soglia, tipo="sigillo"):
+    """Riga achievement_definizioni finta."""
+    return SimpleNamespace(
+        id=id_,
+        nome=id_.replace("_", " ").title(),
+        tipo=tipo,
+        descrizione=None,
+        condizione={"tipo": metrica, "valore": soglia},
+    )
+
+
+async def _catalogo(*righe) -> CatalogoAchievement:
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = list(righe)
+    db = AsyncMock()
+    db.execute = AsyncMock(return_value=result)
+    catalogo = CatalogoAchievement()
+    await catalogo.carica(db)
+    return catalogo
+
+
+def _result_metriche(**valori):
+    """Riga contatori utente per leggi_metriche."""
+    riga = {
+        "nodi_completati": 0,
+        "esercizi_risolti": 0,
+        "esercizi_consecutivi_max": 0,
+        "temi_completati": 0,
+        "sessioni_completate": 0,
+        "streak_corrente": 0,
+        "streak_ultimo_giorno": None,
+    }
+    riga.update(valori)
+    result = MagicMock()
+    result.one_or_none.return_value = SimpleNamespace(**riga)
+    return result
+
+
+def _result_inseriti(ids):
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = ids
+    return result
+
+
+class TestCatalogoAchievement:
     @pytest.mark.asyncio
-    async def test_non_sblocca_se_condizione_non_soddisfatta(self):
-        """Non sblocca se il valore corrente è inferiore al richiesto."""
-        db = AsyncMock()
+    async def test_indice_per_metrica_ordinato_per_soglia(self):
+        catalogo = await _catalogo(
+            _defn("cinque_nodi", "nodi_completati", 5),
+            _defn("primo_nodo", "nodi_completati", 1),
+            _defn("prima_sessione", "sessioni_completate", 1),
+        )
 
-        defn = MagicMock()
-        defn.id = "cinque_nodi"
-        defn.nome = "Cinque su cinque"
-        defn.tipo = "sigillo"
-        defn.condizione = {"tipo": "nodi_completati", "valore": 5}
+        ids = [d.id for d in catalogo.per_metriche(["nodi_completati"])]
+        assert ids == ["primo_nodo", "cinque_nodi"]
+        assert catalogo.per_metriche(["streak"]) == []
+        assert len(catalogo.per_metriche(None)) == 3
 
-        result_def = MagicMock()
-        result_def.scalars.return_value.all.return_value = [defn]
+    def test_non_caricato_errore(self):
+        with pytest.raises(RuntimeError):
+            CatalogoAchievement().definizioni
 
-        result_sbl = MagicMock()
-        result_sbl.scalars.return_value.all.return_value = []
+    def test_metriche_per_eventi(self):
+        assert metriche_per_eventi(["risposta_esercizio"]) == {
+            "esercizi_risolti", "esercizi_consecutivi_ok",
+        }
+        assert metriche_per_eventi(["promozione"]) == {"nodi_completati", "tema_completato"}
+        assert metriche_per_eventi(["energia_utente", "mostra_formula"]) == set()
+
+    def test_ogni_metrica_del_seed_ha_evento_e_contatore(self):
+        da_eventi = metriche_per_eventi(METRICHE_PER_EVENTO)
+        for ach in ACHIEVEMENT_SEED:
+            metrica = ach["condizione"]["tipo"]
+            assert metrica in da_eventi
+            assert metrica in _COLONNE_METRICA or metrica == "streak"
+
+
+class TestVerificaAchievement:
+    """Condizioni valutate sui contatori per utente, solo per le metriche toccate."""
 
-        # Metrica: count nodi completati = 3 (< 5)
-        result_count = MagicMock()
-        result_count.scalar_one.return_value = 3
+    @pytest.mark.asyncio
+    async def test_nessuna_definizione_per_metriche_toccate(self):
+        """Eventi senza achievement collegati: nessuna query."""
+        catalogo = await _catalogo(_defn("primo_nodo", "nodi_completati", 1))
+        db = AsyncMock()
 
-        db.execute = AsyncMock(side_effect=[result_def, result_sbl, result_count])
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            nuovi = await verifica_achievement(uuid.uuid4(), db, ["streak"])
 
-        nuovi = await verifica_achievement(uuid.uuid4(), db)
         assert nuovi == []
+        db.execute.assert_not_awaited()
 
     @pytest.mark.asyncio
-    async def test_sblocca_prima_sessione(self):
-        """Sblocca 'prima_sessione' quando sessioni_completate >= 1."""
+    async def test_sblocca_primo_nodo(self):
+        """Sblocca 'primo_nodo' quando nodi_completati >= 1: due statement."""
+        catalogo = await _catalogo(_defn("primo_nodo", "nodi_completati", 1))
         db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            _result_metriche(nodi_completati=1),
+            _result_inseriti(["primo_nodo"]),
+        ])
 
-        defn = MagicMock()
-        defn.id = "prima_sessione"
-        defn.nome = "Si parte!"
-        defn.tipo = "sigillo"
-        defn.condizione = {"tipo": "sessioni_completate", "valore": 1}
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            nuovi = await verifica_achievement(uuid.uuid4(), db, ["nodi_completati"])
 
-        result_def = MagicMock()
-        result_def.scalars.return_value.all.return_value = [defn]
+        assert nuovi == [{"id": "primo_nodo", "nome": "Primo Nodo", "tipo": "sigillo"}]
+        assert db.execute.await_count == 2
+        sql = str(db.execute.call_args.args[0])
+        assert "ON CONFLICT" in sql
+        assert "RETURNING" in sql
 
-        result_sbl = MagicMock()
-        result_sbl.scalars.return_value.all.return_value = []
+    @pytest.mark.asyncio
+    async def test_achievement_gia_sbloccato_non_ritornato(self):
+        """L'INSERT ... ON CONFLICT DO NOTHING non ritorna gli achievement gia' presenti."""
+        catalogo = await _catalogo(_defn("primo_nodo", "nodi_completati", 1))
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            _result_metriche(nodi_completati=4), _result_inseriti([]),
+        ])
 
-        # Metrica: sessioni completate = 1
-        result_count = MagicMock()
-        result_count.scalar_one.return_value = 1
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            nuovi = await verifica_achievement(uuid.uuid4(), db, ["nodi_completati"])
 
-        db.execute = AsyncMock(side_effect=[result_def, result_sbl, result_count])
-        db.add = MagicMock()
-        db.flush = AsyncMock()
+        assert nuovi == []
 
-        nuovi = await verifica_achievement(uuid.uuid4(), db)
-        assert len(nuovi) == 1
-        assert nuovi[0]["id"] == "prima_sessione"
+    @pytest.mark.asyncio
+    async def test_non_sblocca_se_condizione_non_soddisfatta(self):
+        catalogo = await _catalogo(_defn("cinque_nodi", "nodi_completati", 5))
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_metriche(nodi_completati=3)])
+
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            nuovi = await verifica_achievement(uuid.uuid4(), db, ["nodi_completati"])
+
+        assert nuovi == []
+        assert db.execute.await_count == 1
 
     @pytest.mark.asyncio
-    async def test_sblocca_multipli_in_un_turno(self):
-        """Può sbloccare più achievement in un singolo turno."""
+    async def test_solo_metriche_toccate(self):
+        """Una risposta esercizio non valuta le condizioni sui nodi."""
+        catalogo = await _catalogo(
+            _defn("primo_nodo", "nodi_completati", 1),
+            _defn("dieci_esercizi", "esercizi_risolti", 10),
+        )
         db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            _result_metriche(nodi_completati=3, esercizi_risolti=10),
+            _result_inseriti(["dieci_esercizi"]),
+        ])
 
-        defn1 = MagicMock()
-        defn1.id = "primo_nodo"
-        defn1.nome = "Primo passo!"
-        defn1.tipo = "sigillo"
-        defn1.condizione = {"tipo": "nodi_completati", "valore": 1}
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            nuovi = await verifica_achievement(
+                uuid.uuid4(), db, metriche_per_eventi(["risposta_esercizio"])
+            )
 
-        defn2 = MagicMock()
-        defn2.id = "prima_sessione"
-        defn2.nome = "Si parte!"
-        defn2.tipo = "sigillo"
-        defn2.condizione = {"tipo": "sessioni_completate", "valore": 1}
+        assert [a["id"] for a in nuovi] == ["dieci_esercizi"]
+        inserito = db.execute.call_args.args[0].compile().params
+        assert "primo_nodo" not in inserito.values()
 
+    @pytest.mark.asyncio
+    async def test_sblocca_multipli_e_streak_memorizzato(self):
+        catalogo = await _catalogo(
+            _defn("prima_sessione", "sessioni_completate", 1),
+            _defn("streak_3", "streak", 3, tipo="medaglia"),
+        )
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[
+            _result_metriche(
+                sessioni_completate=1,
+                streak_corrente=3,
+                streak_ultimo_giorno=date.today(),
+            ),
+            _result_inseriti(["prima_sessione", "streak_3"]),
+        ])
+
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            nuovi = await verifica_achievement(uuid.uuid4(), db)
+
+        assert {a["id"] for a in nuovi} == {"prima_sessione", "streak_3"}
+
+    @pytest.mark.asyncio
+    async def test_carica_catalogo_se_assente(self):
+        catalogo = CatalogoAchievement()
         result_def = MagicMock()
-        result_def.scalars.return_value.all.return_value = [defn1, defn2]
+        result_def.scalars.return_value.all.return_value = []
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result_def)
 
-        result_sbl = MagicMock()
-        result_sbl.scalars.return_value.all.return_value = []
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            assert await verifica_achievement(uuid.uuid4(), db) == []
 
-        # Metriche: nodi=1, sessioni=1
-        result_nodi = MagicMock()
-        result_nodi.scalar_one.return_value = 1
-        result_sessioni = MagicMock()
-        result_sessioni.scalar_one.return_value = 1
+        assert catalogo.caricato
 
-        db.execute = AsyncMock(
-            side_effect=[result_def, result_sbl, result_nodi, result_sessioni]
+
+class TestTemiCompletati:
+    def _grafo(self):
+        import networkx as nx
+
+        g = nx.DiGraph()
+        for nodo in ("a", "b", "d"):
+            g.add_node(nodo, tipo_nodo="operativo")
+        g.add_node("c", tipo_nodo="contesto")
+        # nodi_progresso: nodi del tema esclusi quelli di contesto ("c")
+        temi = {"t1": ("a", "b"), "t2": ("b", "d")}
+        mock = MagicMock()
+        mock.caricato = True
+        mock.grafo = g
+        mock.tema.side_effect = lambda t: InfoTema(
+            id=t, nome=t, materia="matematica", descrizione=None, nodi_progresso=temi[t]
         )
-        db.add = MagicMock()
-        db.flush = AsyncMock()
+        mock.temi_nodo.side_effect = lambda n: tuple(t for t, nodi in temi.items() if n in nodi)
+        return mock
+
+    def test_tema_completato_ignora_nodi_contesto(self):
+        livelli = {"a": "operativo", "b": "operativo", "d": "in_corso"}
+        with patch("app.core.gamification.grafo_knowledge", self._grafo()):
+            assert temi_completati_da(["b"], livelli) == 1
 
-        nuovi = await verifica_achievement(uuid.uuid4(), db)
-        assert len(nuovi) == 2
-        ids = {a["id"] for a in nuovi}
-        assert ids == {"primo_nodo", "prima_sessione"}
+    def test_nessun_tema_completato(self):
+        livelli = {"a": "in_corso", "b": "operativo"}
+        with patch("app.core.gamification.grafo_knowledge", self._grafo()):
+            assert temi_completati_da(["b"], livelli) == 0
 
 
 # ===================================================================
@@ -369,28 +604,13 @@ class TestVerificaAchievement:
 class TestListaAchievement:
     @pytest.mark.asyncio
     async def test_lista_con_sbloccato_e_prossimo(self):
-        """Lista mostra sbloccati e prossimi con progresso."""
+        """Lista mostra sbloccati e prossimi con progresso dai contatori."""
         from datetime import datetime, timezone
 
-        db = AsyncMock()
-
-        # Definizioni
-        defn1 = MagicMock()
-        defn1.id = "primo_nodo"
-        defn1.nome = "Primo passo!"
-        defn1.tipo = "sigillo"
-        defn1.descrizione = None
-        defn1.condizione = {"tipo": "nodi_completati", "valore": 1}
-
-        defn2 = MagicMock()
-        defn2.id = "cinque_nodi"
-        defn2.nome = "Cinque su cinque"
-        defn2.tipo = "sigillo"
-        defn2.descrizione = None
-        defn2.condizione = {"tipo": "nodi_completati", "valore": 5}
-
-        result_def = MagicMock()
-        result_def.scalars.return_value.all.return_value = [defn1, defn2]
+        catalogo = await _catalogo(
+            _defn("primo_nodo", "nodi_completati", 1),
+            _defn("cinque_nodi", "nodi_completati", 5),
+        )
 
         # Sbloccati: solo primo_nodo
         ach_utente = MagicMock()
@@ -399,15 +619,13 @@ class TestListaAchievement:
         result_sbl = MagicMock()
         result_sbl.scalars.return_value.all.return_value = [ach_utente]
 
-        # Metrica per cinque_nodi: 3 nodi completati
-        result_count = MagicMock()
-        result_count.scalar_one.return_value = 3
-
+        db = AsyncMock()
         db.execute = AsyncMock(
-            side_effect=[result_def, result_sbl, result_count]
+            side_effect=[result_sbl, _result_metriche(nodi_completati=3)]
         )
 
-        risultato = await lista_achievement_utente(uuid.uuid4(), db)
+        with patch("app.core.gamification.catalogo_achievement", catalogo):
+            risultato = await lista_achievement_utente(uuid.uuid4(), db)
         assert len(risultato["sbloccati"]) == 1
         assert risultato["sbloccati"][0]["id"] == "primo_nodo"
 
@@ -480,42 +698,123 @@ class TestSchemas:
 
 class TestIntegrazioneTurno:
     @pytest.mark.asyncio
-    async def test_verifica_achievement_safe_funziona(self):
-        """_verifica_achievement_safe chiama verifica_achievement con db."""
-        from app.core.turno import _verifica_achievement_safe
+    async def test_preleva_achievement_safe_funziona(self):
+        """_preleva_achievement_safe ritorna gli achievement sbloccati dal worker."""
+        from app.core.turno import _preleva_achievement_safe
 
         with patch(
-            "app.core.gamification.verifica_achievement",
+            "app.core.gamification.preleva_achievement_da_notificare",
             return_value=[{"id": "primo_nodo", "nome": "Primo passo!", "tipo": "sigillo"}],
-        ) as mock_va:
+        ) as mock_pa:
             db = AsyncMock()
             uid = uuid.uuid4()
-            result = await _verifica_achievement_safe(uid, db)
+            result = await _preleva_achievement_safe(uid, db)
             assert len(result) == 1
-            mock_va.assert_called_once_with(uid, db)
+            mock_pa.assert_called_once_with(uid, db)
 
     @pytest.mark.asyncio
-    async def test_verifica_achievement_safe_non_blocca_su_errore(self):
-        """Se verifica_achievement fallisce, ritorna lista vuota."""
-        from app.core.turno import _verifica_achievement_safe
+    async def test_preleva_achievement_safe_non_blocca_su_errore(self):
+        """Se la lettura fallisce, ritorna lista vuota e annulla la transazione."""
+        from app.core.turno import _preleva_achievement_safe
 
         with patch(
-            "app.core.gamification.verifica_achievement",
+            "app.core.gamification.preleva_achievement_da_notificare",
             side_effect=RuntimeError("DB down"),
         ):
             db = AsyncMock()
-            result = await _verifica_achievement_safe(uuid.uuid4(), db)
+            result = await _preleva_achievement_safe(uuid.uuid4(), db)
             assert result == []
+            db.rollback.assert_awaited_once()
 
     @pytest.mark.asyncio
-    async def test_aggiorna_stats_safe_non_blocca_su_errore(self):
-        """Se aggiorna_statistiche fallisce, non blocca il turno."""
-        from app.core.turno import _aggiorna_stats_safe
+    async def test_preleva_achievement_da_notificare(self):
+        """Un solo UPDATE ... RETURNING marca e ritorna gli achievement."""
+        from app.core.gamification import preleva_achievement_da_notificare
+
+        result = MagicMock()
+        result.all.return_value = [
+            MagicMock(id="primo_nodo", nome="Primo passo!", tipo="sigillo"),
+        ]
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result)
+
+        nuovi = await preleva_achievement_da_notificare(uuid.uuid4(), db)
+
+        assert nuovi == [{"id": "primo_nodo", "nome": "Primo passo!", "tipo": "sigillo"}]
+        assert db.execute.call_count == 1
+
+
+# ===================================================================
+# Test: riconciliazione periodica
+# ===================================================================
 
+
+class TestRiconciliazione:
+    @pytest.mark.asyncio
+    async def test_ricalcola_giorni_e_streak_per_utente(self):
+        from app.core.gamification import riconcilia_statistiche
+
+        uid = uuid.uuid4()
+        result = MagicMock()
+        result.scalars.return_value.all.return_value = [uid]
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result)
+
+        with (
+            patch(
+                "app.core.gamification.ricalcola_statistiche_giornaliere",
+                new_callable=AsyncMock,
+            ) as ricalcola,
+            patch(
+                "app.core.gamification.ricalcola_streak",
+                new_callable=AsyncMock,
+                return_value=(3, date.today()),
+            ),
+            patch(
+                "app.core.gamification.ricalcola_contatori_utente",
+                new_callable=AsyncMock,
+            ) as contatori,
+        ):
+            n = await riconcilia_statistiche(db)
+
+        assert n == 1
+        giorni = [c.args[2] for c in ricalcola.await_args_list]
+        assert giorni == [date.today() - timedelta(days=1), date.today()]
+        contatori.assert_awaited_once_with(db, uid)
+        sql_streak = str(db.execute.call_args.args[0])
+        assert "UPDATE utenti" in sql_streak
+        db.commit.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_task_esegue_all_avvio_e_si_ferma(self):
+        import asyncio
+        from contextlib import asynccontextmanager
+
+        from app.core.riconciliazione import RiconciliazioneStatistiche
+
+        @asynccontextmanager
+        async def factory():
+            yield AsyncMock()
+
+        task = RiconciliazioneStatistiche(session_factory=factory, intervallo_sec=60)
         with patch(
-            "app.core.gamification.aggiorna_statistiche_giornaliere",
-            side_effect=RuntimeError("DB down"),
+            "app.core.gamification.riconcilia_statistiche",
+            new_callable=AsyncMock,
+            return_value=2,
         ):
-            db = AsyncMock()
-            # Non deve sollevare eccezione
-            await _aggiorna_stats_safe(uuid.uuid4(), db)
+            task.avvia()
+            assert task.attivo
+            for _ in range(5):
+                await asyncio.sleep(0)
+            await task.ferma()
+
+        assert not task.attivo
+        assert task.esecuzioni == 1
+        assert task.utenti_riconciliati == 2
+
+    def test_intervallo_zero_disattiva(self):
+        from app.core.riconciliazione import RiconciliazioneStatistiche
+
+        task = RiconciliazioneStatistiche(session_factory=MagicMock(), intervallo_sec=0)
+        task.avvia()
+        assert not task.attivo
@@ -12,15 +12,24 @@ async def test_health_check():
     async with AsyncClient(transport=transport, base_url="http://test") as client:
         response = await client.get("/health")
     assert response.status_code == 200
-    assert response.json() == {"status": "ok"}
+    data = response.json()
+    assert data["status"] == "ok"
+    assert {"caricato", "ricarica_in_corso", "ricariche", "ultimo_errore"} <= data["grafo"].keys()
+    metriche = data["metriche"]
+    assert {"checkout", "in_uso", "possesso_medio_sec"} <= metriche["pool"].keys()
+    for cache in ("cache_token", "cache_utenti", "cache_livelli", "cache_tentati"):
+        assert {"hit", "miss", "hit_ratio"} <= metriche[cache].keys()
+    assert isinstance(metriche["llm"], dict)  # per modello, dopo la prima chiamata
+    assert {"attive", "in_coda", "attesa_max_sec"} <= metriche["esecutori"]["hash"].keys()
 
 
 def test_import_all_models():
-    """Verifica che tutti i 17 modelli si importino senza errori."""
+    """Verifica che tutti i 18 modelli si importino senza errori."""
     from app.db.models import (
         AchievementDefinizione,
         AchievementUtente,
         Esercizio,
+        LavoroOutbox,
         Nodo,
         NodoTema,
         NotaUtente,
@@ -42,9 +51,9 @@ def test_import_all_models():
         StatoNodoUtente, StoricoEsercizi, StoricoErrori,
         Utente, PercorsoUtente, Sessione, TurnoConversazione,
         NotaUtente, StatoTemaUtente, AchievementDefinizione,
-        AchievementUtente, StatisticaGiornaliera,
+        AchievementUtente, StatisticaGiornaliera, LavoroOutbox,
     ]
-    assert len(models) == 17
+    assert len(models) == 18
 
 
 def test_all_tables_registered():
@@ -57,7 +66,7 @@ def test_all_tables_registered():
         "stato_nodi_utente", "storico_esercizi", "storico_errori",
         "utenti", "percorsi_utente", "sessioni", "turni_conversazione",
         "note_utente", "stato_temi_utente", "achievement_definizioni",
-        "achievement_utente", "statistiche_giornaliere",
+        "achievement_utente", "statistiche_giornaliere", "outbox_lavori",
     }
     actual_tables = set(Base.metadata.tables.keys())
     assert expected_tables == actual_tables
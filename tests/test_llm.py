@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import asyncio
+import json
 from dataclasses import dataclass
 from unittest.mock import MagicMock, patch
 
@@ -172,6 +174,8 @@ class FakeStopDelta:
 class FakeUsage:
     input_tokens: int = 0
     output_tokens: int = 0
+    cache_read_input_tokens: int | None = None
+    cache_creation_input_tokens: int | None = None
 
 
 @dataclass
@@ -399,3 +403,220 @@ class TestClientStreaming:
         # Modello sconosciuto: fallback a default (3.0, 15.0)
         costo_u = _stima_costo("unknown-model", 1000, 500)
         assert costo_u == expected
+
+    @pytest.mark.asyncio
+    async def test_costo_con_prompt_caching(self):
+        from app.llm.client import _stima_costo
+
+        # Lettura cache a 0.1x, scrittura a 1.25x del prezzo input
+        costo = _stima_costo("claude-sonnet-4-5-20250929", 100, 500, 10_000, 2_000)
+        expected = ((100 + 10_000 * 0.1 + 2_000 * 1.25) * 3.0 + 500 * 15.0) / 1_000_000
+        assert abs(costo - expected) < 1e-9
+
+    @pytest.mark.asyncio
+    async def test_token_cache_registrati(self):
+        from app.llm.client import chiama_tutor
+
+        eventi_stream = [
+            FakeMessageStart(message=FakeMessage(usage=FakeUsage(
+                input_tokens=40,
+                cache_read_input_tokens=3000,
+                cache_creation_input_tokens=500,
+            ))),
+            FakeContentBlockStart(content_block=FakeBlock(type="text")),
+            FakeContentBlockDelta(delta=FakeTextDelta(text="Ok")),
+            FakeContentBlockStop(),
+            FakeMessageDelta(
+                delta=FakeStopDelta(stop_reason="end_turn"),
+                usage=FakeUsage(output_tokens=5),
+            ),
+        ]
+        mock_client = MagicMock()
+        mock_client.messages.stream.return_value = FakeStream(eventi_stream)
+        system = [
+            {"type": "text", "text": "stabile", "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": "volatile"},
+        ]
+
+        with patch("app.llm.client._get_client", return_value=mock_client):
+            eventi = [
+                e async for e in chiama_tutor(
+                    system=system, messages=[{"role": "user", "content": "ciao"}]
+                )
+            ]
+
+        assert mock_client.messages.stream.call_args.kwargs["system"] == system
+        risultato = eventi[-1]["risultato"]
+        assert risultato.token_input == 40
+        assert risultato.token_cache_lettura == 3000
+        assert risultato.token_cache_scrittura == 500
+
+
+# ===================================================================
+# Test: limiti di concorrenza per modello
+# ===================================================================
+
+
+class TestLimitiLLM:
+    @pytest.mark.asyncio
+    async def test_oltre_il_limite_accoda(self):
+        from app.llm.limiti import LimitiLLM
+
+        limiti = LimitiLLM(concorrenza_per_modello=2)
+        limitatore = limiti.per_modello("m")
+        rilascia = asyncio.Event()
+        massimo_attive = 0
+
+        async def richiesta():
+            nonlocal massimo_attive
+            async with limitatore.slot():
+                massimo_attive = max(massimo_attive, limitatore.attive)
+                await rilascia.wait()
+
+        tasks = [asyncio.create_task(richiesta()) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert limitatore.attive == 2
+        assert limitatore.in_coda == 3
+
+        rilascia.set()
+        await asyncio.gather(*tasks)
+
+        stats = limiti.statistiche()["m"]
+        assert massimo_attive == 2
+        assert stats["richieste"] == 5
+        assert stats["accodate"] == 3
+        assert stats["attive"] == 0
+        assert stats["in_coda"] == 0
+
+    def test_limitatore_separato_per_modello(self):
+        from app.llm.limiti import LimitiLLM
+
+        limiti = LimitiLLM(concorrenza_per_modello=1)
+        assert limiti.per_modello("a") is limiti.per_modello("a")
+        assert limiti.per_modello("a") is not limiti.per_modello("b")
+
+
+# ===================================================================
+# Test: client condiviso contro un server HTTP locale finto
+# ===================================================================
+
+_SSE_RISPOSTA = "".join(
+    f"event: {tipo}\ndata: {json.dumps(dati)}\n\n"
+    for tipo, dati in [
+        ("message_start", {
+            "type": "message_start",
+            "message": {
+                "id": "msg_1", "type": "message", "role": "assistant",
+                "model": "modello-test", "content": [],
+                "stop_reason": None, "stop_sequence": None,
+                "usage": {"input_tokens": 12, "output_tokens": 1},
+            },
+        }),
+        ("content_block_start", {
+            "type": "content_block_start", "index": 0,
+            "content_block": {"type": "text", "text": ""},
+        }),
+        ("content_block_delta", {
+            "type": "content_block_delta", "index": 0,
+            "delta": {"type": "text_delta", "text": "Ciao"},
+        }),
+        ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+        ("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": 3},
+        }),
+        ("message_stop", {"type": "message_stop"}),
+    ]
+).encode()
+
+
+class FakeServerAnthropic:
+    """Server HTTP/1.1 keep-alive minimale che risponde in SSE a /v1/messages."""
+
+    def __init__(self) -> None:
+        self.connessioni = 0
+        self.richieste = 0
+        self._server: asyncio.Server | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._gestisci, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *args):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _gestisci(self, reader, writer):
+        self.connessioni += 1
+        try:
+            while True:
+                intestazione = await reader.readuntil(b"\r\n\r\n")
+                lunghezza = 0
+                for riga in intestazione.decode().split("\r\n"):
+                    if riga.lower().startswith("content-length:"):
+                        lunghezza = int(riga.split(":", 1)[1])
+                await reader.readexactly(lunghezza)
+                self.richieste += 1
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: text/event-stream\r\n"
+                    b"Connection: keep-alive\r\n"
+                    + f"Content-Length: {len(_SSE_RISPOSTA)}\r\n\r\n".encode()
+                    + _SSE_RISPOSTA
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+class TestClientCondiviso:
+    @pytest.mark.asyncio
+    async def test_connessione_riusata_tra_turni(self):
+        from app.llm import client as client_mod
+
+        async with FakeServerAnthropic() as server:
+            with (
+                patch.object(client_mod.settings, "LLM_BASE_URL", server.url),
+                patch.object(client_mod.settings, "ANTHROPIC_API_KEY", "sk-test"),
+                patch.object(client_mod, "_client", None),
+            ):
+                await client_mod.apri_client()
+                try:
+                    for _ in range(3):
+                        eventi = [
+                            e async for e in client_mod.chiama_tutor(
+                                system="test",
+                                messages=[{"role": "user", "content": "ciao"}],
+                                modello="modello-test",
+                            )
+                        ]
+                        risultato = eventi[-1]["risultato"]
+                        assert risultato.testo_completo == "Ciao"
+                        assert risultato.token_input == 12
+                        assert risultato.token_output == 3
+                finally:
+                    await client_mod.chiudi_client()
+
+        assert server.richieste == 3
+        assert server.connessioni == 1
+        stats = client_mod.limiti_llm.statistiche()["modello-test"]
+        assert stats["attive"] == 0
+        assert stats["richieste"] >= 3
+
+    @pytest.mark.asyncio
+    async def test_get_client_riusa_istanza(self):
+        from app.llm import client as client_mod
+
+        with patch.object(client_mod, "_client", None):
+            primo = client_mod._get_client()
+            assert client_mod._get_client() is primo
+            await client_mod.chiudi_client()
+            assert client_mod._client is None
@@ -20,6 +20,7 @@ import pytest
 
 from app.core.onboarding import (
     TURNI_CONOSCENZA_MAX,
+    _inizializza_stato_nodi,
     _trova_nodo_per_tema,
     aggiorna_fase_onboarding,
     completa_onboarding,
@@ -300,73 +301,126 @@ class TestCompletaOnboarding:
 # ===================================================================
 
 
+def _grafo_con_ricerca(mock_grafo, *nodi, temi=()):
+    """Grafo reale + indice di ricerca compilato su (id, attributi) dei nodi."""
+    import networkx as nx
+
+    from app.grafo.ricerca import IndiceRicerca
+
+    grafo = nx.DiGraph()
+    for nodo_id, attrs in nodi:
+        grafo.add_node(nodo_id, **attrs)
+    mock_grafo.caricato = True
+    mock_grafo.grafo = grafo
+    mock_grafo.ricerca = IndiceRicerca.compila(grafo, temi)
+    mock_grafo.nodi_operativi.return_value = tuple(
+        n for n, attrs in nodi if attrs.get("tipo_nodo") == "operativo"
+    )
+
+
 class TestTrovaNodoPerTema:
     @patch("app.core.onboarding.grafo_knowledge")
     def test_match_per_tema_id(self, mock_grafo):
-        mock_grafo.caricato = True
-        g = MagicMock()
-        g.nodes.return_value = [
-            ("nodo_1", {"tipo_nodo": "operativo", "tema_id": "equazioni_secondo_grado"}),
-            ("nodo_2", {"tipo_nodo": "operativo", "tema_id": "frazioni"}),
-        ]
-        # Simula iterazione su nodi con data
-        g.nodes.__iter__ = MagicMock(return_value=iter(["nodo_1", "nodo_2"]))
-        g.nodes.__contains__ = MagicMock(return_value=True)
-
-        # Usa metodo diretto con side_effect
-        def nodes_data(data=False):
-            if data:
-                return [
-                    ("nodo_1", {"tipo_nodo": "operativo", "tema_id": "equazioni_secondo_grado"}),
-                    ("nodo_2", {"tipo_nodo": "operativo", "tema_id": "frazioni"}),
-                ]
-            return ["nodo_1", "nodo_2"]
-
-        g.nodes = MagicMock(side_effect=nodes_data)
-        mock_grafo.grafo = g
-
-        # Reimplementa il test con un grafo reale
-        import networkx as nx
-        grafo_reale = nx.DiGraph()
-        grafo_reale.add_node(
-            "nodo_eq2",
-            tipo_nodo="operativo",
-            tema_id="equazioni_secondo_grado",
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("nodo_eq2", {"tipo_nodo": "operativo", "tema_id": "equazioni_secondo_grado"}),
+            ("nodo_fraz", {"tipo_nodo": "operativo", "tema_id": "frazioni"}),
         )
-        grafo_reale.add_node(
-            "nodo_fraz",
-            tipo_nodo="operativo",
-            tema_id="frazioni",
-        )
-        mock_grafo.grafo = grafo_reale
 
         result = _trova_nodo_per_tema("equazioni secondo grado")
         assert result == "nodo_eq2"
 
     @patch("app.core.onboarding.grafo_knowledge")
     def test_match_per_nodo_id_fallback(self, mock_grafo):
-        mock_grafo.caricato = True
-
-        import networkx as nx
-        grafo = nx.DiGraph()
-        grafo.add_node(
-            "mat_algebra2_discriminante",
-            tipo_nodo="operativo",
-            tema_id="equazioni",
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("mat_algebra2_discriminante", {"tipo_nodo": "operativo", "tema_id": "equazioni"}),
         )
-        mock_grafo.grafo = grafo
 
         result = _trova_nodo_per_tema("discriminante")
         assert result == "mat_algebra2_discriminante"
 
     @patch("app.core.onboarding.grafo_knowledge")
-    def test_nessun_match(self, mock_grafo):
-        mock_grafo.caricato = True
+    def test_match_per_nome_italiano_e_parole_chiave(self, mock_grafo):
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("mat_pit", {
+                "tipo_nodo": "operativo", "tema_id": "geometria",
+                "nome": "Teorema di Pitagora", "parole_chiave": ["ipotenusa"],
+            }),
+            ("mat_prob", {
+                "tipo_nodo": "operativo", "tema_id": "statistica",
+                "nome": "Probabilità condizionata",
+            }),
+        )
 
-        import networkx as nx
-        grafo = nx.DiGraph()
-        grafo.add_node("nodo_1", tipo_nodo="operativo", tema_id="algebra")
-        mock_grafo.grafo = grafo
+        assert _trova_nodo_per_tema("pitagora") == "mat_pit"
+        assert _trova_nodo_per_tema("ipotenusa") == "mat_pit"
+        assert _trova_nodo_per_tema("probabilita") == "mat_prob"
+
+    @patch("app.core.onboarding.grafo_knowledge")
+    def test_match_per_tema_ritorna_primo_nodo(self, mock_grafo):
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("mat_sist1", {"tipo_nodo": "operativo", "tema_id": "sistemi"}),
+            ("mat_sist2", {"tipo_nodo": "operativo", "tema_id": "sistemi"}),
+            temi=[("sistemi", "Sistemi lineari")],
+        )
+
+        assert _trova_nodo_per_tema("sistemi lineari") == "mat_sist1"
+
+    @patch("app.core.onboarding.grafo_knowledge")
+    def test_match_parziale_senza_embedding(self, mock_grafo):
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("mat_eq2", {"tipo_nodo": "operativo", "nome": "Equazioni di secondo grado"}),
+            ("mat_sist", {"tipo_nodo": "operativo", "nome": "Sistemi di equazioni"}),
+        )
+
+        # Nessun nodo contiene "parabola": vince il seme con piu' parole trovate
+        assert _trova_nodo_per_tema("parabola secondo grado") == "mat_eq2"
+
+    @patch("app.core.onboarding.grafo_knowledge")
+    def test_match_parziale_con_embedding(self, mock_grafo):
+        from app.grafo.semantica import EmbeddingNodi, IndiceEmbedding
+
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("mat_eq1", {"tipo_nodo": "operativo", "nome": "Equazioni lineari"}),
+            ("mat_eq2", {"tipo_nodo": "operativo", "nome": "Equazioni di secondo grado"}),
+            ("mat_disc", {"tipo_nodo": "operativo", "nome": "Discriminante"}),
+            ("mat_ctx", {"tipo_nodo": "contesto", "nome": "Contesto"}),
+        )
+        embedding = EmbeddingNodi()
+        embedding._indice = IndiceEmbedding.compila([
+            ("mat_eq1", [1.0, 0.0, 0.0]),
+            ("mat_eq2", [0.6, 0.8, 0.0]),
+            ("mat_disc", [0.0, 1.0, 0.0]),
+            ("mat_ctx", [0.7, 0.7, 0.0]),
+        ])
+
+        with patch("app.core.onboarding.embedding_nodi", embedding):
+            # Semi: mat_eq1, mat_eq2, mat_disc → centroide piu' vicino a mat_eq2
+            # (mat_ctx sarebbe piu' vicino ma non e' operativo)
+            assert _trova_nodo_per_tema("equazioni discriminante quantistiche") == "mat_eq2"
+
+    @patch("app.core.onboarding.grafo_knowledge")
+    def test_match_parziale_debole_nessun_nodo(self, mock_grafo):
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("mat_pot", {"tipo_nodo": "operativo", "nome": "Potenze", "tema_id": "potenze"}),
+            ("mat_eq", {"tipo_nodo": "operativo", "nome": "Equazioni", "tema_id": "equazioni"}),
+        )
+
+        # "po" e' prefisso di "potenze", "equaz" di "equazioni": nessuna parola intera
+        assert _trova_nodo_per_tema("non so da dove partire, un po' tutto") is None
+        assert _trova_nodo_per_tema("equaz boh") is None
+
+    @patch("app.core.onboarding.grafo_knowledge")
+    def test_nessun_match(self, mock_grafo):
+        _grafo_con_ricerca(
+            mock_grafo, ("nodo_1", {"tipo_nodo": "operativo", "tema_id": "algebra"}),
+        )
 
         result = _trova_nodo_per_tema("fisica quantistica")
         assert result is None
@@ -380,26 +434,89 @@ class TestTrovaNodoPerTema:
 
     @patch("app.core.onboarding.grafo_knowledge")
     def test_ignora_nodi_contesto(self, mock_grafo):
-        mock_grafo.caricato = True
-
-        import networkx as nx
-        grafo = nx.DiGraph()
-        grafo.add_node(
-            "nodo_contesto",
-            tipo_nodo="contesto",
-            tema_id="equazioni_secondo_grado",
+        _grafo_con_ricerca(
+            mock_grafo,
+            ("nodo_contesto", {"tipo_nodo": "contesto", "tema_id": "equazioni_secondo_grado"}),
+            ("nodo_operativo", {"tipo_nodo": "operativo", "tema_id": "frazioni"}),
         )
-        grafo.add_node(
-            "nodo_operativo",
-            tipo_nodo="operativo",
-            tema_id="frazioni",
-        )
-        mock_grafo.grafo = grafo
 
         result = _trova_nodo_per_tema("equazioni secondo grado")
         assert result is None  # nodo_contesto viene ignorato
 
 
+# ===================================================================
+# Test: inizializzazione stato nodi in blocco
+# ===================================================================
+
+
+def _grafo_lineare(n: int, contesto: tuple[str, ...] = ()):
+    """n0 -> n1 -> ... in ordine topologico; i nodi in `contesto` non sono operativi."""
+    mock = MagicMock()
+    mock.caricato = True
+    ordine = [f"n{i}" for i in range(n)]
+    mock.indice.ordine_topologico = ordine
+    mock.grafo.nodes = {
+        nodo: {"tipo_nodo": "contesto" if nodo in contesto else "operativo"}
+        for nodo in ordine
+    }
+    return mock
+
+
+def _righe_inserite(db) -> list[dict]:
+    righe = []
+    for chiamata in db.execute.await_args_list:
+        stmt = chiamata.args[0]
+        assert "ON CONFLICT" in str(stmt)
+        righe.extend(
+            {getattr(col, "key", col): val for col, val in riga.items()}
+            for riga in stmt._multi_values[0]
+        )
+    return righe
+
+
+class TestInizializzaStatoNodi:
+    @pytest.mark.asyncio
+    @patch("app.core.onboarding.settings")
+    async def test_sparso_scrive_solo_presunti(self, mock_settings):
+        mock_settings.ONBOARDING_STATO_SPARSO = True
+        db = AsyncMock()
+        with patch("app.core.onboarding.grafo_knowledge", _grafo_lineare(6, ("n1",))):
+            n = await _inizializza_stato_nodi(db, uuid.uuid4(), "n3")
+
+        assert n == 2
+        assert db.execute.await_count == 1
+        righe = _righe_inserite(db)
+        assert [r["nodo_id"] for r in righe] == ["n0", "n2"]
+        assert all(r["presunto"] and r["livello"] == "operativo" for r in righe)
+
+    @pytest.mark.asyncio
+    @patch("app.core.onboarding.settings")
+    async def test_sparso_senza_override_nessuna_scrittura(self, mock_settings):
+        mock_settings.ONBOARDING_STATO_SPARSO = True
+        db = AsyncMock()
+        with patch("app.core.onboarding.grafo_knowledge", _grafo_lineare(5)):
+            n = await _inizializza_stato_nodi(db, uuid.uuid4(), None)
+
+        assert n == 0
+        db.execute.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    @patch("app.core.onboarding.RIGHE_PER_INSERT", 2)
+    @patch("app.core.onboarding.settings")
+    async def test_denso_insert_multiriga_a_lotti(self, mock_settings):
+        mock_settings.ONBOARDING_STATO_SPARSO = False
+        db = AsyncMock()
+        with patch("app.core.onboarding.grafo_knowledge", _grafo_lineare(5)):
+            n = await _inizializza_stato_nodi(db, uuid.uuid4(), "n2")
+
+        assert n == 5
+        assert db.execute.await_count == 3  # 2 + 2 + 1 righe
+        righe = _righe_inserite(db)
+        assert [r["livello"] for r in righe] == [
+            "operativo", "operativo", "non_iniziato", "non_iniziato", "non_iniziato",
+        ]
+
+
 # ===================================================================
 # Test: Pydantic schemas
 # ===================================================================
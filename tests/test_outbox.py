@@ -0,0 +1,250 @@
+"""Test outbox post-turno — accodamento e worker (no DB reale)."""
+
+from __future__ import annotations
+
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.core.outbox import (
+    LAVORO_POST_TURNO,
+    WorkerOutbox,
+    accoda_lavoro,
+)
+from app.db.models.outbox import LavoroOutbox
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+
+def _lavoro(id_: int = 1, tipo: str = LAVORO_POST_TURNO, tentativi: int = 0):
+    return LavoroOutbox(
+        id=id_, tipo=tipo, utente_id=uuid.uuid4(), stato="in_attesa", tentativi=tentativi
+    )
+
+
+def _db_con_lavori(lavori):
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = lavori
+    db = AsyncMock()
+    db.execute = AsyncMock(return_value=result)
+    db.begin_nested = MagicMock()  # async context manager (savepoint)
+    return db
+
+
+def _worker(**kwargs) -> WorkerOutbox:
+    base = {
+        "session_factory": MagicMock(),
+        "n_worker": 1,
+        "intervallo_sec": 0.01,
+        "lotto": 10,
+        "max_tentativi": 3,
+    }
+    base.update(kwargs)
+    return WorkerOutbox(**base)
+
+
+# ===================================================================
+# Test: accodamento nella transazione del turno
+# ===================================================================
+
+
+class TestAccodaLavoro:
+    def test_aggiunge_alla_sessione_senza_commit(self):
+        db = MagicMock()
+        uid, sid = uuid.uuid4(), uuid.uuid4()
+
+        lavoro = accoda_lavoro(db, LAVORO_POST_TURNO, utente_id=uid, sessione_id=sid)
+
+        db.add.assert_called_once_with(lavoro)
+        db.commit.assert_not_called()
+        assert lavoro.tipo == LAVORO_POST_TURNO
+        assert lavoro.utente_id == uid
+        assert lavoro.sessione_id == sid
+
+
+# ===================================================================
+# Test: WorkerOutbox
+# ===================================================================
+
+
+class TestWorkerOutbox:
+    @pytest.mark.asyncio
+    async def test_lotto_completato(self):
+        lavori = [_lavoro(1), _lavoro(2)]
+        db = _db_con_lavori(lavori)
+        gestore = AsyncMock()
+        worker = _worker()
+
+        with patch.dict("app.core.outbox.GESTORI_OUTBOX", {LAVORO_POST_TURNO: gestore}):
+            eseguiti = await worker.esegui_lotto(db)
+
+        assert eseguiti == 2
+        assert gestore.await_count == 2
+        assert all(lav.stato == "completato" for lav in lavori)
+        assert all(lav.completato_at is not None for lav in lavori)
+        db.commit.assert_awaited_once()
+        assert worker.statistiche()["completati"] == 2
+
+    @pytest.mark.asyncio
+    async def test_prelievo_con_skip_locked(self):
+        db = _db_con_lavori([])
+        eseguiti = await _worker().esegui_lotto(db)
+
+        assert eseguiti == 0
+        query = db.execute.call_args.args[0]
+        assert query._for_update_arg is not None
+        assert query._for_update_arg.skip_locked is True
+        db.commit.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_errore_ritenta_con_backoff(self):
+        ok, ko = _lavoro(1), _lavoro(2)
+        db = _db_con_lavori([ko, ok])
+
+        async def gestore(_db, lavoro):
+            if lavoro is ko:
+                raise RuntimeError("DB down")
+
+        worker = _worker()
+        prima = datetime.now(timezone.utc)
+        with patch.dict("app.core.outbox.GESTORI_OUTBOX", {LAVORO_POST_TURNO: gestore}):
+            await worker.esegui_lotto(db)
+
+        assert ok.stato == "completato"
+        assert ko.stato == "in_attesa"
+        assert ko.tentativi == 1
+        assert ko.disponibile_da > prima
+        assert "DB down" in ko.errore
+        assert worker.statistiche()["ritentati"] == 1
+
+    @pytest.mark.asyncio
+    async def test_fallito_dopo_max_tentativi(self):
+        lavoro = _lavoro(1, tentativi=2)
+        db = _db_con_lavori([lavoro])
+        gestore = AsyncMock(side_effect=RuntimeError("boom"))
+
+        worker = _worker(max_tentativi=3)
+        with patch.dict("app.core.outbox.GESTORI_OUTBOX", {LAVORO_POST_TURNO: gestore}):
+            await worker.esegui_lotto(db)
+
+        assert lavoro.stato == "fallito"
+        assert lavoro.tentativi == 3
+        assert worker.statistiche()["falliti"] == 1
+
+    @pytest.mark.asyncio
+    async def test_tipo_sconosciuto_non_blocca_il_lotto(self):
+        sconosciuto, ok = _lavoro(1, tipo="boh"), _lavoro(2)
+        db = _db_con_lavori([sconosciuto, ok])
+
+        with patch.dict("app.core.outbox.GESTORI_OUTBOX", {LAVORO_POST_TURNO: AsyncMock()}):
+            await _worker().esegui_lotto(db)
+
+        assert sconosciuto.tentativi == 1
+        assert "sconosciuto" in sconosciuto.errore
+        assert ok.stato == "completato"
+
+    @pytest.mark.asyncio
+    async def test_verifica_achievement_sulle_metriche_del_lavoro(self):
+        from app.core.outbox import _esegui_verifica_achievement
+
+        lavoro = _lavoro(1)
+        lavoro.payload = {"metriche": ["nodi_completati"]}
+        db = AsyncMock()
+        with patch("app.core.gamification.verifica_achievement") as achievement:
+            await _esegui_verifica_achievement(db, lavoro)
+
+        achievement.assert_awaited_once_with(lavoro.utente_id, db, ["nodi_completati"])
+
+    @pytest.mark.asyncio
+    async def test_lavoro_senza_payload_verifica_tutte_le_metriche(self):
+        from app.core.outbox import _esegui_verifica_achievement
+
+        lavoro = _lavoro(1)
+        db = AsyncMock()
+        with patch("app.core.gamification.verifica_achievement") as achievement:
+            await _esegui_verifica_achievement(db, lavoro)
+
+        achievement.assert_awaited_once_with(lavoro.utente_id, db, None)
+
+    @pytest.mark.asyncio
+    async def test_avvia_sveglia_ferma(self):
+        lavoro = _lavoro(1)
+        db = _db_con_lavori([])
+        eseguito = asyncio.Event()
+
+        @asynccontextmanager
+        async def factory():
+            yield db
+
+        async def gestore(_db, _lavoro):
+            eseguito.set()
+
+        worker = _worker(session_factory=factory, intervallo_sec=60)
+        with patch.dict("app.core.outbox.GESTORI_OUTBOX", {LAVORO_POST_TURNO: gestore}):
+            worker.avvia()
+            assert worker.attivo
+            await asyncio.sleep(0)
+
+            # Nuovo lavoro committato: la sveglia evita di attendere l'intervallo
+            db.execute.return_value.scalars.return_value.all.return_value = [lavoro]
+            worker.sveglia()
+            await asyncio.wait_for(eseguito.wait(), timeout=1)
+
+            await worker.ferma()
+
+        assert not worker.attivo
+        assert lavoro.stato == "completato"
+
+
+# ===================================================================
+# Test: retenzione dei lavori completati
+# ===================================================================
+
+
+def _result_eliminati(n: int):
+    result = MagicMock()
+    result.rowcount = n
+    return result
+
+
+class TestPuliziaOutbox:
+    @pytest.mark.asyncio
+    async def test_elimina_a_lotti_solo_completati(self):
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_eliminati(1000), _result_eliminati(3)])
+
+        with patch("app.core.outbox.PULIZIA_LOTTO", 1000):
+            eliminati = await _worker(retenzione_sec=3600).pulisci(db)
+
+        assert eliminati == 1003
+        assert db.execute.await_count == 2
+        assert db.commit.await_count == 2
+        sql = str(db.execute.call_args[0][0])
+        assert "DELETE FROM outbox_lavori" in sql
+        assert "completato_at <" in sql
+
+    @pytest.mark.asyncio
+    async def test_pulizia_periodica_al_piu_una_per_intervallo(self):
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=_result_eliminati(0))
+
+        @asynccontextmanager
+        async def factory():
+            yield db
+
+        worker = _worker(session_factory=factory, retenzione_sec=3600)
+        await worker._pulizia_periodica()
+        await worker._pulizia_periodica()
+        assert db.execute.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_retenzione_zero_disattiva(self):
+        factory = MagicMock()
+        await _worker(session_factory=factory, retenzione_sec=0)._pulizia_periodica()
+        factory.assert_not_called()
@@ -0,0 +1,218 @@
+"""Test ricarica a caldo del grafo: coalescenza, errori, stato, endpoint admin."""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from httpx import ASGITransport, AsyncClient
+
+from app.api.admin import api_ricarica_grafo, verifica_admin
+from app.api.deps import fissa_versione_grafo
+from app.core.ricarica_grafo import RicaricaGrafo
+from app.grafo.struttura import grafo_knowledge
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+
+@asynccontextmanager
+async def _sessione():
+    yield MagicMock()
+
+
+def _grafo_mock() -> MagicMock:
+    grafo = MagicMock(caricato=False)
+    grafo.carica = AsyncMock(return_value=SimpleNamespace(numero=1))
+    return grafo
+
+
+def _embedding_mock() -> MagicMock:
+    return MagicMock(carica=AsyncMock(), indice=SimpleNamespace(nodi=("a", "b")))
+
+
+# ---------------------------------------------------------------------------
+# Test: RicaricaGrafo
+# ---------------------------------------------------------------------------
+
+
+class TestRicaricaGrafo:
+    async def test_ricarica_grafo_embedding_e_contenuti(self):
+        ricarica = RicaricaGrafo(_sessione, canale="")
+        grafo = _grafo_mock()
+        embedding = _embedding_mock()
+        contenuti = MagicMock(versione=3, ricarica=AsyncMock())
+
+        with (
+            patch("app.core.ricarica_grafo.grafo_knowledge", grafo),
+            patch("app.core.ricarica_grafo.embedding_nodi", embedding),
+            patch("app.core.ricarica_grafo.contenuti", contenuti),
+        ):
+            assert ricarica.avvia() is True
+            await ricarica.attendi()
+
+        grafo.carica.assert_awaited_once()
+        embedding.carica.assert_awaited_once()
+        contenuti.ricarica.assert_awaited_once()
+        assert ricarica.ricariche == 1
+        assert ricarica.ultima_durata_sec is not None
+        assert not ricarica.in_corso
+
+    async def test_richieste_ravvicinate_accorpate(self):
+        ricarica = RicaricaGrafo(_sessione, canale="")
+        sblocca = asyncio.Event()
+        chiamate = 0
+
+        async def carica(db):
+            nonlocal chiamate
+            chiamate += 1
+            await sblocca.wait()
+            return SimpleNamespace(numero=chiamate)
+
+        grafo = MagicMock(carica=carica)
+        contenuti = MagicMock(versione=1, ricarica=AsyncMock())
+
+        with (
+            patch("app.core.ricarica_grafo.grafo_knowledge", grafo),
+            patch("app.core.ricarica_grafo.embedding_nodi", _embedding_mock()),
+            patch("app.core.ricarica_grafo.contenuti", contenuti),
+        ):
+            assert ricarica.avvia() is True
+            await asyncio.sleep(0)
+            assert ricarica.avvia() is False
+            assert ricarica.avvia() is False
+            sblocca.set()
+            await ricarica.attendi()
+
+        assert chiamate == 2
+        assert ricarica.ricariche == 2
+
+    async def test_errore_registrato(self):
+        ricarica = RicaricaGrafo(_sessione, canale="")
+        grafo = MagicMock(carica=AsyncMock(side_effect=ValueError("ciclo")))
+        embedding = _embedding_mock()
+        contenuti = MagicMock(ricarica=AsyncMock())
+
+        with (
+            patch("app.core.ricarica_grafo.grafo_knowledge", grafo),
+            patch("app.core.ricarica_grafo.embedding_nodi", embedding),
+            patch("app.core.ricarica_grafo.contenuti", contenuti),
+        ):
+            ricarica.avvia()
+            await ricarica.attendi()
+
+        embedding.carica.assert_not_awaited()
+        contenuti.ricarica.assert_not_awaited()
+        assert ricarica.fallite == 1
+        assert ricarica.ultimo_errore == "ciclo"
+        assert ricarica.ricariche == 0
+
+    async def test_stato(self):
+        from datetime import datetime, timezone
+
+        ricarica = RicaricaGrafo(_sessione, canale="")
+        versione = SimpleNamespace(
+            numero=4, firma="f1", caricato_at=datetime(2026, 1, 1, tzinfo=timezone.utc),
+            durata_sec=0.25, anomalie=("nodo senza tema: X",),
+        )
+        grafo = MagicMock(caricato=True, versione=versione)
+
+        with patch("app.core.ricarica_grafo.grafo_knowledge", grafo):
+            stato = ricarica.stato()
+
+        assert stato == {
+            "caricato": True,
+            "versione": 4,
+            "firma": "f1",
+            "caricato_at": "2026-01-01T00:00:00+00:00",
+            "durata_caricamento_ms": 250.0,
+            "anomalie": 1,
+            "ricarica_in_corso": False,
+            "ricariche": 0,
+            "ultima_ricarica_ms": None,
+            "ultimo_errore": None,
+        }
+
+    async def test_notifica_avvia_ricarica(self):
+        ricarica = RicaricaGrafo(_sessione, canale="dydat_grafo")
+        with patch.object(ricarica, "avvia") as avvia:
+            ricarica._su_notifica(MagicMock(), 123, "dydat_grafo", "f1")
+        avvia.assert_called_once()
+
+    async def test_senza_canale_nessun_ascolto(self):
+        ricarica = RicaricaGrafo(_sessione, canale="")
+        ricarica.avvia_ascolto()
+        assert ricarica._ascolto is None
+        await ricarica.ferma()
+
+
+# ---------------------------------------------------------------------------
+# Test: versione fissata per richiesta
+# ---------------------------------------------------------------------------
+
+
+class TestVersionePerRichiesta:
+    async def test_ricarica_a_meta_richiesta_non_cambia_versione(self):
+        prima = SimpleNamespace(numero=1)
+        dopo = SimpleNamespace(numero=2)
+        router = APIRouter(dependencies=[Depends(fissa_versione_grafo)])
+
+        @router.get("/letture")
+        async def letture():
+            lette = [grafo_knowledge.versione.numero]
+            grafo_knowledge._versione = dopo  # ricarica mentre l'handler attende
+            await asyncio.sleep(0)
+            lette.append(grafo_knowledge.versione.numero)
+            return lette
+
+        app = FastAPI()
+        app.include_router(router)
+        with patch.object(grafo_knowledge, "_versione", prima):
+            async with AsyncClient(
+                transport=ASGITransport(app=app), base_url="http://test"
+            ) as client:
+                risposta = await client.get("/letture")
+            assert grafo_knowledge.versione is dopo
+
+        assert risposta.json() == [1, 1]
+
+
+# ---------------------------------------------------------------------------
+# Test: endpoint admin
+# ---------------------------------------------------------------------------
+
+
+class TestAdmin:
+    def test_disattivato_404(self):
+        with patch("app.api.admin.settings.ADMIN_TOKEN", ""):
+            with pytest.raises(HTTPException) as exc:
+                verifica_admin("qualsiasi")
+        assert exc.value.status_code == 404
+
+    def test_token_errato_403(self):
+        with patch("app.api.admin.settings.ADMIN_TOKEN", "segreto"):
+            with pytest.raises(HTTPException) as exc:
+                verifica_admin("sbagliato")
+        assert exc.value.status_code == 403
+
+    def test_token_corretto(self):
+        with patch("app.api.admin.settings.ADMIN_TOKEN", "segreto"):
+            assert verifica_admin("segreto") is None
+
+    async def test_ricarica_avviata(self):
+        mock = MagicMock()
+        mock.avvia.return_value = True
+        mock.stato.return_value = {"caricato": True, "ricarica_in_corso": True}
+
+        with patch("app.api.admin.ricarica_grafo", mock):
+            risposta = await api_ricarica_grafo()
+
+        assert risposta == {
+            "avviata": True,
+            "stato": {"caricato": True, "ricarica_in_corso": True},
+        }
@@ -0,0 +1,192 @@
+"""Test indice embedding dei nodi (matrice NumPy, no DB reale)."""
+
+from __future__ import annotations
+
+from dataclasses import replace
+from unittest.mock import AsyncMock, MagicMock
+
+import numpy as np
+import pytest
+
+from app.grafo.semantica import EmbeddingNodi, IndiceEmbedding
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+RIGHE = [
+    ("eq1", [1.0, 0.0, 0.0]),
+    ("eq2", [0.9, 0.1, 0.0]),
+    ("prob", [0.0, 0.0, 2.0]),
+    ("geo", [0.0, 1.0, 0.0]),
+]
+
+
+def _result_all(rows):
+    result = MagicMock()
+    result.all.return_value = rows
+    return result
+
+
+def _result_scalar(value):
+    result = MagicMock()
+    result.scalar_one.return_value = value
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Test: compilazione
+# ---------------------------------------------------------------------------
+
+
+class TestCompila:
+    def test_righe_normalizzate_float32(self):
+        indice = IndiceEmbedding.compila(RIGHE)
+        assert indice.matrice.dtype == np.float32
+        assert indice.matrice.shape == (4, 3)
+        assert np.allclose(np.linalg.norm(indice.matrice, axis=1), 1.0)
+        assert indice.posizioni["prob"] == 2
+
+    def test_scarta_mancanti_nulli_e_dimensione_diversa(self):
+        indice = IndiceEmbedding.compila([
+            *RIGHE,
+            ("vuoto", None),
+            ("zero", [0.0, 0.0, 0.0]),
+            ("corto", [1.0, 0.0]),
+        ])
+        assert indice.nodi == ("eq1", "eq2", "prob", "geo")
+
+    def test_immutabile(self):
+        indice = IndiceEmbedding.compila(RIGHE)
+        with pytest.raises(ValueError):
+            indice.matrice[0, 0] = 5.0
+        with pytest.raises(TypeError):
+            indice.posizioni["x"] = 9
+
+    def test_vuoto(self):
+        indice = IndiceEmbedding.compila([])
+        assert indice.nodi == ()
+        assert indice.cerca(np.ones(3)) == [[]]
+
+
+# ---------------------------------------------------------------------------
+# Test: ricerca top-k in blocco
+# ---------------------------------------------------------------------------
+
+
+class TestCerca:
+    def test_top_k_ordinato(self):
+        indice = IndiceEmbedding.compila(RIGHE)
+        [risultati] = indice.cerca(np.array([1.0, 0.0, 0.0]), k=2)
+        assert [n for n, _ in risultati] == ["eq1", "eq2"]
+        assert risultati[0][1] == pytest.approx(1.0)
+
+    def test_batch_una_riga_per_query(self):
+        indice = IndiceEmbedding.compila(RIGHE)
+        risultati = indice.cerca(np.array([[0.0, 0.0, 1.0], [0.0, 3.0, 0.0]]), k=1)
+        assert [r[0][0] for r in risultati] == ["prob", "geo"]
+
+    def test_candidati_ed_esclusi(self):
+        indice = IndiceEmbedding.compila(RIGHE)
+        [risultati] = indice.cerca(
+            np.array([1.0, 0.0, 0.0]), k=5, candidati={"eq1", "eq2", "geo"},
+            escludi=[{"eq1"}],
+        )
+        assert [n for n, _ in risultati] == ["eq2", "geo"]
+
+    def test_dimensione_sbagliata(self):
+        indice = IndiceEmbedding.compila(RIGHE)
+        assert indice.cerca(np.ones((2, 5))) == [[], []]
+
+    def test_simili_esclude_se_stesso(self):
+        indice = IndiceEmbedding.compila(RIGHE)
+        simili = indice.simili(["eq1", "geo", "inesistente"], k=1)
+        assert set(simili) == {"eq1", "geo"}
+        assert simili["eq1"][0][0] == "eq2"
+
+
+# ---------------------------------------------------------------------------
+# Test: snapshot su file + caricamento
+# ---------------------------------------------------------------------------
+
+
+class TestSnapshot:
+    def test_salva_e_mappa_in_memoria(self, tmp_path):
+        percorso = tmp_path / "embedding.npy"
+        originale = replace(IndiceEmbedding.compila(RIGHE), firma="f1")
+        originale.salva(percorso)
+
+        letto = IndiceEmbedding.da_snapshot(percorso)
+        assert isinstance(letto.matrice, np.memmap)
+        assert letto.nodi == originale.nodi
+        assert letto.firma == "f1"
+        assert np.array_equal(letto.matrice, originale.matrice)
+        assert (tmp_path / "embedding.ids.json").exists()
+        assert not list(tmp_path.glob("*.tmp"))
+
+    def test_formato_senza_firma_non_valido(self, tmp_path):
+        percorso = tmp_path / "embedding.npy"
+        IndiceEmbedding.compila(RIGHE).salva(percorso)
+        (tmp_path / "embedding.ids.json").write_text('["eq1", "eq2", "prob", "geo"]')
+        with pytest.raises(ValueError):
+            IndiceEmbedding.da_snapshot(percorso)
+
+    @pytest.mark.asyncio
+    async def test_senza_snapshot_nessuna_firma(self):
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=_result_all(RIGHE))
+
+        store = EmbeddingNodi()
+        await store.carica(db, "")
+
+        assert store.caricato
+        assert store.indice.firma is None
+        assert db.execute.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_carica_dal_db_e_scrive_snapshot(self, tmp_path):
+        percorso = tmp_path / "embedding.npy"
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_scalar("f1"), _result_all(RIGHE)])
+
+        store = EmbeddingNodi()
+        await store.carica(db, str(percorso))
+
+        assert store.caricato
+        assert store.indice.firma == "f1"
+        assert IndiceEmbedding.da_snapshot(percorso).firma == "f1"
+
+    @pytest.mark.asyncio
+    async def test_snapshot_valido_evita_i_vettori(self, tmp_path):
+        percorso = tmp_path / "embedding.npy"
+        replace(IndiceEmbedding.compila(RIGHE), firma="f1").salva(percorso)
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=_result_scalar("f1"))
+
+        store = EmbeddingNodi()
+        await store.carica(db, str(percorso))
+
+        assert db.execute.await_count == 1  # solo la firma, non i JSONB
+        assert store.indice.nodi == tuple(n for n, _ in RIGHE)
+
+    @pytest.mark.asyncio
+    async def test_vettori_cambiati_stessi_id_ricostruisce(self, tmp_path):
+        percorso = tmp_path / "embedding.npy"
+        replace(IndiceEmbedding.compila(RIGHE), firma="f1").salva(percorso)
+        nuove = [(n, v[::-1]) for n, v in RIGHE]
+        db = AsyncMock()
+        db.execute = AsyncMock(side_effect=[_result_scalar("f2"), _result_all(nuove)])
+
+        store = EmbeddingNodi()
+        await store.carica(db, str(percorso))
+
+        letto = IndiceEmbedding.da_snapshot(percorso)
+        assert letto.firma == "f2"
+        assert np.array_equal(letto.matrice, IndiceEmbedding.compila(nuove).matrice)
+        assert np.array_equal(store.indice.matrice, letto.matrice)
+
+    def test_non_caricato(self):
+        store = EmbeddingNodi()
+        assert not store.caricato
+        with pytest.raises(RuntimeError):
+            store.indice
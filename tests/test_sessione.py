@@ -37,6 +37,18 @@ from app.schemas.sessione import (
 # ===================================================================
 
 
+@pytest.fixture(autouse=True)
+def _statistiche_giornaliere():
+    """Minuti e achievement della chiusura sessione: qui interessa solo la durata."""
+    with (
+        patch(
+            "app.core.gamification.registra_attivita_giornaliera", new_callable=AsyncMock
+        ) as registra,
+        patch("app.core.outbox.accoda_lavoro"),
+    ):
+        yield registra
+
+
 def _mock_sessione(
     sessione_id=None,
     utente_id=None,
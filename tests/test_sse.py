@@ -0,0 +1,153 @@
+"""Test stream SSE: frame precalcolati e coalescenza dei text_delta."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+from sse_starlette.sse import ServerSentEvent
+
+from app.api.sse import StatisticheStream, coalesci_delta, frame_sse, stream_sse
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+
+def _delta(testo: str) -> dict:
+    return {"event": "text_delta", "data": {"testo": testo}}
+
+
+async def _genera(eventi, pause: dict[int, float] | None = None):
+    """Generatore asincrono di eventi, con pause (secondi) prima dell'indice dato."""
+    for i, evento in enumerate(eventi):
+        if pause and i in pause:
+            await asyncio.sleep(pause[i])
+        yield evento
+
+
+async def _raccogli(gen) -> list:
+    return [e async for e in gen]
+
+
+def _testi(eventi: list[dict]) -> list[str]:
+    return [e["data"]["testo"] for e in eventi if e["event"] == "text_delta"]
+
+
+# ---------------------------------------------------------------------------
+# Test: serializzazione
+# ---------------------------------------------------------------------------
+
+
+class TestFrameSSE:
+    def test_frame_equivalente_a_server_sent_event(self):
+        dati = {"testo": "Perché x² = 4?", "n": 1}
+        frame = frame_sse("text_delta", dati)
+        atteso = ServerSentEvent(
+            event="text_delta",
+            data=json.dumps(dati, ensure_ascii=False, separators=(",", ":")),
+        ).encode()
+        assert frame == atteso
+
+    def test_json_su_una_riga(self):
+        frame = frame_sse("azione", {"testo": "riga1\nriga2"})
+        assert frame.count(b"\n") == 3  # event, data, riga vuota
+        corpo = frame.split(b"data: ", 1)[1].rstrip(b"\r\n")
+        assert json.loads(corpo) == {"testo": "riga1\nriga2"}
+
+
+# ---------------------------------------------------------------------------
+# Test: coalescenza
+# ---------------------------------------------------------------------------
+
+
+class TestCoalesciDelta:
+    async def test_accorpa_delta_piccoli(self):
+        eventi = [_delta("Ci"), _delta("ao"), _delta(" "), _delta("!")]
+        risultato = await _raccogli(coalesci_delta(_genera(eventi), 32, 1000))
+        assert _testi(risultato) == ["Ciao !"]
+
+    async def test_flush_per_dimensione(self):
+        eventi = [_delta("abcd")] * 5
+        risultato = await _raccogli(coalesci_delta(_genera(eventi), 8, 1000))
+        assert _testi(risultato) == ["abcdabcd", "abcdabcd", "abcd"]
+
+    async def test_flush_per_tempo(self):
+        eventi = [_delta("a"), _delta("b"), _delta("c")]
+        gen = coalesci_delta(_genera(eventi, pause={2: 0.2}), 1000, 20)
+        risultato = await _raccogli(gen)
+        assert _testi(risultato) == ["ab", "c"]
+
+    async def test_flush_prima_di_azione(self):
+        azione = {"event": "azione", "data": {"tipo": "proponi_esercizio", "params": {}}}
+        fine = {"event": "turno_completo", "data": {"turno_id": 1}}
+        eventi = [_delta("Prova "), _delta("questo:"), azione, _delta("ok"), fine]
+        risultato = await _raccogli(coalesci_delta(_genera(eventi), 1000, 1000))
+        assert [e["event"] for e in risultato] == [
+            "text_delta", "azione", "text_delta", "turno_completo",
+        ]
+        assert _testi(risultato) == ["Prova questo:", "ok"]
+        assert risultato[1] is azione
+
+    async def test_disattivata_inoltra_invariati(self):
+        eventi = [_delta("a"), _delta("b")]
+        statistiche = StatisticheStream()
+        risultato = await _raccogli(coalesci_delta(_genera(eventi), 0, 30, statistiche))
+        assert risultato == eventi
+        assert statistiche.eventi == 2
+        assert statistiche.delta == 2
+
+    async def test_errore_a_monte_dopo_il_testo(self):
+        async def gen():
+            yield _delta("parziale")
+            raise RuntimeError("boom")
+
+        ricevuti = []
+        with pytest.raises(RuntimeError, match="boom"):
+            async for evento in coalesci_delta(gen(), 1000, 1000):
+                ricevuti.append(evento)
+        assert _testi(ricevuti) == ["parziale"]
+
+    async def test_chiusura_anticipata_cancella_produttore(self):
+        chiuso = asyncio.Event()
+
+        async def gen():
+            try:
+                while True:
+                    yield _delta("x")
+                    await asyncio.sleep(0)
+            finally:
+                chiuso.set()
+
+        stream = coalesci_delta(gen(), 4, 1000)
+        assert (await anext(stream))["data"]["testo"] == "xxxx"
+        await stream.aclose()
+        assert chiuso.is_set()
+
+
+# ---------------------------------------------------------------------------
+# Test: stream completo
+# ---------------------------------------------------------------------------
+
+
+class TestStreamSSE:
+    async def test_frame_e_contatori(self, caplog):
+        eventi = [_delta("a")] * 10 + [{"event": "turno_completo", "data": {"turno_id": 7}}]
+        iniziale = {"event": "sessione_creata", "data": {"sessione_id": "s1"}}
+
+        with (
+            patch("app.api.sse.settings.SSE_COALESCENZA_BYTE", 32),
+            patch("app.api.sse.settings.SSE_COALESCENZA_MS", 1000),
+            caplog.at_level("INFO", logger="app.api.sse"),
+        ):
+            frame = await _raccogli(stream_sse(_genera(eventi), evento_iniziale=iniziale))
+
+        assert frame == [
+            frame_sse("sessione_creata", {"sessione_id": "s1"}),
+            frame_sse("text_delta", {"testo": "a" * 10}),
+            frame_sse("turno_completo", {"turno_id": 7}),
+        ]
+        assert "11 eventi (10 delta) → 3 frame" in caplog.text
+        assert f"{sum(len(f) for f in frame)} byte" in caplog.text
@@ -0,0 +1,259 @@
+"""Test stato utente sul grafo — cache livelli in memoria (no DB reale)."""
+
+from __future__ import annotations
+
+import uuid
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.grafo.stato import (
+    CacheEserciziTentati,
+    CacheLivelli,
+    cache_livelli,
+    cache_tentati,
+    get_esercizi_tentati,
+    get_livelli_utente,
+)
+
+# ===================================================================
+# Test: CacheLivelli
+# ===================================================================
+
+
+class TestCacheLivelli:
+    def test_miss_poi_hit(self):
+        cache = CacheLivelli(max_utenti=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        assert cache.leggi(uid) is None
+        cache.scrivi(uid, {"A": "operativo"})
+        assert cache.leggi(uid) == {"A": "operativo"}
+        assert cache.statistiche()["hit"] == 1
+        assert cache.statistiche()["miss"] == 1
+        assert cache.statistiche()["hit_ratio"] == 0.5
+
+    def test_ritorna_copia(self):
+        cache = CacheLivelli(max_utenti=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        cache.scrivi(uid, {"A": "in_corso"})
+        livelli = cache.leggi(uid)
+        livelli["A"] = "operativo"
+        assert cache.leggi(uid) == {"A": "in_corso"}
+
+    def test_scadenza_ttl(self):
+        cache = CacheLivelli(max_utenti=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        with patch("app.grafo.stato.time.monotonic", return_value=1000.0):
+            cache.scrivi(uid, {"A": "operativo"})
+        with patch("app.grafo.stato.time.monotonic", return_value=1061.0):
+            assert cache.leggi(uid) is None
+        assert cache.statistiche()["utenti"] == 0
+
+    def test_lru_evince_meno_recente(self):
+        cache = CacheLivelli(max_utenti=2, ttl_sec=60)
+        u1, u2, u3 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        cache.scrivi(u1, {})
+        cache.scrivi(u2, {})
+        cache.leggi(u1)  # u1 diventa il piu' recente
+        cache.scrivi(u3, {})
+        assert cache.leggi(u2) is None
+        assert cache.leggi(u1) == {}
+        assert cache.leggi(u3) == {}
+
+    def test_aggiorna_write_through(self):
+        cache = CacheLivelli(max_utenti=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        cache.scrivi(uid, {"A": "in_corso"})
+        cache.aggiorna(uid, "A", "operativo")
+        cache.aggiorna(uid, "B", "in_corso")
+        assert cache.leggi(uid) == {"A": "operativo", "B": "in_corso"}
+
+    def test_aggiorna_solo_se_assente(self):
+        cache = CacheLivelli(max_utenti=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        cache.scrivi(uid, {"A": "operativo"})
+        cache.aggiorna(uid, "A", "in_corso", solo_se_assente=True)
+        cache.aggiorna(uid, "B", "in_corso", solo_se_assente=True)
+        assert cache.leggi(uid) == {"A": "operativo", "B": "in_corso"}
+
+    def test_aggiorna_utente_non_in_cache_noop(self):
+        cache = CacheLivelli(max_utenti=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        cache.aggiorna(uid, "A", "operativo")
+        assert cache.leggi(uid) is None
+
+    def test_invalida(self):
+        cache = CacheLivelli(max_utenti=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        cache.scrivi(uid, {"A": "operativo"})
+        cache.invalida(uid)
+        assert cache.leggi(uid) is None
+
+
+# ===================================================================
+# Test: CacheEserciziTentati + get_esercizi_tentati
+# ===================================================================
+
+
+class TestCacheEserciziTentati:
+    def test_lettura_e_aggiunta(self):
+        cache = CacheEserciziTentati(max_voci=10, ttl_sec=60)
+        uid = uuid.uuid4()
+        assert cache.leggi(uid, "A") is None
+        cache.scrivi(uid, "A", ["es_1"])
+        cache.aggiungi(uid, "A", "es_2")
+        cache.aggiungi(uid, "B", "es_9")  # non in cache: no-op
+        assert cache.leggi(uid, "A") == {"es_1", "es_2"}
+        assert cache.leggi(uid, "B") is None
+
+    def test_eviction_lru(self):
+        cache = CacheEserciziTentati(max_voci=2, ttl_sec=60)
+        uid = uuid.uuid4()
+        cache.scrivi(uid, "A", [])
+        cache.scrivi(uid, "B", [])
+        cache.leggi(uid, "A")
+        cache.scrivi(uid, "C", [])
+        assert cache.leggi(uid, "B") is None
+        assert cache.leggi(uid, "A") == frozenset()
+
+    def test_ttl_scaduto(self):
+        cache = CacheEserciziTentati(max_voci=10, ttl_sec=0)
+        uid = uuid.uuid4()
+        cache.scrivi(uid, "A", ["es_1"])
+        assert cache.leggi(uid, "A") is None
+
+    @pytest.mark.asyncio
+    async def test_una_query_per_utente_e_nodo(self):
+        uid = uuid.uuid4()
+        result = MagicMock()
+        result.scalars.return_value.all.return_value = ["es_1", "es_2"]
+        db = AsyncMock()
+        db.execute = AsyncMock(return_value=result)
+
+        primo = await get_esercizi_tentati(uid, "A", db)
+        cache_tentati.aggiungi(uid, "A", "es_3")
+        secondo = await get_esercizi_tentati(uid, "A", db)
+
+        assert primo == {"es_1", "es_2"}
+        assert secondo == {"es_1", "es_2", "es_3"}
+        assert db.execute.call_count == 1
+
+
+# ===================================================================
+# Test: get_livelli_utente con cache
+# ===================================================================
+
+
+class TestGetLivelliUtente:
+    @pytest.mark.asyncio
+    async def test_seconda_lettura_senza_query(self):
+        uid = uuid.uuid4()
+        db = AsyncMock()
+        result = MagicMock()
+        result.all.return_value = [("A", "operativo"), ("B", "in_corso")]
+        db.execute = AsyncMock(return_value=result)
+
+        primo = await get_livelli_utente(uid, db)
+        secondo = await get_livelli_utente(uid, db)
+
+        assert primo == secondo == {"A": "operativo", "B": "in_corso"}
+        assert db.execute.call_count == 1
+        cache_livelli.invalida(uid)
+
+    @pytest.mark.asyncio
+    async def test_promozione_visibile_senza_rilettura(self):
+        """Il write-through della promozione e' visto dalla lettura successiva."""
+        from app.core.elaborazione import processa_segnali
+
+        uid = uuid.uuid4()
+        cache_livelli.scrivi(uid, {"nodo_test": "in_corso"})
+
+        riga = MagicMock(
+            nodo_id="nodo_test", livello="in_corso",
+            spiegazione_data=True, esercizi_completati=3, esercizi_consecutivi_ok=1,
+        )
+        result_upsert = MagicMock()
+        result_upsert.all.return_value = [riga]
+        result_promo = MagicMock()
+        result_promo.scalars.return_value.all.return_value = ["nodo_test"]
+
+        result_stats = MagicMock()
+        result_stats.one.return_value = MagicMock(
+            minuti_studio=0, obiettivo_raggiunto=False, obiettivo=20
+        )
+
+        db = AsyncMock()
+        db.execute = AsyncMock(
+            side_effect=[MagicMock(), result_upsert, result_promo, result_stats, MagicMock()]
+        )
+
+        segnali = [{
+            "name": "risposta_esercizio",
+            "input": {"nodo_focale": "nodo_test", "esito": "primo_tentativo"},
+        }]
+        with patch("app.core.elaborazione.grafo_knowledge") as mock_grafo:
+            mock_grafo.caricato = False
+            await processa_segnali(db, segnali, uuid.uuid4(), uid)
+
+        assert await get_livelli_utente(uid, db) == {"nodo_test": "operativo"}
+        cache_livelli.invalida(uid)
+
+
+# ===================================================================
+# Test: write-through annullato se la transazione non arriva al commit
+# ===================================================================
+
+
+class TestCacheETransazione:
+    async def _turno(self, uid, commit: bool):
+        from functools import partial
+
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        from app.db.transazioni import dopo_rollback
+
+        async with AsyncSession() as db:
+            db.sync_session.begin()
+            cache_livelli.aggiorna(uid, "A", "operativo")
+            dopo_rollback(db, partial(cache_livelli.invalida, uid))
+            assert cache_livelli.leggi(uid) == {"A": "operativo"}
+            if commit:
+                await db.commit()
+
+    async def test_commit_mantiene_livello(self):
+        uid = uuid.uuid4()
+        cache_livelli.scrivi(uid, {"A": "in_corso"})
+        await self._turno(uid, commit=True)
+        assert cache_livelli.leggi(uid) == {"A": "operativo"}
+        cache_livelli.invalida(uid)
+
+    async def test_senza_commit_invalida(self):
+        uid = uuid.uuid4()
+        cache_livelli.scrivi(uid, {"A": "in_corso"})
+        await self._turno(uid, commit=False)
+        assert cache_livelli.leggi(uid) is None
+
+    @pytest.mark.parametrize("commit", [True, False])
+    async def test_esercizi_risolti_in_cache_solo_dopo_commit(self, commit):
+        from datetime import datetime, timezone
+
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        from app.core.elaborazione import _processa_risposte_esercizio
+
+        uid = uuid.uuid4()
+        cache_tentati.scrivi(uid, "A", ["es_1"])
+        db = AsyncSession()
+        db.execute = AsyncMock(return_value=MagicMock(all=MagicMock(return_value=[])))
+        db.sync_session.begin()
+
+        await _processa_risposte_esercizio(
+            db, [{"nodo_focale": "A", "esercizio_id": "es_2", "esito": "primo_tentativo"}],
+            uid, uuid.uuid4(), datetime.now(timezone.utc),
+        )
+        assert cache_tentati.leggi(uid, "A") == {"es_1"}
+        if commit:
+            await db.commit()
+        await db.close()
+
+        assert cache_tentati.leggi(uid, "A") == ({"es_1", "es_2"} if commit else {"es_1"})